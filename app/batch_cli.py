@@ -0,0 +1,148 @@
+# batch_cli.py
+
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import argparse
+from typing import Any, Dict, List, Optional
+
+import database
+import db_connections
+# split_pdf, batch_jobs e ingest_pipeline se importan en run(): importan logic, que lee el
+# mapeo de extractores de la BBDD al importarse, y --db tiene que fijarse antes.
+
+# --- Ingesta de una carpeta sin interfaz (cron / servidor) ---
+# Sustituye al antiguo lecturaFact1.py (PyPDF2, en serie) con la misma pila que la
+# aplicación: el pipeline de ingesta (ingest_pipeline) sobre logic + database. Ejemplo:
+#     cd /ruta/app && python batch_cli.py /ruta/facturas --jsonl salida.jsonl --csv salida.csv
+#
+# - Lectura, OCR y extracción van en pools de procesos (--workers, por defecto uno por núcleo).
+# - Solo el hilo escritor del pipeline escribe en la BBDD (transacciones por lotes).
+# - Los PDFs de Pradilla se dividen; los ya procesados se saltan (salvo --reprocess).
+# - Cada resultado se añade a JSONL/CSV en cuanto termina, así un corte no pierde lo ya hecho.
+# Código de salida: 0 si todo fue bien, 1 si hubo errores, 2 si no hay ficheros.
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.tif')
+
+# BBDD por defecto: la de la aplicación, aunque se lance desde otra carpeta (cron)
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), database.DB_NAME)
+
+OUTPUT_COLUMNS = ['Archivo', 'Ruta', 'Estado']
+
+
+def find_files(folder: str) -> List[str]:
+    """Ficheros soportados de la carpeta y sus subcarpetas (como 'Seleccionar carpeta')."""
+    found = []
+    for root, _, files in os.walk(folder):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+                found.append(os.path.abspath(os.path.join(root, file_name)))
+    return sorted(found)
+
+
+# --- Salidas JSONL / CSV ---
+
+class ResultWriter:
+    """Escribe cada resultado en JSON-lines y/o CSV (utf-8-sig, como el CSV de la aplicación)."""
+
+    def __init__(self, columns: List[str], jsonl_path: Optional[str] = None, csv_path: Optional[str] = None):
+        self._jsonl = open(jsonl_path, 'w', encoding='utf-8') if jsonl_path else None
+        self._csv_file = open(csv_path, 'w', newline='', encoding='utf-8-sig') if csv_path else None
+        self._csv = csv.DictWriter(self._csv_file, fieldnames=columns, extrasaction='ignore') if self._csv_file else None
+        if self._csv:
+            self._csv.writeheader()
+
+    def write(self, row: Dict[str, Any]):
+        if self._jsonl:
+            self._jsonl.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+            self._jsonl.flush()
+        if self._csv:
+            self._csv.writerow(row)
+            self._csv_file.flush()
+
+    def close(self):
+        for handle in (self._jsonl, self._csv_file):
+            if handle:
+                handle.close()
+
+
+def run(folder: str, workers: int, reprocess: bool = False, debug_mode: bool = False,
+        jsonl_path: Optional[str] = None, csv_path: Optional[str] = None) -> Dict[str, Any]:
+    """Procesa la carpeta y devuelve el resumen del lote (contadores y ritmo)."""
+    database.setup_database() # Antes de importar logic: una BBDD nueva ya tiene sus tablas
+    import split_pdf
+    import batch_jobs
+    from ingest_pipeline import IngestPipeline, KEYS, STATUS_SAVED, STATUS_EMPTY, STATUS_ERROR
+
+    paths = find_files(folder)
+    if not paths:
+        return {'found': 0, 'saved': 0, 'skipped': 0, 'errors': 0, 'cancelled': 0, 'elapsed': 0.0, 'files_per_minute': 0.0}
+    print(f"--- {len(paths)} archivos encontrados, procesando con {workers} procesos ---")
+
+    pipeline = IngestPipeline(workers=workers)
+    job = batch_jobs.BatchJob(paths, force_reprocess=reprocess, debug_mode=debug_mode,
+                              is_multi_invoice=split_pdf.is_pradilla_multipage, pipeline=pipeline)
+    writer = ResultWriter(OUTPUT_COLUMNS + KEYS, jsonl_path, csv_path)
+    summary = None
+    last_report = time.perf_counter()
+    try:
+        job.start()
+        while summary is None:
+            try:
+                kind, path, data = job.events.get(timeout=1.0)
+            except queue.Empty:
+                kind = None
+            if kind == 'log':
+                print(data)
+            elif kind == 'result' and data['status'] in (STATUS_SAVED, STATUS_EMPTY, STATUS_ERROR):
+                row = {key: (data['data'] or {}).get(key) for key in KEYS}
+                row.update({'Archivo': os.path.basename(path), 'Ruta': path.replace('\\', '/'), 'Estado': data['status']})
+                writer.write(row)
+            elif kind == 'finished':
+                summary = data
+            if time.perf_counter() - last_report >= 30: # Progreso para el log de cron
+                last_report = time.perf_counter()
+                stats, depths = job.throughput(), pipeline.depths()
+                print(f"... {stats['done']}/{stats['total']} · {stats['files_per_minute']:.1f} facturas/min · colas {depths}")
+                print(f"... {db_connections.describe()}")
+    finally:
+        writer.close()
+        pipeline.shutdown(wait=summary is not None)
+
+    stats = job.throughput()
+    summary.update(found=len(paths), elapsed=stats['elapsed'], files_per_minute=stats['files_per_minute'])
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Procesa (sin interfaz) todas las facturas de una carpeta y las guarda en la BBDD.')
+    parser.add_argument('carpeta', help='Carpeta con las facturas (se recorren también las subcarpetas)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos del pipeline, repartidos entre lectura, OCR y extracción (por defecto, uno por núcleo)')
+    parser.add_argument('--reprocess', action='store_true', help='Volver a procesar los ficheros que ya están en la BBDD')
+    parser.add_argument('--jsonl', metavar='RUTA', help='Escribir los resultados en un fichero JSON-lines')
+    parser.add_argument('--csv', metavar='RUTA', help='Escribir los resultados en un fichero CSV')
+    parser.add_argument('--db', metavar='RUTA', default=DEFAULT_DB, help=f'Base de datos SQLite (por defecto, {DEFAULT_DB})')
+    parser.add_argument('--debug', action='store_true', help='Guardar las trazas de extracción en el log de cada factura')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.carpeta):
+        print(f"❌ No existe la carpeta: {args.carpeta}")
+        return 2
+    database.DB_NAME = os.path.abspath(args.db)
+
+    summary = run(args.carpeta, max(args.workers, 1), reprocess=args.reprocess, debug_mode=args.debug,
+                  jsonl_path=args.jsonl, csv_path=args.csv)
+    if summary['found'] == 0:
+        print("❌ No se encontraron archivos para procesar.")
+        return 2
+    print(f"--- Terminado en {summary['elapsed']:.1f}s: {summary['saved']} guardadas, "
+          f"{summary['skipped']} ya procesadas, {summary['errors']} errores ({summary['files_per_minute']:.1f} facturas/min) ---")
+    print(f"--- {db_connections.describe()} ---")
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# batch_jobs.py
+
+import time
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import split_pdf
+import ingest_pipeline
+from ingest_pipeline import (
+    FINAL_STATUSES, STATUS_QUEUED, STATUS_READING,
+    STATUS_SPLIT, STATUS_SAVED, STATUS_SKIPPED, STATUS_ERROR, STATUS_CANCELLED,
+)
+
+# Los estados se re-exportan para la interfaz (main_gui usa batch_jobs.STATUS_*)
+__all__ = [
+    'BatchJob', 'FINAL_STATUSES', 'STATUS_QUEUED', 'STATUS_READING',
+    'STATUS_SPLIT', 'STATUS_SAVED', 'STATUS_SKIPPED', 'STATUS_ERROR', 'STATUS_CANCELLED',
+]
+
+# --- Proceso de facturas por lotes en segundo plano ---
+# Un BatchJob es un lote enviado al pipeline de ingesta (ingest_pipeline): detección de
+# multi-factura, lectura, OCR, extracción y guardado ocurren en sus etapas. El hilo de la
+# interfaz NO se bloquea: lee los eventos de BatchJob.events (cola thread-safe) con after().
+#
+# Eventos: (tipo, ruta, datos)
+#   ('queued', ruta, None)        fichero añadido a la cola (también los de una división)
+#   ('status', ruta, estado)      nuevo estado del fichero (ver STATUS_* en ingest_pipeline)
+#   ('log', ruta, texto)          línea para el log de la ventana
+#   ('result', ruta, resultado)   fin del fichero: {'status', 'data', 'log', 'timings'}
+#   ('finished', None, resumen)   no queda nada pendiente (o se ha cancelado)
+
+Event = Tuple[str, Optional[str], Any]
+
+
+class BatchJob(ingest_pipeline.IngestClient):
+    """Un lote de ficheros procesado por el pipeline de ingesta."""
+
+    def __init__(self, paths: List[str], force_reprocess: bool = False, debug_mode: bool = False,
+                 is_multi_invoice: Optional[Callable[[str], bool]] = None,
+                 pipeline: Optional[ingest_pipeline.IngestPipeline] = None):
+        self.paths = list(paths)
+        self.force_reprocess = force_reprocess
+        self.debug_mode = debug_mode
+        self.is_multi_invoice = is_multi_invoice
+        self.pipeline = pipeline
+        self.events: "queue.Queue[Event]" = queue.Queue()
+        self.processed_paths: List[str] = []
+
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self.counters = {'total': 0, 'done': 0, 'saved': 0, 'skipped': 0, 'errors': 0, 'cancelled': 0,
+                         'busy_seconds': 0.0, 'ocr_seconds': 0.0}
+
+    # --- Control ---
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        # Reserva: el lote no puede darse por terminado mientras se siguen encolando ficheros
+        with self._lock:
+            self._pending += 1
+        # El envío puede esperar si las colas del pipeline están llenas: nunca en el hilo de la ventana
+        threading.Thread(target=self._submit_all, name="lote-envio", daemon=True).start()
+
+    def cancel(self):
+        """Los ficheros en curso terminan; los que siguen en cola se marcan como cancelados."""
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def throughput(self) -> Dict[str, float]:
+        """Facturas/minuto desde el inicio y porcentaje del tiempo de proceso que fue OCR."""
+        with self._lock:
+            end = self._finished_at or time.perf_counter()
+            elapsed = end - self._started_at if self._started_at else 0.0
+            done = self.counters['done']
+            busy, ocr = self.counters['busy_seconds'], self.counters['ocr_seconds']
+            return {
+                'done': done, 'total': self.counters['total'], 'elapsed': elapsed,
+                'files_per_minute': done / elapsed * 60 if elapsed > 0 else 0.0,
+                'ocr_share': ocr / busy * 100 if busy > 0 else 0.0,
+            }
+
+    def depths(self) -> Dict[str, int]:
+        """Ficheros en cola o en curso por etapa del pipeline (de todos los lotes)."""
+        return self._get_pipeline().depths()
+
+    def _get_pipeline(self) -> ingest_pipeline.IngestPipeline:
+        return self.pipeline or ingest_pipeline.get_pipeline()
+
+    def _submit_all(self):
+        try:
+            self._get_pipeline().submit(self, self.paths)
+        except Exception as e:
+            self._emit('log', None, f"  ❌ No se pudo enviar el lote al pipeline de ingesta: {e}")
+        finally:
+            self._release()
+
+    # --- IngestClient ---
+
+    def split(self, path: str) -> Optional[List[str]]:
+        # PDF con varias facturas (Pradilla): cada parte vuelve a entrar en el pipeline
+        if self.is_multi_invoice and self.is_multi_invoice(path):
+            return split_pdf.split_pdf_into_single_page_files(path)
+        return None
+
+    def notify(self, kind: str, path: Optional[str], data: Any = None):
+        if kind == 'queued':
+            with self._lock:
+                self._pending += 1
+                self.counters['total'] += 1
+        elif kind == 'done':
+            self._done(path, data)
+            return
+        self._emit(kind, path, data)
+
+    def _done(self, path: str, result: Dict[str, Any]):
+        status, timings = result['status'], result['timings']
+        with self._lock:
+            self.counters['busy_seconds'] += sum(v for k, v in timings.items() if k != 'ocr_seconds')
+            self.counters['ocr_seconds'] += timings.get('ocr_seconds', 0.0)
+            if status == STATUS_SPLIT:
+                self.counters['total'] -= 1 # Cuentan sus partes (encoladas aparte), no el PDF original
+            else:
+                self.counters['done'] += 1
+            counter = {STATUS_SAVED: 'saved', STATUS_SKIPPED: 'skipped', STATUS_ERROR: 'errors', STATUS_CANCELLED: 'cancelled'}.get(status)
+            if counter:
+                self.counters[counter] += 1
+            if status == STATUS_SAVED:
+                self.processed_paths.append(path)
+        self._emit('result', path, result)
+        self._release()
+
+    # --- Cola ---
+
+    def _emit(self, kind: str, path: Optional[str], data: Any = None):
+        self.events.put((kind, path, data))
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            last = self._pending == 0
+        if last:
+            self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._finished_at = time.perf_counter()
+            summary = dict(self.counters, cancelled_job=self._cancel.is_set())
+        self._emit('finished', None, summary)
@@ -6,6 +6,17 @@ from typing import Dict, Any
 # Nombre del archivo de base de datos SQLite
 DB_NAME: str = 'facturas.db'
 
+# --- Conexiones SQLite (db_connections.py) ---
+# Segundos que una escritura espera a que otra conexión suelte el bloqueo antes de fallar
+DB_BUSY_TIMEOUT: float = 10.0
+# Tamaño mapeado en memoria y caché de páginas por conexión (holgados para decenas de miles de facturas)
+DB_MMAP_SIZE: int = 256 * 1024 * 1024
+DB_CACHE_KB: int = 16 * 1024
+# Sentencias preparadas que guarda cada conexión para reutilizarlas
+DB_CACHED_STATEMENTS: int = 256
+# Facturas por página en las tablas (Treeview, histórico web): se cargan más al llegar al final
+TABLE_PAGE_SIZE: int = 200
+
 # Ruta al ejecutable de Tesseract OCR (requerido para OCR en Windows)
 # ¡AJUSTA ESTA RUTA SI ES NECESARIO!
 TESSERACT_CMD_PATH: str = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
@@ -18,6 +29,63 @@ DEFAULT_VAT_RATE_STR: str = "21%"
 # Directorio donde se guardan los extractores dinámicos
 EXTRACTORS_DIR: str = 'extractors'
 
+# --- Caché de Texto/OCR ---
+# Se guarda junto a la base de datos de facturas (misma carpeta que facturas.db)
+OCR_CACHE_ENABLED: bool = True
+OCR_CACHE_FILE: str = 'ocr_cache.db'
+# Tamaño máximo de la caché en bytes (se expulsan las entradas menos usadas - LRU)
+OCR_CACHE_MAX_BYTES: int = 200 * 1024 * 1024
+
+# Parámetros de OCR (forman parte de la clave de la caché)
+OCR_LANG: str = 'spa'
+OCR_DPI: int = 300
+# OCR multipágina: se rasterizan y reconocen varias páginas en paralelo (pool de procesos)
+OCR_MULTIPAGE: bool = True
+# Límite de páginas por documento escaneado (0 = sin límite)
+OCR_MAX_PAGES: int = 10
+# Procesos del pool de OCR (0 = uno por núcleo)
+OCR_WORKERS: int = 0
+# Clasificador por página (texto digital vs. escaneo):
+# - Sin capa de texto -> se hace OCR.
+# - Con capa de texto, solo si una imagen cubre >= OCR_MIN_IMAGE_AREA de la página y
+#   además hay menos de OCR_MIN_PAGE_CHARS caracteres o el texto cubre
+#   < OCR_MIN_TEXT_COVERAGE (p.ej. escaneo con sello digital). Una página digital casi
+#   vacía y sin imágenes no se manda a OCR.
+OCR_MIN_PAGE_CHARS: int = 25
+OCR_MIN_TEXT_COVERAGE: float = 0.02
+OCR_MIN_IMAGE_AREA: float = 0.5
+# OCR adaptativo: se renderiza en gris a la primera resolución de OCR_ADAPTIVE_DPI_STEPS y
+# solo se sube a la siguiente si la confianza media de Tesseract queda por debajo del umbral.
+OCR_ADAPTIVE: bool = True
+OCR_ADAPTIVE_DPI_STEPS: tuple = (150, 200, 300)
+OCR_MIN_CONFIDENCE: float = 75.0
+
+# --- Lectura por páginas ---
+# El documento se lee página a página y se deja de leer (y de hacer OCR) en cuanto el
+# extractor detectado tiene resueltos todos los campos obligatorios (extraction_fields.is_required).
+# El extractor se detecta con las páginas leídas hasta ese momento.
+EXTRACTION_EARLY_STOP: bool = True
+
+# --- Reglas de extracción (rule_store.py) ---
+# Cada cuánto se consulta en la BBDD si otro proceso (p.ej. el editor de reglas) las ha
+# cambiado. Los cambios hechos en este mismo proceso se ven en el momento.
+RULES_CHECK_SECONDS: float = 1.0
+
+# --- Pipeline de ingesta por etapas (ingest_pipeline.py) ---
+# Procesos en total para las etapas de CPU (lectura, OCR, extracción, ver split_workers); 0 = uno por núcleo
+PIPELINE_WORKERS: int = 0
+# Capacidad de cada cola entre etapas: si se llena, la etapa anterior espera
+PIPELINE_QUEUE_SIZE: int = 32
+# Facturas como máximo por transacción del hilo escritor
+PIPELINE_WRITE_BATCH: int = 50
+
+# --- Clasificador por maquetación ---
+# Si ni el nombre del fichero ni el CIF identifican al proveedor, se busca la factura
+# validada con la maquetación más parecida (layout_index.py) y se usa su extractor.
+LAYOUT_MATCH_ENABLED: bool = True
+LAYOUT_MIN_SIMILARITY: float = 0.6 # Similitud mínima (0..1) para aceptar la plantilla
+LAYOUT_INDEX_REFRESH_SECONDS: int = 60 # Cada cuánto se recarga (en segundo plano) el índice de huellas
+
 
 # --- Mapeo de Clases de Extracción (Movido de main_extractor_gui.py) ---
 # {nombre_clave_archivo: ruta_completa_a_clase}
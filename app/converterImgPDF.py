@@ -1,6 +1,6 @@
 from PIL import Image
-import pytesseract
 import os # Asegurarse de que os está importado
+import ocr_engine
 
 def convert_image_to_searchable_pdf(image_path, output_pdf_path):
     try:
@@ -10,11 +10,11 @@ def convert_image_to_searchable_pdf(image_path, output_pdf_path):
         # Realizar OCR y obtener el texto en formato PDF (hOCR o PDF de Tesseract)
         # Tesseract puede generar un PDF directamente.
         # Asegúrate de que Tesseract esté instalado en tu sistema y su ruta añadida al PATH
-        # O configura pytesseract.pytesseract.tesseract_cmd = r'<path_to_tesseract_executable>'
+        # O configura TESSERACT_CMD_PATH en config.py (ocr_engine.TESSERACT_CMD)
 
         # Este método es el más directo para un PDF "buscable":
-        # 'spa' para español. Se genera el PDF directamente en la ruta especificada.
-        pdf_output = pytesseract.image_to_pdf_or_hocr(img, extension='pdf', lang='spa')
+        # 'spa' para español. Se genera el PDF en el pool de OCR y se guarda en la ruta especificada.
+        pdf_output = ocr_engine.submit_searchable_pdf(img, lang='spa').result()
         
         with open(output_pdf_path, 'wb') as f:
             f.write(pdf_output)
@@ -29,7 +29,7 @@ def convert_image_to_searchable_pdf(image_path, output_pdf_path):
 # if __name__ == '__main__':
 #     # Asegúrate de tener una imagen de prueba, por ejemplo, 'test_image.png'
 #     # y que la ruta a Tesseract esté configurada si no está en el PATH
-#     pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe' 
+#     # (TESSERACT_CMD_PATH en config.py)
 #     
 #     image_file = "test_image.png" # Reemplaza con una imagen real
 #     # Generar el PDF en el mismo directorio que la imagen de prueba
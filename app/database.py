@@ -1,25 +1,21 @@
 import sqlite3
 import os
-from typing import Any, List, Dict, Optional, Tuple
+import re
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
-from contextlib import contextmanager
+
+import db_connections
+from utils import normalize_date_iso
 
 # --- Configuración ---
 DB_NAME = "facturas.db"
 
-class DuplicateInvoiceError(Exception):
-    """Excepción lanzada cuando se intenta insertar una factura duplicada."""
-    pass
-
-@contextmanager
 def get_db_connection():
-    """Gestiona la conexión a la BBDD de forma segura."""
-    conn = sqlite3.connect(DB_NAME, timeout=10)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+    """
+    Conexión persistente del hilo actual a la BBDD (WAL, ver db_connections). Lo que no
+    se confirme con commit() se deshace al salir del bloque, como al cerrar la conexión.
+    """
+    return db_connections.connection(DB_NAME)
 
 # --- Utilidades ---
 def _clean_numeric_value(value: Any) -> Optional[float]:
@@ -60,7 +56,9 @@ def setup_database():
                 log_data TEXT,
                 procesado_en TEXT,
                 concepto TEXT,
-                exportado TEXT       
+                exportado TEXT,
+                fecha_iso TEXT,
+                extractor TEXT
             )
         """)
         # NUEVA TABLA: Base de Conocimiento para Aprendizaje Inteligente
@@ -115,6 +113,38 @@ def setup_database():
                 FOREIGN KEY (field_id) REFERENCES extraction_fields(field_id)
             )
         """)
+
+        # Post-procesado declarativo de los extractores de reglas (extractors/rule_extractor.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS extractor_postprocessors (
+                postprocessor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                extractor_id INTEGER NOT NULL,
+                field_name TEXT NOT NULL,         -- Campo en mayúsculas (IMPORTE, MATRICULA...)
+                step_order INTEGER NOT NULL DEFAULT 1,
+                processor TEXT NOT NULL,          -- Nombre en rule_extractor.VALIDATORS, DERIVATIONS u OPTIONS
+                argument TEXT,                    -- Parámetro opcional (prefijo, regex, tipo de IVA...)
+                UNIQUE (extractor_id, field_name, step_order),
+                FOREIGN KEY (extractor_id) REFERENCES extractors(extractor_id)
+            )
+        """)
+
+        # Huellas de maquetación de las facturas validadas (ver layout_index.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS layout_fingerprints (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                grid TEXT,
+                mtime REAL
+            )
+        """)
+
+        # Contadores persistentes (p.ej. 'rules_version', compartido entre procesos)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS config_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
         conn.commit()
     
     insert_default_fields()
@@ -124,7 +154,7 @@ def _run_migrations():
     REQUIRED_COLUMNS = {
         "processed_invoices": {
             "tasas": "REAL", "log_data": "TEXT", "procesado_en": "TEXT",
-            "concepto": "TEXT", "exportado": "TEXT"
+            "concepto": "TEXT", "exportado": "TEXT", "fecha_iso": "TEXT", "extractor": "TEXT"
         }
     }
     with get_db_connection() as conn:
@@ -135,7 +165,111 @@ def _run_migrations():
             for col_name, col_type in columns.items():
                 if col_name not in existing:
                     cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}")
+                    if (table, col_name) == ("processed_invoices", "extractor"):
+                        _migrate_invoice_extractors(cursor)
+        _migrate_invoice_indexes(cursor)
+        _migrate_rule_extractors(cursor)
         conn.commit()
+
+# --- Índices y fecha normalizada de processed_invoices ---
+# Filtros habituales: pendientes de validar (dashboard), lotes exportados, duplicados por
+# emisor + número, búsquedas por matrícula y rangos de fechas sobre fecha_iso (AAAA-MM-DD).
+INVOICE_INDEXES = {
+    'idx_invoices_validated': 'is_validated',
+    'idx_invoices_exportado': 'exportado',
+    'idx_invoices_emisor_numero': 'cif_emisor, numero_factura',
+    'idx_invoices_matricula': 'matricula',
+    'idx_invoices_fecha_iso': 'fecha_iso',
+    'idx_invoices_procesado_en': 'procesado_en, path', # Orden por defecto de las tablas (fetch_invoice_page)
+}
+
+def _migrate_invoice_indexes(cursor):
+    """Rellena fecha_iso donde falte (filas anteriores a la columna) y crea los índices."""
+    rows = cursor.execute(
+        "SELECT path, fecha FROM processed_invoices WHERE fecha_iso IS NULL AND fecha IS NOT NULL"
+    ).fetchall()
+    updates = [(normalize_date_iso(fecha), path) for path, fecha in rows]
+    cursor.executemany("UPDATE processed_invoices SET fecha_iso = ? WHERE path = ?",
+                       [update for update in updates if update[0]])
+    for name, columns in INVOICE_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON processed_invoices({columns})")
+
+# --- Extractor usado por factura (processed_invoices.extractor, ver layout_index.py) ---
+# Las filas anteriores a la columna solo lo tienen en el log: se rellena una vez, al añadirla.
+_LOG_EXTRACTOR_RE = re.compile(r'Usado extractor: (\w+(?:\.\w+)+)')
+
+def _migrate_invoice_extractors(cursor):
+    rows = cursor.execute(
+        "SELECT path, log_data FROM processed_invoices WHERE log_data LIKE '%Usado extractor: %'"
+    ).fetchall()
+    updates = [(match.group(1), path) for path, log_data in rows
+               for match in [_LOG_EXTRACTOR_RE.search(log_data or '')] if match]
+    cursor.executemany("UPDATE processed_invoices SET extractor = ? WHERE path = ?", updates)
+
+# --- Extractores generados que pasan al motor de reglas (extractors/rule_extractor.py) ---
+# Módulos generados sin código propio (plantilla con limpieza numérica de base, iva, importe
+# y tasas): sus reglas ya están en la BBDD y RuleExtractor devuelve lo mismo (ver
+# tests/test_rule_extractor.py). Tampoco buscan la fecha en todo el documento: se activa por
+# clave con el post-procesador 'date_fallback' en FECHA. Clase del módulo -> clave de sus reglas.
+RULE_EXTRACTOR_MIGRATIONS = {
+    'extractors.adevinta_extractor.AdevintaExtractor': 'adevinta',
+    'extractors.autocasher_extractor.AutocasherExtractor': 'autocasher',
+    'extractors.autodescuento_extractor.AutodescuentoExtractor': 'autodescuento',
+    'extractors.autodoc_extractor.AutodocExtractor': 'autodoc',
+    'extractors.autolunas_extractor.AutolunasExtractor': 'autolunas',
+    'extractors.autolux_extractor.AutoluxExtractor': 'autolux',
+    'extractors.beroil_extractor.BeroilExtractor': 'beroil',
+    'extractors.berolkemi_extractor.BerolkemiExtractor': 'berolkemi',
+    'extractors.brildor_extractor.BrildorExtractor': 'brildor',
+    'extractors.cantelar_extractor.CantelarExtractor': 'cantelar',
+    'extractors.cesvimap_extractor.CesvimapExtractor': 'cesvimap',
+    'extractors.codigo_extractor.CodigoExtractor': 'codigo',
+    'extractors.colomer_extractor.ColomerExtractor': 'colomer',
+    'extractors.desguaceseduardo_extractor.DesguaceseduardoExtractor': 'eduardo',
+    'extractors.fiel_extractor.FielExtractor': 'fiel',
+    'extractors.guarnecidos_extractor.GuarnecidosExtractor': 'guarnecidos',
+    'extractors.minuta_extractor.MinutaExtractor': 'minuta',
+    'extractors.valdizarbe_extractor.ValdizarbeExtractor': 'valdizarbe',
+}
+
+def _migrate_rule_extractors(cursor):
+    """Apunta a RuleExtractor las filas de 'extractors' que usan un módulo de RULE_EXTRACTOR_MIGRATIONS."""
+    migrated = []
+    for class_path, key in RULE_EXTRACTOR_MIGRATIONS.items():
+        cursor.execute("UPDATE extractors SET class_path = ? WHERE class_path = ?",
+                       (f"extractors.rule_extractor.{key}", class_path))
+        if cursor.rowcount > 0:
+            migrated.append(key)
+    if migrated:
+        print(f"Migración: extractores que pasan a RuleExtractor: {', '.join(migrated)}.")
+        bump_config_version()
+
+# Consultas que deben resolverse con un índice (ver check_index_usage)
+INDEXED_QUERIES = {
+    'pendientes de validar': ("SELECT COUNT(*) FROM processed_invoices WHERE is_validated = ?", (0,)),
+    'lote exportado': ("SELECT path FROM processed_invoices WHERE exportado = ?", ('SI',)),
+    'duplicado emisor/número': ("SELECT path FROM processed_invoices WHERE cif_emisor = ? AND numero_factura = ?", ('', '')),
+    'matrícula': ("SELECT path FROM processed_invoices WHERE matricula = ?", ('',)),
+    'rango de fechas': ("SELECT path FROM processed_invoices WHERE fecha_iso BETWEEN ? AND ?", ('2025-01-01', '2025-12-31')),
+}
+
+def explain_query_plan(sql: str, params: Tuple[Any, ...] = ()) -> List[str]:
+    """Pasos de EXPLAIN QUERY PLAN de la consulta (p.ej. 'SEARCH ... USING INDEX ...')."""
+    with get_db_connection() as conn:
+        return [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+def check_index_usage() -> Dict[str, List[str]]:
+    """
+    Comprueba con EXPLAIN QUERY PLAN que cada consulta de INDEXED_QUERIES usa un índice.
+    Devuelve {consulta: plan} de las que recorren la tabla entera (vacío si todo está bien).
+    """
+    full_scans = {}
+    for name, (sql, params) in INDEXED_QUERIES.items():
+        plan = explain_query_plan(sql, params)
+        if not any('USING INDEX' in step or 'USING COVERING INDEX' in step for step in plan):
+            full_scans[name] = plan
+    return full_scans
+
 # --- Funciones de Aprendizaje (NUEVAS) ---
 
 def save_learning_rule(emisor_id, campo, ancla, rel_x, rel_y, pagina):
@@ -199,6 +333,93 @@ def fetch_all_invoices_exported() -> List[Dict]:
         cursor.execute("SELECT * FROM processed_invoices WHERE exportado = 'SI'")
         return [dict(row) for row in cursor.fetchall()]
 
+# --- Consultas de facturas por páginas (paginación por clave) ---
+# Para las tablas: solo las columnas pedidas (log_data, que es lo que más pesa, solo si se
+# pide), filtros sencillos y paginación por clave: el cursor es la clave de orden de la
+# última fila (valor de order_by, path), así que la página N cuesta lo mismo que la primera
+# (sin OFFSET) y una inserción entre páginas no repite ni salta filas.
+INVOICE_COLUMNS = (
+    'path', 'file_name', 'tipo', 'fecha', 'numero_factura', 'emisor', 'cif_emisor', 'cliente',
+    'cif', 'modelo', 'matricula', 'concepto', 'base', 'iva', 'importe', 'tasas', 'is_validated',
+    'log_data', 'procesado_en', 'exportado', 'fecha_iso',
+)
+LIST_COLUMNS = tuple(column for column in INVOICE_COLUMNS if column != 'log_data')
+
+# Filtros: {columna: valor} (=), {columna: None} (IS NULL) o {columna: (operador, valor)};
+# 'EMPTY' es NULL o cadena vacía (p.ej. facturas aún no exportadas) y no lleva valor.
+FILTER_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'LIKE', 'EMPTY')
+
+InvoiceCursor = Tuple[Any, str] # (valor de order_by, path) de la última fila servida
+
+def _check_column(column: str) -> str:
+    if column not in INVOICE_COLUMNS:
+        raise ValueError(f"Columna desconocida en processed_invoices: {column}")
+    return column
+
+def _invoice_page_sql(columns: Iterable[str], filters: Optional[Dict[str, Any]], order_by: str,
+                      descending: bool, after: Optional[InvoiceCursor]) -> Tuple[str, List[Any]]:
+    selected = list(dict.fromkeys([_check_column(c) for c in columns] + [_check_column(order_by), 'path']))
+    conditions, params = [], []
+    for column, value in (filters or {}).items():
+        _check_column(column)
+        if value is None:
+            conditions.append(f"{column} IS NULL")
+            continue
+        operator, operand = value if isinstance(value, tuple) else ('=', value)
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Operador de filtro no admitido: {operator}")
+        if operator == 'EMPTY':
+            conditions.append(f"({column} IS NULL OR {column} = '')")
+        else:
+            conditions.append(f"{column} {operator} ?")
+            params.append(operand)
+    if after is not None:
+        # NULL es el menor valor para SQLite: va al principio en ASC y al final en DESC
+        last_value, last_path = after
+        cmp = '<' if descending else '>'
+        if last_value is None:
+            keyset = f"({order_by} IS NULL AND path {cmp} ?)"
+            keyset = keyset if descending else f"({keyset} OR {order_by} IS NOT NULL)"
+            params.append(last_path)
+        else:
+            keyset = f"({order_by}, path) {cmp} (?, ?)" # Comparación de filas: usa el índice
+            keyset = f"({keyset} OR {order_by} IS NULL)" if descending else keyset
+            params.extend([last_value, last_path])
+        conditions.append(keyset)
+    direction = 'DESC' if descending else 'ASC'
+    sql = f"SELECT {', '.join(selected)} FROM processed_invoices"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {order_by} {direction}, path {direction} LIMIT ?"
+    return sql, params
+
+def fetch_invoice_page(columns: Iterable[str] = LIST_COLUMNS, filters: Optional[Dict[str, Any]] = None,
+                       order_by: str = 'procesado_en', descending: bool = False, limit: int = 200,
+                       after: Optional[InvoiceCursor] = None) -> Tuple[List[Dict], Optional[InvoiceCursor]]:
+    """
+    Una página de facturas: (filas, cursor de la siguiente página o None si es la última).
+    Las filas traen siempre 'path' y la columna de orden además de las pedidas.
+    """
+    sql, params = _invoice_page_sql(columns, filters, order_by, descending, after)
+    with get_db_connection() as conn:
+        rows = [dict(row) for row in conn.execute(sql, params + [limit + 1]).fetchall()]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1][order_by], rows[-1]['path'])
+
+def iter_invoices(columns: Iterable[str] = LIST_COLUMNS, filters: Optional[Dict[str, Any]] = None,
+                  order_by: str = 'procesado_en', descending: bool = False,
+                  page_size: int = 500) -> Iterator[Dict]:
+    """Recorre las facturas página a página (sin tener todas en memoria ni una lectura abierta)."""
+    columns = list(columns)
+    after = None
+    while True:
+        rows, after = fetch_invoice_page(columns, filters, order_by, descending, page_size, after)
+        yield from rows
+        if after is None:
+            return
+
 def delete_invoice_data(file_path: str):
     normalized_path = file_path.replace('\\', '/')
     with get_db_connection() as conn:
@@ -213,6 +434,8 @@ def update_invoice_field(file_path: str, field_name: str, new_value: Any):
         if field_name in ['base', 'iva', 'importe', 'tasas']:
             new_value = _clean_numeric_value(new_value)
         cursor.execute(f"UPDATE processed_invoices SET {field_name} = ? WHERE path = ?", (new_value, normalized_path))
+        if field_name == 'fecha':
+            cursor.execute("UPDATE processed_invoices SET fecha_iso = ? WHERE path = ?", (normalize_date_iso(new_value), normalized_path))
         conn.commit()
 
 def is_invoice_processed(file_path: str) -> bool:
@@ -224,12 +447,43 @@ def is_invoice_processed(file_path: str) -> bool:
 
 def delete_entire_database_schema():
     """Cuidado: Esto borra todo."""
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
+    db_connections.close_all(DB_NAME)
+    for path in (DB_NAME, DB_NAME + '-wal', DB_NAME + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
     setup_database()
 
 # --- Gestión de Extractores ---
 
+# Versión de la configuración de extractores en este proceso: se incrementa con cada
+# cambio para que las estructuras derivadas (p.ej. el índice CIF de logic) se reconstruyan.
+_config_version = 0
+
+def get_config_version() -> int:
+    return _config_version
+
+def bump_config_version():
+    global _config_version
+    _config_version += 1
+
+def get_rules_version() -> int:
+    """
+    Versión de las reglas de extractor guardada en BBDD. La incrementa cada
+    save_extractor_configuration, también desde otro proceso (editor de reglas).
+    """
+    try:
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT value FROM config_meta WHERE key = 'rules_version'").fetchone()
+            return row['value'] if row else 0
+    except sqlite3.OperationalError:
+        return 0
+
+def _bump_rules_version(cursor):
+    cursor.execute("""
+        INSERT INTO config_meta (key, value) VALUES ('rules_version', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """)
+
 def get_extractor_configuration(extractor_name: str) -> Dict[str, List[Dict[str, Any]]]:
     config = {}
     try:
@@ -256,6 +510,76 @@ def get_extractor_configuration(extractor_name: str) -> Dict[str, List[Dict[str,
         return {} # Retorna vacío si la tabla no existe aún
     return config
 
+def get_all_extractor_configurations() -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """Reglas de TODOS los extractores en una sola consulta: {extractor: {campo: [reglas]}}."""
+    configs: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT e.name AS extractor_name, ef.field_name, ec.type, ec.ref_text, ec.offset, ec.segment, ec.value, ec.line, ec.attempt_order
+                FROM extractor_configurations ec
+                JOIN extractors e ON ec.extractor_id = e.extractor_id
+                JOIN extraction_fields ef ON ec.field_id = ef.field_id
+                ORDER BY e.name, ef.field_name, ec.attempt_order
+            """)
+            for row in cursor.fetchall():
+                rule = dict(row)
+                fields = configs.setdefault(rule.pop('extractor_name'), {})
+                fields.setdefault(rule['field_name'], []).append(rule)
+    except sqlite3.OperationalError:
+        return {} # Retorna vacío si las tablas no existen aún
+    return configs
+
+def get_all_extractor_postprocessors() -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """Post-procesadores de TODOS los extractores: {extractor: {campo: [pasos por step_order]}}."""
+    steps: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT e.name AS extractor_name, pp.field_name, pp.step_order, pp.processor, pp.argument
+                FROM extractor_postprocessors pp
+                JOIN extractors e ON pp.extractor_id = e.extractor_id
+                ORDER BY e.name, pp.field_name, pp.step_order
+            """)
+            for row in cursor.fetchall():
+                step = dict(row)
+                fields = steps.setdefault(step.pop('extractor_name'), {})
+                fields.setdefault(step['field_name'], []).append(step)
+    except sqlite3.OperationalError:
+        return {} # Retorna vacío si la tabla no existe aún
+    return steps
+
+def save_extractor_postprocessor(extractor_name: str, field_name: str, processor: str,
+                                 argument: Optional[str] = None, step_order: int = 1) -> bool:
+    """Añade (o sustituye) un paso de post-procesado de un campo de un extractor existente."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT extractor_id FROM extractors WHERE name = ?", (extractor_name,))
+            ext_row = cursor.fetchone()
+            if not ext_row: return False
+            cursor.execute("""
+                INSERT OR REPLACE INTO extractor_postprocessors
+                (extractor_id, field_name, step_order, processor, argument)
+                VALUES (?, ?, ?, ?, ?)
+            """, (ext_row['extractor_id'], field_name.upper(), step_order, processor, argument))
+            _bump_rules_version(cursor)
+            conn.commit()
+            bump_config_version()
+            return True
+        except Exception as e:
+            print(f"Error: {e}")
+            return False
+
+def get_required_fields() -> List[str]:
+    """Nombres de los campos marcados como obligatorios (is_required = 1)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT field_name FROM extraction_fields WHERE is_required = 1")
+        return [row['field_name'] for row in cursor.fetchall()]
+
 def save_extractor_configuration(extractor_name: str, field_name: str, rule: Dict[str, Any]) -> bool:
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -263,8 +587,9 @@ def save_extractor_configuration(extractor_name: str, field_name: str, rule: Dic
             cursor.execute("SELECT extractor_id FROM extractors WHERE name = ?", (extractor_name,))
             ext_row = cursor.fetchone()
             if not ext_row:
+                # Sin módulo propio: lo ejecuta el motor de reglas (extractors/rule_extractor.py)
                 cursor.execute("INSERT INTO extractors (name, class_path) VALUES (?, ?)", 
-                               (extractor_name, f"extractors.{extractor_name.lower()}.{extractor_name}"))
+                               (extractor_name, f"extractors.rule_extractor.{extractor_name}"))
                 ext_id = cursor.lastrowid
             else: ext_id = ext_row['extractor_id']
 
@@ -279,7 +604,9 @@ def save_extractor_configuration(extractor_name: str, field_name: str, rule: Dic
             """, (ext_id, f_row['field_id'], rule.get('attempt_order', 1), rule.get('type'), 
                   rule.get('ref_text'), rule.get('offset', 0), rule.get('segment', '1'), 
                   rule.get('value'), rule.get('line', 0)))
+            _bump_rules_version(cursor)
             conn.commit()
+            bump_config_version()
             return True
         except Exception as e:
             print(f"Error: {e}")
@@ -291,29 +618,97 @@ def get_extraction_mapping() -> Dict[str, str]:
         cursor.execute("SELECT name, class_path FROM extractors WHERE is_enabled=1")
         return {row['name']: row['class_path'] for row in cursor.fetchall()}
 
-def insert_invoice_data(data: Dict[str, Any], original_path: str, is_validated: int):
+# Guardar otra vez una ruta ya procesada sustituye la fila anterior (INSERT OR REPLACE):
+# no hay error de factura duplicada. Así se reprocesa (force_reprocess) y se corrige.
+INSERT_INVOICE_SQL = """
+    INSERT OR REPLACE INTO processed_invoices (
+        path, file_name, tipo, fecha, numero_factura, emisor, cif_emisor, 
+        cliente, cif, modelo, matricula, concepto, base, iva, importe, 
+        tasas, is_validated, log_data, procesado_en, fecha_iso, extractor
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def invoice_row_values(data: Dict[str, Any], original_path: str, is_validated: int) -> Tuple[Any, ...]:
+    """Valores de INSERT_INVOICE_SQL para una factura (mismo orden que las columnas)."""
     normalized_path = original_path.replace('\\', '/')
+    return (
+        normalized_path, data.get('Archivo', os.path.basename(normalized_path)),
+        data.get('Tipo'), data.get('Fecha'), data.get('Número de Factura'), 
+        data.get('Emisor'), data.get('CIF Emisor'), data.get('Cliente'), 
+        data.get('CIF'), data.get('Modelo'), data.get('Matricula'), 
+        data.get('Concepto'), _clean_numeric_value(data.get('Base')), 
+        _clean_numeric_value(data.get('IVA')), _clean_numeric_value(data.get('Importe')), 
+        _clean_numeric_value(data.get('Tasas')), is_validated, 
+        data.get('DebugLines'), datetime.now().isoformat(),
+        normalize_date_iso(data.get('Fecha')), data.get('Extractor')
+    )
+
+def insert_invoice_data(data: Dict[str, Any], original_path: str, is_validated: int):
+    with get_db_connection() as conn:
+        conn.execute(INSERT_INVOICE_SQL, invoice_row_values(data, original_path, is_validated))
+        conn.commit()
+
+def insert_invoices_bulk(records: List[Tuple[Dict[str, Any], str, int]]) -> int:
+    """
+    Inserta (o actualiza) varias facturas con executemany en UNA transacción: un solo
+    commit (y un solo fsync) por lote. records: [(datos, ruta original, is_validated)],
+    los mismos argumentos que insert_invoice_data. Si algo falla no se guarda ninguna
+    y se propaga el sqlite3.Error. Devuelve el número de facturas guardadas.
+    La huella de maquetación ('Huella' en los datos, ver layout_index.encode_fingerprint)
+    se guarda en la misma transacción; sin ella se borra la anterior de esa ruta.
+    """
+    rows = [invoice_row_values(data, original_path, is_validated) for data, original_path, is_validated in records]
+    if not rows:
+        return 0
+    fingerprints = [(row[0], *data['Huella']) for row, (data, _, _) in zip(rows, records) if data.get('Huella')]
+    without = [(row[0],) for row, (data, _, _) in zip(rows, records) if not data.get('Huella')]
+    with get_db_connection() as conn:
+        try:
+            conn.executemany(INSERT_INVOICE_SQL, rows)
+            conn.executemany(SAVE_FINGERPRINT_SQL, fingerprints)
+            conn.executemany("DELETE FROM layout_fingerprints WHERE path = ?", without)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return len(rows)
+
+# --- Huellas de maquetación (layout_index.py) ---
+
+SAVE_FINGERPRINT_SQL = """
+    INSERT OR REPLACE INTO layout_fingerprints (path, signature, grid, mtime)
+    VALUES (?, ?, ?, ?)
+"""
+
+def fetch_layout_training_rows() -> List[Dict]:
+    """Facturas validadas con extractor específico y huella (sin leer log_data)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.path, p.extractor, f.signature, f.grid
+            FROM processed_invoices p
+            JOIN layout_fingerprints f ON f.path = p.path
+            WHERE p.is_validated = 1 AND p.extractor IS NOT NULL
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+def fetch_paths_without_fingerprint(limit: Optional[int] = None) -> List[str]:
+    """Facturas validadas con extractor específico a las que aún les falta la huella."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        sql = """
-            INSERT OR REPLACE INTO processed_invoices (
-                path, file_name, tipo, fecha, numero_factura, emisor, cif_emisor, 
-                cliente, cif, modelo, matricula, concepto, base, iva, importe, 
-                tasas, is_validated, log_data, procesado_en
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        values = (
-            normalized_path, data.get('Archivo', os.path.basename(normalized_path)),
-            data.get('Tipo'), data.get('Fecha'), data.get('Número de Factura'), 
-            data.get('Emisor'), data.get('CIF Emisor'), data.get('Cliente'), 
-            data.get('CIF'), data.get('Modelo'), data.get('Matricula'), 
-            data.get('Concepto'), _clean_numeric_value(data.get('Base')), 
-            _clean_numeric_value(data.get('IVA')), _clean_numeric_value(data.get('Importe')), 
-            _clean_numeric_value(data.get('Tasas')), is_validated, 
-            data.get('DebugLines'), datetime.now().isoformat()
-        )
-        cursor.execute(sql, values)
+        cursor.execute("""
+            SELECT p.path FROM processed_invoices p
+            LEFT JOIN layout_fingerprints f ON f.path = p.path
+            WHERE p.is_validated = 1 AND p.extractor IS NOT NULL AND f.path IS NULL
+            LIMIT ?
+        """, (-1 if limit is None else limit,))
+        return [row['path'] for row in cursor.fetchall()]
+
+def save_layout_fingerprint(path: str, signature: str, grid: str, mtime: Optional[float]):
+    with get_db_connection() as conn:
+        conn.execute(SAVE_FINGERPRINT_SQL, (path, signature, str(grid), mtime))
         conn.commit()
+
 def initialize_extractors_data():
     """
     Inserta los extractores base en la tabla 'extractors' si no existen.
@@ -332,6 +727,7 @@ def initialize_extractors_data():
                 VALUES (?, ?, ?)
             """, extractors_base)
             conn.commit()
+            bump_config_version()
         except Exception as e:
             print(f"Error inicializando extractors: {e}")
 
@@ -342,6 +738,26 @@ def is_invoice_processed(file_path: str) -> bool:
         cursor = conn.cursor()
         cursor.execute("SELECT 1 FROM processed_invoices WHERE path = ?", (normalized_path,))
         return cursor.fetchone() is not None
+
+# Rutas por consulta en filter_unprocessed (por debajo del límite de 999 variables de SQLite antiguos)
+_PATHS_PER_QUERY = 500
+
+def filter_unprocessed(paths: List[str]) -> List[str]:
+    """
+    Las rutas que aún no están en processed_invoices, en el mismo orden. Comprueba el lote
+    entero con una consulta IN (...) por cada _PATHS_PER_QUERY rutas en lugar de una por fichero.
+    """
+    normalized = [path.replace('\\', '/') for path in paths]
+    unique = list(dict.fromkeys(normalized))
+    processed = set()
+    with get_db_connection() as conn:
+        for start in range(0, len(unique), _PATHS_PER_QUERY):
+            chunk = unique[start:start + _PATHS_PER_QUERY]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f"SELECT path FROM processed_invoices WHERE path IN ({placeholders})", chunk).fetchall()
+            processed.update(row[0] for row in rows)
+    return [path for path, normalized_path in zip(paths, normalized) if normalized_path not in processed]
+
 def get_all_extractor_names():
     """Obtiene la lista de nombres de extractores registrados en la tabla 'extractors'."""
     try:
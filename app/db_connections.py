@@ -0,0 +1,185 @@
+# db_connections.py
+
+import os
+import time
+import sqlite3
+import weakref
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from config import DB_BUSY_TIMEOUT, DB_CACHE_KB, DB_MMAP_SIZE, DB_CACHED_STATEMENTS
+
+# --- Conexiones SQLite persistentes por hilo ---
+# Antes cada get_db_connection() abría y cerraba una conexión (y la caché de sentencias
+# preparadas se perdía con ella). Ahora cada hilo guarda UNA conexión por fichero y la
+# reutiliza en todas sus llamadas:
+#     with db_connections.connection(DB_NAME) as conn: ...
+# - WAL + synchronous=NORMAL: los lectores (dashboards, tabla) no bloquean al escritor
+#   del pipeline ni al revés; solo espera quien quiere escribir mientras otro escribe.
+# - Las sentencias se preparan una vez por conexión (caché de sqlite3 por texto SQL).
+# - Al salir del bloque más externo se deshace lo que no se haya confirmado con commit(),
+#   igual que al cerrar la conexión de antes. Los bloques anidados comparten la conexión.
+# - Tras un fork (procesos del pipeline) el proceso hijo abre sus propias conexiones.
+
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA mmap_size = {DB_MMAP_SIZE}",
+    f"PRAGMA cache_size = -{DB_CACHE_KB}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    'opened': 0, 'checkouts': 0, 'nested': 0, 'rollbacks': 0,
+    'write_waits': 0, 'write_wait_seconds': 0.0, 'max_write_wait': 0.0, 'lock_errors': 0,
+}
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_open_connections: "weakref.WeakSet[_Connection]" = weakref.WeakSet() # Para close_all()
+_generation = 0 # close_all() lo incrementa: las conexiones anteriores ya no se usan
+
+
+def _count(stat: str, n: float = 1):
+    with _stats_lock:
+        _stats[stat] += n
+
+
+def _timed_execute(conn: sqlite3.Connection, execute: Callable, sql: str, parameters: Any):
+    """
+    Ejecuta la sentencia midiendo la espera del bloqueo de escritura: la primera escritura
+    de cada transacción es la que abre la transacción y espera (hasta DB_BUSY_TIMEOUT)
+    si otra conexión está escribiendo.
+    """
+    if conn.in_transaction:
+        return execute(sql, parameters)
+    start = time.perf_counter()
+    try:
+        return execute(sql, parameters)
+    except sqlite3.OperationalError as e:
+        if 'locked' in str(e) or 'busy' in str(e):
+            _count('lock_errors')
+        raise
+    finally:
+        if conn.in_transaction:
+            elapsed = time.perf_counter() - start
+            with _stats_lock:
+                _stats['write_waits'] += 1
+                _stats['write_wait_seconds'] += elapsed
+                _stats['max_write_wait'] = max(_stats['max_write_wait'], elapsed)
+
+
+class _Cursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters: Any = ()):
+        return _timed_execute(self.connection, super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any):
+        return _timed_execute(self.connection, super().executemany, sql, seq_of_parameters)
+
+
+class _Connection(sqlite3.Connection):
+    """sqlite3.Connection que cuenta las esperas de escritura (ver get_stats)."""
+
+    def cursor(self, factory: type = _Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()):
+        return _timed_execute(self, super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any):
+        return _timed_execute(self, super().executemany, sql, seq_of_parameters)
+
+
+def _open(path: str, setup: Optional[Callable[[sqlite3.Connection], None]]) -> "_Connection":
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, factory=_Connection,
+                           cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
+    try:
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        if setup:
+            setup(conn)
+            conn.commit()
+    except sqlite3.Error:
+        conn.close()
+        raise
+    conn.db_path, conn.pid = path, os.getpid()
+    with _registry_lock:
+        _open_connections.add(conn)
+    _count('opened')
+    return conn
+
+
+def _thread_connections() -> Dict[str, list]:
+    """Conexiones del hilo actual: {ruta absoluta: [conexión, profundidad]}."""
+    state = getattr(_local, 'state', None)
+    if state is None or state[0] != os.getpid() or state[1] != _generation:
+        # Primer uso en el hilo, proceso hijo de un fork o tras close_all()
+        state = (os.getpid(), _generation, {})
+        _local.state = state
+    return state[2]
+
+
+@contextmanager
+def connection(path: str, setup: Optional[Callable[[sqlite3.Connection], None]] = None) -> Iterator[sqlite3.Connection]:
+    """
+    Conexión persistente del hilo actual al fichero path (filas sqlite3.Row). setup(conn)
+    se ejecuta solo al abrir la conexión (p.ej. crear tablas de una BBDD auxiliar).
+    """
+    key = path if path == ':memory:' else os.path.abspath(path)
+    connections = _thread_connections()
+    entry = connections.get(key)
+    if entry is None:
+        entry = [_open(key, setup), 0]
+        connections[key] = entry
+    conn = entry[0]
+    _count('nested' if entry[1] else 'checkouts')
+    if entry[1] == 0:
+        conn.row_factory = sqlite3.Row
+    entry[1] += 1
+    try:
+        yield conn
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and conn.in_transaction:
+            conn.rollback()
+            _count('rollbacks')
+
+
+def close_all(path: Optional[str] = None):
+    """
+    Cierra las conexiones de todos los hilos (solo las de path si se indica). Usar solo
+    cuando nadie está usando la BBDD: antes de borrar el fichero o al terminar.
+    """
+    global _generation
+    key = os.path.abspath(path) if path and path != ':memory:' else path
+    with _registry_lock:
+        _generation += 1
+        for conn in list(_open_connections):
+            # Las heredadas de un fork son del proceso padre: no se tocan
+            if conn.pid == os.getpid() and key in (None, conn.db_path):
+                conn.close()
+                _open_connections.discard(conn)
+
+
+def get_stats() -> Dict[str, Any]:
+    """
+    Métricas de uso: conexiones abiertas y reutilizadas, y esperas del bloqueo de escritura
+    (número, segundos acumulados y la mayor) y errores 'database is locked'.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _registry_lock:
+        stats['open'] = sum(1 for conn in _open_connections if conn.pid == os.getpid())
+    checkouts = stats['checkouts']
+    stats['reuse_ratio'] = (checkouts - stats['opened']) / checkouts if checkouts else 0.0
+    return stats
+
+
+def describe() -> str:
+    """Resumen de get_stats() en una línea (barra de estado, log del lote)."""
+    stats = get_stats()
+    return (f"BBDD: {stats['open']} conexiones · {stats['reuse_ratio'] * 100:.0f}% reutilizadas · "
+            f"{stats['write_waits']:.0f} escrituras (espera {stats['write_wait_seconds']:.2f}s, "
+            f"máx {stats['max_write_wait'] * 1000:.0f} ms) · {stats['lock_errors']:.0f} bloqueos")
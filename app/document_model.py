@@ -0,0 +1,278 @@
+# document_model.py
+
+import os
+import base64
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Dict, Any, Callable
+
+try:
+    import fitz # PyMuPDF
+except ImportError:
+    fitz = None
+
+# --- Modelo geométrico del documento (palabras + líneas + índice espacial) ---
+# Se construye UNA vez por fichero con la misma TextPage para "dict" (líneas) y "words"
+# (cajas de palabra). El texto de las líneas es idéntico al de page.get_text(), así que
+# las reglas FIXED/VARIABLE ven las mismas líneas que con la lectura directa.
+
+MODEL_VERSION = 1
+GRID_CELL = 36.0 # Tamaño de celda del índice espacial (puntos PDF, media pulgada)
+
+Rect = Tuple[float, float, float, float]
+
+
+class DocumentModel:
+    """
+    Palabras y líneas de un PDF en arrays compactos (float32 para coordenadas y una
+    tabla de cadenas), con un índice en rejilla por página para consultas espaciales.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self.page_sizes = array('f')      # ancho, alto por página
+
+        # Palabras
+        self.word_boxes = array('f')      # x0, y0, x1, y1 por palabra
+        self.word_text = array('I')       # id en la tabla de cadenas
+        self.word_page = array('H')
+        self.word_line = array('I')       # índice de la línea a la que pertenece
+
+        # Líneas
+        self.line_boxes = array('f')
+        self.line_text = array('I')
+        self.line_page = array('H')
+
+        self._grid: Optional[List[Dict[Tuple[int, int], List[int]]]] = None
+
+    # --- Construcción ---
+
+    def _intern(self, text: str) -> int:
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self._string_ids[text] = string_id
+        return string_id
+
+    @classmethod
+    def from_pdf(cls, pdf_path: str) -> "DocumentModel":
+        doc = fitz.open(pdf_path)
+        try:
+            return cls.from_fitz(doc)
+        finally:
+            doc.close()
+
+    @classmethod
+    def from_fitz(cls, doc) -> "DocumentModel":
+        model = cls()
+        for page_index, page in enumerate(doc):
+            model.page_sizes.extend((page.rect.width, page.rect.height))
+            textpage = page.get_textpage()
+            blocks = page.get_text("dict", textpage=textpage)["blocks"]
+
+            line_ids: Dict[Tuple[int, int], int] = {}
+            for block_no, block in enumerate(blocks):
+                if block.get("type") != 0:
+                    continue
+                for line_no, line in enumerate(block["lines"]):
+                    line_ids[(block_no, line_no)] = len(model.line_page)
+                    model.line_boxes.extend(line["bbox"])
+                    model.line_text.append(model._intern("".join(span["text"] for span in line["spans"])))
+                    model.line_page.append(page_index)
+
+            for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words", textpage=textpage):
+                line_index = line_ids.get((block_no, line_no))
+                if line_index is None:
+                    continue
+                model.word_boxes.extend((x0, y0, x1, y1))
+                model.word_text.append(model._intern(word))
+                model.word_page.append(page_index)
+                model.word_line.append(line_index)
+        return model
+
+    # --- Acceso básico ---
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_sizes) // 2
+
+    def word_count(self) -> int:
+        return len(self.word_page)
+
+    def word(self, index: int) -> Tuple[Rect, str]:
+        i = index * 4
+        return tuple(self.word_boxes[i:i + 4]), self.strings[self.word_text[index]]
+
+    def line_box(self, index: int) -> Rect:
+        i = index * 4
+        return tuple(self.line_boxes[i:i + 4])
+
+    def lines(self, page: Optional[int] = None) -> List[str]:
+        """Líneas no vacías del documento (o de una página), en el orden de page.get_text()."""
+        texts = (
+            self.strings[self.line_text[i]] for i in range(len(self.line_page))
+            if page is None or self.line_page[i] == page
+        )
+        return [t for t in texts if t.strip()]
+
+    # --- Índice espacial en rejilla ---
+
+    def _build_grid(self):
+        grid: List[Dict[Tuple[int, int], List[int]]] = [{} for _ in range(self.page_count)]
+        boxes = self.word_boxes
+        for index in range(len(self.word_page)):
+            x0, y0, x1, y1 = boxes[index * 4:index * 4 + 4]
+            cells = grid[self.word_page[index]]
+            for cx in range(int(x0 // GRID_CELL), int(x1 // GRID_CELL) + 1):
+                for cy in range(int(y0 // GRID_CELL), int(y1 // GRID_CELL) + 1):
+                    cells.setdefault((cx, cy), []).append(index)
+        self._grid = grid
+
+    def _candidates(self, page: int, rect: Rect) -> List[int]:
+        if self._grid is None:
+            self._build_grid()
+        if not (0 <= page < len(self._grid)):
+            return []
+        cells = self._grid[page]
+        found = set()
+        for cx in range(int(rect[0] // GRID_CELL), int(rect[2] // GRID_CELL) + 1):
+            for cy in range(int(rect[1] // GRID_CELL), int(rect[3] // GRID_CELL) + 1):
+                found.update(cells.get((cx, cy), ()))
+        return sorted(found)
+
+    # --- Consultas ---
+
+    def word_at(self, page: int, x: float, y: float, margin: float = 3) -> Optional[int]:
+        """Índice de la palabra bajo el punto (con margen) o None."""
+        boxes = self.word_boxes
+        for index in self._candidates(page, (x - margin, y - margin, x + margin, y + margin)):
+            x0, y0, x1, y1 = boxes[index * 4:index * 4 + 4]
+            if x0 - margin <= x <= x1 + margin and y0 - margin <= y <= y1 + margin:
+                return index
+        return None
+
+    def line_at(self, page: int, x: float, y: float, margin: float = 3) -> Optional[int]:
+        """Índice de la línea a la altura del punto (prefiere la que contiene x)."""
+        best = None
+        for index in range(len(self.line_page)):
+            if self.line_page[index] != page:
+                continue
+            x0, y0, x1, y1 = self.line_box(index)
+            if y0 - margin <= y <= y1 + margin:
+                if x0 - margin <= x <= x1 + margin:
+                    return index
+                if best is None:
+                    best = index
+        return best
+
+    def words_in_rect(self, page: int, rect: Rect) -> List[int]:
+        """Palabras cuyo centro cae dentro del rectángulo, en orden de lectura."""
+        rx0, ry0, rx1, ry1 = min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3])
+        boxes = self.word_boxes
+        result = []
+        for index in self._candidates(page, (rx0, ry0, rx1, ry1)):
+            x0, y0, x1, y1 = boxes[index * 4:index * 4 + 4]
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            if rx0 <= cx <= rx1 and ry0 <= cy <= ry1:
+                result.append(index)
+        return result
+
+    def text_in_rect(self, page: int, rect: Rect) -> str:
+        """Texto de la región: palabras agrupadas por línea, una línea por renglón."""
+        by_line: Dict[int, List[int]] = {}
+        for index in self.words_in_rect(page, rect):
+            by_line.setdefault(self.word_line[index], []).append(index)
+        output = []
+        for line_index in sorted(by_line):
+            words = sorted(by_line[line_index], key=lambda i: self.word_boxes[i * 4])
+            output.append(" ".join(self.strings[self.word_text[i]] for i in words))
+        return "\n".join(output)
+
+    def nearest_word(self, page: int, x: float, y: float, predicate: Optional[Callable[[str], bool]] = None) -> Optional[int]:
+        """Palabra más cercana (por centro) al punto, opcionalmente filtrada por predicate(texto)."""
+        best, min_dist = None, float('inf')
+        boxes = self.word_boxes
+        for index in range(len(self.word_page)):
+            if self.word_page[index] != page:
+                continue
+            if predicate and not predicate(self.strings[self.word_text[index]]):
+                continue
+            x0, y0, x1, y1 = boxes[index * 4:index * 4 + 4]
+            dist = ((x - (x0 + x1) / 2) ** 2 + (y - (y0 + y1) / 2) ** 2) ** 0.5
+            if dist < min_dist:
+                best, min_dist = index, dist
+        return best
+
+    # --- Serialización (para la caché persistente) ---
+
+    _ARRAYS = ('page_sizes', 'word_boxes', 'word_text', 'word_page', 'word_line',
+               'line_boxes', 'line_text', 'line_page')
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {'version': MODEL_VERSION, 'strings': self.strings}
+        for name in self._ARRAYS:
+            data[name] = base64.b64encode(getattr(self, name).tobytes()).decode('ascii')
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DocumentModel":
+        if data.get('version') != MODEL_VERSION:
+            raise ValueError("Versión de DocumentModel incompatible")
+        model = cls()
+        model.strings = list(data['strings'])
+        model._string_ids = {s: i for i, s in enumerate(model.strings)}
+        for name in cls._ARRAYS:
+            target = getattr(model, name)
+            target.frombytes(base64.b64decode(data[name]))
+        return model
+
+
+# --- Carga con caché (memoria + caché persistente de ocr_cache) ---
+
+_MEMORY_CACHE_SIZE = 16
+_memory_cache: "OrderedDict[str, Tuple[float, int, DocumentModel]]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def load_document_model(pdf_path: str) -> DocumentModel:
+    """
+    Devuelve el DocumentModel del fichero. Se reutiliza en memoria mientras el fichero
+    no cambie (mtime/tamaño) y se guarda en la caché persistente por contenido.
+    """
+    abs_path = os.path.abspath(pdf_path)
+    stat = os.stat(abs_path)
+    with _memory_lock:
+        cached = _memory_cache.get(abs_path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            _memory_cache.move_to_end(abs_path)
+            return cached[2]
+
+    model = None
+    cache_key = None
+    try:
+        import ocr_cache
+        cache_key = ocr_cache.make_key(ocr_cache.file_sha256(abs_path), {'kind': 'document_model', 'version': MODEL_VERSION})
+        entry = ocr_cache.get_entry(cache_key)
+        if entry is not None and 'model' in entry['meta']:
+            model = DocumentModel.from_dict(entry['meta']['model'])
+    except Exception as e:
+        print(f"Aviso: caché de DocumentModel no disponible: {e}")
+        cache_key = None
+
+    if model is None:
+        model = DocumentModel.from_pdf(abs_path)
+        if cache_key:
+            try:
+                ocr_cache.put_lines(cache_key, model.lines(), meta={'model': model.to_dict()})
+            except Exception as e:
+                print(f"Aviso: no se pudo guardar el DocumentModel en caché: {e}")
+
+    with _memory_lock:
+        _memory_cache[abs_path] = (stat.st_mtime, stat.st_size, model)
+        _memory_cache.move_to_end(abs_path)
+        while len(_memory_cache) > _MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return model
@@ -11,6 +11,8 @@ except ImportError:
     fitz = None
     VIEWER_AVAILABLE = False
 
+from document_model import load_document_model
+
 
 def get_document_lines(file_path: str) -> List[str]:
     """
@@ -21,12 +23,9 @@ def get_document_lines(file_path: str) -> List[str]:
     # 1. Intento con PyMuPDF (fitz) para PDFs
     if fitz and file_path and os.path.exists(file_path) and file_path.lower().endswith(('.pdf', '.xps', '.epub', '.cbz')):
         try:
-            doc = fitz.open(file_path)
-            for page in doc:
-                # Usar sort=True para una mejor reconstrucción de líneas
-                text = page.get_text("text", sort=True) 
-                lines.extend([l for l in text.splitlines() if l.strip()])
-            doc.close()
+            # Mismas líneas (y mismo orden) que ven las reglas en logic.extraer_datos,
+            # servidas desde el DocumentModel cacheado.
+            lines = load_document_model(file_path).lines()
             if lines:
                 return lines
         except Exception:
@@ -1,18 +1,15 @@
 import fitz
 from PIL import Image, ImageTk
 import io
-import pytesseract  # <--- IMPORTANTE: Necesario para leer imágenes
+import ocr_engine  # <--- OCR a través del pool persistente (configura Tesseract desde config.py)
+from document_model import load_document_model
 from .view import EditorView
 from .controller import EditorController
 
-# Configuración básica de ruta Tesseract si estás en Windows (ajusta si es necesario)
-# from config import TESSERACT_CMD_PATH
-# if TESSERACT_CMD_PATH:
-#     pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
-
 class PDFEngine:
     def __init__(self):
         self.pdf_doc = None
+        self.doc_model = None
         self.current_page = 0
         self.zoom = 1.0
         self.rotation = 0
@@ -21,6 +18,7 @@ class PDFEngine:
 
     def load_document(self, path):
         self.pdf_doc = fitz.open(path)
+        self.doc_model = load_document_model(path)
         self.current_page = 0
 
     def get_page_image(self):
@@ -58,13 +56,9 @@ class PDFEngine:
                 # Usamos un zoom de 2x (matrix=2) para mejorar la precisión del OCR
                 pix = page.get_pixmap(clip=rect, matrix=fitz.Matrix(2, 2))
                 
-                # Convertimos pixmap a imagen PIL
-                img_data = pix.tobytes("png")
-                pil_image = Image.open(io.BytesIO(img_data))
-                
-                # Ejecutamos Tesseract
+                # Ejecutamos Tesseract en el pool de OCR (motor ya cargado)
                 # --psm 6 asume un bloque de texto uniforme
-                texto = pytesseract.image_to_string(pil_image, lang='spa', config='--psm 6')
+                texto = ocr_engine.submit_pixmap(pix, config='--psm 6').result()
                 
             return texto.strip()
 
@@ -73,38 +67,24 @@ class PDFEngine:
             return ""
 
     def find_nearest_anchor(self, target_coords):
-        if not self.pdf_doc: return None
-        page = self.pdf_doc[self.current_page]
-        words = page.get_text("words") 
-        
-        # Si no hay palabras (es una imagen), el ancla no funcionará con 'words'.
-        # En una versión futura podrías hacer OCR de toda la página, pero es lento.
-        if not words:
-            return None
-
+        if not self.doc_model: return None
+        # Si no hay palabras (es una imagen), el modelo no tiene anclas para esta página.
         center_x = (target_coords[0] + target_coords[2]) / 2
         center_y = (target_coords[1] + target_coords[3]) / 2
-        
-        best_anchor = None
-        min_dist = float('inf')
-        
-        for w in words:
-            if any(char.isdigit() for char in w[4]) and len(w[4]) < 10:
-                continue
-            
-            anchor_x = (w[0] + w[2]) / 2
-            anchor_y = (w[1] + w[3]) / 2
-            dist = ((center_x - anchor_x)**2 + (center_y - anchor_y)**2)**0.5
-            
-            if dist < min_dist:
-                min_dist = dist
-                best_anchor = {
-                    'texto': w[4],
-                    'x': w[0],
-                    'y': w[1]
-                }
-                
-        return best_anchor
+
+        index = self.doc_model.nearest_word(
+            self.current_page, center_x, center_y,
+            predicate=lambda texto: not (any(char.isdigit() for char in texto) and len(texto) < 10)
+        )
+        if index is None:
+            return None
+
+        (x0, y0, _, _), texto = self.doc_model.word(index)
+        return {
+            'texto': texto,
+            'x': x0,
+            'y': y0
+        }
 
     def zoom_in(self): self.zoom += 0.2
     def zoom_out(self): self.zoom = max(0.2, self.zoom - 0.2)
@@ -0,0 +1,104 @@
+# extractor_registry.py
+
+import os
+import sys
+import hashlib
+import threading
+import importlib.util
+from typing import Any, Callable, Dict, Optional
+
+# --- Registro de clases de extractor (carga dinámica con recarga en caliente) ---
+# Cada módulo de extractor se ejecuta UNA vez y su clase se reutiliza para todas las
+# facturas. Se vuelve a ejecutar solo si:
+#   - cambia su fichero fuente (mtime/tamaño y, si cambian, el hash del contenido),
+#   - cambia la versión de SUS reglas (version_fn(EXTRACTOR_KEY del módulo)), porque los
+#     extractores generados leen sus reglas de la BBDD al importarse. Editar las reglas
+#     de un proveedor no recarga los módulos de los demás; un módulo sin EXTRACTOR_KEY
+#     no lee reglas y solo se recarga si cambia su fichero.
+
+
+class ExtractorRegistry:
+    """Caché de clases de extractor por ruta 'paquete.modulo.Clase'."""
+
+    def __init__(self, inject: Optional[Dict[str, Any]] = None, version_fn: Optional[Callable[[str], Any]] = None):
+        self._inject = inject or {}           # Nombres que se inyectan en el módulo antes de ejecutarlo
+        self._version_fn = version_fn         # EXTRACTOR_KEY -> versión de sus reglas
+        self._modules: Dict[str, Dict[str, Any]] = {}  # module_name -> {module, key, mtime, size, sha256, version}
+        self._lock = threading.RLock()
+        self.counters = {'hits': 0, 'loads': 0, 'reloads': 0, 'failures': 0}
+
+    def _rules_version(self, extractor_key: Optional[str]) -> Any:
+        if not self._version_fn or not extractor_key:
+            return None
+        try:
+            return self._version_fn(extractor_key)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _exec_module(self, module_name: str):
+        module_spec = importlib.util.find_spec(module_name)
+        if not module_spec:
+            raise ImportError(f"Módulo {module_name} no encontrado")
+        module = importlib.util.module_from_spec(module_spec)
+        module.__dict__.update(self._inject)
+        sys.modules[module_name] = module
+        module_spec.loader.exec_module(module)
+        return module, module_spec.origin
+
+    def _is_current(self, entry: Dict[str, Any]) -> bool:
+        if entry['version'] != self._rules_version(entry['key']):
+            return False
+        origin = entry['origin']
+        if not origin or not os.path.exists(origin):
+            return True
+        stat = os.stat(origin)
+        if stat.st_mtime == entry['mtime'] and stat.st_size == entry['size']:
+            return True
+        # El fichero se ha tocado: solo se recarga si el contenido es distinto
+        if self._file_hash(origin) != entry['sha256']:
+            return False
+        entry['mtime'], entry['size'] = stat.st_mtime, stat.st_size
+        return True
+
+    def get(self, class_path: str):
+        """Clase del extractor, cargando (o recargando) su módulo si hace falta."""
+        module_name, _, class_name = class_path.rpartition('.')
+        with self._lock:
+            entry = self._modules.get(module_name)
+            if entry is not None and self._is_current(entry):
+                self.counters['hits'] += 1
+                return getattr(entry['module'], class_name)
+
+            try:
+                module, origin = self._exec_module(module_name)
+            except Exception:
+                self.counters['failures'] += 1
+                raise
+            self.counters['reloads' if entry is not None else 'loads'] += 1
+
+            extractor_key = getattr(module, 'EXTRACTOR_KEY', None)
+            stat = os.stat(origin) if origin and os.path.exists(origin) else None
+            self._modules[module_name] = {
+                'module': module, 'origin': origin, 'key': extractor_key,
+                'version': self._rules_version(extractor_key),
+                'mtime': stat.st_mtime if stat else None, 'size': stat.st_size if stat else None,
+                'sha256': self._file_hash(origin) if stat else None,
+            }
+            return getattr(module, class_name)
+
+    def invalidate(self, class_path: Optional[str] = None):
+        """Olvida un extractor (o todos) para forzar su recarga en el próximo uso."""
+        with self._lock:
+            if class_path is None:
+                self._modules.clear()
+            else:
+                self._modules.pop(class_path.rpartition('.')[0], None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, cached_modules=len(self._modules))
@@ -14,11 +14,13 @@ import re
 # 'type': 'FIXED' (Fila Fija, línea absoluta 1-based), 'VARIABLE' (Variable, relativa a un texto), o 'FIXED_VALUE' (Valor Fijo, valor constante).
 # 'segment': Posición de la palabra en la línea (1-based), o un rango (ej. "3-5").
 
-import database
+import rule_store
+import rule_engine
+import tracing
 EXTRACTOR_KEY = "autolux"
 
-EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = database.get_extractor_configuration(EXTRACTOR_KEY)
-print("EXTRACTION_MAPPING",EXTRACTION_MAPPING)
+EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = rule_store.get_rules(EXTRACTOR_KEY)
+tracing.debug(EXTRACTOR_KEY, "EXTRACTION_MAPPING %s", EXTRACTION_MAPPING)
 
 EXTRACTION_MAPPING_PROCESSED = {}
 for key, value in EXTRACTION_MAPPING.items():
@@ -90,12 +92,8 @@ class AutoluxExtractor:
         
         # Función auxiliar para buscar línea de referencia (primera coincidencia)
         def find_reference_line(ref_text: str) -> Optional[int]:
-            ref_text_lower = ref_text.lower()
-            for i, line in enumerate(lines):
-                # Buscamos la etiqueta de referencia
-                if ref_text_lower in line.lower():
-                    return i
-            return None
+            # Índice de líneas del documento (compartido con el resto de extractores)
+            return rule_engine.find_reference_line(lines, ref_text)
 
         # Función auxiliar para obtener el valor
         def get_value(mapping: Dict[str, Any]) -> Optional[str]:
@@ -4,25 +4,45 @@ import re
 from typing import Tuple, List, Optional, Any, Dict
 
 from utils import extract_and_format_date
+import rule_engine
+import tracing
 
 # Se asume que estos imports están disponibles o se manejan en el entorno
 # from utils import _clean_and_convert_float 
 
 # --- Mapeo Genérico para Fallback ---
-import database
+import rule_store
 EXTRACTOR_KEY = "base"
 
 # EXTRACTION_MAPPING ahora es el mapeo COMPLETO con listas de reglas (si las hay)
 # Definimos la variable vacía primero
 EXTRACTION_MAPPING = {}
+# Campos obligatorios (extraction_fields.is_required); None = todos los del mapeo
+REQUIRED_FIELDS = None
+# Versión de rule_store con la que se cargó EXTRACTION_MAPPING
+_RULES_VERSION = None
+# EXTRACTION_MAPPING compilado (rule_engine.RulePlan)
+BASE_RULE_PLAN = rule_engine.compile_rules({})
 
 def reload_extraction_config():
     """Función para cargar la configuración de forma segura después de que la DB exista."""
-    global EXTRACTION_MAPPING
+    global EXTRACTION_MAPPING, BASE_EXTRACTION_MAPPING, BASE_RULE_PLAN, REQUIRED_FIELDS, _RULES_VERSION
     try:
-        EXTRACTION_MAPPING = database.get_extractor_configuration(EXTRACTOR_KEY)
+        _RULES_VERSION = rule_store.version()
+        EXTRACTION_MAPPING = rule_store.get_rules(EXTRACTOR_KEY)
     except Exception:
         EXTRACTION_MAPPING = {}
+    BASE_EXTRACTION_MAPPING = EXTRACTION_MAPPING
+    BASE_RULE_PLAN = rule_engine.compile_rules(EXTRACTION_MAPPING)
+    REQUIRED_FIELDS = rule_engine.load_required_fields()
+
+def _refresh_extraction_config():
+    """Recarga las reglas si han cambiado (rule_store) desde la última carga."""
+    try:
+        if rule_store.version() != _RULES_VERSION:
+            reload_extraction_config()
+    except Exception:
+        pass
 
 # Intentamos una carga inicial silenciosa
 reload_extraction_config()
@@ -94,29 +114,24 @@ class BaseInvoiceExtractor:
             
     def _find_reference_line(self, ref_text: str) -> Optional[int]:
         """Busca línea de referencia (primera coincidencia)."""
-        ref_text_lower = ref_text.lower()
-        # Se elimina el print de la búsqueda aquí, ya que se hará antes de llamar a _get_value
-        # print(f"DEBUG FALLBACK: Buscando referencia '{ref_text}'...") 
-        for i, line in enumerate(self.lines):
-            if ref_text_lower in line.lower():
-                print(f"DEBUG FALLBACK: Referencia '{ref_text}' encontrada en línea {i}.")
-                return i
-        # Se elimina el print de la no encontrada aquí, ya que se hará al final de la iteración de reglas
-        # print(f"DEBUG FALLBACK: Referencia '{ref_text}' NO encontrada.")
-        return None
+        # Índice de líneas del documento (compartido con el resto de extractores)
+        i = rule_engine.find_reference_line(self.lines, ref_text)
+        if i is not None:
+            tracing.debug(type(self).__name__, "Referencia '%s' encontrada en línea %d.", ref_text, i)
+        return i
         
     def _get_value(self, mapping: Dict[str, Any]) -> Optional[str]:
         """Obtiene un solo valor (FIXED, VARIABLE o FIXED_VALUE) usando el mapeo."""
         
         if mapping.get('type') == 'FIXED_VALUE':
-            print(f"DEBUG FALLBACK: Aplicando FIXED_VALUE para el valor fijo '{mapping.get('value')}'.")
+            tracing.debug(type(self).__name__, "Aplicando FIXED_VALUE para el valor fijo '%s'.", mapping.get('value'))
             return str(mapping.get('value'))
             
         line_index = None
         
         # (Lógica para obtener line_index a partir de FIXED o VARIABLE, omitida por brevedad) ...
         if mapping.get('type') == 'FIXED':
-            print(f"DEBUG FALLBACK: Aplicando mapeo FIXED (línea absoluta).")
+            tracing.debug(type(self).__name__, "Aplicando mapeo FIXED (línea absoluta).")
             abs_line_1based = mapping.get('line')
             if abs_line_1based is not None and abs_line_1based > 0:
                 line_index = abs_line_1based - 1 
@@ -129,7 +144,7 @@ class BaseInvoiceExtractor:
             
             if ref_index is not None:
                 line_index = ref_index + offset
-                print(f"DEBUG FALLBACK: Mapeo VARIABLE. Ref. index: {ref_index}, Offset: {offset}, Línea final: {line_index}.")
+                tracing.debug(type(self).__name__, "Mapeo VARIABLE. Ref. index: %s, Offset: %s, Línea final: %s.", ref_index, offset, line_index)
             # Nota: Si ref_index es None, line_index sigue siendo None y fallará el check posterior
         
         if line_index is None or not (0 <= line_index < len(self.lines)):
@@ -162,7 +177,7 @@ class BaseInvoiceExtractor:
                     value = line_segments[segment_index_0based].strip()
                     
             if value:
-                print(f"DEBUG FALLBACK: Valor extraído de segmento '{segment_input}': '{value[:50]}...'.")
+                tracing.debug(type(self).__name__, "Valor extraído de segmento '%s': '%.50s...'.", segment_input, value)
                 return value
                     
         except Exception:
@@ -175,42 +190,92 @@ class BaseInvoiceExtractor:
         return self._get_value({k: v for k, v in mapping.items() if k != 'type'})
 
     def _get_all_values_from_attempts(self, attempts: List[Dict[str, Any]]) -> Optional[str]:
-        print(f"DEBUG FALLBACK: Intentando extracción con múltiples mapeos.")
+        tracing.debug(type(self).__name__, "Intentando extracción con múltiples mapeos.")
         for mapping in attempts:
             value = self._get_value(mapping)
             if value is not None and value:
                 return value
         return None
         
+    @classmethod
+    def uses_date_fallback(cls) -> bool:
+        """True si, sin FECHA por reglas, se toma la primera fecha del documento."""
+        return True
+
     def _find_date_fallback(self) -> Optional[str]:
         """
         Intenta encontrar la fecha de forma genérica en el documento 
         si las reglas de mapeo fallaron.
         """
-        print(f"DEBUG FALLBACK: Intentando búsqueda de fecha genérica en todo el documento...")
+        tracing.debug(type(self).__name__, "Intentando búsqueda de fecha genérica en todo el documento...")
         try:
             # Reutilizamos la lógica robusta de utils.extract_and_format_date
             date_value = extract_and_format_date(self.lines)
             if date_value:
-                print(f"DEBUG FALLBACK: Fecha genérica ENCONTRADA: {date_value}")
+                tracing.debug(type(self).__name__, "Fecha genérica ENCONTRADA: %s", date_value)
                 return date_value
             else:
-                print(f"DEBUG FALLBACK: Búsqueda de fecha genérica FALLIDA.")
+                tracing.debug(type(self).__name__, "Búsqueda de fecha genérica FALLIDA.")
                 return None
         except Exception as e:
-            print(f"DEBUG FALLBACK: Error en búsqueda genérica de fecha: {e}")
+            tracing.warning(type(self).__name__, "Error en búsqueda genérica de fecha: %s", e)
             return None
 
+    # --- REGLAS DEL EXTRACTOR ---
+    # Las subclases dirigidas por datos (extractors/rule_extractor.py) sustituyen estos
+    # dos métodos para usar las reglas de su clave en lugar de las de "base".
+
+    @classmethod
+    def rule_mapping(cls) -> Dict[str, Any]:
+        """Reglas por campo ({campo: [reglas]}), recargadas si han cambiado."""
+        _refresh_extraction_config()
+        return BASE_EXTRACTION_MAPPING
+
+    @classmethod
+    def rule_plan(cls) -> rule_engine.RulePlan:
+        """rule_mapping() compilado."""
+        _refresh_extraction_config()
+        return BASE_RULE_PLAN
+
+    # --- LECTURA POR PÁGINAS (parada temprana) ---
+
+    @classmethod
+    def supports_early_stop(cls) -> bool:
+        """Las subclases que sustituyen extract_data necesitan el documento entero."""
+        return cls.extract_data is BaseInvoiceExtractor.extract_data
+
+    def required_fields_resolved(self, lines: Optional[List[str]] = None) -> bool:
+        """
+        True si con las líneas leídas hasta ahora los campos obligatorios ya tienen su
+        valor definitivo y no hace falta leer (ni pasar por OCR) más páginas.
+        """
+        if not self.supports_early_stop():
+            return False
+        lines = self.lines if lines is None else lines
+        resolved = self.rule_plan().resolve(rule_engine.document_lines(lines), complete=False, fields=REQUIRED_FIELDS)
+        for key, (value, final) in resolved.items():
+            if not final:
+                return False
+            # La fecha tiene búsqueda genérica de respaldo (primera fecha del documento)
+            if key == 'FECHA' and not value and self.uses_date_fallback() and not extract_and_format_date(lines):
+                return False
+        return True
+
     # --- MÉTODOS DE EXTRACCIÓN PRINCIPALES ---
 
     def extract_data(self, lines: List[str]) -> Dict[str, Any]:
         """Implementa la extracción basada en mapeo genérico."""
-        extracted_data = {}
-        print("\nDEBUG FALLBACK: --- INICIANDO EXTRACCIÓN GENÉRICA (BaseInvoiceExtractor) ---")
+        tracing.debug(type(self).__name__, "--- INICIANDO EXTRACCIÓN POR REGLAS ---")
+
+        # 4. Aplicar el mapeo genérico (plan compilado: todas las reglas de una pasada)
+        values = self.rule_plan().evaluate(rule_engine.document_lines(self.lines))
+        return self._build_extracted_data(values)
 
-        # 4. Aplicar el mapeo genérico
-        # BASE_EXTRACTION_MAPPING ahora contiene listas de reglas para cada campo
-        for key, rules_list in BASE_EXTRACTION_MAPPING.items():
+    def _build_extracted_data(self, values: Dict[str, Optional[str]]) -> Dict[str, Any]:
+        """Resultado final a partir de los valores de las reglas: respaldo de FECHA y limpieza numérica."""
+        extracted_data = {}
+        # rule_mapping() contiene listas de reglas para cada campo
+        for key, rules_list in self.rule_mapping().items():
             
             value = None
             key_lower = key.lower()
@@ -219,37 +284,22 @@ class BaseInvoiceExtractor:
                 extracted_data[key_lower] = None
                 continue
                 
-            print(f"\nDEBUG FALLBACK: Procesando campo '{key}'...")
+            tracing.debug(type(self).__name__, "Procesando campo '%s'...", key)
             
             # Aseguramos que rules_list es una lista de diccionarios (aunque sea de un solo elemento)
-            if not isinstance(rules_list, list):
-                if isinstance(rules_list, dict):
-                    rules_list = [rules_list]
-                else:
-                    extracted_data[key_lower] = None
-                    continue
-
-            # ⚠️ NUEVA LÓGICA: Iterar sobre TODAS las reglas para el campo
-            for mapping in rules_list:
-                
-                # Para el mapeo VARIABLE, imprimimos la referencia antes de intentar la búsqueda.
-                if mapping.get('type') == 'VARIABLE':
-                    ref_text = mapping.get('ref_text', '')
-                    print(f"DEBUG FALLBACK: Buscando referencia '{ref_text}'...")
-                
-                # Intento de extracción por regla
-                value = self._get_value(mapping)
-                
-                if value is not None:
-                    # Regla exitosa: usamos el valor y rompemos el bucle interno de reglas.
-                    break 
+            if not isinstance(rules_list, (list, dict)):
+                extracted_data[key_lower] = None
+                continue
+
+            # Primera regla del campo con valor (en orden de attempt_order)
+            value = values.get(key)
 
             # Si después de todas las reglas, el valor es None, mostramos el fallo general
             if value is None:
-                print(f"DEBUG FALLBACK: Referencia de mapeo NO encontrada para todas las reglas del campo '{key}'.")
+                tracing.debug(type(self).__name__, "Referencia de mapeo NO encontrada para todas las reglas del campo '%s'.", key)
                 
             # APLICAR FALLBACK SOLO A LA FECHA
-            if key == 'FECHA' and (value is None or value.strip() == ''):
+            if key == 'FECHA' and (value is None or value.strip() == '') and self.uses_date_fallback():
                 value = self._find_date_fallback()
 
             
@@ -257,31 +307,28 @@ class BaseInvoiceExtractor:
             if key_lower in ['base', 'iva', 'importe', 'tasas']:
                 cleaned_value = self._clean_and_convert_float(value)
                 extracted_data[key_lower] = cleaned_value
-                print(f"DEBUG FALLBACK: Resultado FINAL para '{key}': {cleaned_value} (FLOAT).")
+                tracing.debug(type(self).__name__, "Resultado FINAL para '%s': %s (FLOAT).", key, cleaned_value)
                 
             # --- ASIGNAR VALOR A CAMPOS NO NUMÉRICOS ---
             elif value is not None:
                 extracted_data[key.lower()] = value
-                print(f"DEBUG FALLBACK: Resultado FINAL para '{key}': '{value}'.")
+                tracing.debug(type(self).__name__, "Resultado FINAL para '%s': '%s'.", key, value)
             else:
                 extracted_data[key.lower()] = None
-                print(f"DEBUG FALLBACK: Resultado FINAL para '{key}': None.")
+                tracing.debug(type(self).__name__, "Resultado FINAL para '%s': None.", key)
 
         return extracted_data
 
     def extract_all(self) -> Tuple[Any, ...]:
         """Método de fallback llamado por logic.py para obtener la tupla de 13 campos."""
         data_dict = self.extract_data(self.lines)
-        print ("cif_emisor", data_dict.get('cif_emisor'))
-        print ("------------------------------------------------------------------------------------------------------------------------------------")
         cif_emisor="CIF No encotrado"
         if data_dict.get('cif_emisor')!=None:
            cif_emisor=data_dict.get('cif_emisor')
-        print ("cif_emisor",cif_emisor)     
         nun_fact="Numero factura  No encotrado"
         if data_dict.get('num_factura')!=None:
            nun_fact=data_dict.get('num_factura')
-        print ("cif_emisor",cif_emisor)     
+        tracing.debug(type(self).__name__, "CIF emisor: %s, número de factura: %s", cif_emisor, nun_fact)
         # Mapeo de dict a tupla (Tupla de 13 elementos)
         return (
             data_dict.get('tipo'), data_dict.get('fecha'), nun_fact,
@@ -14,11 +14,13 @@ import re
 # 'type': 'FIXED' (Fila Fija, línea absoluta 1-based), 'VARIABLE' (Variable, relativa a un texto), o 'FIXED_VALUE' (Valor Fijo, valor constante).
 # 'segment': Posición de la palabra en la línea (1-based), o un rango (ej. "3-5").
 
-import database
+import rule_store
+import rule_engine
+import tracing
 EXTRACTOR_KEY = "boxes"
 
-EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = database.get_extractor_configuration(EXTRACTOR_KEY)
-print("EXTRACTION_MAPPING",EXTRACTION_MAPPING)
+EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = rule_store.get_rules(EXTRACTOR_KEY)
+tracing.debug(EXTRACTOR_KEY, "EXTRACTION_MAPPING %s", EXTRACTION_MAPPING)
 
 EXTRACTION_MAPPING_PROCESSED = {}
 for key, value in EXTRACTION_MAPPING.items():
@@ -108,12 +110,8 @@ class BoxesExtractor:
         
         # Función auxiliar para buscar línea de referencia (primera coincidencia)
         def find_reference_line(ref_text: str) -> Optional[int]:
-            ref_text_lower = ref_text.lower()
-            for i, line in enumerate(lines):
-                # Buscamos la etiqueta de referencia
-                if ref_text_lower in line.lower():
-                    return i
-            return None
+            # Índice de líneas del documento (compartido con el resto de extractores)
+            return rule_engine.find_reference_line(lines, ref_text)
 
         # Función auxiliar para obtener el valor
         def get_value(mapping: Dict[str, Any]) -> Optional[str]:
@@ -175,11 +173,11 @@ class BoxesExtractor:
             if isinstance(mapping, list):
                 # Si 'mapping' es una lista, iteramos sobre los intentos
                 for single_mapping in mapping:
-                    print(f"Intentando extraer {key} con: {single_mapping}")
+                    tracing.debug(EXTRACTOR_KEY, "Intentando extraer %s con: %s", key, single_mapping)
             
                     # Obtener el valor
                     temp_value = get_value(single_mapping)
-                    print("temp_value",temp_value)
+                    tracing.debug(EXTRACTOR_KEY, "temp_value %s", temp_value)
                     # 2. Verificar la validación del campo si el valor no es None
                     is_valid = True
                     if key in VALIDATORS:
@@ -187,13 +185,13 @@ class BoxesExtractor:
                             # Validar el valor obtenido
                             if not VALIDATORS[key](temp_value):
                                 is_valid = False
-                                print(f"Valor '{temp_value}' para {key} falló la validación.") 
+                                tracing.debug(EXTRACTOR_KEY, "Valor '%s' para %s falló la validación.", temp_value, key) 
                         
-                        print("is_valid",is_valid)
+                        tracing.debug(EXTRACTOR_KEY, "is_valid %s", is_valid)
                     # 3. Si es válido (o si la clave no requiere validación), lo guardamos y salimos del bucle.
                     if is_valid and temp_value is not None:
                        value = temp_value
-                       print(f"Éxito en {key} con el valor: {value}")
+                       tracing.debug(EXTRACTOR_KEY, "Éxito en %s con el valor: %s", key, value)
                        break # ¡Valor encontrado! Salimos del bucle interno
             else:
                 # Si 'mapping' es un diccionario simple (el comportamiento anterior)
@@ -24,11 +24,13 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 # 'type': 'FIXED' (Fila Fija, línea absoluta 1-based), 'VARIABLE' (Variable, relativa a un texto), o 'FIXED_VALUE' (Valor Fijo, valor constante).
 # 'segment': Posición de la palabra en la línea (1-based), o un rango (ej. "3-5").
 
-import database
+import rule_store
+import rule_engine
+import tracing
 EXTRACTOR_KEY = "coslauto"
 
-EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = database.get_extractor_configuration(EXTRACTOR_KEY)
-print("EXTRACTION_MAPPING",EXTRACTION_MAPPING)
+EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = rule_store.get_rules(EXTRACTOR_KEY)
+tracing.debug(EXTRACTOR_KEY, "EXTRACTION_MAPPING %s", EXTRACTION_MAPPING)
 
 EXTRACTION_MAPPING_PROCESSED = {}
 for key, value in EXTRACTION_MAPPING.items():
@@ -123,12 +125,8 @@ class CoslautoExtractor:
         
         # Función auxiliar para buscar línea de referencia (primera coincidencia)
         def find_reference_line(ref_text: str) -> Optional[int]:
-            ref_text_lower = ref_text.lower()
-            for i, line in enumerate(lines):
-                # Buscamos la etiqueta de referencia
-                if ref_text_lower in line.lower():
-                    return i
-            return None
+            # Índice de líneas del documento (compartido con el resto de extractores)
+            return rule_engine.find_reference_line(lines, ref_text)
 
         # Función auxiliar para obtener el valor
         def get_value(mapping: Dict[str, Any]) -> Optional[str]:
@@ -196,7 +194,7 @@ class CoslautoExtractor:
         # 1. Intentar la primera regla: offset +1
         mapping_v1F = {'type': 'VARIABLE', 'ref_text': ref_text_fac, 'offset': +1, 'segment': segment}
         num_factura = get_value(mapping_v1F)
-        print("num_factura",num_factura)
+        tracing.debug(EXTRACTOR_KEY, "num_factura %s", num_factura)
         if not num_factura.startswith("CA"):
                 num_factura = None
         
@@ -233,7 +231,7 @@ class CoslautoExtractor:
             key_lower = key.lower()
             if key == 'IMPORTE':
                 base,iva = self.calculate_base_and_vat_from_total(value)
-                print("base",base,"iva",iva)
+                tracing.debug(EXTRACTOR_KEY, "base %s iva %s", base, iva)
                 extracted_data['base'] = base
                 extracted_data['iva'] = iva
             # --- APLICAR LIMPIEZA NUMÉRICA A LOS TOTALES Y ASIGNAR FLOAT ---
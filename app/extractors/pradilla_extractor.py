@@ -4,11 +4,13 @@ from extractors.base_invoice_extractor import BaseInvoiceExtractor
 from config import DEFAULT_VAT_RATE 
 import math
 from typing import Tuple
-import database
+import rule_store
+import rule_engine
+import tracing
 
 EXTRACTOR_KEY = "pradilla"
 
-EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = database.get_extractor_configuration(EXTRACTOR_KEY)
+EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = rule_store.get_rules(EXTRACTOR_KEY)
 # print("EXTRACTION_MAPPING",EXTRACTION_MAPPING) # Debug opcional
 
 EXTRACTION_MAPPING_PROCESSED = {}
@@ -175,11 +177,8 @@ class PradillaExtractor(BaseInvoiceExtractor):
         valor_tasas=None
         
         def find_reference_line(ref_text: str) -> Optional[int]:
-            ref_text_lower = ref_text.lower()
-            for i, line in enumerate(lines):
-                if line and ref_text_lower in line.lower():
-                    return i
-            return None
+            # Índice de líneas del documento (compartido con el resto de extractores)
+            return rule_engine.find_reference_line(lines, ref_text)
 
         def get_value(mapping: Dict[str, Any]) -> Optional[str]:
             if mapping['type'] == 'FIXED_VALUE':
@@ -255,10 +254,10 @@ class PradillaExtractor(BaseInvoiceExtractor):
                         if validated_val is not None:
                             clean_extracted_value = validated_val
                             is_valid = True
-                            print(f"✅ {key}: Validado '{temp_value}' -> '{clean_extracted_value}'")
+                            tracing.debug(EXTRACTOR_KEY, "✅ %s: Validado '%s' -> '%s'", key, temp_value, clean_extracted_value)
                         else:
                             is_valid = False
-                            print(f"❌ {key}: Falló validación para '{temp_value}'")
+                            tracing.debug(EXTRACTOR_KEY, "❌ %s: Falló validación para '%s'", key, temp_value)
                     
                     if is_valid:
                         value = clean_extracted_value
@@ -0,0 +1,250 @@
+# extractors/rule_extractor.py
+
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import rule_engine
+import rule_store
+from config import DEFAULT_VAT_RATE
+from extractors.base_invoice_extractor import BaseInvoiceExtractor
+
+# --- Motor de reglas genérico (un extractor por clave, sin módulo propio) ---
+# Sustituye a los módulos generados (leroy_extractor.py, malaga_extractor.py...), que solo
+# se diferencian en EXTRACTOR_KEY y en algún retoque del resultado. Todo sale de la BBDD:
+#   - reglas por campo:       extractor_configurations (rule_store.get_rules)
+#   - post-procesado por campo: extractor_postprocessors (rule_store.get_postprocessors)
+# Para usarlo, la fila de 'extractors' apunta a la clave con class_path
+# "extractors.rule_extractor.<clave>" (p.ej. "extractors.rule_extractor.leroy").
+#
+# Hay tres clases de post-procesadores (columna 'processor', parámetro en 'argument'):
+#   - VALIDADORES: se aplican a cada valor encontrado, regla a regla. Devuelven el valor
+#     limpio o None, y con None se prueba la siguiente regla del campo.
+#   - DERIVACIONES: se aplican al resultado final (importes ya convertidos a float).
+#   - OPCIONES: activan comportamientos de BaseInvoiceExtractor para el campo. Por ahora
+#     solo 'date_fallback' en FECHA: sin fecha por reglas, la primera del documento. Va
+#     desactivada por defecto, como en los módulos generados a los que sustituye.
+
+
+# --- Validadores: argumento -> (valor -> valor limpio o None) ---
+
+def _strip(argument: Optional[str]) -> rule_engine.Validator:
+    chars = argument or ' |.'
+    return lambda value: value.strip(chars) or None
+
+def _only_text(argument: Optional[str]) -> rule_engine.Validator:
+    # Como PradillaExtractor.is_only_text_tolerant: alguna letra y ningún dígito
+    return lambda value: value if re.search(r'[a-zA-Z]', value) and not re.search(r'\d', value) else None
+
+def _starts_with(argument: Optional[str]) -> rule_engine.Validator:
+    prefix = argument or ''
+    return lambda value: value if value.startswith(prefix) else None
+
+def _starts_with_digit(argument: Optional[str]) -> rule_engine.Validator:
+    return lambda value: value if value[:1].isdigit() else None
+
+def _regex(argument: Optional[str]) -> rule_engine.Validator:
+    # Devuelve el primer grupo (o la coincidencia entera si el patrón no tiene grupos)
+    pattern = re.compile(argument or '.+')
+    def validate(value: str) -> Optional[str]:
+        match = pattern.search(value)
+        if not match:
+            return None
+        return match.group(1) if pattern.groups else match.group(0)
+    return validate
+
+def _plate(argument: Optional[str]) -> rule_engine.Validator:
+    # Matrícula española: 4 números y 3 consonantes (NNNNCCC o NNNN-CCC)
+    pattern = re.compile(r"([0-9]{4}-?[BCDFGHJKLMNÑPQRSTVWXYZ]{3})")
+    def validate(value: str) -> Optional[str]:
+        clean = value.upper().replace(' ', '').replace('.', '').replace(',', '').replace('|', '').strip()
+        match = pattern.search(clean)
+        return match.group(1) if match else None
+    return validate
+
+def _date(argument: Optional[str]) -> rule_engine.Validator:
+    # dd/mm/aaaa o dd-mm-aa dentro de texto sucio
+    pattern = re.compile(r"\b(0[1-9]|[12][0-9]|3[01])[/-](0[1-9]|1[0-2])[/-]([0-9]{2}|[0-9]{4})\b")
+    def validate(value: str) -> Optional[str]:
+        match = pattern.search(value.strip().replace('|', '').replace('.', ' '))
+        return match.group(0) if match else None
+    return validate
+
+def _leading_number(argument: Optional[str]) -> rule_engine.Validator:
+    # "123,45 Texto" -> "123,45" (el resto de valores no se tocan)
+    pattern = re.compile(r"^([0-9.,]+)\s.*$")
+    def validate(value: str) -> Optional[str]:
+        match = pattern.match(value)
+        return match.group(1) if match else value
+    return validate
+
+def _upper(argument: Optional[str]) -> rule_engine.Validator:
+    return lambda value: value.upper()
+
+
+# --- Derivaciones: (datos extraídos, campo en minúsculas, argumento) ---
+
+def _parse_rate(argument: Optional[str]) -> float:
+    """'21', '21%' o '0.21' -> 0.21 (DEFAULT_VAT_RATE si no hay argumento)."""
+    if not argument:
+        return DEFAULT_VAT_RATE
+    rate = float(argument.replace('%', '').replace(',', '.'))
+    return rate / 100 if rate > 1 else rate
+
+def _vat_from_total(data: Dict[str, Any], field: str, argument: Optional[str]):
+    # Base e IVA a partir del total del campo (como calculate_base_and_vat_from_total)
+    total = data.get(field)
+    if total is None:
+        data['base'], data['iva'] = None, None
+        return
+    base = total / (1 + _parse_rate(argument))
+    data['base'], data['iva'] = round(base, 2), round(total - base, 2)
+
+def _complete_amounts(data: Dict[str, Any], field: str, argument: Optional[str]):
+    # Completa base/iva/importe cuando falta alguno y corrige el IVA si no cuadran (como check_importes)
+    base, iva, importe = data.get('base'), data.get('iva'), data.get('importe')
+    tasas = data.get('tasas') or 0.0
+    rate = _parse_rate(argument)
+    missing = sum(v is None for v in (base, iva, importe))
+    if missing == 1:
+        if importe is None:
+            importe = base + iva + tasas
+        elif iva is None and importe >= base:
+            iva = importe - base - tasas
+        elif base is None and importe >= iva:
+            base = importe - iva - tasas
+    elif missing == 2:
+        if importe is not None and importe > 0:
+            neto = importe - tasas
+            base = neto / (1 + rate) if neto > 0 else 0.0
+            iva = neto - base if neto > 0 else 0.0
+        elif base is not None and base > 0:
+            iva = base * rate
+            importe = base + iva + tasas
+    elif missing == 0 and abs(base + iva + tasas - importe) > 0.01:
+        iva = importe - base - tasas
+    for key, value in (('base', base), ('iva', iva), ('importe', importe)):
+        data[key] = round(value, 2) if value is not None else None
+
+
+VALIDATORS: Dict[str, Callable[[Optional[str]], rule_engine.Validator]] = {
+    'strip': _strip,
+    'only_text': _only_text,
+    'starts_with': _starts_with,
+    'starts_with_digit': _starts_with_digit,
+    'regex': _regex,
+    'plate': _plate,
+    'date': _date,
+    'leading_number': _leading_number,
+    'upper': _upper,
+}
+
+DERIVATIONS: Dict[str, Callable[[Dict[str, Any], str, Optional[str]], None]] = {
+    'vat_from_total': _vat_from_total,
+    'complete_amounts': _complete_amounts,
+}
+
+OPTIONS = {'date_fallback'}
+
+Derivation = Tuple[str, Callable[[Dict[str, Any], str, Optional[str]], None], Optional[str]]
+
+
+def _chain(steps: List[rule_engine.Validator]) -> rule_engine.Validator:
+    def validate(value: str) -> Optional[str]:
+        for step in steps:
+            value = step(value)
+            if value is None:
+                return None
+        return value
+    return validate
+
+def build_postprocessors(steps_by_field: Dict[str, List[Dict[str, Any]]]) -> Tuple[Dict[str, rule_engine.Validator], List[Derivation], Set[Tuple[str, str]]]:
+    """Filas de extractor_postprocessors -> (validadores por campo, derivaciones en orden, opciones (campo, nombre))."""
+    validators: Dict[str, rule_engine.Validator] = {}
+    derivations: List[Derivation] = []
+    options: Set[Tuple[str, str]] = set()
+    for field_name, steps in steps_by_field.items():
+        chain = []
+        for step in steps:
+            name, argument = step['processor'], step.get('argument')
+            if name in VALIDATORS:
+                chain.append(VALIDATORS[name](argument))
+            elif name in DERIVATIONS:
+                derivations.append((field_name.lower(), DERIVATIONS[name], argument))
+            elif name in OPTIONS:
+                options.add((field_name, name))
+            else:
+                print(f"Aviso: post-procesador desconocido '{name}' en el campo {field_name}.")
+        if chain:
+            validators[field_name] = _chain(chain)
+    return validators, derivations, options
+
+
+# --- Configuración compilada por clave (se recarga si cambia rule_store.key_version(clave)) ---
+
+Config = Tuple[Any, Dict[str, Any], rule_engine.RulePlan, List[Derivation], Set[Tuple[str, str]]]
+
+_configs: Dict[str, Config] = {}
+_configs_lock = threading.Lock()
+
+def _config(extractor_key: str) -> Config:
+    version = rule_store.key_version(extractor_key)
+    with _configs_lock:
+        cached = _configs.get(extractor_key)
+        if cached is None or cached[0] != version:
+            mapping = rule_store.get_rules(extractor_key)
+            validators, derivations, options = build_postprocessors(rule_store.get_postprocessors(extractor_key))
+            cached = (version, mapping, rule_engine.compile_rules(mapping, validators), derivations, options)
+            _configs[extractor_key] = cached
+        return cached
+
+def invalidate():
+    """Olvida las configuraciones compiladas (p.ej. tras cambiar de BBDD: la versión puede coincidir)."""
+    with _configs_lock:
+        _configs.clear()
+
+
+class RuleExtractor(BaseInvoiceExtractor):
+    """
+    Extractor configurado solo con filas de la BBDD. Cada clave tiene su subclase
+    (RuleExtractor.for_key) con EXTRACTOR_KEY fijado. Como no sustituye extract_data,
+    admite parada temprana y extracción por lotes igual que BaseInvoiceExtractor.
+    """
+    EXTRACTOR_KEY: Optional[str] = None
+    EMISOR_NAME = 'RuleExtractor'
+
+    _classes: Dict[str, type] = {}
+
+    @classmethod
+    def for_key(cls, extractor_key: str) -> type:
+        with _configs_lock:
+            if extractor_key not in cls._classes:
+                cls._classes[extractor_key] = type(
+                    f"RuleExtractor_{extractor_key}", (cls,), {'EXTRACTOR_KEY': extractor_key}
+                )
+            return cls._classes[extractor_key]
+
+    @classmethod
+    def rule_mapping(cls) -> Dict[str, Any]:
+        return _config(cls.EXTRACTOR_KEY)[1]
+
+    @classmethod
+    def rule_plan(cls) -> rule_engine.RulePlan:
+        return _config(cls.EXTRACTOR_KEY)[2]
+
+    @classmethod
+    def uses_date_fallback(cls) -> bool:
+        return ('FECHA', 'date_fallback') in _config(cls.EXTRACTOR_KEY)[4]
+
+    def _build_extracted_data(self, values: Dict[str, Optional[str]]) -> Dict[str, Any]:
+        extracted_data = super()._build_extracted_data(values)
+        for field, derive, argument in _config(self.EXTRACTOR_KEY)[3]:
+            derive(extracted_data, field, argument)
+        return extracted_data
+
+
+def __getattr__(name: str) -> type:
+    """class_path "extractors.rule_extractor.<clave>" -> RuleExtractor de esa clave."""
+    if name.startswith('_'):
+        raise AttributeError(name)
+    return RuleExtractor.for_key(name)
@@ -0,0 +1,568 @@
+# ingest_pipeline.py
+
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import database
+import logic
+import ocr_engine
+from config import PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_WRITE_BATCH
+
+# --- Pipeline de ingesta por etapas ---
+# Cada fichero pasa por etapas separadas, unidas por colas acotadas:
+#   1. descubrimiento  (hilos)    división multi-factura, ¿ya procesado?, hash para la caché
+#   2. texto           (procesos) caché de texto/OCR o capa de texto (logic.read_document)
+#   3. OCR             (procesos) solo si quedan páginas escaneadas (logic.ocr_document)
+#   4. extracción      (procesos) detección de extractor y reglas (logic.extract_document)
+#   5. persistencia    (1 hilo)   un único escritor que guarda en transacciones por lotes
+# Los 'workers' procesos se reparten entre las tres etapas de procesos (ver split_workers):
+# el OCR, que es lo lento, se lleva la mitad. Cada etapa tiene como mucho tantos ficheros en
+# curso como procesos; si la cola de la siguiente está llena, espera (contrapresión) y su
+# propia cola se llena a su vez hasta submit().
+# Solo el hilo escritor escribe facturas: los procesos leen la BBDD pero no compiten por
+# el bloqueo de escritura de SQLite.
+#
+# Quien envía ficheros (lote de Tk, subida web, CLI) es un IngestClient: da las opciones
+# del lote y recibe los eventos (tipo, ruta, datos) en notify():
+#   ('queued', ruta, None)      fichero en cola (también las partes de una división)
+#   ('status', ruta, estado)    nuevo estado (ver STATUS_*)
+#   ('log', ruta, texto)        línea para el log
+#   ('done', ruta, resultado)   fin del fichero: {'status', 'data', 'log', 'timings'}
+
+STATUS_QUEUED = "En cola"
+STATUS_READING = "Leyendo"
+STATUS_OCR = "OCR"
+STATUS_EXTRACTING = "Extrayendo"
+STATUS_WRITING = "Guardando"
+STATUS_SPLIT = "Dividida"
+STATUS_SAVED = "Guardada"
+STATUS_SKIPPED = "Ya procesada"
+STATUS_EMPTY = "Sin datos"
+STATUS_ERROR = "Error"
+STATUS_CANCELLED = "Cancelada"
+
+FINAL_STATUSES = (STATUS_SPLIT, STATUS_SAVED, STATUS_SKIPPED, STATUS_EMPTY, STATUS_ERROR, STATUS_CANCELLED)
+
+STAGES = ('discovery', 'text', 'ocr', 'extraction', 'persistence')
+
+KEYS = ['Tipo', 'Fecha', 'Número de Factura', 'Emisor', 'CIF Emisor', 'Cliente', 'CIF', 'Modelo', 'Matricula', 'Importe', 'Base', 'IVA', 'Tasas']
+
+
+class IngestClient:
+    """
+    Quien envía ficheros al pipeline: opciones de proceso y receptor de eventos.
+    notify() se llama desde los hilos del pipeline, así que debe ser rápido (lo normal es
+    dejar el evento en una cola que lee el hilo de la interfaz).
+    """
+    force_reprocess: bool = False
+    debug_mode: bool = False
+    save_empty: bool = True                           # Guardar aunque no se extraiga ningún campo
+    record_defaults: Optional[Dict[str, Any]] = None  # Campos fijos del registro (p.ej. 'Concepto')
+
+    @property
+    def cancelled(self) -> bool:
+        return False
+
+    def split(self, path: str) -> Optional[List[str]]:
+        """Partes de un PDF multi-factura ([] si la división falló) o None si no lo es."""
+        return None
+
+    def notify(self, kind: str, path: Optional[str], data: Any = None):
+        pass
+
+
+class _Item:
+    """Un fichero dentro del pipeline."""
+    __slots__ = ('path', 'client', 'is_part', 'checked', 'cache_key', 'read', 'record', 'log', 'timings', 'finished')
+
+    def __init__(self, path: str, client: IngestClient, is_part: bool = False, checked: bool = False):
+        self.path = path
+        self.client = client
+        self.is_part = is_part # Parte de un PDF ya dividido: no se vuelve a dividir
+        self.checked = checked # Ya se comprobó en submit() que no está en la BBDD
+        self.cache_key: Optional[str] = None
+        self.read: Optional[Dict[str, Any]] = None
+        self.record: Optional[Dict[str, Any]] = None
+        self.log: List[str] = []
+        self.timings: Dict[str, float] = {}
+        self.finished = False # Ya se emitió 'done' (nunca dos veces)
+
+
+# --- Trabajos que se ejecutan en los pools ---
+
+def _init_worker(db_settings: Dict[str, Any]):
+    for name, value in db_settings.items():
+        setattr(database, name, value)
+    # Con 'spawn' (Windows) logic ya se importó con la BBDD por defecto al deserializar la tarea
+    logic.reload_database_config()
+    # El paralelismo ya está en los pools del pipeline: el OCR de cada documento va en línea
+    ocr_engine.OCR_WORKERS = 1
+
+
+def _db_settings() -> Dict[str, Any]:
+    """Ruta de la BBDD de este proceso, para que los procesos hijos usen la misma."""
+    return {name: getattr(database, name) for name in ('DB_NAME', 'DB_PATH') if hasattr(database, name)}
+
+
+def _timed(fn: Callable, *args) -> Tuple[Any, float, float]:
+    """(resultado, segundos, segundos de OCR). Las excepciones llegan como RuntimeError (ver ocr_engine._pool_job)."""
+    started, ocr_before = time.perf_counter(), ocr_engine.ocr_seconds()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    return result, time.perf_counter() - started, ocr_engine.ocr_seconds() - ocr_before
+
+
+def split_workers(total: int) -> Dict[str, int]:
+    """
+    Reparte 'total' procesos entre las etapas de texto, OCR y extracción: una cuarta parte
+    para texto, otra para extracción y el resto para OCR. Cada etapa tiene al menos uno,
+    así que con menos de 3 procesos en total se usan 3 (una etapa vacía pararía el pipeline).
+    """
+    text = max(1, total // 4)
+    extraction = max(1, total // 4)
+    return {'text': text, 'ocr': max(1, total - text - extraction), 'extraction': extraction}
+
+
+_END = object() # Marca de cierre de una cola
+
+
+def _put_end_nowait(target: "queue.Queue[Any]"):
+    # Al cerrar sin esperar no se bloquea: los hilos son daemon y mueren con el proceso
+    try:
+        target.put_nowait(_END)
+    except queue.Full:
+        pass
+
+
+class _Stage:
+    """
+    Una etapa: cola de entrada acotada, un ejecutor y un hilo que reparte el trabajo (como
+    mucho max_in_flight a la vez) y entrega cada resultado a route(item, resultado, error).
+    """
+
+    def __init__(self, name: str, make_executor: Callable[[], Any], max_in_flight: int, queue_size: int,
+                 job: Callable[[_Item], Tuple[Callable, tuple]], route: Callable[[_Item, Any, Optional[Exception]], None],
+                 skip: Callable[[_Item], bool]):
+        self.name = name
+        self.inbox: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._front: Deque[_Item] = deque() # Partes de una división: entran antes que la cola
+        self._make_executor = make_executor
+        self._executor = make_executor()
+        self._max_in_flight = max(max_in_flight, 1)
+        self._job, self._route, self._skip = job, route, skip
+        self._pending: Dict[Future, Tuple[_Item, Any]] = {}
+        self._thread = threading.Thread(target=self._run, name=f"ingesta-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def push_front(self, item: _Item):
+        """Encola sin esperar (solo desde route de esta misma etapa)."""
+        self._front.append(item)
+
+    def depth(self) -> int:
+        return self.inbox.qsize() + len(self._front) + len(self._pending)
+
+    def close(self, wait: bool = True):
+        if wait:
+            self.inbox.put(_END)
+            self._thread.join()
+        else:
+            _put_end_nowait(self.inbox)
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _next(self, block: bool) -> Any:
+        if self._front:
+            return self._front.popleft()
+        try:
+            return self.inbox.get(timeout=0.1) if block else self.inbox.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        closed = False
+        while not closed or self._pending or self._front:
+            # 1. Admitir trabajo mientras haya hueco (esperando un poco solo si no hay nada en curso)
+            while len(self._pending) < self._max_in_flight:
+                item = self._next(block=not self._pending and not closed)
+                if item is None:
+                    break
+                if item is _END:
+                    closed = True
+                    continue
+                if self._skip(item):
+                    continue
+                fn, args = self._job(item)
+                try:
+                    future = self._executor.submit(_timed, fn, *args)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    self._replace_executor(self._executor)
+                    self._route(item, None, e)
+                    continue
+                self._pending[future] = (item, self._executor)
+
+            # 2. Recoger lo terminado y pasarlo a la siguiente etapa
+            if not self._pending:
+                continue
+            done, _ = wait(list(self._pending), timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, executor = self._pending.pop(future)
+                try:
+                    result, seconds, ocr_seconds = future.result()
+                except BrokenProcessPool as e:
+                    # Un proceso murió (p.ej. Tesseract abortó): se recrea el pool una vez
+                    self._replace_executor(executor)
+                    self._route(item, None, e)
+                    continue
+                except Exception as e:
+                    self._route(item, None, e)
+                    continue
+                item.timings[self.name] = item.timings.get(self.name, 0.0) + seconds
+                if ocr_seconds:
+                    item.timings['ocr_seconds'] = item.timings.get('ocr_seconds', 0.0) + ocr_seconds
+                self._route(item, result, None)
+
+    def _replace_executor(self, broken: Any):
+        if broken is self._executor:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._make_executor()
+
+
+class IngestPipeline:
+    """Motor de ingesta compartido por todas las entradas (ver cabecera del módulo)."""
+
+    def __init__(self, workers: int = PIPELINE_WORKERS, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 write_batch: int = PIPELINE_WRITE_BATCH):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.stage_workers = split_workers(self.workers)
+        self.write_batch = max(write_batch, 1)
+
+        settings = _db_settings()
+        def processes(stage: str) -> Callable[[], ProcessPoolExecutor]:
+            return lambda: ProcessPoolExecutor(max_workers=self.stage_workers[stage], initializer=_init_worker, initargs=(settings,))
+        threads = lambda: ThreadPoolExecutor(max_workers=2, thread_name_prefix="ingesta-descubrimiento")
+        self._stages: Dict[str, _Stage] = {
+            'discovery': _Stage('discovery', threads, 2, queue_size, self._discovery_job, self._discovered, self._cancelled),
+            'text': _Stage('text', processes('text'), self.stage_workers['text'], queue_size,
+                           self._text_job, self._text_read, self._cancelled),
+            'ocr': _Stage('ocr', processes('ocr'), self.stage_workers['ocr'], queue_size,
+                          self._ocr_job, self._ocr_done, self._cancelled),
+            'extraction': _Stage('extraction', processes('extraction'), self.stage_workers['extraction'], queue_size,
+                                 self._extraction_job, self._extracted, self._cancelled),
+        }
+        self._writes: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._writing = 0
+        self._writer = threading.Thread(target=self._write_loop, name="ingesta-escritor", daemon=True)
+
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self.counters = {'submitted': 0, 'done': 0, 'saved': 0, 'skipped': 0, 'errors': 0, 'cancelled': 0,
+                         'transactions': 0, 'write_seconds': 0.0}
+
+    # --- Control ---
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for stage in self._stages.values():
+            stage.start()
+        self._writer.start()
+
+    def submit(self, client: IngestClient, paths: List[str]):
+        """
+        Encola ficheros. Si la cola de descubrimiento está llena, espera (contrapresión):
+        las interfaces deben llamarlo desde un hilo propio, no desde el de la ventana.
+        """
+        if self._closed:
+            raise RuntimeError("El pipeline de ingesta está cerrado.")
+        self.start()
+        # Los ya procesados se descartan aquí con una consulta para todo el lote
+        unprocessed = None
+        if not client.force_reprocess:
+            try:
+                unprocessed = set(database.filter_unprocessed(paths))
+            except sqlite3.Error as e:
+                print(f"Aviso: no se pudo comprobar el lote en la BBDD, se comprobará fichero a fichero: {e}")
+        for path in paths:
+            item = _Item(path, client, checked=unprocessed is not None)
+            with self._lock:
+                self.counters['submitted'] += 1
+            client.notify('queued', path)
+            if unprocessed is not None and path not in unprocessed:
+                self._finish(item, STATUS_SKIPPED, f"{os.path.basename(path)} -> Ya procesado (BBDD). Saltando.")
+                continue
+            self._stages['discovery'].inbox.put(item)
+
+    def shutdown(self, wait: bool = True):
+        """Con wait=True termina lo pendiente etapa a etapa; con wait=False lo descarta."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            started = self._started
+        if not started:
+            for stage in self._stages.values():
+                stage.close(wait=False)
+            return
+        for stage in self._stages.values(): # En orden: cada etapa cierra cuando la anterior ya no envía
+            stage.close(wait=wait)
+        if wait:
+            self._writes.put(_END)
+            self._writer.join()
+        else:
+            _put_end_nowait(self._writes)
+
+    def depths(self) -> Dict[str, int]:
+        """Ficheros en cola o en curso por etapa."""
+        depths = {name: stage.depth() for name, stage in self._stages.items()}
+        depths['persistence'] = self._writes.qsize() + self._writing
+        return depths
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats['depths'] = self.depths()
+        return stats
+
+    # --- Trabajos por etapa: (función, argumentos) para el pool ---
+
+    def _discovery_job(self, item: _Item) -> Tuple[Callable, tuple]:
+        return self._discover, (item.path, item.client, not item.is_part, not item.checked)
+
+    def _text_job(self, item: _Item) -> Tuple[Callable, tuple]:
+        return logic.read_document, (item.path, item.cache_key)
+
+    def _ocr_job(self, item: _Item) -> Tuple[Callable, tuple]:
+        return logic.ocr_document, (item.path, item.read)
+
+    def _extraction_job(self, item: _Item) -> Tuple[Callable, tuple]:
+        return logic.extract_document, (item.path, item.read, item.client.debug_mode)
+
+    @staticmethod
+    def _discover(path: str, client: IngestClient, allow_split: bool, check_processed: bool) -> Dict[str, Any]:
+        parts = client.split(path) if allow_split else None
+        if parts:
+            return {'parts': parts}
+        found = {'split_failed': parts is not None}
+        if check_processed and not client.force_reprocess and database.is_invoice_processed(path):
+            found['processed'] = True
+        else:
+            found['cache_key'] = logic.document_cache_key(path)
+        return found
+
+    # --- Enrutado (en el hilo de cada etapa) ---
+
+    def _cancelled(self, item: _Item) -> bool:
+        if item.client.cancelled:
+            self._finish(item, STATUS_CANCELLED)
+            return True
+        return False
+
+    def _forward(self, item: _Item, stage: str, status: str):
+        self._notify(item, 'status', status)
+        self._stages[stage].inbox.put(item)
+
+    def _discovered(self, item: _Item, found: Optional[Dict[str, Any]], error: Optional[Exception]):
+        name = os.path.basename(item.path)
+        if error is not None:
+            self._finish(item, STATUS_ERROR, f"  ❌ Error procesando {name}: {error}")
+            return
+        if found.get('parts'):
+            self._log(item, f"🔍 PDF multi-factura {name}: {len(found['parts'])} archivos individuales.")
+            for part in found['parts']:
+                part_item = _Item(part, item.client, is_part=True)
+                with self._lock:
+                    self.counters['submitted'] += 1
+                self._notify(part_item, 'queued')
+                self._stages['discovery'].push_front(part_item)
+            self._finish(item, STATUS_SPLIT)
+            return
+        if found['split_failed']:
+            self._log(item, f"   ❌ Falló la división de {name}. Se intentará procesar el original.")
+        if found.get('processed'):
+            self._finish(item, STATUS_SKIPPED, f"{name} -> Ya procesado (BBDD). Saltando.")
+            return
+        item.cache_key = found['cache_key']
+        self._forward(item, 'text', STATUS_READING)
+
+    def _text_read(self, item: _Item, read: Optional[Dict[str, Any]], error: Optional[Exception]):
+        if error is not None:
+            self._finish(item, STATUS_ERROR, f"  ❌ Error leyendo {os.path.basename(item.path)}: {error}")
+            return
+        item.read = read
+        if read['ocr_pages']:
+            self._forward(item, 'ocr', STATUS_OCR)
+        else:
+            self._forward(item, 'extraction', STATUS_EXTRACTING)
+
+    def _ocr_done(self, item: _Item, read: Optional[Dict[str, Any]], error: Optional[Exception]):
+        if error is not None:
+            self._finish(item, STATUS_ERROR, f"  ❌ Error en el OCR de {os.path.basename(item.path)}: {error}")
+            return
+        item.read = read
+        self._forward(item, 'extraction', STATUS_EXTRACTING)
+
+    def _extracted(self, item: _Item, extracted: Optional[Tuple[Tuple[Any, ...], Dict[str, Any]]], error: Optional[Exception]):
+        name = os.path.basename(item.path)
+        item.read = None # Ya no hace falta: no se retiene el texto mientras espera al escritor
+        if error is not None:
+            self._finish(item, STATUS_ERROR, f"  ❌ Error procesando {name}: {error}")
+            return
+        extraction_result, extra = extracted
+        if len(extraction_result) == 14: # 13 campos + log
+            data_tuple, log_data = extraction_result[:-1], extraction_result[-1]
+        else:
+            data_tuple, log_data = (list(extraction_result) + [None] * 13)[:13], "Error de formato de resultado."
+
+        record = dict(zip(KEYS, data_tuple))
+        record.update(item.client.record_defaults or {})
+        record['Archivo'] = name
+        record['DebugLines'] = log_data
+        record.update(extra) # Extractor usado y huella de maquetación (layout_index)
+        item.record = record
+        if not item.client.save_empty and not any(data_tuple):
+            self._finish(item, STATUS_EMPTY, "❌ No se extrajeron datos válidos.")
+            return
+        self._notify(item, 'status', STATUS_WRITING)
+        self._writes.put(item)
+
+    # --- Persistencia: un único hilo escritor ---
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is _END:
+                return
+            batch, closed = [item], False
+            while len(batch) < self.write_batch:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END:
+                    closed = True
+                    break
+                batch.append(item)
+            self._writing = len(batch)
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Nunca debe morir el escritor: sin él no termina ningún fichero más
+                for pending in batch:
+                    self._finish(pending, STATUS_ERROR, f"  ❌ Fallo al guardar {os.path.basename(pending.path)}: {type(e).__name__}: {e}")
+            finally:
+                self._writing = 0
+            if closed:
+                return
+
+    def _write(self, batch: List[_Item]):
+        """Todo el lote en una transacción; si falla, fila a fila para aislar la que da error."""
+        started = time.perf_counter()
+        errors: Dict[int, Exception] = {}
+        try:
+            database.insert_invoices_bulk([(item.record, item.path, 0) for item in batch])
+            transactions = 1
+        except Exception:
+            # sqlite3.Error, pero también un valor que no se puede guardar (TypeError...)
+            transactions = len(batch)
+            for item in batch:
+                try:
+                    database.insert_invoices_bulk([(item.record, item.path, 0)]) # Con su huella
+                except Exception as e:
+                    errors[id(item)] = e
+        with self._lock:
+            self.counters['transactions'] += transactions
+            self.counters['write_seconds'] += time.perf_counter() - started
+
+        for item in batch:
+            name = os.path.basename(item.path)
+            if id(item) in errors:
+                error = errors[id(item)]
+                self._finish(item, STATUS_ERROR, f"  ❌ Fallo al insertar {name} en la BBDD: {type(error).__name__}: {error}")
+            else:
+                self._finish(item, STATUS_SAVED, f"{name} -> Guardado: {item.record.get('Número de Factura', 'N/A')}")
+
+    # --- Eventos ---
+
+    def _notify(self, item: _Item, kind: str, data: Any = None):
+        # Un cliente que falla no puede tumbar el hilo de la etapa ni el escritor
+        try:
+            item.client.notify(kind, item.path, data)
+        except Exception as e:
+            print(f"Aviso: el cliente del pipeline falló al recibir '{kind}' de {item.path}: {type(e).__name__}: {e}")
+
+    def _log(self, item: _Item, text: str):
+        item.log.append(text)
+        self._notify(item, 'log', text)
+
+    def _finish(self, item: _Item, status: str, text: Optional[str] = None):
+        if item.finished:
+            return
+        item.finished = True
+        if text:
+            self._log(item, text)
+        counter = {STATUS_SAVED: 'saved', STATUS_SKIPPED: 'skipped', STATUS_ERROR: 'errors', STATUS_CANCELLED: 'cancelled'}.get(status)
+        with self._lock:
+            self.counters['done'] += 1
+            if counter:
+                self.counters[counter] += 1
+        self._notify(item, 'status', status)
+        self._notify(item, 'done', {
+            'status': status, 'data': item.record, 'log': "\n".join(item.log), 'timings': dict(item.timings),
+        })
+
+
+# --- Pipeline compartido del proceso ---
+
+_default: Optional[IngestPipeline] = None
+_default_lock = threading.Lock()
+
+
+def get_pipeline() -> IngestPipeline:
+    """Pipeline del proceso (se crea y arranca la primera vez que se pide)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = IngestPipeline()
+            _default.start()
+            atexit.register(_default.shutdown, False)
+        return _default
+
+
+class _FileClient(IngestClient):
+    """Un único fichero cuyo resultado se espera con un Future (ver ingest_file)."""
+
+    def __init__(self, force_reprocess: bool, debug_mode: bool, save_empty: bool, record_defaults: Optional[Dict[str, Any]]):
+        self.force_reprocess = force_reprocess
+        self.debug_mode = debug_mode
+        self.save_empty = save_empty
+        self.record_defaults = record_defaults
+        self.future: Future = Future()
+
+    def notify(self, kind: str, path: Optional[str], data: Any = None):
+        if kind == 'done' and not self.future.done():
+            self.future.set_result(data)
+
+
+def ingest_file(path: str, force_reprocess: bool = False, debug_mode: bool = False, save_empty: bool = True,
+                record_defaults: Optional[Dict[str, Any]] = None, pipeline: Optional[IngestPipeline] = None) -> Future:
+    """
+    Envía un fichero y devuelve un Future con su resultado ({'status', 'data', 'log', 'timings'}).
+    Desde código asíncrono (NiceGUI): await asyncio.wrap_future(ingest_file(ruta)).
+    """
+    client = _FileClient(force_reprocess, debug_mode, save_empty, record_defaults)
+    (pipeline or get_pipeline()).submit(client, [path])
+    return client.future
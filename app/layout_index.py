@@ -0,0 +1,240 @@
+# layout_index.py
+
+import os
+import re
+import time
+import zlib
+import random
+import threading
+from typing import List, Optional, Dict, Any, Tuple, Callable, Iterable
+
+import database
+from config import LAYOUT_MIN_SIMILARITY, LAYOUT_INDEX_REFRESH_SECONDS
+
+# --- Huella de maquetación (plantilla) por documento ---
+# Para enrutar proveedores conocidos cuando ni el nombre del fichero ni el CIF coinciden.
+# La huella combina:
+#   - MinHash de los "shingles" (pares de tokens consecutivos, con los dígitos
+#     sustituidos por '#': las etiquetas de la plantilla se repiten, los importes no),
+#   - una rejilla gruesa (16x16) con las celdas de la 1ª página que tienen palabras.
+# Las huellas de las facturas validadas se indexan con LSH (bandas de MinHash): una
+# consulta solo compara con los documentos que comparten alguna banda.
+#
+# La huella de cada factura se calcula en la etapa de extracción (logic.extract_document,
+# con las líneas ya leídas) y el escritor la guarda con la factura (layout_fingerprints);
+# el extractor usado va en processed_invoices.extractor. classify() solo consulta el
+# índice en memoria: nunca lee PDFs ni hace OCR. Las facturas validadas anteriores a las
+# huellas se completan en segundo plano (backfill_fingerprints).
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+GRID_SIZE = 16
+SHINGLE_SIZE = 2
+GRID_WEIGHT = 0.25 # Peso de la rejilla en la similitud final (el resto es MinHash)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# Semilla fija: las firmas se guardan en BBDD y deben ser estables entre ejecuciones
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# --- Cálculo de la huella ---
+
+def _tokens(lines: Iterable[str]) -> List[str]:
+    return [re.sub(r'\d', '#', t.lower()) for line in lines for t in _TOKEN_RE.findall(line)]
+
+def minhash_signature(lines: List[str]) -> Tuple[int, ...]:
+    """Firma MinHash (NUM_PERM valores) de los shingles de tokens del documento."""
+    tokens = _tokens(lines)
+    shingles = {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles if s]
+    if not hashes:
+        return tuple([_MERSENNE_PRIME] * NUM_PERM)
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def layout_grid(pdf_path: str) -> int:
+    """Máscara de bits GRID_SIZE x GRID_SIZE con las celdas de la 1ª página que tienen palabras."""
+    if not pdf_path.lower().endswith('.pdf'):
+        return 0
+    try:
+        from document_model import load_document_model
+        model = load_document_model(pdf_path)
+    except Exception:
+        return 0
+    if model.page_count == 0:
+        return 0
+    width, height = model.page_sizes[0] or 1.0, model.page_sizes[1] or 1.0
+    mask = 0
+    for index in range(model.word_count()):
+        if model.word_page[index] != 0:
+            continue
+        (x0, y0, x1, y1), _ = model.word(index)
+        cx = min(int((x0 + x1) / 2 / width * GRID_SIZE), GRID_SIZE - 1)
+        cy = min(int((y0 + y1) / 2 / height * GRID_SIZE), GRID_SIZE - 1)
+        mask |= 1 << (max(cy, 0) * GRID_SIZE + max(cx, 0))
+    return mask
+
+def compute_fingerprint(pdf_path: str, lines: List[str]) -> Dict[str, Any]:
+    return {'signature': minhash_signature(lines), 'grid': layout_grid(pdf_path)}
+
+def similarity(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """Similitud 0..1: Jaccard estimado por MinHash combinado con el de la rejilla."""
+    sig_a, sig_b = a['signature'], b['signature']
+    minhash_sim = sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+    grid_a, grid_b = a['grid'], b['grid']
+    if not grid_a or not grid_b:
+        return minhash_sim
+    grid_sim = bin(grid_a & grid_b).count('1') / bin(grid_a | grid_b).count('1')
+    return (1 - GRID_WEIGHT) * minhash_sim + GRID_WEIGHT * grid_sim
+
+def encode_fingerprint(fingerprint: Dict[str, Any], pdf_path: str) -> Tuple[str, str, Optional[float]]:
+    """(signature, grid, mtime) para guardar en layout_fingerprints (la rejilla no cabe en un INTEGER)."""
+    try:
+        mtime = os.path.getmtime(pdf_path)
+    except OSError:
+        mtime = None
+    return ','.join(map(str, fingerprint['signature'])), str(fingerprint['grid']), mtime
+
+def decode_fingerprint(signature: str, grid: Any) -> Dict[str, Any]:
+    return {'signature': tuple(int(v) for v in signature.split(',')), 'grid': int(grid or 0)}
+
+
+# --- Índice LSH ---
+
+class LayoutIndex:
+    """Índice LSH de huellas etiquetadas con el extractor (plantilla) de cada documento."""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, Dict[str, Any]]] = {}  # path -> (label, huella)
+        self._buckets: Dict[Tuple[int, int], set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._entries
+
+    @staticmethod
+    def _bands(signature: Tuple[int, ...]):
+        for band in range(BANDS):
+            yield band, hash(signature[band * ROWS:(band + 1) * ROWS])
+
+    def add(self, path: str, label: str, fingerprint: Dict[str, Any]):
+        self.remove(path)
+        self._entries[path] = (label, fingerprint)
+        for key in self._bands(fingerprint['signature']):
+            self._buckets.setdefault(key, set()).add(path)
+
+    def remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        for key in self._bands(entry[1]['signature']):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(path)
+
+    def query(self, fingerprint: Dict[str, Any], exclude: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """(extractor, similitud) del documento indexado más parecido, o None si no hay candidatos."""
+        candidates = set()
+        for key in self._bands(fingerprint['signature']):
+            candidates.update(self._buckets.get(key, ()))
+        candidates.discard(exclude)
+        best = None
+        for path in candidates:
+            label, other = self._entries[path]
+            score = similarity(fingerprint, other)
+            if best is None or score > best[1]:
+                best = (label, score)
+        return best
+
+
+# --- Índice del proceso (facturas validadas de processed_invoices) ---
+# La primera consulta lo carga en línea (una SELECT de huellas ya calculadas); después se
+# recarga en un hilo cada LAYOUT_INDEX_REFRESH_SECONDS y las consultas usan el anterior.
+
+_index: Optional[LayoutIndex] = None
+_index_lock = threading.Lock()
+_loaded_at = 0.0
+_refreshing = False
+
+def build_index(rows: Iterable[Dict[str, Any]]) -> LayoutIndex:
+    """Índice con las filas de database.fetch_layout_training_rows()."""
+    index = LayoutIndex()
+    for row in rows:
+        try:
+            index.add(row['path'], row['extractor'], decode_fingerprint(row['signature'], row['grid']))
+        except (ValueError, TypeError) as e:
+            print(f"Aviso: huella de maquetación no válida para {row['path']}: {e}")
+    return index
+
+def _reload():
+    global _index, _loaded_at, _refreshing
+    index = None
+    try:
+        index = build_index(database.fetch_layout_training_rows())
+    except Exception as e:
+        print(f"Aviso: no se pudo cargar el índice de maquetación: {e}")
+    with _index_lock:
+        if index is not None or _index is None:
+            _index = index or LayoutIndex()
+        _loaded_at = time.monotonic()
+        _refreshing = False
+
+def get_index() -> LayoutIndex:
+    """Índice de las facturas validadas; si está caducado, lo recarga en segundo plano."""
+    global _refreshing
+    with _index_lock:
+        index = _index
+        reload = not _refreshing and (index is None or time.monotonic() - _loaded_at >= LAYOUT_INDEX_REFRESH_SECONDS)
+        if reload:
+            _refreshing = True
+    if reload and index is None:
+        _reload()
+        return _index
+    if reload:
+        threading.Thread(target=_reload, name="indice-maquetacion", daemon=True).start()
+    return index if index is not None else LayoutIndex() # Otro hilo lo está cargando por primera vez
+
+def invalidate_index():
+    """Descarta el índice: la próxima consulta lo vuelve a cargar (p.ej. tras cambiar de BBDD)."""
+    global _index
+    with _index_lock:
+        _index = None
+
+def classify(pdf_path: str, lines: List[str], fingerprint: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, float]]:
+    """
+    Plantilla (ruta de clase del extractor) más parecida al documento y su similitud,
+    o None si no llega a LAYOUT_MIN_SIMILARITY. fingerprint: la del documento, si ya se calculó.
+    """
+    index = get_index()
+    if not len(index):
+        return None
+    match = index.query(fingerprint or compute_fingerprint(pdf_path, lines), exclude=pdf_path.replace('\\', '/'))
+    if match and match[1] >= LAYOUT_MIN_SIMILARITY:
+        return match
+    return None
+
+def backfill_fingerprints(read_lines: Callable[[str], List[str]], limit: Optional[int] = None) -> int:
+    """
+    Calcula y guarda las huellas de las facturas validadas que aún no la tienen (anteriores
+    a layout_fingerprints). Lee los PDFs (y puede hacer OCR): se lanza en segundo plano al
+    arrancar la aplicación, nunca desde classify. Devuelve cuántas se guardaron.
+    """
+    saved = 0
+    for path in database.fetch_paths_without_fingerprint(limit):
+        if not os.path.exists(path):
+            continue
+        try:
+            fingerprint = compute_fingerprint(path, read_lines(path))
+        except Exception as e:
+            print(f"Aviso: no se pudo calcular la huella de {path}: {e}")
+            continue
+        database.save_layout_fingerprint(path, *encode_fingerprint(fingerprint, path))
+        saved += 1
+    if saved:
+        invalidate_index()
+    return saved
@@ -1,33 +1,29 @@
 import os
-import sys
-import importlib
-import importlib.util
-import tempfile
 import traceback
-from typing import Tuple, List, Optional, Any, Dict
+import threading
+from typing import Tuple, List, Optional, Any, Dict, Iterator
 import re
 
-# Importaciones para extracción de PDF y OCR
-import fitz # PyMuPDF
-try:
-    from PIL import Image
-    import pytesseract
-except ImportError:
-    Image = None
-    pytesseract = None
-
 # Dependencias del proyecto
-from config import ERROR_DATA, TESSERACT_CMD_PATH, DEFAULT_VAT_RATE_STR
+from config import (
+    OCR_CACHE_ENABLED, OCR_LANG, OCR_DPI, OCR_MULTIPAGE, OCR_MAX_PAGES,
+    OCR_MIN_PAGE_CHARS, OCR_MIN_TEXT_COVERAGE, OCR_MIN_IMAGE_AREA,
+    OCR_ADAPTIVE, OCR_ADAPTIVE_DPI_STEPS, OCR_MIN_CONFIDENCE, EXTRACTION_EARLY_STOP,
+    LAYOUT_MATCH_ENABLED
+)
 import database
+import ocr_cache
+import ocr_engine
+import layout_index
+import rule_store
+import tracing
+import rule_engine
+from utils import normalize_tax_id, is_valid_tax_id
+from keyword_matcher import KeywordMatcher
+from extractor_registry import ExtractorRegistry
+from extractors import base_invoice_extractor, rule_extractor
 from extractors.base_invoice_extractor import BaseInvoiceExtractor
 
-# --- Configuración de OCR (Tesseract) ---
-if sys.platform == "win32" and pytesseract and TESSERACT_CMD_PATH:
-    try:
-        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
-    except Exception as e:
-        print(f"Error al configurar Tesseract: {e}")
-
 # --- Mapeo Global de Extractores (Cargado de BBDD) ---
 EXTRACTION_MAPPING: Dict[str, str] = database.get_extraction_mapping()
 
@@ -35,138 +31,469 @@ EXTRACTION_MAPPING: Dict[str, str] = database.get_extraction_mapping()
 
 def find_reference_line(lines: List[str], ref_text: str) -> Optional[int]:
     """Busca el índice de una línea que contiene un texto de referencia."""
-    ref_text_lower = ref_text.lower()
-    for i, line in enumerate(lines):
-        if ref_text_lower in line.lower():
-            return i
-    return None
+    return rule_engine.find_reference_line(lines, ref_text)
 
 def apply_extraction_rule(lines: List[str], mapping: Dict[str, Any]) -> Optional[str]:
     """Aplica la lógica de una regla específica sobre el texto extraído."""
     if mapping.get('type') == 'FIXED_VALUE':
         return mapping.get('value')
-        
-    line_index = None
-    if mapping.get('type') == 'FIXED':
-        abs_line = mapping.get('line')
-        if abs_line and abs_line > 0:
-            line_index = abs_line - 1 
-    elif mapping.get('type') == 'VARIABLE':
-        ref_index = find_reference_line(lines, mapping.get('ref_text', ''))
-        if ref_index is not None:
-            line_index = ref_index + mapping.get('offset', 0)
-            
-    if line_index is None or not (0 <= line_index < len(lines)):
-        return None
-        
-    try:
-        segments = re.split(r'\s+', lines[line_index].strip())
-        segments = [s for s in segments if s]
-        segment_input = mapping.get('segment', 1)
-        
-        # Manejo de rangos (ej. '1-3')
-        if isinstance(segment_input, str) and '-' in segment_input:
-            start_s, end_s = segment_input.split('-')
-            start_idx, end_idx = int(start_s) - 1, int(end_s)
-            if 0 <= start_idx < end_idx <= len(segments):
-                return ' '.join(segments[start_idx:end_idx]).strip()
-        
-        # Segmento simple
-        idx = int(segment_input) - 1
-        return segments[idx] if 0 <= idx < len(segments) else None
-    except Exception:
-        return None
+    rule = rule_engine.compile_rule(dict(mapping, segment=mapping.get('segment', 1)))
+    return rule_engine.apply_compiled(rule_engine.document_lines(lines), rule)
 
 # --- Funciones Principales de Lógica ---
 
+def _ocr_settings() -> Dict[str, Any]:
+    """Ajustes de OCR que afectan al resultado (forman parte de la clave de caché)."""
+    return {
+        'lang': OCR_LANG, 'dpi': OCR_DPI, 'max_pages': OCR_MAX_PAGES if OCR_MULTIPAGE else 1,
+        'mode': 'hibrido', 'min_chars': OCR_MIN_PAGE_CHARS,
+        'min_text_coverage': OCR_MIN_TEXT_COVERAGE, 'min_image_area': OCR_MIN_IMAGE_AREA,
+        'adaptive': OCR_ADAPTIVE, 'dpi_steps': list(OCR_ADAPTIVE_DPI_STEPS), 'min_confidence': OCR_MIN_CONFIDENCE,
+    }
+
 def _get_pdf_lines(pdf_path: str) -> List[str]:
-    """Extrae el texto de un PDF o Imagen. Punto único de OCR."""
-    lines: List[str] = []
-    file_extension = os.path.splitext(pdf_path)[1].lower()
-    
-    # 1. Intento de lectura directa (PDF con capa de texto)
-    if file_extension == ".pdf":
+    """Extrae el texto de un PDF o Imagen usando la caché persistente de texto/OCR."""
+    return _get_pdf_lines_with_info(pdf_path)[0]
+
+def _get_pdf_lines_with_info(pdf_path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Igual que _get_pdf_lines pero devuelve también la información por página
+    (origen texto/OCR, DPI usado y confianza) para dejarla en el log de extracción.
+    """
+    pages_info: List[Dict[str, Any]] = []
+    lines = [line for page_lines in _iter_pdf_lines(pdf_path, pages_info, lazy=False) for line in page_lines]
+    return lines, pages_info
+
+def _iter_pdf_lines(pdf_path: str, pages_info: List[Dict[str, Any]], lazy: bool = True, start: int = 0) -> Iterator[List[str]]:
+    """
+    Genera las líneas de un PDF o Imagen página a página (desde la página start).
+    Punto único de OCR: en los PDF se decide página a página, capa de texto si la tiene
+    y OCR si es un escaneo.
+    Con lazy=True cada página se lee (y se pasa por OCR) solo cuando se pide: si el
+    consumidor deja de iterar, las siguientes no se procesan. Con lazy=False lo que
+    queda se lee de una vez (OCR en paralelo). pages_info recibe la info de cada página.
+    Lo leído se guarda en la caché de texto/OCR; una lectura cortada queda marcada como
+    incompleta y la siguiente continúa desde la última página guardada.
+    """
+    cache_key = None
+    read_pages: List[List[str]] = []
+    read_info: List[Dict[str, Any]] = []
+    cached_pages = 0
+    complete = False
+    failed = False
+
+    if OCR_CACHE_ENABLED:
         try:
-            doc = fitz.open(pdf_path)
-            texto = "".join([page.get_text() or '' for page in doc])
-            doc.close()
-            lines = [l for l in texto.splitlines() if l.strip()]
-            if lines: return lines
-        except Exception:
-            pass
+            cache_key = ocr_cache.make_key(ocr_cache.file_sha256(pdf_path), _ocr_settings())
+            cached = ocr_cache.get_entry(cache_key)
+        except Exception as e:
+            print(f"Aviso: caché de OCR no disponible: {e}")
+            cache_key, cached = None, None
+
+        if cached is not None:
+            meta = cached['meta']
+            read_info = list(meta.get('pages', []))
+            if meta.get('complete', True) and not meta.get('page_lines'):
+                # Entrada completa sin reparto por páginas: se entrega de una vez
+                if start == 0:
+                    pages_info.extend(read_info)
+                    yield cached['lines']
+                return
+            position = 0
+            for count in meta['page_lines']:
+                read_pages.append(cached['lines'][position:position + count])
+                position += count
+            if meta.get('complete', True):
+                for info, page_lines in zip(read_info[start:], read_pages[start:]):
+                    pages_info.append(info)
+                    yield page_lines
+                return
+            cached_pages = len(read_pages)
 
-    # 2. OCR (Fallback para imágenes o PDFs escaneados)
-    if Image and pytesseract:
+    if cached_pages < start:
+        # La caché no tiene las páginas anteriores: no se puede guardar una lectura parcial
+        cache_key = None
+
+    try:
+        for info, page_lines in zip(read_info[start:cached_pages], read_pages[start:cached_pages]):
+            pages_info.append(info)
+            yield page_lines
+
+        first_page = max(start, cached_pages)
+        file_extension = os.path.splitext(pdf_path)[1].lower()
         try:
-            if file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif']:
-                ocr_text = pytesseract.image_to_string(Image.open(pdf_path), lang='spa')
-            elif file_extension == ".pdf":
-                doc = fitz.open(pdf_path)
-                if len(doc) > 0:
-                    page = doc.load_page(0)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-                    temp_path = os.path.join(tempfile.gettempdir(), f"ocr_tmp_{os.getpid()}.png")
-                    pix.save(temp_path)
-                    ocr_text = pytesseract.image_to_string(Image.open(temp_path), lang='spa')
-                    if os.path.exists(temp_path): os.remove(temp_path)
-                doc.close()
-            
-            lines = [l for l in ocr_text.splitlines() if l.strip()]
+            # 1. PDF: lectura híbrida por página (capa de texto + OCR solo donde haga falta)
+            if file_extension == ".pdf":
+                max_ocr_pages = OCR_MAX_PAGES if OCR_MULTIPAGE else 1
+                ocr_done = sum(1 for info in read_info if info.get('source') == 'ocr')
+                reader = ocr_engine.iter_pdf_pages if lazy else ocr_engine.extract_pdf_pages
+                pages = reader(pdf_path, max_ocr_pages=max_ocr_pages, dpi=OCR_DPI, lang=OCR_LANG,
+                               start=first_page, ocr_pages_done=ocr_done)
+                page_texts = ((p['text'], {k: v for k, v in p.items() if k != 'text'}) for p in pages)
+
+            # 2. Imágenes sueltas: OCR directo
+            elif file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif'] and ocr_engine.OCR_AVAILABLE and first_page == 0:
+                page_texts = iter([(ocr_engine.ocr_image(pdf_path, lang=OCR_LANG),
+                                    {'page': 0, 'source': 'ocr', 'dpi': None, 'confidence': None})])
+            else:
+                page_texts = iter([])
+
+            for texto, info in page_texts:
+                page_lines = [l for l in texto.splitlines() if l.strip()]
+                read_pages.append(page_lines)
+                read_info.append(info)
+                pages_info.append(info)
+                yield page_lines
+            complete = True
         except Exception as e:
-            print(f"Error crítico en OCR: {e}")
-            
-    return lines
+            failed = True
+            print(f"Error crítico en lectura/OCR: {e}")
+    finally:
+        # También se guarda una lectura cortada por parada temprana (marcada como incompleta)
+        if cache_key and not failed and any(read_pages) and (len(read_pages) > cached_pages or complete):
+            try:
+                ocr_cache.put_lines(cache_key, [l for page_lines in read_pages for l in page_lines], meta={
+                    'pages': read_info, 'page_lines': [len(p) for p in read_pages], 'complete': complete
+                })
+            except Exception as e:
+                print(f"Aviso: no se pudo guardar en la caché de OCR: {e}")
+
+def _format_pages_log(pages_info: List[Dict[str, Any]]) -> str:
+    """Resumen para el log de extracción de las páginas que han pasado por OCR."""
+    output = ""
+    for info in pages_info:
+        if info.get('source') != 'ocr':
+            continue
+        dpi = f"{info['dpi']} DPI" if info.get('dpi') else "resolución original"
+        conf = f", confianza {info['confidence']:.0f}%" if info.get('confidence') is not None else ""
+        output += f"🔎 OCR página {info['page'] + 1}: {dpi}{conf}\n"
+    return output
+
+# --- Lectura por etapas (ingest_pipeline) ---
+# Lo mismo que _iter_pdf_lines con lazy=False, partido en dos pasos para que el pipeline
+# de ingesta los ejecute en pools distintos: read_document (caché o capa de texto) y
+# ocr_document (solo si quedan páginas por OCR). La lectura es un dict que viaja entre
+# procesos: {'cache_key', 'pages': [{'page', 'text', 'source', 'dpi', 'confidence'}], 'ocr_pages'}.
+
+def document_cache_key(pdf_path: str) -> Optional[str]:
+    """Clave de la caché de texto/OCR del fichero (None si la caché está desactivada o falla)."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    try:
+        return ocr_cache.make_key(ocr_cache.file_sha256(pdf_path), _ocr_settings())
+    except Exception as e:
+        print(f"Aviso: caché de OCR no disponible: {e}")
+        return None
+
+def read_document(pdf_path: str, cache_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Primera etapa de lectura: la entrada completa de la caché si la hay y, si no, la capa
+    de texto de cada página. 'ocr_pages' lista las páginas que aún necesitan OCR.
+    """
+    if cache_key:
+        try:
+            cached = ocr_cache.get_entry(cache_key)
+        except Exception as e:
+            print(f"Aviso: caché de OCR no disponible: {e}")
+            cached = None
+        if cached is not None and cached['meta'].get('complete', True):
+            meta = cached['meta']
+            counts = meta.get('page_lines') or [len(cached['lines'])]
+            infos = meta.get('pages') or [{'page': 0, 'source': 'texto', 'dpi': None, 'confidence': None}]
+            pages, position = [], 0
+            for info, count in zip(infos, counts):
+                pages.append(dict(info, text="\n".join(cached['lines'][position:position + count])))
+                position += count
+            # Ya está en caché: ocr_document/_store_document no la vuelven a guardar
+            return {'cache_key': None, 'pages': pages, 'ocr_pages': []}
+
+    read: Dict[str, Any] = {'cache_key': cache_key, 'pages': [], 'ocr_pages': []}
+    file_extension = os.path.splitext(pdf_path)[1].lower()
+    try:
+        if file_extension == ".pdf":
+            read['pages'], read['ocr_pages'] = ocr_engine.read_text_pages(
+                pdf_path, max_ocr_pages=OCR_MAX_PAGES if OCR_MULTIPAGE else 1
+            )
+        elif file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif'] and ocr_engine.OCR_AVAILABLE:
+            read['pages'] = [{'page': 0, 'text': '', 'source': 'texto', 'dpi': None, 'confidence': None}]
+            read['ocr_pages'] = [0]
+    except Exception as e:
+        print(f"Error crítico en lectura/OCR: {e}")
+        read['cache_key'] = None
+    if not read['ocr_pages']:
+        _store_document(read)
+    return read
+
+def ocr_document(pdf_path: str, read: Dict[str, Any]) -> Dict[str, Any]:
+    """Segunda etapa de lectura: OCR de read['ocr_pages'] y guardado en la caché."""
+    if read['ocr_pages']:
+        if os.path.splitext(pdf_path)[1].lower() == ".pdf":
+            ocr_engine.ocr_into_pages(pdf_path, read['pages'], read['ocr_pages'], dpi=OCR_DPI, lang=OCR_LANG)
+        else:
+            try:
+                read['pages'][0].update(text=ocr_engine.ocr_image(pdf_path, lang=OCR_LANG), source='ocr')
+            except Exception as e:
+                print(f"Error crítico en lectura/OCR: {e}")
+                read['cache_key'] = None
+        read['ocr_pages'] = []
+    _store_document(read)
+    return read
+
+def document_lines(read: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Líneas no vacías de una lectura y la información por página (sin el texto)."""
+    page_lines = [[l for l in page['text'].splitlines() if l.strip()] for page in read['pages']]
+    pages_info = [{k: v for k, v in page.items() if k != 'text'} for page in read['pages']]
+    return [l for lines in page_lines for l in lines], pages_info
+
+def _store_document(read: Dict[str, Any]):
+    """Guarda una lectura completa en la caché de texto/OCR (mismo formato que _iter_pdf_lines)."""
+    if not read['cache_key']:
+        return
+    page_lines = [[l for l in page['text'].splitlines() if l.strip()] for page in read['pages']]
+    if not any(page_lines):
+        return
+    try:
+        ocr_cache.put_lines(read['cache_key'], [l for lines in page_lines for l in lines], meta={
+            'pages': document_lines(read)[1], 'page_lines': [len(p) for p in page_lines], 'complete': True
+        })
+    except Exception as e:
+        print(f"Aviso: no se pudo guardar en la caché de OCR: {e}")
+
+# --- Índice de detección de extractor (nombre de fichero + CIF) ---
+# Se construye una vez con las reglas CIF_EMISOR de todos los extractores (rule_store)
+# y se reconstruye cuando cambia la configuración o la versión de reglas.
+#   'filenames': autómata con las claves de EXTRACTION_MAPPING (nombre de fichero)
+#   'fixed':     CIF normalizado -> (orden, class_path)   (reglas FIXED_VALUE)
+#   'dynamic':   [(orden, class_path, reglas compiladas)] (reglas que leen el CIF del documento)
+# 'orden' es la posición en EXTRACTION_MAPPING: gana el primer extractor, como antes.
+CIF_CLIENTE_FIJO = "B85629020" # Ignorar CIF propio
+PATRON_CIF = re.compile(r'[A-Z]\d{7,8}[A-Z0-9]?')
+
+_detection_index: Optional[Dict[str, Any]] = None
+_detection_index_lock = threading.Lock()
+
+def _detection_version() -> Tuple[int, int]:
+    return database.get_config_version(), rule_store.version()
+
+def _build_detection_index() -> Dict[str, Any]:
+    global EXTRACTION_MAPPING
+    version = _detection_version()
+    EXTRACTION_MAPPING = database.get_extraction_mapping()
+    rules_by_extractor = rule_store.get_rules_for_field('CIF_EMISOR')
+
+    filenames = KeywordMatcher()
+    fixed: Dict[str, Tuple[int, str]] = {}
+    dynamic: List[Tuple[int, str, List[rule_engine.CompiledRule]]] = []
+    for order, (keyword, class_path) in enumerate(EXTRACTION_MAPPING.items()):
+        filenames.add(keyword.lower(), order, class_path)
+        dynamic_rules = []
+        for rule in rules_by_extractor.get(keyword, []):
+            if rule.get('type') == 'FIXED_VALUE':
+                cif = normalize_tax_id(rule.get('value'))
+                if cif and cif not in fixed:
+                    fixed[cif] = (order, class_path)
+            else:
+                dynamic_rules.append(rule_engine.compile_rule(rule))
+        if dynamic_rules:
+            dynamic.append((order, class_path, dynamic_rules))
+    return {'version': version, 'filenames': filenames.build(), 'fixed': fixed, 'dynamic': dynamic}
+
+def get_detection_index() -> Dict[str, Any]:
+    """Índice de detección (reconstruido si la configuración ha cambiado)."""
+    global _detection_index
+    with _detection_index_lock:
+        if _detection_index is None or _detection_index['version'] != _detection_version():
+            _detection_index = _build_detection_index()
+        return _detection_index
+
+def invalidate_detection_index():
+    """Fuerza la reconstrucción del índice (p.ej. tras editar la BBDD desde otro proceso)."""
+    global _detection_index
+    with _detection_index_lock:
+        _detection_index = None
 
 def find_extractor_for_file(file_path: str, lines: List[str]) -> Optional[str]:
     """Identifica el extractor usando el nombre del archivo o el contenido (CIF)."""
+    index = get_detection_index()
     nombre_archivo = os.path.basename(file_path).lower()
     
-    # 1. Por nombre de archivo
-    for keyword, class_path in EXTRACTION_MAPPING.items():
-        if keyword.lower() in nombre_archivo:
-            return class_path
+    # 1. Por nombre de archivo (una pasada del autómata; gana la primera clave del mapeo)
+    class_path = index['filenames'].best_match(nombre_archivo)
+    if class_path:
+        return class_path
 
     # 2. Por contenido (CIF Emisor)
     if not lines: return None
     texto_completo = "\n".join(lines).upper()
-    CIF_CLIENTE_FIJO = "B85629020" # Ignorar CIF propio
-    
-    patron_cif = re.compile(r'[A-Z]\d{7,8}[A-Z0-9]?')
-    cifs_documento = set(patron_cif.findall(texto_completo))
-    
-    for keyword, class_path in EXTRACTION_MAPPING.items():
+    cifs_documento = set(PATRON_CIF.findall(texto_completo))
+    cifs_documento.discard(CIF_CLIENTE_FIJO)
+
+    # 2a. CIF fijos: intersección con el índice
+    best: Optional[Tuple[int, str]] = None
+    for cif in cifs_documento & index['fixed'].keys():
+        if best is None or index['fixed'][cif] < best:
+            best = index['fixed'][cif]
+
+    # 2b. Reglas que leen el CIF del documento: solo extractores anteriores al mejor
+    # encontrado y solo contra candidatos con dígito de control válido.
+    cifs_validos = {cif for cif in cifs_documento if is_valid_tax_id(cif)}
+    doc = rule_engine.document_lines(lines) if cifs_validos and index['dynamic'] else None
+    for order, class_path, rules in index['dynamic']:
+        if doc is None or (best is not None and order >= best[0]):
+            break
         try:
-            config = database.get_extractor_configuration(keyword)
-            if not config or 'CIF_EMISOR' not in config: continue
-            
-            for rule in config['CIF_EMISOR']:
-                val = apply_extraction_rule(lines, rule)
-                if val:
-                    cif_objetivo = val.replace('-', '').replace('.', '').strip().upper()
-                    if cif_objetivo in cifs_documento and cif_objetivo != CIF_CLIENTE_FIJO:
-                        return class_path
+            for rule in rules:
+                val = rule_engine.apply_compiled(doc, rule)
+                if val and normalize_tax_id(val) in cifs_validos:
+                    best = (order, class_path)
+                    break
         except Exception:
             continue
-    return None
+    return best[1] if best else None
+
+# Registro de clases de extractor: cada módulo se ejecuta una vez y se recarga solo si
+# cambia su fichero o la versión de SUS reglas (rule_store.key_version de su EXTRACTOR_KEY).
+_extractor_registry = ExtractorRegistry(
+    inject={'BaseInvoiceExtractor': BaseInvoiceExtractor}, version_fn=rule_store.key_version
+)
+
+def get_extractor_registry_stats() -> Dict[str, Any]:
+    """Contadores del registro de extractores (hits, loads, reloads, failures)."""
+    return _extractor_registry.stats()
 
 def _load_extractor_class_dynamic(extractor_path_str: str):
-    """Carga una clase de extractor dinámicamente."""
+    """Carga una clase de extractor dinámicamente (con caché, ver ExtractorRegistry)."""
     try:
-        parts = extractor_path_str.split('.')
-        module_name, class_name = ".".join(parts[:-1]), parts[-1]
-        
-        module_spec = importlib.util.find_spec(module_name)
-        if not module_spec: raise ImportError(f"Módulo {module_name} no encontrado")
-        
-        module = importlib.util.module_from_spec(module_spec)
-        module.__dict__['BaseInvoiceExtractor'] = BaseInvoiceExtractor
-        sys.modules[module_name] = module
-        module_spec.loader.exec_module(module)
-        return getattr(module, class_name)
+        return _extractor_registry.get(extractor_path_str)
     except Exception as e:
         raise RuntimeError(f"Error cargando {extractor_path_str}: {e}")
 
+def reload_database_config():
+    """
+    Vuelve a leer de la BBDD el mapeo y las reglas. Necesario si database.DB_NAME cambia
+    después de importar logic (batch_cli --db, procesos hijos del pipeline): las cachés se
+    validan por versión y la de otra BBDD puede coincidir.
+    """
+    global EXTRACTION_MAPPING
+    rule_store.invalidate()
+    rule_extractor.invalidate()
+    base_invoice_extractor.reload_extraction_config()
+    _extractor_registry.invalidate()
+    EXTRACTION_MAPPING = database.get_extraction_mapping()
+    invalidate_detection_index()
+    layout_index.invalidate_index()
+
+
+
+def _supports_early_stop(ExtractorClass) -> bool:
+    """El extractor sabe decir cuándo tiene resueltos sus campos obligatorios."""
+    supports = getattr(ExtractorClass, 'supports_early_stop', None)
+    try:
+        return bool(supports and supports())
+    except Exception:
+        return False
+
+def _read_lines_streaming(pdf_path: str, pages_info: List[Dict[str, Any]], select_class_path) -> Tuple[List[str], Optional[str]]:
+    """
+    Lectura por páginas con parada temprana. Con la primera página se elige el extractor
+    (select_class_path(lines) -> ruta de clase o None) y, mientras este admita parada
+    temprana, se lee página a página hasta que declara resueltos los campos obligatorios.
+    Si no hay extractor o no la admite, el resto del documento se lee de una vez (OCR en
+    paralelo). Devuelve (lines, ruta del extractor si se paró antes del final).
+    """
+    lines: List[str] = []
+    reader = _iter_pdf_lines(pdf_path, pages_info)
+    try:
+        page_lines = next(reader, None)
+        if page_lines is None:
+            return lines, None
+        lines.extend(page_lines)
+
+        class_path = select_class_path(lines)
+        ExtractorClass = None
+        if class_path:
+            try:
+                ExtractorClass = _load_extractor_class_dynamic(class_path)
+            except Exception:
+                ExtractorClass = None
+
+        if ExtractorClass is not None and _supports_early_stop(ExtractorClass):
+            while True:
+                if ExtractorClass(lines, pdf_path).required_fields_resolved(lines):
+                    return lines, class_path
+                page_lines = next(reader, None)
+                if page_lines is None:
+                    return lines, None
+                lines.extend(page_lines)
+    finally:
+        reader.close()
+
+    for page_lines in _iter_pdf_lines(pdf_path, pages_info, lazy=False, start=len(pages_info)):
+        lines.extend(page_lines)
+    return lines, None
+
+def _classify_by_layout(pdf_path: str, lines: List[str], fingerprint: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, float]]:
+    """Extractor de la factura validada con la maquetación más parecida (o None)."""
+    try:
+        return layout_index.classify(pdf_path, lines, fingerprint)
+    except Exception as e:
+        print(f"Aviso: clasificador por maquetación no disponible: {e}")
+        return None
+
+def start_layout_backfill() -> Optional[threading.Thread]:
+    """Completa en segundo plano las huellas de las facturas validadas que no la tienen (layout_index)."""
+    if not LAYOUT_MATCH_ENABLED:
+        return None
+    thread = threading.Thread(target=layout_index.backfill_fingerprints, args=(_get_pdf_lines,),
+                              name="huellas-maquetacion", daemon=True)
+    thread.start()
+    return thread
 
+def _manual_class_path(extractor_manual: str) -> str:
+    """Ruta de clase de un extractor elegido a mano (clave de EXTRACTION_MAPPING o nombre de clase)."""
+    # Buscamos la ruta completa en el mapeo cargado de la BBDD
+    if extractor_manual in EXTRACTION_MAPPING:
+        return EXTRACTION_MAPPING[extractor_manual]
+    # Fallback: Si no está en el mapa, intentamos la convención estándar:
+    # extractors.<nombre_minuscula>.<NombreExacto>
+    # Ej: extractors.leroy.Leroy
+    return f"extractors.{extractor_manual.lower()}.{extractor_manual}"
+
+def _read_for_extraction(pdf_path: str, select_class_path, debug_mode: bool) -> Tuple[List[str], str, Optional[str]]:
+    """
+    Lectura única del documento (por páginas, parando en cuanto el extractor tiene lo
+    obligatorio). Devuelve (líneas, log de lectura, extractor si se paró antes del final).
+    """
+    early_class_path = None
+    if EXTRACTION_EARLY_STOP:
+        pages_info: List[Dict[str, Any]] = []
+        lines, early_class_path = _read_lines_streaming(pdf_path, pages_info, select_class_path)
+    else:
+        lines, pages_info = _get_pdf_lines_with_info(pdf_path)
+    if not lines:
+        return lines, "", None
+
+    debug_output = _format_pages_log(pages_info)
+    if early_class_path:
+        debug_output += f"⏩ Lectura detenida tras {len(pages_info)} página(s): campos obligatorios resueltos.\n"
+    return lines, debug_output + _text_debug_log(lines, debug_mode), early_class_path
+
+def _text_debug_log(lines: List[str], debug_mode: bool) -> str:
+    """Primeras líneas del texto leído para el log (solo en modo depuración)."""
+    if not debug_mode:
+        return ""
+    debug_output = "🔍 DEBUG: Texto extraído correctamente.\n"
+    for i, l in enumerate(lines[:20]):
+        debug_output += f"L{i:02d}: {l}\n"
+    return debug_output
+
+def _data_dict_to_tuple(data_dict: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        data_dict.get('tipo'), data_dict.get('fecha'), data_dict.get('num_factura'),
+        data_dict.get('emisor'), data_dict.get('cif_emisor'), data_dict.get('cliente'),
+        data_dict.get('cif'), data_dict.get('modelo'), data_dict.get('matricula'),
+        data_dict.get('importe'), data_dict.get('base'), data_dict.get('iva'), data_dict.get('tasas')
+    )
 
 def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str = None) -> Tuple[Any, ...]:
     """
@@ -174,38 +501,54 @@ def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str
     Si extractor_manual tiene un valor (ej: 'Leroy'), 
     busca su ruta de clase correcta (ej: 'extractors.leroy.Leroy') y fuerza su uso.
     """
-    debug_output = ""
     try:
-        # 1. LECTURA ÚNICA
-        lines = _get_pdf_lines(pdf_path)
+        # Ruta del extractor forzado a mano (si lo hay)
+        manual_class_path = _manual_class_path(extractor_manual) if extractor_manual else None
+
+        # 1. LECTURA ÚNICA (por páginas, parando en cuanto el extractor tiene lo obligatorio)
+        if extractor_manual:
+            select = lambda _lines: manual_class_path
+        else:
+            select = lambda _lines: find_extractor_for_file(pdf_path, _lines)
+        lines, debug_output, early_class_path = _read_for_extraction(pdf_path, select, debug_mode)
         if not lines:
             return (*[None]*13, "Error: No se detectó texto en el documento.")
 
-        if debug_mode:
-            debug_output += "🔍 DEBUG: Texto extraído correctamente.\n"
-            for i, l in enumerate(lines[:20]):
-                debug_output += f"L{i:02d}: {l}\n"
+        return _extract_from_lines(pdf_path, lines, debug_output, early_class_path, extractor_manual, debug_mode)
 
-        # 2. IDENTIFICACIÓN / SELECCIÓN DE EXTRACTOR
-        ExtractorClass = None
-        full_class_path = None
+    except Exception as e:
+        return (*[None]*13, f"❌ ERROR FATAL: {e}\n{traceback.format_exc()}")
 
-        if extractor_manual:
-            # --- CORRECCIÓN AQUÍ ---
-            # Buscamos la ruta completa en el mapeo cargado de la BBDD
-            if extractor_manual in EXTRACTION_MAPPING:
-                full_class_path = EXTRACTION_MAPPING[extractor_manual]
-            else:
-                # Fallback: Si no está en el mapa, intentamos la convención estándar:
-                # extractors.<nombre_minuscula>.<NombreExacto>
-                # Ej: extractors.leroy.Leroy
-                full_class_path = f"extractors.{extractor_manual.lower()}.{extractor_manual}"
-            
-            debug_output += f"⚡ FORZADO MANUAL: Usando {extractor_manual} -> Ruta: {full_class_path}...\n"
-        else:
-            # Lógica de detección automática habitual
-            full_class_path = find_extractor_for_file(pdf_path, lines)
+def _extract_from_lines(pdf_path: str, lines: List[str], debug_output: str, early_class_path: Optional[str] = None,
+                        extractor_manual: Optional[str] = None, debug_mode: bool = False,
+                        info: Optional[Dict[str, Any]] = None) -> Tuple[Any, ...]:
+    """
+    Pasos 2-5 de extraer_datos sobre las líneas ya leídas: detección, carga y extracción.
+    info (opcional): entra con la huella de maquetación ('layout') si ya se calculó y sale
+    con la ruta del extractor usado ('extractor', None si fue el genérico).
+    """
+    info = {} if info is None else info
+    # 2. IDENTIFICACIÓN / SELECCIÓN DE EXTRACTOR
+    ExtractorClass = None
+    full_class_path = None
+
+    if extractor_manual:
+        full_class_path = _manual_class_path(extractor_manual)
+        debug_output += f"⚡ FORZADO MANUAL: Usando {extractor_manual} -> Ruta: {full_class_path}...\n"
+    elif early_class_path:
+        # Detectado con las páginas leídas antes de parar
+        full_class_path = early_class_path
+    else:
+        # Lógica de detección automática habitual
+        full_class_path = find_extractor_for_file(pdf_path, lines)
+        if not full_class_path and LAYOUT_MATCH_ENABLED:
+            layout_match = _classify_by_layout(pdf_path, lines, info.get('layout'))
+            if layout_match:
+                full_class_path, score = layout_match
+                debug_output += f"🧭 Plantilla por maquetación: {full_class_path} (similitud {score:.2f})\n"
 
+    # Trazas de los extractores: solo se recogen (y formatean) en modo depuración
+    with tracing.capture(enabled=debug_mode) as trace_events:
         # 3. CARGA DINÁMICA
         if full_class_path:
             try:
@@ -217,26 +560,107 @@ def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str
         if ExtractorClass:
             extractor = ExtractorClass(lines, pdf_path)
             data_dict = extractor.extract_data(lines) if hasattr(extractor, 'extract_data') else {}
-            res_raw = (
-                data_dict.get('tipo'), data_dict.get('fecha'), data_dict.get('num_factura'),
-                data_dict.get('emisor'), data_dict.get('cif_emisor'), data_dict.get('cliente'),
-                data_dict.get('cif'), data_dict.get('modelo'), data_dict.get('matricula'),
-                data_dict.get('importe'), data_dict.get('base'), data_dict.get('iva'), data_dict.get('tasas')
-            )
-            debug_output += f"✅ Usado extractor: {full_class_path}\n"
+            res_raw = _data_dict_to_tuple(data_dict)
         else:
             # Fallback Genérico si no hay manual ni automático detectado o si falló la carga
-            from extractors.base_invoice_extractor import BaseInvoiceExtractor
             generic = BaseInvoiceExtractor(lines, pdf_path)
             res_raw = generic.extract_all()
-            debug_output += "ℹ️ Usado extractor genérico (BaseInvoiceExtractor).\n"
+    debug_output += tracing.format_events(trace_events)
+    info['extractor'] = full_class_path if ExtractorClass else None
+    if ExtractorClass:
+        debug_output += f"✅ Usado extractor: {full_class_path}\n"
+    else:
+        debug_output += "ℹ️ Usado extractor genérico (BaseInvoiceExtractor).\n"
 
-        # 5. LÓGICA DE RESCATE (Igual que antes)
-        res_list = list(res_raw[:13])
-        # ... (aquí va tu código de rescate de CIF si lo tenías implementado, si no, dejar vacío) ...
+    # 5. LÓGICA DE RESCATE (Igual que antes)
+    res_list = list(res_raw[:13])
+    # ... (aquí va tu código de rescate de CIF si lo tenías implementado, si no, dejar vacío) ...
 
-        return (*res_list, debug_output)
+    return (*res_list, debug_output)
 
+def _layout_fingerprint(pdf_path: str, lines: List[str]) -> Optional[Dict[str, Any]]:
+    if not LAYOUT_MATCH_ENABLED:
+        return None
+    try:
+        return layout_index.compute_fingerprint(pdf_path, lines)
     except Exception as e:
-        import traceback
-        return (*[None]*13, f"❌ ERROR FATAL: {e}\n{traceback.format_exc()}")
\ No newline at end of file
+        print(f"Aviso: no se pudo calcular la huella de {pdf_path}: {e}")
+        return None
+
+def _record_extras(pdf_path: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnas extra para la BBDD (insert_invoices_bulk): extractor usado y huella de maquetación."""
+    layout = info.get('layout')
+    return {'Extractor': info.get('extractor'),
+            'Huella': layout_index.encode_fingerprint(layout, pdf_path) if layout else None}
+
+def extract_document(pdf_path: str, read: Dict[str, Any], debug_mode: bool = False) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """
+    Etapa de extracción del pipeline de ingesta: como extraer_datos, pero sobre una lectura
+    ya hecha (read_document / ocr_document). Devuelve (tupla de 13 campos + log, columnas
+    extra para la BBDD: {'Extractor', 'Huella'}). La huella se calcula aquí, con las líneas
+    ya leídas, para que layout_index no tenga que volver a leer el PDF.
+    """
+    info: Dict[str, Any] = {}
+    try:
+        lines, pages_info = document_lines(read)
+        if not lines:
+            return (*[None]*13, "Error: No se detectó texto en el documento."), _record_extras(pdf_path, info)
+        debug_output = _format_pages_log(pages_info) + _text_debug_log(lines, debug_mode)
+        info['layout'] = _layout_fingerprint(pdf_path, lines)
+        result = _extract_from_lines(pdf_path, lines, debug_output, debug_mode=debug_mode, info=info)
+        return result, _record_extras(pdf_path, info)
+    except Exception as e:
+        return (*[None]*13, f"❌ ERROR FATAL: {e}\n{traceback.format_exc()}"), _record_extras(pdf_path, {})
+
+def extract_batch(paths: List[str], extractor: str, debug_mode: bool = False) -> List[Tuple[Any, ...]]:
+    """
+    Extrae un lote de facturas del MISMO proveedor. 'extractor' es el extractor a usar,
+    como extractor_manual en extraer_datos. Solo ahorra cargar la clase (y compilar su plan
+    de reglas) una vez para todo el lote: cada documento se extrae por separado.
+    Devuelve, por documento y en el mismo orden, la tupla de extraer_datos(path, debug_mode, extractor).
+    """
+    class_path = _manual_class_path(extractor)
+    results: List[Optional[Tuple[Any, ...]]] = [None] * len(paths)
+
+    ExtractorClass = None
+    load_error = None
+    try:
+        ExtractorClass = _load_extractor_class_dynamic(class_path)
+    except Exception as e:
+        load_error = e
+
+    # 1. Lectura de todos los documentos
+    documents: List[Tuple[int, List[str], str]] = [] # (posición, líneas, log)
+    for position, pdf_path in enumerate(paths):
+        try:
+            lines, debug_output, _ = _read_for_extraction(pdf_path, lambda _lines: class_path, debug_mode)
+            if not lines:
+                results[position] = (*[None]*13, "Error: No se detectó texto en el documento.")
+                continue
+            debug_output += f"⚡ FORZADO MANUAL: Usando {extractor} -> Ruta: {class_path}...\n"
+            documents.append((position, lines, debug_output))
+        except Exception as e:
+            results[position] = (*[None]*13, f"❌ ERROR FATAL: {e}\n{traceback.format_exc()}")
+
+    # 2. Extracción documento a documento con la misma clase
+    for position, lines, debug_output in documents:
+        pdf_path = paths[position]
+        try:
+            if not ExtractorClass:
+                debug_output += f"⚠️ Fallo carga dinámica de {class_path}: {load_error}\n"
+            with tracing.capture(enabled=debug_mode) as trace_events:
+                if ExtractorClass:
+                    instance = ExtractorClass(lines, pdf_path)
+                    data_dict = instance.extract_data(lines) if hasattr(instance, 'extract_data') else {}
+                    res_raw = _data_dict_to_tuple(data_dict)
+                else:
+                    res_raw = BaseInvoiceExtractor(lines, pdf_path).extract_all()
+            debug_output += tracing.format_events(trace_events)
+            if ExtractorClass:
+                debug_output += f"✅ Usado extractor: {class_path}\n"
+            else:
+                debug_output += "ℹ️ Usado extractor genérico (BaseInvoiceExtractor).\n"
+            results[position] = (*list(res_raw[:13]), debug_output)
+        except Exception as e:
+            results[position] = (*[None]*13, f"❌ ERROR FATAL: {e}\n{traceback.format_exc()}")
+    return results
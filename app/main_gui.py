@@ -1,13 +1,14 @@
 
 import os
 import csv
-import sqlite3
 import sys
 import subprocess
+import time
+import queue
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinter.scrolledtext import ScrolledText
-from typing import Tuple, List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict
 import io 
 
 # ⬇️ AÑADIR ESTA IMPORTACIÓN
@@ -29,14 +30,15 @@ except ImportError:
 # Importar las partes refactorizadas
 # Asegúrese de que estos módulos existen en su entorno
 import database
+import db_connections
 database.setup_database() 
 database.initialize_extractors_data() 
 import logic
-from config import TESSERACT_CMD_PATH, DEFAULT_VAT_RATE_STR, DEFAULT_VAT_RATE
-from logic import extraer_datos
-# update_invoice_field ahora funciona correctamente
-# 🚨 CORRECCIÓN: Se añade DuplicateInvoiceError a las importaciones
-from database import fetch_all_invoices, delete_invoice_data, fetch_all_invoices_OK, fetch_all_invoices_exported, insert_invoice_data, update_invoice_field, delete_entire_database_schema, is_invoice_processed, DuplicateInvoiceError 
+import ocr_engine
+import batch_jobs
+from config import DEFAULT_VAT_RATE_STR, DEFAULT_VAT_RATE, TABLE_PAGE_SIZE
+# El proceso de facturas va por batch_jobs (pipeline de ingesta); aquí solo la edición de la tabla
+from database import delete_invoice_data, fetch_all_invoices_OK, update_invoice_field, delete_entire_database_schema
 # Se asume que 'utils' existe y contiene 'calculate_total_and_vat'
 from utils import calculate_total_and_vat  
 
@@ -45,6 +47,9 @@ from utils import calculate_total_and_vat
 # iniciales de INITIAL_EXTRACTION_MAPPING si la tabla está vacía.
 database.initialize_extractors_data() # <--- ¡NUEVA LÍNEA CLAVE!
 
+# Columnas de la tabla principal (también las que se piden a la BBDD: sin log_data)
+INVOICE_TREE_COLUMNS = ("path", "file_name", "tipo", "fecha", "numero_factura", "emisor", "cif_emisor", "cliente", "cif", "modelo", "matricula","concepto", "base", "iva", "importe", "tasas","is_validated" )
+
 class InvoiceApp:
     def __init__(self, master):
         self.master = master
@@ -69,6 +74,18 @@ class InvoiceApp:
         # Atributos de Control (Variables para Checkboxes)
         self.files_to_process: List[str] = []
         self.process_button: Optional[ttk.Button] = None 
+        self.cancel_button: Optional[ttk.Button] = None
+        # Proceso en segundo plano (batch_jobs.BatchJob) y filas de la cola de proceso por ruta
+        self.batch_job: Optional[batch_jobs.BatchJob] = None
+        self.job_tree: Optional[ttk.Treeview] = None
+        self.job_rows: Dict[str, str] = {}
+        self.job_started: Dict[str, float] = {}
+        self.throughput_var = tk.StringVar(value="")
+        # Tabla de facturas por páginas (database.fetch_invoice_page): filtros de la vista
+        # actual y cursor de la página siguiente (None cuando ya están todas cargadas)
+        self.tree_filters: Optional[Dict[str, Any]] = None
+        self.tree_cursor: Optional[database.InvoiceCursor] = None
+        self._tree_page_pending = False
         self.debug_var = tk.BooleanVar(value=False) # Modo Debug
         self.reprocess_var = tk.BooleanVar(value=False) # Forzar Re-proceso
         self.log_var = tk.BooleanVar(value=True) # Ver Log de Selección (por defecto SÍ)
@@ -88,6 +105,8 @@ class InvoiceApp:
         self.filesProcess: List[str] = []
 
         self.master.after(50, self._initial_sash_position)
+        # Arranca en segundo plano los procesos de OCR para que el primer OCR no pague el arranque
+        self.master.after(500, ocr_engine.warm_up)
 
     # ------------------------------------------------------------------
     # --- AJUSTES DE GUI Y CONFIGURACIÓN ---
@@ -104,39 +123,8 @@ class InvoiceApp:
             pass
             
     def _is_pradilla_multipage(self, file_path: str) -> bool:
-        """
-        Detecta si un PDF pertenece a Gestoría Pradilla.
-        1. Comprueba si el nombre del archivo contiene 'pradilla' (útil para escaneos).
-        2. Si no, lee la primera página buscando texto clave.
-        """
-        try:
-            if not file_path.lower().endswith('.pdf'):
-                return False
-            
-            # 1. Chequeo por NOMBRE DE ARCHIVO (Prioritario para escaneos)
-            filename = os.path.basename(file_path).lower()
-            if "pradilla" in filename:
-                return True
-
-            # 2. Chequeo por CONTENIDO (Si tiene capa de texto)
-            try:
-                doc = fitz.open(file_path)
-                if len(doc) < 1:
-                    return False
-                first_page_text = doc[0].get_text().upper()
-                doc.close()
-                
-                KEYWORDS = ["GESTORIA PRADILLA", "B-80481369", "B80481369"]
-                for keyword in KEYWORDS:
-                    if keyword in first_page_text:
-                        return True
-            except Exception:
-                pass # Si falla la lectura, asumimos que no es texto o está corrupto
-
-            return False
-        except Exception as e:
-            print(f"Error detectando Pradilla en {file_path}: {e}")
-            return False
+        """Detecta si un PDF pertenece a Gestoría Pradilla (ver split_pdf.is_pradilla_multipage)."""
+        return split_pdf.is_pradilla_multipage(file_path)
 
     def setup_gui(self):
         self.main_frame = ttk.Frame(self.master, padding="10")
@@ -262,9 +250,14 @@ class InvoiceApp:
         ttk.Checkbutton(check_frame, text="Forzar Re-proceso", variable=self.reprocess_var).pack(side='left', padx=5)
         ttk.Checkbutton(check_frame, text="Modo Debug", variable=self.debug_var).pack(side='left', padx=5)
 
-        # Botón de Procesar
-        self.process_button = ttk.Button(process_options_frame, text="Procesar (0 archivos)", command=self.process_selected_files)
-        self.process_button.pack(side='top', fill='x', pady=5)
+        # Botón de Procesar (y de cancelar el lote en curso)
+        process_buttons_frame = ttk.Frame(process_options_frame)
+        process_buttons_frame.pack(side='top', fill='x', pady=5)
+        self.process_button = ttk.Button(process_buttons_frame, text="Procesar (0 archivos)", command=self.process_selected_files)
+        self.process_button.pack(side='left', fill='x', expand=True)
+        self.cancel_button = ttk.Button(process_buttons_frame, text="Cancelar", command=self.cancel_processing, state='disabled')
+        self.cancel_button.pack(side='left', padx=(5, 0))
+        ttk.Label(process_options_frame, textvariable=self.throughput_var).pack(side='top', fill='x')
 
         # --- Contenedor para apilar 3 y 4 a la derecha ---
         # Este nuevo frame irá a la derecha de todo lo anterior.
@@ -293,8 +286,7 @@ class InvoiceApp:
         tree_frame = ttk.Frame(table_panel)
         tree_frame.pack(side='top', fill='both', expand=True)
 
-        columns = ("path", "file_name", "tipo", "fecha", "numero_factura", "emisor", "cif_emisor", "cliente", "cif", "modelo", "matricula","concepto", "base", "iva", "importe", "tasas","is_validated" )
-        self.tree = ttk.Treeview(tree_frame, columns=columns, show='headings')
+        self.tree = ttk.Treeview(tree_frame, columns=INVOICE_TREE_COLUMNS, show='headings')
         # Configuración de colores (Tags)
         self.tree.tag_configure('validated', background='#d4edda') # Verde claro suave
         self.tree.tag_configure('unvalidated', background='#fff3cd') # Amarillo claro suave
@@ -324,7 +316,7 @@ class InvoiceApp:
         
         vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
         hsb = ttk.Scrollbar(tree_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        self.tree.configure(yscrollcommand=lambda first, last: self._on_tree_scroll(vsb, first, last), xscrollcommand=hsb.set)
 
         vsb.pack(side='right', fill='y')
         hsb.pack(side='bottom', fill='x')
@@ -346,6 +338,23 @@ class InvoiceApp:
         self.log_text.pack(fill='both', expand=True)
         self.log_text.insert(tk.END, f"Listo. Tasa de IVA por defecto: {DEFAULT_VAT_RATE_STR}\n")
 
+        # Cola de proceso (estado de cada fichero del lote en curso, encima del log)
+        job_frame = ttk.LabelFrame(table_panel, text="Cola de Proceso", padding="5")
+        job_frame.pack(side='bottom', fill='x', pady=5)
+        self.job_tree = ttk.Treeview(job_frame, columns=("file_name", "status", "seconds"), show='headings', height=5)
+        self.job_tree.heading("file_name", text="Archivo", anchor="w")
+        self.job_tree.heading("status", text="Estado", anchor="center")
+        self.job_tree.heading("seconds", text="Segundos", anchor="e")
+        self.job_tree.column("file_name", width=300, anchor="w")
+        self.job_tree.column("status", width=110, anchor="center")
+        self.job_tree.column("seconds", width=70, anchor="e")
+        self.job_tree.tag_configure('error', background='#f8d7da')
+        self.job_tree.tag_configure('done', background='#d4edda')
+        job_vsb = ttk.Scrollbar(job_frame, orient="vertical", command=self.job_tree.yview)
+        self.job_tree.configure(yscrollcommand=job_vsb.set)
+        job_vsb.pack(side='right', fill='y')
+        self.job_tree.pack(side='left', fill='x', expand=True)
+
     # ------------------------------------------------------------------
     # --- MÉTODOS DE VISTAS Y ACTUALIZACIONES ---
     # ------------------------------------------------------------------
@@ -565,87 +574,101 @@ class InvoiceApp:
         if not self.files_to_process:
             messagebox.showwarning("Procesar", "Primero debe seleccionar archivos usando los botones '1. Seleccionar...'.")
             return
+        if self.batch_job is not None:
+            messagebox.showwarning("Procesar", "Ya hay un lote en proceso. Espere a que termine o cancélelo.")
+            return
         self.filesProcess = []
         initial_files = self.files_to_process 
-        force_reprocess = self.reprocess_var.get()
-        debug_mode = self.debug_var.get()
-
-        # --- 1. PRE-PROCESAMIENTO: Detectar y Dividir Facturas Múltiples (Pradilla) ---
-        final_processing_queue = []
-        
-        self.update_log_display(f"--- Analizando {len(initial_files)} archivos para detectar multipáginas... ---")
-        
-        for file_path in initial_files:
-            # Comprobar si es Pradilla
-            if self._is_pradilla_multipage(file_path):
-                self.update_log_display(f"🔍 Detectado PDF Multi-factura (Pradilla): {os.path.basename(file_path)}")
-                self.update_log_display(f"   ✂️ Dividiendo en facturas individuales...")
-                
-                # Definir carpeta de salida (misma carpeta que el original / split_invoices)
-                splitted_files = split_pdf.split_pdf_into_single_page_files(file_path)
-                
-                if splitted_files:
-                    final_processing_queue.extend(splitted_files)
-                    self.update_log_display(f"   ✅ Se generaron {len(splitted_files)} archivos individuales.")
-                else:
-                    self.update_log_display(f"   ❌ Falló la división. Se intentará procesar el original.")
-                    final_processing_queue.append(file_path)
-            else:
-                # Archivo normal, se pasa tal cual
-                final_processing_queue.append(file_path)
-
-        # --- 2. PROCESAMIENTO ESTÁNDAR ---
-        total_processed = 0
-        self.update_log_display(f"--- Iniciando extracción de {len(final_processing_queue)} facturas... ---", clear=False)
-
-        KEYS = ['Tipo', 'Fecha', 'Número de Factura', 'Emisor', 'CIF Emisor','Cliente', 'CIF', 'Modelo', 'Matricula', 'Importe', 'Base', 'IVA', 'Tasas']
-
-        for i, file_path in enumerate(final_processing_queue):
-            self.update_log_display(f"[{i+1}/{len(final_processing_queue)}] Procesando: {os.path.basename(file_path)}...")
-
-            if not force_reprocess and is_invoice_processed(file_path): 
-                self.update_log_display("  -> Ya procesado (BBDD). Saltando.")
-                continue
-
-            extraction_result = extraer_datos(file_path, debug_mode=debug_mode) 
-
-            # Manejo de la tupla de resultados
-            if len(extraction_result) == 14: # 13 campos + log
-                data_tuple, log_data = extraction_result[:-1], extraction_result[-1]
-            else:
-                data_tuple = logic._pad_data(extraction_result) 
-                log_data = "Error de formato de resultado."
-
-            data_dict = dict(zip(KEYS, data_tuple))
-            data_dict['Archivo'] = os.path.basename(file_path)
-            data_dict['DebugLines'] = log_data
-            
-            # --- Lógica específica para asignar CONCEPTO si no viene del extractor ---
-            # Si es una factura dividida de Pradilla, a veces el concepto se pierde o es genérico.
-            # Podrías añadir lógica extra aquí si quisieras forzar un concepto.
 
+        # Detección/división de multi-factura (Pradilla), extracción y guardado en segundo plano
+        self.batch_job = batch_jobs.BatchJob(
+            initial_files,
+            force_reprocess=self.reprocess_var.get(),
+            debug_mode=self.debug_var.get(),
+            is_multi_invoice=self._is_pradilla_multipage,
+        )
+        for row in self.job_tree.get_children():
+            self.job_tree.delete(row)
+        self.job_rows = {}
+        self.job_started = {}
+        self.update_log_display(f"--- Iniciando extracción de {len(initial_files)} archivos en segundo plano... ---", clear=False)
+        self.process_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        self.batch_job.start()
+        self.master.after(100, self._poll_batch_job)
+
+    def cancel_processing(self):
+        """Cancela el lote en curso: los ficheros que se están leyendo terminan, el resto no."""
+        if self.batch_job is not None:
+            self.batch_job.cancel()
+            self.cancel_button.config(state='disabled')
+            self.update_log_display("--- Cancelando: se terminan los ficheros en curso... ---")
+
+    def _poll_batch_job(self):
+        """Lee los eventos del lote (hilo de la interfaz, vía after) y actualiza tabla, log y ritmo."""
+        job = self.batch_job
+        if job is None:
+            return
+        finished = None
+        for _ in range(200): # Tope por ciclo para no bloquear la interfaz con lotes grandes
             try:
-                insert_invoice_data(data_dict, original_path=file_path, is_validated=0) 
-                self.update_log_display(f"  -> Guardado: {data_dict.get('Número de Factura', 'N/A')}")
-                self.filesProcess.append(file_path)
-                total_processed += 1
-            except DuplicateInvoiceError as e:
-                # Si es un duplicado en archivos split, suele ser seguro ignorarlo o avisar en log
-                self.update_log_display(f"  ⚠️ Duplicado detectado: {str(e)}")
-                continue
-            except sqlite3.Error as e:
-                messagebox.showerror("Error de Base de Datos", f"Fallo al insertar: {e}")
-            except Exception as e:
-                messagebox.showerror("Error Inesperado", f"Error procesando {os.path.basename(file_path)}: {e}")
-
-        self.update_log_display(f"--- Finalizado. {total_processed} nuevas facturas procesadas. ---")
+                kind, path, data = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'queued':
+                self.job_rows[path] = self.job_tree.insert('', tk.END, values=(os.path.basename(path), batch_jobs.STATUS_QUEUED, ""))
+            elif kind == 'status':
+                self._update_job_row(path, data)
+            elif kind == 'log':
+                self.update_log_display(data)
+            elif kind == 'finished':
+                finished = data
+
+        stats = job.throughput()
+        depths = job.depths()
+        self.throughput_var.set(
+            f"{stats['done']}/{stats['total']} · {stats['files_per_minute']:.1f} facturas/min · OCR {stats['ocr_share']:.0f}%\n"
+            f"Colas: entrada {depths['discovery']} · texto {depths['text']} · OCR {depths['ocr']} · "
+            f"extracción {depths['extraction']} · BBDD {depths['persistence']}\n"
+            f"{db_connections.describe()}"
+        )
+        if finished is None:
+            self.master.after(100, self._poll_batch_job)
+            return
+        self._on_batch_finished(job, finished)
+
+    def _update_job_row(self, path: str, status: str):
+        row = self.job_rows.get(path)
+        if row is None:
+            return
+        if status == batch_jobs.STATUS_READING:
+            self.job_started[path] = time.perf_counter()
+            self.job_tree.see(row)
+        seconds = ""
+        if path in self.job_started and status in batch_jobs.FINAL_STATUSES:
+            seconds = f"{time.perf_counter() - self.job_started[path]:.1f}"
+        tags = ('error',) if status == batch_jobs.STATUS_ERROR else ('done',) if status == batch_jobs.STATUS_SAVED else ()
+        self.job_tree.item(row, values=(os.path.basename(path), status, seconds), tags=tags)
+
+    def _on_batch_finished(self, job: batch_jobs.BatchJob, summary: Dict[str, Any]):
+        self.batch_job = None
+        self.filesProcess = list(job.processed_paths)
+        self.process_button.config(state='normal')
+        self.cancel_button.config(state='disabled')
+        if summary['cancelled_job']:
+            self.update_log_display(f"--- Cancelado. {summary['saved']} facturas guardadas, {summary['cancelled']} sin procesar. ---")
+        else:
+            self.update_log_display(f"--- Finalizado. {summary['saved']} nuevas facturas procesadas. ---")
+        if summary['errors']:
+            messagebox.showerror("Procesar", f"{summary['errors']} ficheros no se pudieron procesar. Revise el log.")
         self.load_data_to_tree()
         # Limpiar lista original
         self.files_to_process = []
         self._update_process_buttons_text()
         
         # Opcional: Lanzar generador con el último procesado
-        self.abrir_ventana_editor()
+        if not summary['cancelled_job']:
+            self.abrir_ventana_editor()
 
 
     # ------------------------------------------------------------------
@@ -677,101 +700,81 @@ class InvoiceApp:
             return 0.0
 
     def load_data_to_tree(self):
-        """Carga los datos de la BBDD al Treeview."""
-        # Limpiar tabla
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-
-        try:
-            invoices = fetch_all_invoices()
-            for inv in invoices:
-                # --- CORRECCIÓN LÓGICA: Conversión segura ---
-                raw_validated = inv.get('is_validated')
-                is_validated = False
-                try:
-                    # Intenta convertir a entero, maneja "1", 1, o True
-                    is_validated = int(raw_validated) == 1
-                except (TypeError, ValueError):
-                    is_validated = False
-                # --------------------------------------------
-                values = (
-                    inv.get('path'),
-                    inv.get('file_name'),
-                    inv.get('tipo'),
-                    inv.get('fecha'),
-                    inv.get('numero_factura'),
-                    inv.get('emisor'),
-                    inv.get('cif_emisor'),
-                    inv.get('cliente'),
-                    inv.get('cif'),
-                    inv.get('modelo'),
-                    inv.get('matricula'),
-                    inv.get('concepto'),
-                    f"{self.safe_float(inv.get('base')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('iva')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('importe')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('tasas')):.2f}".replace('.', ','),
-                    "✅" if is_validated else "❌", # Usamos la variable saneada
-                    
-                )
-                tag = 'validated' if is_validated else 'unvalidated'
-                self.tree.insert('', tk.END, values=values, tags=(tag,))
-
-        except Exception as e:
-            messagebox.showerror("Error de BBDD", f"Fallo al cargar datos de la base de datos: {e}")
+        """Carga la primera página de facturas; el resto se carga al desplazarse hasta el final."""
+        self._reset_tree(filters=None)
 
     def load_data_to_tree_exported(self):
-        """Carga los datos de la BBDD al Treeview."""
-        # Limpiar tabla
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-
+        """Como load_data_to_tree, solo con las facturas exportadas."""
+        self._reset_tree(filters={'exportado': 'SI'})
+
+    def _reset_tree(self, filters: Optional[Dict[str, Any]]):
+        self.tree.delete(*self.tree.get_children())
+        self.tree_filters = filters
+        self.tree_cursor = None
+        self._load_tree_page(first=True)
+
+    def _on_tree_scroll(self, scrollbar: ttk.Scrollbar, first: str, last: str):
+        """yscrollcommand de la tabla: al acercarse al final se pide la página siguiente."""
+        scrollbar.set(first, last)
+        if self.tree_cursor is not None and float(last) >= 0.9 and not self._tree_page_pending:
+            self._tree_page_pending = True
+            self.master.after_idle(self._load_tree_page)
+
+    def _load_tree_page(self, first: bool = False):
+        """Añade a la tabla la página siguiente (solo las columnas de la tabla, sin log_data)."""
+        self._tree_page_pending = False
+        if not first and self.tree_cursor is None:
+            return
         try:
-            invoices = fetch_all_invoices_exported()
-            for inv in invoices:
-                values = (
-                    inv.get('path'),
-                    inv.get('file_name'),
-                    inv.get('tipo'),
-                    inv.get('fecha'),
-                    inv.get('numero_factura'),
-                    inv.get('emisor'),
-                    inv.get('cif_emisor'),
-                    inv.get('cliente'),
-                    inv.get('cif'),
-                    inv.get('modelo'),
-                    inv.get('matricula'),
-                    inv.get('concepto'),
-                    f"{self.safe_float(inv.get('base')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('iva')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('importe')):.2f}".replace('.', ','),
-                    f"{self.safe_float(inv.get('tasas')):.2f}".replace('.', ','),
-                    "✅" if inv.get('is_validated') == 1 else "❌",
-                    
-                )
-                tag = 'validated' if inv.get('is_validated') == 1 else 'unvalidated'
-                self.tree.insert('', tk.END, values=values, tags=(tag,))
-
+            invoices, self.tree_cursor = database.fetch_invoice_page(
+                INVOICE_TREE_COLUMNS, filters=self.tree_filters, limit=TABLE_PAGE_SIZE, after=self.tree_cursor
+            )
         except Exception as e:
+            self.tree_cursor = None
             messagebox.showerror("Error de BBDD", f"Fallo al cargar datos de la base de datos: {e}")
+            return
+        for inv in invoices:
+            # --- CORRECCIÓN LÓGICA: Conversión segura ---
+            raw_validated = inv.get('is_validated')
+            is_validated = False
+            try:
+                # Intenta convertir a entero, maneja "1", 1, o True
+                is_validated = int(raw_validated) == 1
+            except (TypeError, ValueError):
+                is_validated = False
+            # --------------------------------------------
+            values = (
+                inv.get('path'),
+                inv.get('file_name'),
+                inv.get('tipo'),
+                inv.get('fecha'),
+                inv.get('numero_factura'),
+                inv.get('emisor'),
+                inv.get('cif_emisor'),
+                inv.get('cliente'),
+                inv.get('cif'),
+                inv.get('modelo'),
+                inv.get('matricula'),
+                inv.get('concepto'),
+                f"{self.safe_float(inv.get('base')):.2f}".replace('.', ','),
+                f"{self.safe_float(inv.get('iva')):.2f}".replace('.', ','),
+                f"{self.safe_float(inv.get('importe')):.2f}".replace('.', ','),
+                f"{self.safe_float(inv.get('tasas')):.2f}".replace('.', ','),
+                "✅" if is_validated else "❌", # Usamos la variable saneada
+            )
+            tag = 'validated' if is_validated else 'unvalidated'
+            self.tree.insert('', tk.END, values=values, tags=(tag,))
 
-    
-        
     def _get_log_data_for_path(self, file_path: str) -> str:
         """Busca el log_data para un path dado directamente en la BBDD."""
         if not file_path:
             return "Ruta no válida."
-        import sqlite3 # Importar para usar sqlite3.connect y Row
-        conn = sqlite3.connect(database.DB_NAME)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT log_data FROM processed_invoices WHERE path = ?", (file_path,))
-            result = cursor.fetchone()
+            with database.get_db_connection() as conn:
+                result = conn.execute("SELECT log_data FROM processed_invoices WHERE path = ?", (file_path,)).fetchone()
             return result[0] if result and result[0] else "Log no disponible."
         except Exception as e:
             return f"Error al recuperar log_data: {e}"
-        finally:
-            conn.close()
 
     def on_double_click(self, event):
         """Maneja el doble click para activar la edición de celda."""
@@ -818,13 +821,8 @@ class InvoiceApp:
 
     def recalculate_and_update(self, file_path: str, edited_column: str, edited_value: Any):
         """Recalcula Base/IVA/Importe automáticamente tras una edición numérica."""
-        import sqlite3 # Importar para usar sqlite3.connect y Row
-        conn = sqlite3.connect(database.DB_NAME) 
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT base, iva, importe FROM processed_invoices WHERE path = ?", (file_path,))
-        row = cursor.fetchone()
-        conn.close()
+        with database.get_db_connection() as conn:
+            row = conn.execute("SELECT base, iva, importe FROM processed_invoices WHERE path = ?", (file_path,)).fetchone()
         if not row: return
 
         # database._clean_numeric_value se ha movido/definido en database.py
@@ -846,12 +844,10 @@ class InvoiceApp:
             except (ZeroDivisionError, TypeError):
                 return
 
-        conn = sqlite3.connect(database.DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE processed_invoices SET base = ?, iva = ?, importe = ? WHERE path = ?",
-                       (base, iva, importe, file_path))
-        conn.commit()
-        conn.close()
+        with database.get_db_connection() as conn:
+            conn.execute("UPDATE processed_invoices SET base = ?, iva = ?, importe = ? WHERE path = ?",
+                         (base, iva, importe, file_path))
+            conn.commit()
 
     def validate_invoice(self):
             selected_items = self.tree.selection()
@@ -987,13 +983,8 @@ class InvoiceApp:
             messagebox.showwarning("Generador", "Seleccione un registro en la tabla para pasar los datos al generador.")
             return
 
-        import sqlite3 # Necesario para sqlite3.connect y Row
-        conn = sqlite3.connect(database.DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM processed_invoices WHERE path = ?", (self.selected_file_path,))
-        row = cursor.fetchone()
-        conn.close()
+        with database.get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM processed_invoices WHERE path = ?", (self.selected_file_path,)).fetchone()
         if not row:
             messagebox.showerror("Error", "No se encontraron datos completos para la fila seleccionada.")
             return
@@ -1032,22 +1023,14 @@ class InvoiceApp:
         if not self.filesProcess:
             # Si la lista está vacía, no hay nada que procesar. Salir de la función.
             return
-        import sqlite3 # Necesario para sqlite3.connect y Row
-        conn = sqlite3.connect(database.DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
         # 🟢 CORRECCIÓN: Cambiar self.filesProcess[0] por self.filesProcess[-1]
         # Esto asegura que si procesas 5 facturas, abra la última, no la primera.
-        try:
-            cursor.execute("SELECT * FROM processed_invoices WHERE path = ?", (self.filesProcess[-1],))
-            row = cursor.fetchone()
-        finally:
-            conn.close() # Es buena práctica cerrar la conexión en un bloque finally o tras usarla
+        with database.get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM processed_invoices WHERE path = ?", (self.filesProcess[-1],)).fetchone()
 
         if not row:
             # messagebox.showerror("Error", "No se encontraron datos...") # Opcional: silenciar si no hay datos
             return
-        conn.close()
         if not row:
             messagebox.showerror("Error", "No se encontraron datos completos para la fila seleccionada.")
             return
@@ -1100,4 +1083,5 @@ if __name__ == "__main__":
     root = tk.Tk()
     root.geometry("1400x800") 
     app = InvoiceApp(root)
+    logic.start_layout_backfill() # Huellas de maquetación de facturas validadas antiguas
     root.mainloop()
\ No newline at end of file
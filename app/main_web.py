@@ -1,7 +1,7 @@
 import flet as ft
 import os
 import database
-import logic
+from config import TABLE_PAGE_SIZE
 from PDFEngineWeb import PDFEngineWeb
 
 # Aseguramos que la BBDD esté lista al iniciar
@@ -190,28 +190,43 @@ def main(page: ft.Page):
 
     # --- Lógica de la Vista HOME (Tabla de Facturas) ---
     def vista_home():
-        invoices = database.fetch_all_invoices()
-        
-        filas = []
-        for inv in invoices:
+        # Solo las columnas de la tabla (sin log_data), por páginas como en el histórico:
+        # cursor de la página siguiente (database.fetch_invoice_page); None si ya están todas
+        columnas = ('path', 'emisor', 'fecha', 'importe', 'is_validated')
+        pagina = {'cursor': None}
+
+        def fila(inv):
             is_valid = inv['is_validated'] == 1
             icon = ft.Icon(ft.icons.CHECK_CIRCLE, color="green") if is_valid else ft.Icon(ft.icons.WARNING, color="orange")
             
             # Click en la fila para ir al editor
             # Usamos un lambda que captura el path
-            filas.append(
-                ft.DataRow(
-                    cells=[
-                        ft.DataCell(icon),
-                        ft.DataCell(ft.Text(os.path.basename(inv['path']))),
-                        ft.DataCell(ft.Text(inv['emisor'] or "")),
-                        ft.DataCell(ft.Text(inv['fecha'] or "")),
-                        ft.DataCell(ft.Text(f"{inv['importe']} €" if inv['importe'] else "")),
-                    ],
-                    on_select_changed=lambda e, p=inv['path']: page.go(f"/editor?path={p}")
-                )
+            return ft.DataRow(
+                cells=[
+                    ft.DataCell(icon),
+                    ft.DataCell(ft.Text(os.path.basename(inv['path']))),
+                    ft.DataCell(ft.Text(inv['emisor'] or "")),
+                    ft.DataCell(ft.Text(inv['fecha'] or "")),
+                    ft.DataCell(ft.Text(f"{inv['importe']} €" if inv['importe'] else "")),
+                ],
+                on_select_changed=lambda e, p=inv['path']: page.go(f"/editor?path={p}")
             )
 
+        def cargar_mas(_):
+            # Página siguiente por clave (procesado_en, path): no vuelve a leer las ya cargadas
+            if pagina['cursor'] is None:
+                return
+            invoices, pagina['cursor'] = database.fetch_invoice_page(
+                columns=columnas, descending=True, limit=TABLE_PAGE_SIZE, after=pagina['cursor'])
+            tabla.rows.extend(fila(inv) for inv in invoices)
+            boton_mas.visible = pagina['cursor'] is not None
+            page.update()
+
+        invoices, pagina['cursor'] = database.fetch_invoice_page(columns=columnas, descending=True, limit=TABLE_PAGE_SIZE)
+        filas = [fila(inv) for inv in invoices]
+        boton_mas = ft.TextButton("Cargar más", icon=ft.icons.EXPAND_MORE, on_click=cargar_mas,
+                                  visible=pagina['cursor'] is not None)
+
         tabla = ft.DataTable(
             columns=[
                 ft.DataColumn(ft.Text("Estado")),
@@ -234,7 +249,8 @@ def main(page: ft.Page):
                     content=ft.Column([
                         ft.Text("Mis Facturas", size=30, weight="bold"),
                         ft.ElevatedButton("Recargar", on_click=lambda _: page.go("/")), # Recarga simple
-                        tabla
+                        tabla,
+                        boton_mas
                     ], scroll=ft.ScrollMode.AUTO),
                     padding=20,
                     expand=True
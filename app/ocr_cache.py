@@ -0,0 +1,158 @@
+# ocr_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional, Dict, Any
+
+import database
+import db_connections
+from config import OCR_CACHE_FILE, OCR_CACHE_MAX_BYTES
+
+# --- Caché persistente de texto/OCR direccionada por contenido ---
+# La clave es SHA-256(bytes del fichero + ajustes de OCR), así que renombrar o mover
+# un PDF no invalida la entrada, y cambiar el idioma/DPI sí.
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _cache_path() -> str:
+    """Ruta del fichero de caché: misma carpeta que facturas.db."""
+    db_file = getattr(database, 'DB_PATH', None) or getattr(database, 'DB_NAME', 'facturas.db')
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), OCR_CACHE_FILE)
+
+
+def _create_schema(conn: sqlite3.Connection):
+    """Crea la tabla de la caché si no existe (una vez por conexión)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS text_cache (
+            cache_key TEXT PRIMARY KEY,
+            lines TEXT NOT NULL,
+            meta TEXT,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_text_cache_access ON text_cache(last_access)")
+    existing = [info[1] for info in conn.execute("PRAGMA table_info(text_cache)").fetchall()]
+    if 'meta' not in existing:
+        conn.execute("ALTER TABLE text_cache ADD COLUMN meta TEXT")
+
+
+def _get_cache_connection():
+    """Conexión persistente del hilo a la BBDD de caché (ver db_connections)."""
+    return db_connections.connection(_cache_path(), setup=_create_schema)
+
+
+def _count(stat: str, n: int = 1):
+    with _stats_lock:
+        _stats[stat] += n
+
+
+# --- Claves ---
+
+def file_sha256(file_path: str) -> str:
+    """Calcula el SHA-256 del contenido del fichero (lectura por bloques)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(file_hash: str, settings: Dict[str, Any]) -> str:
+    """Combina el hash del fichero con los ajustes de OCR en una única clave."""
+    settings_str = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{file_hash}|{settings_str}".encode('utf-8')).hexdigest()
+
+
+# --- Lectura / Escritura ---
+
+def get_entry(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Devuelve {'lines': [...], 'meta': {...}} para la clave o None si no está en caché."""
+    with _get_cache_connection() as conn:
+        row = conn.execute("SELECT lines, meta FROM text_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+        if row is None:
+            _count('misses')
+            return None
+        conn.execute("UPDATE text_cache SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+        conn.commit()
+    _count('hits')
+    return {'lines': json.loads(row[0]), 'meta': json.loads(row[1]) if row[1] else {}}
+
+
+def get_lines(cache_key: str) -> Optional[List[str]]:
+    """Devuelve las líneas guardadas para la clave o None si no están en caché."""
+    entry = get_entry(cache_key)
+    return entry['lines'] if entry is not None else None
+
+
+def put_lines(cache_key: str, lines: List[str], meta: Optional[Dict[str, Any]] = None):
+    """Guarda las líneas extraídas (y sus metadatos) y aplica la política de expulsión LRU."""
+    payload = json.dumps(lines, ensure_ascii=False)
+    meta_payload = json.dumps(meta, ensure_ascii=False) if meta else None
+    size = len(payload.encode('utf-8')) + len((meta_payload or '').encode('utf-8'))
+    if size > OCR_CACHE_MAX_BYTES:
+        return
+    ahora = time.time()
+    with _get_cache_connection() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO text_cache (cache_key, lines, meta, size_bytes, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (cache_key, payload, meta_payload, size, ahora, ahora))
+        _evict_lru(conn)
+        conn.commit()
+
+
+def _evict_lru(conn: sqlite3.Connection):
+    """Elimina las entradas menos usadas hasta respetar OCR_CACHE_MAX_BYTES."""
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM text_cache").fetchone()[0]
+    if total <= OCR_CACHE_MAX_BYTES:
+        return
+    evicted = 0
+    cursor = conn.execute("SELECT cache_key, size_bytes FROM text_cache ORDER BY last_access ASC")
+    for cache_key, size in cursor.fetchall():
+        if total <= OCR_CACHE_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM text_cache WHERE cache_key = ?", (cache_key,))
+        total -= size
+        evicted += 1
+    _count('evictions', evicted)
+
+
+# --- Mantenimiento ---
+
+def get_stats() -> Dict[str, Any]:
+    """Contadores de aciertos/fallos y ocupación actual de la caché."""
+    with _stats_lock:
+        stats = dict(_stats)
+    try:
+        with _get_cache_connection() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM text_cache"
+            ).fetchone()
+    except sqlite3.Error:
+        entries, total = 0, 0
+    lookups = stats['hits'] + stats['misses']
+    stats.update({
+        'entries': entries,
+        'size_bytes': total,
+        'max_bytes': OCR_CACHE_MAX_BYTES,
+        'hit_rate': (stats['hits'] / lookups) if lookups else 0.0,
+    })
+    return stats
+
+
+def clear_cache():
+    """Vacía la caché y reinicia los contadores."""
+    with _get_cache_connection() as conn:
+        conn.execute("DELETE FROM text_cache")
+        conn.commit()
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,639 @@
+# ocr_engine.py
+
+import io
+import os
+import re
+import sys
+import shlex
+import shutil
+import atexit
+import ctypes
+import ctypes.util
+import subprocess
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Iterable, Iterator, Dict, Any, Tuple
+
+# Importaciones para rasterizado y OCR
+try:
+    import fitz # PyMuPDF
+except ImportError:
+    fitz = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+# Opcional: API nativa de Tesseract (pip install tesserocr). Permite mantener el motor
+# cargado (con el traineddata de 'spa') en cada proceso en lugar de lanzar un
+# ejecutable tesseract por llamada.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Módulo ligero a propósito: los procesos del pool lo importan para ejecutar el OCR,
+# así que NO debe importar database ni logic.
+from config import (
+    TESSERACT_CMD_PATH, OCR_LANG, OCR_DPI, OCR_MAX_PAGES, OCR_WORKERS,
+    OCR_MIN_PAGE_CHARS, OCR_MIN_TEXT_COVERAGE, OCR_MIN_IMAGE_AREA,
+    OCR_ADAPTIVE, OCR_ADAPTIVE_DPI_STEPS, OCR_MIN_CONFIDENCE
+)
+
+# --- Configuración de OCR (Tesseract) ---
+# Ejecutable para cuando no hay tesserocr (en Windows, la ruta configurada)
+TESSERACT_CMD: str = TESSERACT_CMD_PATH if sys.platform == "win32" and TESSERACT_CMD_PATH else 'tesseract'
+
+# Carpeta tessdata para el motor persistente (en Windows, junto al ejecutable configurado)
+TESSDATA_PATH: Optional[str] = None
+if sys.platform == "win32" and TESSERACT_CMD_PATH:
+    TESSDATA_PATH = os.path.join(os.path.dirname(TESSERACT_CMD_PATH), 'tessdata')
+
+
+# --- libtesseract por ctypes (motor persistente sin tesserocr) ---
+# Toda instalación de Tesseract trae la biblioteca (libtesseract-5.dll junto a tesseract.exe
+# en Windows, libtesseract.so.5 en Linux). Con su API en C cada proceso carga el motor y el
+# traineddata una vez, igual que con tesserocr, sin compilar nada.
+
+_dll_directories: List[Any] = [] # os.add_dll_directory deja de valer si se cierra su objeto
+
+
+def _load_libtesseract():
+    candidates: List[str] = []
+    if sys.platform == "win32" and TESSERACT_CMD_PATH:
+        folder = os.path.dirname(TESSERACT_CMD_PATH)
+        if os.path.isdir(folder):
+            _dll_directories.append(os.add_dll_directory(folder)) # Sus dependencias (leptonica...) están en la misma carpeta
+            candidates += [os.path.join(folder, name) for name in os.listdir(folder)
+                           if name.lower().startswith('libtesseract') and name.lower().endswith('.dll')]
+    found = ctypes.util.find_library('tesseract')
+    if found:
+        candidates.append(found)
+    candidates += ['libtesseract.so.5', 'libtesseract.so.4', 'libtesseract.5.dylib']
+    for candidate in candidates:
+        try:
+            lib = ctypes.CDLL(candidate)
+        except OSError:
+            continue
+        handle = ctypes.c_void_p
+        lib.TessBaseAPICreate.restype = handle
+        lib.TessBaseAPIInit3.argtypes = [handle, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPISetPageSegMode.argtypes = [handle, ctypes.c_int]
+        lib.TessBaseAPISetImage.argtypes = [handle, ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.TessBaseAPIGetUTF8Text.argtypes = [handle]
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p # Se libera con TessDeleteText
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIAllWordConfidences.argtypes = [handle]
+        lib.TessBaseAPIAllWordConfidences.restype = ctypes.POINTER(ctypes.c_int) # Termina en -1
+        lib.TessDeleteIntArray.argtypes = [ctypes.POINTER(ctypes.c_int)]
+        lib.TessBaseAPIClear.argtypes = [handle]
+        lib.TessBaseAPIDelete.argtypes = [handle]
+        return lib
+    return None
+
+_libtesseract = None if tesserocr is not None else _load_libtesseract()
+
+# Motor que se carga una vez y se reutiliza (tesserocr o libtesseract); si no hay, cada OCR
+# lanza el ejecutable tesseract
+PERSISTENT_ENGINE: bool = bool(tesserocr or _libtesseract)
+
+OCR_AVAILABLE: bool = bool(fitz and Image and (PERSISTENT_ENGINE or shutil.which(TESSERACT_CMD)))
+
+# --- Pool de procesos (se crea la primera vez que hace falta y se reutiliza) ---
+# Sin motor persistente, el servicio de OCR (submit, submit_searchable_pdf) no usa el pool: cada
+# llamada ya lanza su propio proceso tesseract, así que basta un hilo que lo espere y se
+# ahorra serializar la imagen para enviarla a otro proceso.
+_pool: Optional[ProcessPoolExecutor] = None
+_threads: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_cold_engine_warned = False
+
+
+def _max_workers() -> int:
+    """Número de procesos del pool: OCR_WORKERS o, si es 0, uno por núcleo."""
+    return OCR_WORKERS if OCR_WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def _pool_job(fn, *args):
+    """
+    Ejecuta fn dentro del pool. Las excepciones se convierten en RuntimeError porque
+    algunas (p.ej. las de tesserocr) no se pueden reconstruir en el proceso principal
+    y dejarían el pool marcado como roto.
+    """
+    try:
+        return fn(*args)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_max_workers())
+        return _pool
+
+
+def _get_threads() -> ThreadPoolExecutor:
+    global _threads
+    with _pool_lock:
+        if _threads is None:
+            _threads = ThreadPoolExecutor(max_workers=_max_workers(), thread_name_prefix="ocr")
+        return _threads
+
+
+def _warn_cold_engine():
+    """Avisa una vez por proceso de que no hay motor persistente (tesserocr o libtesseract)."""
+    global _cold_engine_warned
+    if not PERSISTENT_ENGINE and not _cold_engine_warned:
+        _cold_engine_warned = True
+        print("Aviso: no se encontró libtesseract ni tesserocr; cada OCR lanza el ejecutable "
+              "tesseract (la imagen va por su entrada estándar) y vuelve a cargar el idioma.")
+
+
+def shutdown_pool():
+    """Cierra el pool de OCR (se llama automáticamente al salir)."""
+    global _pool, _threads
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _threads is not None:
+            _threads.shutdown(wait=False, cancel_futures=True)
+            _threads = None
+
+atexit.register(shutdown_pool)
+
+# --- Tiempo de OCR por hilo ---
+# Segundos que el hilo ha pasado esperando al OCR (en el pool o en línea). El proceso
+# por lotes lo compara con el tiempo total de cada factura para medir qué parte es OCR.
+_ocr_time = threading.local()
+
+
+def ocr_seconds() -> float:
+    """Segundos de OCR acumulados por el hilo actual."""
+    return getattr(_ocr_time, 'seconds', 0.0)
+
+
+@contextmanager
+def _timed_ocr():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _ocr_time.seconds = ocr_seconds() + time.perf_counter() - started
+
+# --- Motores Tesseract persistentes (uno por hilo y por idioma en cada proceso) ---
+# Los dos motores ofrecen recognize(imagen, psm, with_confidence) -> (texto, confianza o None).
+_engines = threading.local()
+_PSM_AUTO = 3
+
+
+class _TesserocrEngine:
+    def __init__(self, lang: str):
+        kwargs = {'lang': lang}
+        if TESSDATA_PATH:
+            kwargs['path'] = TESSDATA_PATH
+        self.api = tesserocr.PyTessBaseAPI(**kwargs)
+
+    def recognize(self, image, psm: Optional[int], with_confidence: bool) -> Tuple[str, Optional[float]]:
+        api = self.api
+        api.SetPageSegMode(psm if psm is not None else tesserocr.PSM.AUTO)
+        try:
+            api.SetImage(image)
+            text = api.GetUTF8Text()
+            conf = None
+            if with_confidence:
+                confidences = [c for c in api.AllWordConfidences() if c >= 0]
+                conf = sum(confidences) / len(confidences) if confidences else 0.0
+            return text, conf
+        finally:
+            api.Clear()
+
+
+class _LibtesseractEngine:
+    def __init__(self, lang: str):
+        lib = _libtesseract
+        self.api = lib.TessBaseAPICreate()
+        datapath = TESSDATA_PATH.encode() if TESSDATA_PATH else None
+        if lib.TessBaseAPIInit3(self.api, datapath, lang.encode()) != 0:
+            lib.TessBaseAPIDelete(self.api)
+            raise RuntimeError(f"libtesseract no pudo cargar el idioma '{lang}'.")
+
+    def recognize(self, image, psm: Optional[int], with_confidence: bool) -> Tuple[str, Optional[float]]:
+        lib = _libtesseract
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('L' if image.mode == '1' else 'RGB')
+        bytes_per_pixel = 1 if image.mode == 'L' else 3
+        data = image.tobytes() # Se mantiene viva hasta Clear()
+        lib.TessBaseAPISetPageSegMode(self.api, psm if psm is not None else _PSM_AUTO)
+        try:
+            lib.TessBaseAPISetImage(self.api, data, image.width, image.height, bytes_per_pixel, image.width * bytes_per_pixel)
+            pointer = lib.TessBaseAPIGetUTF8Text(self.api)
+            if not pointer:
+                raise RuntimeError("libtesseract no devolvió texto.")
+            try:
+                text = ctypes.string_at(pointer).decode('utf-8', 'replace')
+            finally:
+                lib.TessDeleteText(pointer)
+            conf = None
+            if with_confidence:
+                confidences: List[int] = []
+                array = lib.TessBaseAPIAllWordConfidences(self.api)
+                if array:
+                    try:
+                        while array[len(confidences)] != -1:
+                            confidences.append(array[len(confidences)])
+                    finally:
+                        lib.TessDeleteIntArray(array)
+                conf = sum(confidences) / len(confidences) if confidences else 0.0
+            return text, conf
+        finally:
+            lib.TessBaseAPIClear(self.api)
+
+
+def _new_engine(lang: str):
+    return _TesserocrEngine(lang) if tesserocr is not None else _LibtesseractEngine(lang)
+
+
+def _get_engine(lang: str):
+    engines = getattr(_engines, 'by_lang', None)
+    if engines is None:
+        engines = _engines.by_lang = {}
+    engine = engines.get(lang)
+    if engine is None:
+        engine = engines[lang] = _new_engine(lang)
+    return engine
+
+
+def _psm_from_config(config: str) -> Optional[int]:
+    match = re.search(r'--psm\s+(\d+)', config or '')
+    return int(match.group(1)) if match else None
+
+
+# --- Ejecutable tesseract por la entrada/salida estándar (sin motor persistente) ---
+# La imagen se codifica en memoria como PNM (sin compresión: lo más barato de generar y
+# Leptonica lo lee directamente) y el resultado se lee de stdout. Ni la imagen ni la
+# salida pasan por el disco.
+
+def _encode_pnm(image) -> bytes:
+    if image.mode not in ('1', 'L', 'RGB'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PPM')
+    return buffer.getvalue()
+
+
+def run_tesseract_cli(image, lang: str = OCR_LANG, config: str = '', output: str = 'txt') -> bytes:
+    """Salida de "tesseract stdin stdout" para una imagen PIL ('txt', 'tsv' o 'pdf')."""
+    args = [TESSERACT_CMD, 'stdin', 'stdout', '-l', lang, *shlex.split(config or '')]
+    if output != 'txt':
+        args.append(output)
+    try:
+        completed = subprocess.run(args, input=_encode_pnm(image), capture_output=True,
+                                   creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    except FileNotFoundError:
+        raise RuntimeError(f"No se encuentra el ejecutable de Tesseract ({TESSERACT_CMD}).") from None
+    if completed.returncode != 0:
+        error = completed.stderr.decode('utf-8', 'replace').strip()
+        raise RuntimeError(f"Tesseract terminó con código {completed.returncode}: {error}")
+    return completed.stdout
+
+
+def _text_from_tsv(tsv: str) -> Tuple[str, float]:
+    """Texto (una línea por línea de Tesseract) y confianza media de la salida TSV."""
+    lines: Dict[Tuple[str, str, str], List[str]] = {}
+    confidences: List[float] = []
+    for row in tsv.splitlines()[1:]: # La primera fila es la cabecera
+        columns = row.split('\t')
+        if len(columns) < 12 or not columns[11].strip():
+            continue
+        conf = float(columns[10])
+        if conf >= 0:
+            confidences.append(conf)
+        lines.setdefault((columns[2], columns[3], columns[4]), []).append(columns[11])
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+
+def run_tesseract(image, lang: str = OCR_LANG, config: str = '', with_confidence: bool = False) -> Tuple[str, Optional[float]]:
+    """
+    Ejecuta Tesseract sobre una imagen PIL. Usa el motor persistente del hilo (tesserocr o
+    libtesseract) si lo hay y, si no, el ejecutable tesseract con la imagen por la entrada
+    estándar (run_tesseract_cli). Devuelve (texto, confianza media o None).
+    """
+    if PERSISTENT_ENGINE:
+        return _get_engine(lang).recognize(image, _psm_from_config(config), with_confidence)
+
+    if not with_confidence:
+        return run_tesseract_cli(image, lang, config).decode('utf-8', 'replace'), None
+    return _text_from_tsv(run_tesseract_cli(image, lang, config, output='tsv').decode('utf-8', 'replace'))
+
+# --- Conversión Pixmap -> PIL en memoria ---
+# Cada hilo reutiliza su propio búfer de trabajo, así que varias llamadas concurrentes
+# desde hilos del mismo proceso no se pisan (antes compartían ocr_tmp_{pid}.png).
+_scratch = threading.local()
+
+
+def _scratch_buffer(size: int) -> memoryview:
+    """Devuelve un búfer del hilo actual de al menos 'size' bytes."""
+    buffer = getattr(_scratch, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        _scratch.buffer = buffer
+    return memoryview(buffer)[:size]
+
+
+def pixmap_to_image(pix) -> "Image.Image":
+    """
+    Convierte un Pixmap de PyMuPDF en imagen PIL sin pasar por disco ni por PNG.
+    """
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}.get(pix.n, "RGB")
+    size = pix.stride * pix.height
+    view = _scratch_buffer(size)
+    view[:] = pix.samples_mv
+    return Image.frombuffer(mode, (pix.width, pix.height), view, "raw", mode, pix.stride, 1)
+
+
+def ocr_pixmap(pix, lang: str = OCR_LANG, config: str = '') -> str:
+    """OCR directo de un Pixmap. La imagen se consume aquí mismo porque el búfer se reutiliza."""
+    image = pixmap_to_image(pix)
+    try:
+        return run_tesseract(image, lang=lang, config=config)[0]
+    finally:
+        image.close()
+
+
+def ocr_pixmap_with_confidence(pix, lang: str = OCR_LANG, config: str = '') -> Tuple[str, float]:
+    """OCR de un Pixmap devolviendo también la confianza media de las palabras (0-100)."""
+    image = pixmap_to_image(pix)
+    try:
+        return run_tesseract(image, lang=lang, config=config, with_confidence=True)
+    finally:
+        image.close()
+
+# --- OCR de páginas ---
+
+def _render_page(page, dpi: int, gray: bool = False):
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    return page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), colorspace=colorspace)
+
+
+def ocr_pdf_page(pdf_path: str, page_index: int, dpi: int = OCR_DPI, lang: str = OCR_LANG) -> Dict[str, Any]:
+    """
+    Rasteriza una página del PDF y la pasa por Tesseract. Se ejecuta dentro del pool.
+    Con OCR_ADAPTIVE empieza en gris a baja resolución y solo escala de DPI si la
+    confianza no llega a OCR_MIN_CONFIDENCE. Devuelve {'text', 'dpi', 'confidence'}.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc.load_page(page_index)
+        if not OCR_ADAPTIVE:
+            pix = _render_page(page, dpi)
+            return {'text': ocr_pixmap(pix, lang=lang), 'dpi': dpi, 'confidence': None}
+
+        best = None
+        for step_dpi in OCR_ADAPTIVE_DPI_STEPS:
+            pix = _render_page(page, step_dpi, gray=True)
+            text, conf = ocr_pixmap_with_confidence(pix, lang=lang)
+            if best is None or conf > best['confidence']:
+                best = {'text': text, 'dpi': step_dpi, 'confidence': conf}
+            if conf >= OCR_MIN_CONFIDENCE:
+                break
+        return best
+    finally:
+        doc.close()
+
+
+def ocr_pdf_pages(pdf_path: str, page_indices: Iterable[int], dpi: int = OCR_DPI, lang: str = OCR_LANG) -> List[Dict[str, Any]]:
+    """OCR de varias páginas en paralelo. Devuelve los resultados en el orden de page_indices."""
+    page_indices = list(page_indices)
+    if not page_indices:
+        return []
+    with _timed_ocr():
+        if len(page_indices) == 1 or _max_workers() <= 1:
+            return [ocr_pdf_page(pdf_path, i, dpi, lang) for i in page_indices]
+
+        try:
+            pool = _get_pool()
+            futures = [pool.submit(_pool_job, ocr_pdf_page, pdf_path, i, dpi, lang) for i in page_indices]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # Un proceso del pool murió (p.ej. Tesseract abortó): se descarta y se hace en serie
+            shutdown_pool()
+            return [ocr_pdf_page(pdf_path, i, dpi, lang) for i in page_indices]
+
+
+def ocr_pdf(pdf_path: str, max_pages: int = OCR_MAX_PAGES, dpi: int = OCR_DPI, lang: str = OCR_LANG) -> str:
+    """OCR de un PDF escaneado (hasta max_pages páginas; 0 = todas)."""
+    doc = fitz.open(pdf_path)
+    total_pages = len(doc)
+    doc.close()
+    if max_pages and max_pages > 0:
+        total_pages = min(total_pages, max_pages)
+    return "\n".join(r['text'] for r in ocr_pdf_pages(pdf_path, range(total_pages), dpi, lang))
+
+
+# --- Extracción híbrida por página (capa de texto / OCR) ---
+
+def page_needs_ocr(page, text: Optional[str] = None) -> bool:
+    """
+    Decide si una página debe rasterizarse para OCR según el número de caracteres
+    de su capa de texto, la superficie cubierta por imágenes y la cubierta por texto.
+    """
+    if text is None:
+        text = page.get_text() or ''
+    chars = sum(1 for c in text if not c.isspace())
+    if chars == 0:
+        return True # Sin capa de texto
+
+    # Con capa de texto solo compensa el OCR si hay una imagen grande que leer: una página
+    # digital casi vacía (p.ej. "Página 2 de 2") no tiene nada más que reconocer.
+    page_rect = page.rect
+    page_area = page_rect.get_area() or 1.0
+    image_area = sum((fitz.Rect(info['bbox']) & page_rect).get_area() for info in page.get_image_info())
+    if min(image_area / page_area, 1.0) < OCR_MIN_IMAGE_AREA:
+        return False
+    if chars < OCR_MIN_PAGE_CHARS:
+        return True
+
+    text_area = sum(
+        (fitz.Rect(b[:4]) & page_rect).get_area()
+        for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()
+    )
+    return text_area / page_area < OCR_MIN_TEXT_COVERAGE
+
+
+def read_text_pages(pdf_path: str, max_ocr_pages: int = OCR_MAX_PAGES, start: int = 0,
+                    ocr_pages_done: int = 0) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Primera mitad de extract_pdf_pages: capa de texto de cada página (desde start) y
+    páginas clasificadas como escaneo, ya recortadas a max_ocr_pages. No hace OCR.
+    """
+    pages: List[Dict[str, Any]] = []
+    ocr_indices: List[int] = []
+    doc = fitz.open(pdf_path)
+    try:
+        for i in range(start, doc.page_count):
+            page = doc.load_page(i)
+            text = page.get_text() or ''
+            pages.append({'page': i, 'text': text, 'source': 'texto', 'dpi': None, 'confidence': None})
+            if OCR_AVAILABLE and page_needs_ocr(page, text):
+                ocr_indices.append(i)
+    finally:
+        doc.close()
+
+    if max_ocr_pages and max_ocr_pages > 0:
+        ocr_indices = ocr_indices[:max(max_ocr_pages - ocr_pages_done, 0)]
+    return pages, ocr_indices
+
+
+def ocr_into_pages(pdf_path: str, pages: List[Dict[str, Any]], ocr_indices: List[int],
+                   dpi: int = OCR_DPI, lang: str = OCR_LANG, start: int = 0):
+    """Segunda mitad de extract_pdf_pages: OCR de ocr_indices (en paralelo) sobre pages."""
+    try:
+        ocr_results = ocr_pdf_pages(pdf_path, ocr_indices, dpi, lang)
+    except Exception as e:
+        # Si Tesseract falla se conserva al menos la capa de texto de todas las páginas
+        print(f"Error crítico en OCR: {e}")
+        ocr_results = []
+
+    for i, result in zip(ocr_indices, ocr_results):
+        _apply_ocr_result(pages[i - start], result)
+
+
+def extract_pdf_pages(pdf_path: str, max_ocr_pages: int = OCR_MAX_PAGES, dpi: int = OCR_DPI, lang: str = OCR_LANG,
+                      start: int = 0, ocr_pages_done: int = 0) -> List[Dict[str, Any]]:
+    """
+    Lee un PDF página a página: las páginas digitales usan su capa de texto y solo las
+    clasificadas como escaneo se rasterizan y pasan por OCR (en paralelo).
+    Devuelve [{'page': i, 'text': str, 'source': 'texto'|'ocr', 'dpi', 'confidence'}]
+    en orden de página ('dpi' y 'confidence' solo se rellenan en las páginas con OCR).
+    Con start > 0 se empieza en esa página para continuar una lectura parcial; las
+    ocr_pages_done páginas ya OCReadas en esa lectura cuentan para max_ocr_pages.
+    """
+    pages, ocr_indices = read_text_pages(pdf_path, max_ocr_pages, start, ocr_pages_done)
+    ocr_into_pages(pdf_path, pages, ocr_indices, dpi, lang, start)
+    return pages
+
+
+def _apply_ocr_result(page_info: Dict[str, Any], result: Dict[str, Any]):
+    """Sustituye el texto de la página por el del OCR (si ha devuelto algo)."""
+    ocr_text = result['text']
+    if ocr_text.strip():
+        page_info['text'] = ocr_text if ocr_text.endswith('\n') else ocr_text + '\n'
+        page_info['source'] = 'ocr'
+        page_info['dpi'] = result['dpi']
+        page_info['confidence'] = result['confidence']
+
+
+def iter_pdf_pages(pdf_path: str, max_ocr_pages: int = OCR_MAX_PAGES, dpi: int = OCR_DPI, lang: str = OCR_LANG,
+                   start: int = 0, ocr_pages_done: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Versión perezosa de extract_pdf_pages: genera las páginas de una en una y solo
+    rasteriza/OCRea una página cuando el consumidor la pide. Si se deja de iterar
+    (o se llama a close()), las páginas siguientes no se leen.
+    """
+    ocr_count = ocr_pages_done
+    ocr_failed = False
+    doc = fitz.open(pdf_path)
+    try:
+        for i in range(start, doc.page_count):
+            page = doc.load_page(i)
+            text = page.get_text() or ''
+            page_info = {'page': i, 'text': text, 'source': 'texto', 'dpi': None, 'confidence': None}
+            within_limit = not (max_ocr_pages and max_ocr_pages > 0) or ocr_count < max_ocr_pages
+            if OCR_AVAILABLE and not ocr_failed and within_limit and page_needs_ocr(page, text):
+                ocr_count += 1
+                try:
+                    with _timed_ocr():
+                        result = ocr_pdf_page(pdf_path, i, dpi, lang)
+                    _apply_ocr_result(page_info, result)
+                except Exception as e:
+                    # Igual que en extract_pdf_pages: se sigue con la capa de texto
+                    print(f"Error crítico en OCR: {e}")
+                    ocr_failed = True
+            yield page_info
+    finally:
+        doc.close()
+
+
+def ocr_image(image_path: str, lang: str = OCR_LANG) -> str:
+    """OCR de un fichero de imagen (jpg, png, tiff...)."""
+    with _timed_ocr(), Image.open(image_path) as image:
+        return run_tesseract(image, lang=lang)[0]
+
+# --- Servicio de OCR: submit / await sobre el pool persistente ---
+# Con motor persistente, los procesos del pool (uno por núcleo) viven lo que dura la
+# aplicación y cada uno conserva su motor Tesseract cargado, así que un OCR de una región
+# pequeña no paga el arranque. Con el ejecutable tesseract el trabajo va en hilos de este
+# proceso (ver _pool arriba).
+
+def _ocr_image_job(image, lang: str, config: str) -> str:
+    return run_tesseract(image, lang=lang, config=config)[0]
+
+
+def _pdf_image_job(image, lang: str) -> bytes:
+    # tesserocr no genera PDF: esto siempre usa el ejecutable tesseract
+    return run_tesseract_cli(image, lang, output='pdf')
+
+
+def _warm_job(lang: str) -> int:
+    _get_engine(lang)
+    return os.getpid()
+
+
+def _submit(fn, *args, in_process: bool = False) -> Future:
+    if in_process or not PERSISTENT_ENGINE:
+        _warn_cold_engine()
+        return _get_threads().submit(fn, *args)
+    try:
+        return _get_pool().submit(_pool_job, fn, *args)
+    except (BrokenProcessPool, RuntimeError):
+        # Pool roto o cerrado: se recrea una vez
+        shutdown_pool()
+        return _get_pool().submit(_pool_job, fn, *args)
+
+
+def submit(image, lang: str = OCR_LANG, config: str = '') -> Future:
+    """Encola el OCR de una imagen PIL en el pool y devuelve un Future con el texto."""
+    return _submit(_ocr_image_job, image, lang, config)
+
+
+def submit_pixmap(pix, lang: str = OCR_LANG, config: str = '') -> Future:
+    """Encola el OCR de un Pixmap (se copia porque el envío al pool es asíncrono)."""
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}.get(pix.n, "RGB")
+    image = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    return submit(image, lang=lang, config=config)
+
+
+def submit_searchable_pdf(image, lang: str = OCR_LANG) -> Future:
+    """Encola la conversión de una imagen PIL a PDF con capa de texto (bytes)."""
+    return _submit(_pdf_image_job, image, lang, in_process=True)
+
+
+def ocr(image, lang: str = OCR_LANG, config: str = '', timeout: Optional[float] = None) -> str:
+    """OCR síncrono de una imagen PIL a través del pool (submit + espera)."""
+    with _timed_ocr():
+        return submit(image, lang=lang, config=config).result(timeout=timeout)
+
+
+async def ocr_async(image, lang: str = OCR_LANG, config: str = '') -> str:
+    """OCR para código asíncrono (NiceGUI): no bloquea el bucle de eventos."""
+    return await asyncio.wrap_future(submit(image, lang=lang, config=config))
+
+
+def warm_up(lang: str = OCR_LANG) -> List[Future]:
+    """
+    Arranca los procesos del pool y carga un motor Tesseract (con el idioma) en cada uno.
+    Devuelve los Future de la carga (el pid de cada proceso) para quien quiera esperarla.
+    """
+    if not OCR_AVAILABLE:
+        return []
+    if not PERSISTENT_ENGINE:
+        _warn_cold_engine() # Sin motor persistente no hay nada que precargar
+        return []
+    return [_submit(_warm_job, lang) for _ in range(_max_workers())]
@@ -0,0 +1,100 @@
+# rule_store.py
+
+import json
+import hashlib
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+import database
+from config import RULES_CHECK_SECONDS
+
+# --- Almacén de reglas de extracción en memoria (versionado) ---
+# Todas las reglas de extractor_configurations se cargan con UNA consulta y se sirven
+# desde memoria a los extractores (por clave) y a los índices de detección (por campo).
+# Igual con los post-procesadores de extractor_postprocessors (motor de reglas genérico).
+# El almacén se recarga cuando cambia database.get_rules_version(), que incrementa
+# save_extractor_configuration (también desde el editor de reglas en otro proceso).
+# Esa versión está en la BBDD y los extractores la piden en cada campo, así que se
+# consulta como mucho cada RULES_CHECK_SECONDS; un cambio hecho en este proceso
+# (database.get_config_version()) obliga a consultarla en la siguiente llamada.
+# key_version(clave) resume las reglas de UN extractor: no cambia cuando se editan las
+# de otro, así que quien compila o importa un extractor solo lo rehace con las suyas.
+
+RulesByField = Dict[str, List[Dict[str, Any]]]
+
+_rules: Optional[Dict[str, RulesByField]] = None # extractor -> {campo: [reglas]}
+_postprocessors: Dict[str, RulesByField] = {}      # extractor -> {campo: [pasos]}
+_version: Optional[int] = None
+_key_versions: Dict[str, str] = {}                 # extractor -> huella de sus reglas y post-procesado
+_checked_at = 0.0                  # time.monotonic() de la última consulta de la versión
+_checked_config: Optional[int] = None # database.get_config_version() en esa consulta
+_lock = threading.Lock()
+
+
+def _load() -> Dict[str, RulesByField]:
+    global _rules, _postprocessors, _version, _key_versions, _checked_at, _checked_config
+    now = time.monotonic()
+    config_version = database.get_config_version()
+    with _lock:
+        if (_rules is not None and config_version == _checked_config
+                and now - _checked_at < RULES_CHECK_SECONDS):
+            return _rules
+    current = database.get_rules_version()
+    with _lock:
+        _checked_at, _checked_config = now, config_version
+        if _rules is None or current != _version:
+            _rules = database.get_all_extractor_configurations()
+            _postprocessors = database.get_all_extractor_postprocessors()
+            _version = current
+            _key_versions = {}
+        return _rules
+
+
+def version() -> int:
+    """Versión de las reglas en memoria (recargándolas antes si han cambiado en BBDD)."""
+    _load()
+    return _version
+
+
+def key_version(extractor_key: str) -> str:
+    """
+    Versión de las reglas de un extractor: huella de sus reglas y post-procesadores, que
+    solo cambia cuando cambian las suyas (no con cada save_extractor_configuration).
+    """
+    rules = _load()
+    with _lock:
+        fingerprint = _key_versions.get(extractor_key)
+        if fingerprint is None:
+            content = [rules.get(extractor_key, {}), _postprocessors.get(extractor_key, {})]
+            encoded = json.dumps(content, sort_keys=True, default=str).encode('utf-8')
+            fingerprint = _key_versions[extractor_key] = hashlib.sha256(encoded).hexdigest()
+        return fingerprint
+
+
+def get_rules(extractor_key: str) -> RulesByField:
+    """Reglas de un extractor: {campo: [reglas por attempt_order]}. Devuelve una copia."""
+    rules = _load().get(extractor_key, {})
+    return {field: [dict(rule) for rule in field_rules] for field, field_rules in rules.items()}
+
+
+def get_postprocessors(extractor_key: str) -> RulesByField:
+    """Post-procesado de un extractor: {campo: [pasos por step_order]}. Devuelve una copia."""
+    _load()
+    steps = _postprocessors.get(extractor_key, {})
+    return {field: [dict(step) for step in field_steps] for field, field_steps in steps.items()}
+
+
+def get_rules_for_field(field_name: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Reglas de un campo para todos los extractores: {extractor: [reglas]}."""
+    return {
+        extractor: [dict(rule) for rule in fields[field_name]]
+        for extractor, fields in _load().items() if field_name in fields
+    }
+
+
+def invalidate():
+    """Descarta las reglas en memoria; se recargan en el próximo acceso."""
+    global _rules
+    with _lock:
+        _rules = None
@@ -47,5 +47,41 @@ def split_pdf_into_single_page_files(input_pdf_path, output_folder="split_invoic
         print(f"❌ Error al dividir PDF: {e}")
         return []
 
+PRADILLA_KEYWORDS = ["GESTORIA PRADILLA", "B-80481369", "B80481369"]
+
+def is_pradilla_multipage(file_path: str) -> bool:
+    """
+    Detecta si un PDF pertenece a Gestoría Pradilla (varias facturas en un PDF).
+    1. Comprueba si el nombre del archivo contiene 'pradilla' (útil para escaneos).
+    2. Si no, lee la primera página buscando texto clave.
+    """
+    try:
+        if not file_path.lower().endswith('.pdf'):
+            return False
+
+        # 1. Chequeo por NOMBRE DE ARCHIVO (Prioritario para escaneos)
+        filename = os.path.basename(file_path).lower()
+        if "pradilla" in filename:
+            return True
+
+        # 2. Chequeo por CONTENIDO (Si tiene capa de texto)
+        try:
+            doc = fitz.open(file_path)
+            if len(doc) < 1:
+                return False
+            first_page_text = doc[0].get_text().upper()
+            doc.close()
+
+            for keyword in PRADILLA_KEYWORDS:
+                if keyword in first_page_text:
+                    return True
+        except Exception:
+            pass # Si falla la lectura, asumimos que no es texto o está corrupto
+
+        return False
+    except Exception as e:
+        print(f"Error detectando Pradilla en {file_path}: {e}")
+        return False
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
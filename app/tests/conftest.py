@@ -0,0 +1,34 @@
+# conftest.py
+# Pruebas de la aplicación de escritorio: se ejecutan con "python -m pytest app/tests"
+# desde la raíz del repositorio. Los módulos de app/ se importan como en main_gui.py
+# (sin paquete), así que se añade la carpeta al path.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+import database # noqa: E402
+
+# Algunos módulos leen la BBDD al importarse (reglas del extractor base, mapeo de logic):
+# que no creen facturas.db en la carpeta desde la que se lanza pytest y que encuentren el
+# esquema aunque se importen en la cabecera de un fichero de pruebas.
+database.DB_NAME = os.path.join(tempfile.mkdtemp(prefix='facturas-tests-'), 'facturas.db')
+database.setup_database()
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """BBDD vacía con el esquema completo en una carpeta temporal (la de trabajo también)."""
+    import db_connections
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'facturas.db'))
+    database.setup_database()
+    yield database.DB_NAME
+    db_connections.close_all(database.DB_NAME)
@@ -0,0 +1,110 @@
+# test_batch_cli.py
+
+import csv
+import json
+
+import fitz
+import pytest
+
+import batch_cli
+import database
+import db_connections
+from ingest_pipeline import KEYS, STATUS_ERROR, STATUS_SAVED, STATUS_SKIPPED
+
+
+def _write_pdf(path, lines):
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((72, 72 + 18 * i), line)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def folder(temp_db, tmp_path, monkeypatch):
+    """Carpeta con dos facturas (una en una subcarpeta) y un fichero que no se procesa."""
+    monkeypatch.setattr(database, 'DB_NAME', database.DB_NAME) # main() cambia DB_NAME
+    invoices = tmp_path / 'facturas'
+    (invoices / 'marzo').mkdir(parents=True)
+    _write_pdf(invoices / 'factura_1.pdf', ["Factura", "F-1", "Fecha: 12/05/2025", "Total", "10,00"])
+    _write_pdf(invoices / 'marzo' / 'factura_2.pdf', ["Factura", "F-2", "Fecha: 13/05/2025", "Total", "20,00"])
+    (invoices / 'notas.txt').write_text("no es una factura")
+    return invoices
+
+
+def _main(folder, *args):
+    return batch_cli.main([str(folder), '--workers', '1', '--db', database.DB_NAME, *args])
+
+
+def _saved_paths(db_path):
+    with db_connections.connection(db_path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT path FROM processed_invoices"))
+
+
+def test_find_files(folder):
+    assert batch_cli.find_files(str(folder)) == sorted([
+        str(folder / 'factura_1.pdf'), str(folder / 'marzo' / 'factura_2.pdf')])
+
+
+def test_writes_jsonl_and_csv(folder, tmp_path):
+    jsonl, csv_path = tmp_path / 'salida.jsonl', tmp_path / 'salida.csv'
+    assert _main(folder, '--jsonl', str(jsonl), '--csv', str(csv_path)) == 0
+
+    rows = [json.loads(line) for line in jsonl.read_text(encoding='utf-8').splitlines()]
+    assert sorted(row['Archivo'] for row in rows) == ['factura_1.pdf', 'factura_2.pdf']
+    assert {row['Estado'] for row in rows} == {STATUS_SAVED}
+    assert all(set(row) == set(batch_cli.OUTPUT_COLUMNS + KEYS) for row in rows)
+    assert {row['Ruta'] for row in rows} == {path.replace('\\', '/') for path in batch_cli.find_files(str(folder))}
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as handle:
+        reader = csv.DictReader(handle)
+        assert reader.fieldnames == batch_cli.OUTPUT_COLUMNS + KEYS
+        assert sorted(row['Archivo'] for row in reader) == ['factura_1.pdf', 'factura_2.pdf']
+    assert len(_saved_paths(database.DB_NAME)) == 2
+
+    # Segunda pasada: ya están en la BBDD y no se escriben en las salidas
+    assert _main(folder, '--jsonl', str(jsonl)) == 0
+    assert jsonl.read_text(encoding='utf-8') == ''
+    assert _main(folder, '--jsonl', str(jsonl), '--reprocess') == 0
+    assert len(jsonl.read_text(encoding='utf-8').splitlines()) == 2
+    assert STATUS_SKIPPED not in jsonl.read_text(encoding='utf-8')
+
+
+def test_errors_give_exit_code_1(folder, tmp_path, monkeypatch):
+    insert_invoices_bulk = database.insert_invoices_bulk
+    def failing(records):
+        if any(path.endswith('factura_2.pdf') for _, path, _ in records):
+            raise database.sqlite3.IntegrityError("fila rechazada")
+        return insert_invoices_bulk(records)
+    monkeypatch.setattr(database, 'insert_invoices_bulk', failing)
+
+    jsonl = tmp_path / 'salida.jsonl'
+    assert _main(folder, '--jsonl', str(jsonl)) == 1
+    statuses = {row['Archivo']: row['Estado'] for row in map(json.loads, jsonl.read_text(encoding='utf-8').splitlines())}
+    assert statuses == {'factura_1.pdf': STATUS_SAVED, 'factura_2.pdf': STATUS_ERROR}
+
+
+def test_no_files_or_missing_folder_give_exit_code_2(temp_db, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(database, 'DB_NAME', database.DB_NAME)
+    empty = tmp_path / 'vacia'
+    empty.mkdir()
+    (empty / 'notas.txt').write_text("nada")
+    assert _main(empty) == 2
+    assert "No se encontraron archivos" in capsys.readouterr().out
+    assert _main(tmp_path / 'no_existe') == 2
+    assert "No existe la carpeta" in capsys.readouterr().out
+
+
+def test_db_option_creates_and_uses_that_database(folder, tmp_path):
+    default_db = database.DB_NAME
+    other = tmp_path / 'otra' / 'cron.db'
+    other.parent.mkdir()
+    try:
+        assert batch_cli.main([str(folder), '--workers', '1', '--db', str(other)]) == 0
+        assert database.DB_NAME == str(other)
+        assert len(_saved_paths(str(other))) == 2 # Se crea con su esquema
+        assert _saved_paths(default_db) == []
+    finally:
+        db_connections.close_all(str(other))
@@ -0,0 +1,191 @@
+# test_database.py
+
+import pytest
+
+import database
+from utils import normalize_date_iso
+
+
+@pytest.mark.parametrize('name', sorted(database.INDEXED_QUERIES))
+def test_indexed_queries_use_an_index(temp_db, name):
+    sql, params = database.INDEXED_QUERIES[name]
+    plan = database.explain_query_plan(sql, params)
+    assert any(step.startswith('SEARCH') and 'USING' in step and 'INDEX' in step for step in plan), plan
+
+
+def test_check_index_usage_reports_no_full_scans(temp_db):
+    assert database.check_index_usage() == {}
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('12/05/2025', '2025-05-12'),
+    ('12/05/25', '2025-05-12'),
+    ('12-5-2025', '2025-05-12'),
+    ('12.05.2025', '2025-05-12'),
+    ('01 -04 2025', '2025-04-01'),
+    ('2025-05-12', '2025-05-12'),
+    ('Fecha: 12/05/2025 10:30', '2025-05-12'),
+    ('1 de junio de 2025', '2025-06-01'),
+    ('12 de mayo, 2025', '2025-05-12'),
+    ('3 jun 2025', '2025-06-03'),
+    ('31/02/2025', None),
+    ('13/13/2025', None),
+    ('', None),
+    (None, None),
+    ('sin fecha', None),
+])
+def test_normalize_date_iso(value, expected):
+    assert normalize_date_iso(value) == expected
+
+
+# --- Inserción por lotes y rutas pendientes ---
+
+def _record(n, **extra):
+    return dict({'Tipo': 'COMPRA', 'Número de Factura': f'F-{n}', 'Fecha': '12/05/2025', 'Importe': '1.234,56'}, **extra)
+
+
+def _rows():
+    with database.get_db_connection() as conn:
+        return {row['path']: dict(row) for row in conn.execute("SELECT * FROM processed_invoices")}
+
+
+def test_insert_invoices_bulk_writes_every_column(temp_db):
+    assert database.insert_invoices_bulk([]) == 0
+    saved = database.insert_invoices_bulk([
+        (_record(1, Extractor='extractors.garcia.Garcia'), 'C:\\facturas\\a.pdf', 0),
+        (_record(2, Fecha='sin fecha'), '/f/b.pdf', 1),
+    ])
+    assert saved == 2
+    rows = _rows()
+    assert set(rows) == {'C:/facturas/a.pdf', '/f/b.pdf'} # Rutas normalizadas
+    a, b = rows['C:/facturas/a.pdf'], rows['/f/b.pdf']
+    assert (a['file_name'], a['numero_factura'], a['importe'], a['is_validated']) == ('a.pdf', 'F-1', 1234.56, 0)
+    assert (a['fecha_iso'], a['extractor']) == ('2025-05-12', 'extractors.garcia.Garcia')
+    assert (b['fecha_iso'], b['extractor'], b['is_validated']) == (None, None, 1)
+
+
+def test_reinserting_a_path_replaces_the_row(temp_db):
+    database.insert_invoices_bulk([(_record(1), '/f/a.pdf', 0), (_record(2), '/f/b.pdf', 0)])
+    database.insert_invoices_bulk([(_record(9, Fecha='01/02/2024'), '/f/a.pdf', 1)])
+    database.insert_invoice_data(_record(8), '/f/b.pdf', 0)
+    rows = _rows()
+    assert len(rows) == 2
+    assert (rows['/f/a.pdf']['numero_factura'], rows['/f/a.pdf']['fecha_iso'], rows['/f/a.pdf']['is_validated']) == ('F-9', '2024-02-01', 1)
+    assert rows['/f/b.pdf']['numero_factura'] == 'F-8'
+    assert not hasattr(database, 'DuplicateInvoiceError')
+
+
+def test_insert_invoices_bulk_is_all_or_nothing(temp_db):
+    with pytest.raises(database.sqlite3.Error):
+        database.insert_invoices_bulk([(_record(1), '/f/a.pdf', 0), (_record(2, Tipo=object()), '/f/b.pdf', 0)])
+    assert _rows() == {}
+
+
+def test_filter_unprocessed_keeps_order_and_chunks(temp_db, monkeypatch):
+    known = [f'/f/{n:04d}.pdf' for n in range(0, 1200, 2)]
+    database.insert_invoices_bulk([(_record(n), path, 0) for n, path in enumerate(known)])
+    paths = [f'/f/{n:04d}.pdf' for n in range(1200)] + ['\\f\\0001.pdf', '/f/0003.pdf'] # Más de 2 consultas
+    queries = []
+    connection = database.get_db_connection
+    class Spy:
+        def __init__(self, conn):
+            self.conn = conn
+        def execute(self, sql, parameters=()):
+            queries.append(len(parameters))
+            return self.conn.execute(sql, parameters)
+    class SpyContext:
+        def __enter__(self):
+            self.context = connection()
+            return Spy(self.context.__enter__())
+        def __exit__(self, *exc):
+            return self.context.__exit__(*exc)
+    monkeypatch.setattr(database, 'get_db_connection', SpyContext)
+
+    pending = database.filter_unprocessed(paths)
+    assert pending == [f'/f/{n:04d}.pdf' for n in range(1, 1200, 2)] + ['\\f\\0001.pdf', '/f/0003.pdf']
+    assert queries == [500, 500, 200] # Sin las rutas repetidas
+    assert database.filter_unprocessed([]) == []
+    assert database.filter_unprocessed(known[:3]) == []
+
+
+# --- Paginación por clave (fetch_invoice_page / iter_invoices) ---
+
+# procesado_en con valores repetidos y NULL: el orden lo desempata path
+PROCESSED_AT = {
+    '/f/a.pdf': '2025-01-02', '/f/b.pdf': None, '/f/c.pdf': '2025-01-01', '/f/d.pdf': '2025-01-02',
+    '/f/e.pdf': None, '/f/f.pdf': '2025-01-03', '/f/g.pdf': '2025-01-02', '/f/h.pdf': '2025-01-01',
+}
+
+
+def _expected_order(descending):
+    # NULL es el menor valor para SQLite
+    keyed = sorted(PROCESSED_AT, key=lambda path: (PROCESSED_AT[path] is not None, PROCESSED_AT[path] or '', path))
+    return keyed[::-1] if descending else keyed
+
+
+@pytest.fixture
+def paged(temp_db):
+    database.insert_invoices_bulk([(_record(n), path, n % 2) for n, path in enumerate(PROCESSED_AT)])
+    with database.get_db_connection() as conn:
+        conn.executemany("UPDATE processed_invoices SET procesado_en = ? WHERE path = ?",
+                         [(value, path) for path, value in PROCESSED_AT.items()])
+        conn.commit()
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('page_size', [1, 2, 3, 7, 8, 50])
+def test_iter_invoices_visits_every_row_once_in_order(paged, descending, page_size):
+    rows = list(database.iter_invoices(columns=['path'], descending=descending, page_size=page_size))
+    assert [row['path'] for row in rows] == _expected_order(descending)
+    assert set(rows[0]) == {'path', 'procesado_en'} # Siempre la columna de orden
+
+
+def test_fetch_invoice_page_cursors(paged):
+    # Ascendente: b, e (NULL) · c, h · a, d, g · f
+    rows, cursor = database.fetch_invoice_page(columns=['path'], limit=1)
+    assert [row['path'] for row in rows] == ['/f/b.pdf'] and cursor == (None, '/f/b.pdf')
+    rows, cursor = database.fetch_invoice_page(columns=['path'], limit=2, after=cursor)
+    assert [row['path'] for row in rows] == ['/f/e.pdf', '/f/c.pdf'] and cursor == ('2025-01-01', '/f/c.pdf')
+    rows, cursor = database.fetch_invoice_page(columns=['path'], limit=3, after=cursor)
+    assert [row['path'] for row in rows] == ['/f/h.pdf', '/f/a.pdf', '/f/d.pdf']
+    assert cursor == ('2025-01-02', '/f/d.pdf') # Empate en procesado_en: sigue por path
+    rows, cursor = database.fetch_invoice_page(columns=['path'], limit=2, after=cursor)
+    assert [row['path'] for row in rows] == ['/f/g.pdf', '/f/f.pdf'] and cursor is None
+
+    # Descendente: los NULL al final
+    rows, cursor = database.fetch_invoice_page(columns=['path'], descending=True, limit=5)
+    assert [row['path'] for row in rows] == ['/f/f.pdf', '/f/g.pdf', '/f/d.pdf', '/f/a.pdf', '/f/h.pdf']
+    rows, cursor = database.fetch_invoice_page(columns=['path'], descending=True, limit=2, after=cursor)
+    assert [row['path'] for row in rows] == ['/f/c.pdf', '/f/e.pdf'] and cursor == (None, '/f/e.pdf')
+    rows, cursor = database.fetch_invoice_page(columns=['path'], descending=True, limit=2, after=cursor)
+    assert [row['path'] for row in rows] == ['/f/b.pdf'] and cursor is None
+
+
+def test_rows_inserted_between_pages_are_not_repeated_or_skipped(paged):
+    seen, after = [], None
+    rows, after = database.fetch_invoice_page(columns=['path'], limit=4)
+    seen += [row['path'] for row in rows]
+    # Una fila nueva antes del cursor y otra después
+    database.insert_invoices_bulk([(_record(20), '/f/0.pdf', 0), (_record(21), '/f/z.pdf', 0)])
+    with database.get_db_connection() as conn:
+        conn.execute("UPDATE processed_invoices SET procesado_en = NULL WHERE path = '/f/0.pdf'")
+        conn.execute("UPDATE processed_invoices SET procesado_en = '2025-01-09' WHERE path = '/f/z.pdf'")
+        conn.commit()
+    while after is not None:
+        rows, after = database.fetch_invoice_page(columns=['path'], limit=4, after=after)
+        seen += [row['path'] for row in rows]
+    assert len(seen) == len(set(seen))
+    assert seen == _expected_order(False) + ['/f/z.pdf']
+
+
+def test_fetch_invoice_page_filters(paged):
+    rows, _ = database.fetch_invoice_page(columns=['path'], filters={'is_validated': 1, 'procesado_en': ('>=', '2025-01-02')})
+    assert [row['path'] for row in rows] == ['/f/d.pdf', '/f/f.pdf']
+    rows, _ = database.fetch_invoice_page(columns=['path'], filters={'procesado_en': None})
+    assert [row['path'] for row in rows] == ['/f/b.pdf', '/f/e.pdf']
+    rows, _ = database.fetch_invoice_page(columns=['path'], filters={'exportado': ('EMPTY', None)}, limit=100)
+    assert len(rows) == len(PROCESSED_AT)
+    with pytest.raises(ValueError):
+        database.fetch_invoice_page(columns=['path; DROP TABLE processed_invoices'])
+    with pytest.raises(ValueError):
+        database.fetch_invoice_page(filters={'path': ('OR 1=1 --', 'x')})
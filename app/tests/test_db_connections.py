@@ -0,0 +1,127 @@
+# test_db_connections.py
+
+import sqlite3
+import threading
+
+import pytest
+
+import db_connections
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'pruebas.db')
+    with db_connections.connection(path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+    yield path
+    db_connections.close_all(path)
+
+
+def _count_rows(path):
+    with db_connections.connection(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+def test_pragmas(db_path):
+    with db_connections.connection(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2 # MEMORY
+        assert isinstance(conn.execute("SELECT 1 AS uno").fetchone(), sqlite3.Row)
+
+
+def test_nested_blocks_share_the_connection(db_path):
+    before = db_connections.get_stats()
+    with db_connections.connection(db_path) as outer:
+        with db_connections.connection(db_path) as inner:
+            assert inner is outer
+            state = db_connections._thread_connections()[db_connections.os.path.abspath(db_path)]
+            assert state == [outer, 2]
+        assert state[1] == 1
+    assert state[1] == 0
+    stats = db_connections.get_stats()
+    assert stats['nested'] - before['nested'] == 1
+    assert stats['checkouts'] - before['checkouts'] == 1
+    assert stats['opened'] == before['opened'] # Reutiliza la del fixture
+
+
+def test_uncommitted_work_is_rolled_back_on_outermost_exit(db_path):
+    before = db_connections.get_stats()['rollbacks']
+    with pytest.raises(ValueError):
+        with db_connections.connection(db_path) as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            with db_connections.connection(db_path) as inner:
+                inner.execute("INSERT INTO t VALUES (2)")
+            assert conn.in_transaction # El bloque anidado no deshace nada
+            raise ValueError("fallo a mitad")
+    assert _count_rows(db_path) == 0
+    assert db_connections.get_stats()['rollbacks'] - before == 1
+
+    with db_connections.connection(db_path) as conn:
+        conn.execute("INSERT INTO t VALUES (3)")
+        conn.commit()
+    assert _count_rows(db_path) == 1
+
+
+def test_each_thread_gets_its_own_connection(db_path):
+    with db_connections.connection(db_path) as conn:
+        main = conn
+    seen = []
+    def worker():
+        with db_connections.connection(db_path) as conn:
+            seen.append(conn)
+            with db_connections.connection(db_path) as again:
+                seen.append(again)
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen[0] is seen[1] and seen[2] is seen[3]
+    assert len({id(main), id(seen[0]), id(seen[2])}) == 3
+    assert db_connections.get_stats()['open'] >= 3
+
+
+def test_close_all_opens_new_connections(db_path, tmp_path):
+    other = str(tmp_path / 'otra.db')
+    with db_connections.connection(db_path) as first, db_connections.connection(other) as kept:
+        pass
+    db_connections.close_all(db_path)
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+    kept.execute("SELECT 1") # Solo se cierran las de esa ruta
+    with db_connections.connection(db_path) as second:
+        assert second is not first
+        assert second.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    db_connections.close_all(other)
+
+
+def test_write_wait_stats(db_path):
+    before = db_connections.get_stats()
+    with db_connections.connection(db_path) as conn:
+        conn.execute("SELECT COUNT(*) FROM t") # Lectura: no abre transacción
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.execute("INSERT INTO t VALUES (2)") # Ya dentro de la transacción
+        conn.commit()
+    stats = db_connections.get_stats()
+    assert stats['write_waits'] - before['write_waits'] == 1
+    assert stats['write_wait_seconds'] >= before['write_wait_seconds']
+    assert stats['max_write_wait'] >= 0
+    assert "escrituras" in db_connections.describe()
+
+
+def test_locked_database_is_counted(db_path, monkeypatch):
+    monkeypatch.setattr(db_connections, 'DB_BUSY_TIMEOUT', 0)
+    db_connections.close_all(db_path) # Que se reabra con el nuevo timeout
+    blocker = sqlite3.connect(db_path)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        before = db_connections.get_stats()['lock_errors']
+        with db_connections.connection(db_path) as conn:
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                conn.execute("INSERT INTO t VALUES (1)")
+        assert db_connections.get_stats()['lock_errors'] - before == 1
+    finally:
+        blocker.rollback()
+        blocker.close()
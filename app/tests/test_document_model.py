@@ -0,0 +1,143 @@
+# test_document_model.py
+
+import random
+
+import fitz
+import pytest
+
+import db_connections
+import document_model
+import ocr_cache
+from document_model import DocumentModel, load_document_model
+
+PAGES = [
+    [(72, 72, "FACTURA Nº F-2025-001"), (72, 100, "Fecha: 12/05/2025"), (350, 100, "CIF: B12345678"),
+     (72, 400, "Base imponible 100,00"), (350, 400, "Total 121,00")],
+    [(72, 72, "Página dos"), (300, 500, "Importe 50,00")],
+]
+
+
+def _write_pdf(path, pages):
+    doc = fitz.open()
+    for texts in pages:
+        page = doc.new_page()
+        for x, y, text in texts:
+            page.insert_text((x, y), text)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    return _write_pdf(tmp_path / 'factura.pdf', PAGES)
+
+
+@pytest.fixture
+def model(pdf):
+    return DocumentModel.from_pdf(pdf)
+
+
+def _find(model, text):
+    return next(i for i in range(model.word_count()) if model.word(i)[1] == text)
+
+
+def _center(model, index):
+    x0, y0, x1, y1 = model.word(index)[0]
+    return (x0 + x1) / 2, (y0 + y1) / 2
+
+
+def test_lines_match_page_get_text(pdf, model):
+    doc = fitz.open(pdf)
+    try:
+        expected = [[line for line in page.get_text().splitlines() if line.strip()] for page in doc]
+    finally:
+        doc.close()
+    assert model.page_count == 2
+    assert model.lines(0) == expected[0] and model.lines(1) == expected[1]
+    assert model.lines() == expected[0] + expected[1]
+
+
+def test_word_boxes(model):
+    assert model.word_count() == sum(len(text.split()) for texts in PAGES for _, _, text in texts)
+    (x0, y0, x1, y1), text = model.word(_find(model, "B12345678"))
+    assert text == "B12345678"
+    # insert_text coloca la línea base en (x, y): la caja queda justo encima
+    assert 350 < x0 < x1 and y0 < 100 < y1 + 5 and y1 - y0 < 20
+    total = _find(model, "Total")
+    assert model.word_page[total] == 0
+    assert model.lines()[model.word_line[total]] == "Total 121,00"
+    assert model.word_page[_find(model, "Importe")] == 1
+
+
+def test_point_queries(model):
+    cif = _find(model, "B12345678")
+    assert model.word_at(0, *_center(model, cif)) == cif
+    assert model.word_at(1, *_center(model, cif)) is None # Otra página
+    assert model.word_at(0, 500, 700) is None
+    assert model.word_at(5, 10, 10) is None # Página inexistente
+
+    fecha = model.word_line[_find(model, "12/05/2025")]
+    cif_line = model.word_line[cif]
+    assert model.line_at(0, *_center(model, cif)) == cif_line
+    assert model.line_at(0, 100, 95) == fecha
+    assert model.line_at(0, 300, 95) in (fecha, cif_line) # Misma altura, fuera de las dos
+    assert model.line_at(0, 300, 700) is None
+
+    amounts = lambda text: text.replace(',', '').isdigit()
+    assert model.word(model.nearest_word(0, 400, 390, amounts))[1] == "121,00"
+    assert model.word(model.nearest_word(0, 60, 390, amounts))[1] == "100,00"
+    assert model.word(model.nearest_word(1, 0, 0))[1] == "Página"
+    assert model.nearest_word(0, 0, 0, lambda text: False) is None
+
+
+def test_region_queries(model):
+    assert model.text_in_rect(0, (340, 380, 600, 410)) == "Total 121,00"
+    assert model.text_in_rect(0, (600, 410, 340, 380)) == "Total 121,00" # Esquinas al revés
+    assert model.text_in_rect(0, (60, 50, 600, 110)) == "FACTURA Nº F-2025-001\nFecha: 12/05/2025\nCIF: B12345678"
+    assert model.text_in_rect(0, (60, 300, 600, 350)) == ""
+    assert model.text_in_rect(1, (290, 480, 500, 510)) == "Importe 50,00"
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_grid_matches_brute_force(model, seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        page = rng.randrange(model.page_count)
+        x0, x1 = sorted(rng.uniform(0, 612) for _ in range(2))
+        y0, y1 = sorted(rng.uniform(0, 792) for _ in range(2))
+        expected = []
+        for index in range(model.word_count()):
+            if model.word_page[index] != page:
+                continue
+            cx, cy = _center(model, index)
+            if x0 <= cx <= x1 and y0 <= cy <= y1:
+                expected.append(index)
+        assert model.words_in_rect(page, (x0, y0, x1, y1)) == expected
+
+
+def test_serialization_round_trip(model):
+    data = model.to_dict()
+    copy = DocumentModel.from_dict(data)
+    assert copy.lines() == model.lines()
+    assert [copy.word(i) for i in range(copy.word_count())] == [model.word(i) for i in range(model.word_count())]
+    assert copy.text_in_rect(0, (340, 380, 600, 410)) == "Total 121,00"
+    with pytest.raises(ValueError):
+        DocumentModel.from_dict(dict(data, version=document_model.MODEL_VERSION + 1))
+
+
+def test_load_document_model_is_cached(temp_db, pdf, monkeypatch):
+    ocr_cache.clear_cache()
+    monkeypatch.setattr(document_model, '_memory_cache', document_model.OrderedDict())
+    builds = []
+    from_pdf = DocumentModel.from_pdf.__func__
+    monkeypatch.setattr(DocumentModel, 'from_pdf', classmethod(lambda cls, path: builds.append(path) or from_pdf(cls, path)))
+
+    first = load_document_model(pdf)
+    assert load_document_model(pdf) is first # Memoria
+    document_model._memory_cache.clear()
+    again = load_document_model(pdf) # Caché persistente
+    assert again is not first and again.lines() == first.lines()
+    assert len(builds) == 1
+    ocr_cache.clear_cache()
+    db_connections.close_all(ocr_cache._cache_path())
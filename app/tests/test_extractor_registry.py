@@ -0,0 +1,112 @@
+# test_extractor_registry.py
+
+import importlib
+import os
+
+import pytest
+
+from extractor_registry import ExtractorRegistry
+
+SOURCE = """
+EXTRACTOR_KEY = {key!r}
+LOADS.append(__name__)
+
+class Extractor:
+    VALUE = {value!r}
+"""
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """Escribe módulos de extractor en una carpeta del path; devuelve (escribir, cargas)."""
+    monkeypatch.syspath_prepend(str(tmp_path))
+    loads = []
+    def write(name, value, key=None):
+        path = tmp_path / f"{name}.py"
+        source = SOURCE.format(key=key, value=value) if key else SOURCE.format(key=None, value=value).replace("EXTRACTOR_KEY = None\n", "")
+        path.write_text(source)
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000 * (len(loads) + 1))) # mtime distinto
+        importlib.invalidate_caches()
+        return f"{name}.Extractor"
+    return write, loads
+
+
+def _registry(loads, versions=None):
+    return ExtractorRegistry(inject={'LOADS': loads}, version_fn=versions.get if versions is not None else None)
+
+
+def test_module_is_executed_once(modules):
+    write, loads = modules
+    class_path = write('ext_cache', 'a')
+    registry = _registry(loads)
+    first = registry.get(class_path)
+    assert registry.get(class_path) is first and first.VALUE == 'a'
+    assert loads == ['ext_cache']
+    assert registry.stats() == {'hits': 1, 'loads': 1, 'reloads': 0, 'failures': 0, 'cached_modules': 1}
+
+
+def test_reloads_only_when_the_content_changes(modules, tmp_path):
+    write, loads = modules
+    class_path = write('ext_edit', 'a')
+    registry = _registry(loads)
+    registry.get(class_path)
+
+    # Se toca el fichero sin cambiarlo: no se vuelve a ejecutar
+    path = tmp_path / 'ext_edit.py'
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+    assert registry.get(class_path).VALUE == 'a'
+    assert loads == ['ext_edit']
+
+    write('ext_edit', 'bb')
+    assert registry.get(class_path).VALUE == 'bb'
+    assert loads == ['ext_edit', 'ext_edit']
+    assert registry.stats()['reloads'] == 1 and registry.stats()['hits'] == 1
+
+
+def test_rule_changes_reload_only_that_extractor(modules):
+    write, loads = modules
+    versions = {'leroy': 1, 'malaga': 1}
+    leroy, malaga = write('ext_leroy', 'l', key='leroy'), write('ext_malaga', 'm', key='malaga')
+    plain = write('ext_plain', 'p') # Sin EXTRACTOR_KEY: no lee reglas
+    registry = _registry(loads, versions)
+    for class_path in (leroy, malaga, plain):
+        registry.get(class_path)
+
+    versions['leroy'] = 2
+    for class_path in (leroy, malaga, plain):
+        registry.get(class_path)
+    assert loads == ['ext_leroy', 'ext_malaga', 'ext_plain', 'ext_leroy']
+    assert registry.stats()['reloads'] == 1 and registry.stats()['hits'] == 2
+
+    registry.get(leroy) # Ya cargado con la versión 2
+    assert loads.count('ext_leroy') == 2
+
+
+def test_failures_are_counted_and_not_cached(modules, tmp_path):
+    write, loads = modules
+    registry = _registry(loads)
+    (tmp_path / 'ext_broken.py').write_text("def roto(:\n")
+    importlib.invalidate_caches()
+    with pytest.raises(SyntaxError):
+        registry.get('ext_broken.Extractor')
+    with pytest.raises(ImportError):
+        registry.get('ext_no_existe.Extractor')
+    assert registry.stats()['failures'] == 2 and registry.stats()['cached_modules'] == 0
+
+    class_path = write('ext_broken', 'ok')
+    assert registry.get(class_path).VALUE == 'ok'
+    assert registry.stats()['loads'] == 1
+
+
+def test_invalidate(modules):
+    write, loads = modules
+    first, second = write('ext_one', '1'), write('ext_two', '2')
+    registry = _registry(loads)
+    registry.get(first), registry.get(second)
+    registry.invalidate(first)
+    registry.get(first), registry.get(second)
+    assert loads == ['ext_one', 'ext_two', 'ext_one']
+    registry.invalidate()
+    assert registry.stats()['cached_modules'] == 0
@@ -0,0 +1,194 @@
+# test_ingest_pipeline.py
+
+import threading
+
+import fitz
+import pytest
+
+import database
+import ingest_pipeline
+from ingest_pipeline import IngestClient, IngestPipeline
+
+TIMEOUT = 60
+
+
+def _write_pdf(path, lines):
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((72, 72 + 18 * i), line)
+    doc.save(str(path))
+    doc.close()
+    return str(path).replace('\\', '/')
+
+
+class Client(IngestClient):
+    """Recoge los eventos y avisa cuando han terminado 'expected' ficheros."""
+
+    def __init__(self, expected, cancelled=False, parts=None, save_empty=True):
+        self.expected = expected
+        self._cancelled = cancelled
+        self.parts = parts or {}
+        self.save_empty = save_empty
+        self.results = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self.all_done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def split(self, path):
+        return self.parts.get(path)
+
+    def notify(self, kind, path, data=None):
+        with self._lock:
+            self.events.append((kind, path, data))
+            if kind == 'done':
+                self.results[path] = data
+                if len(self.results) >= self.expected:
+                    self.all_done.set()
+
+    def statuses(self):
+        assert self.all_done.wait(TIMEOUT), f"Sin terminar: {self.results}"
+        return {path: result['status'] for path, result in self.results.items()}
+
+
+@pytest.fixture
+def invoices(temp_db, tmp_path):
+    return [_write_pdf(tmp_path / f"factura_{i}.pdf", ["Factura", f"F-{i}", "Fecha: 12/05/2025", "Total", f"{i}0,00"])
+            for i in range(3)]
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = IngestPipeline(workers=1)
+    yield pipeline
+    pipeline.shutdown(wait=False)
+
+
+def _saved_paths():
+    with database.get_db_connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT path FROM processed_invoices"))
+
+
+def test_final_statuses(invoices, pipeline, tmp_path):
+    missing = str(tmp_path / "no_existe.pdf").replace('\\', '/')
+    client = Client(len(invoices) + 1)
+    pipeline.submit(client, invoices + [missing])
+    statuses = client.statuses()
+    assert [statuses[path] for path in invoices] == [ingest_pipeline.STATUS_SAVED] * 3
+    assert statuses[missing] in (ingest_pipeline.STATUS_ERROR, ingest_pipeline.STATUS_SAVED)
+    assert set(invoices) <= set(_saved_paths())
+
+    # Se vuelven a enviar: ya están en la BBDD
+    again = Client(len(invoices))
+    pipeline.submit(again, invoices)
+    assert set(again.statuses().values()) == {ingest_pipeline.STATUS_SKIPPED}
+    stats = pipeline.stats()
+    assert stats['saved'] >= 3 and stats['skipped'] == 3
+
+
+def test_only_the_writer_thread_writes(invoices, pipeline, monkeypatch):
+    writers = []
+    insert_invoices_bulk = database.insert_invoices_bulk
+    def recorded(records):
+        writers.append(threading.current_thread().name)
+        return insert_invoices_bulk(records)
+    monkeypatch.setattr(database, 'insert_invoices_bulk', recorded)
+    monkeypatch.setattr(database, 'insert_invoice_data', lambda *a, **k: writers.append('insert_invoice_data'))
+
+    client = Client(len(invoices))
+    pipeline.submit(client, invoices)
+    assert set(client.statuses().values()) == {ingest_pipeline.STATUS_SAVED}
+    assert writers and set(writers) == {'ingesta-escritor'}
+    assert _saved_paths() == sorted(invoices)
+    assert pipeline.stats()['transactions'] == len(writers)
+
+
+def test_cancelled_client_gets_cancelled_status(invoices, pipeline):
+    client = Client(len(invoices), cancelled=True)
+    pipeline.submit(client, invoices)
+    assert set(client.statuses().values()) == {ingest_pipeline.STATUS_CANCELLED}
+    assert _saved_paths() == []
+    assert pipeline.stats()['cancelled'] == len(invoices)
+
+
+def test_failing_batch_falls_back_to_row_by_row(invoices, monkeypatch):
+    bad = invoices[1]
+    insert_invoices_bulk = database.insert_invoices_bulk
+    def failing(records):
+        if any(path == bad for _, path, _ in records):
+            raise database.sqlite3.IntegrityError("fila rechazada")
+        return insert_invoices_bulk(records)
+    monkeypatch.setattr(database, 'insert_invoices_bulk', failing)
+
+    pipeline = IngestPipeline(workers=1, write_batch=10)
+    try:
+        client = Client(len(invoices))
+        pipeline.submit(client, invoices)
+        statuses = client.statuses()
+        assert statuses[bad] == ingest_pipeline.STATUS_ERROR
+        assert "fila rechazada" in client.results[bad]['log']
+        assert [statuses[path] for path in invoices if path != bad] == [ingest_pipeline.STATUS_SAVED] * 2
+        assert _saved_paths() == sorted(path for path in invoices if path != bad)
+
+        # El escritor sigue vivo
+        monkeypatch.setattr(database, 'insert_invoices_bulk', insert_invoices_bulk)
+        after = Client(1)
+        after.force_reprocess = True
+        pipeline.submit(after, [bad])
+        assert after.statuses() == {bad: ingest_pipeline.STATUS_SAVED}
+    finally:
+        pipeline.shutdown(wait=False)
+
+
+def test_write_retries_row_by_row_inside_the_writer(temp_db, monkeypatch):
+    pipeline = IngestPipeline(workers=1)
+    client = Client(3)
+    batch = []
+    for name in ('a', 'malo', 'c'):
+        item = ingest_pipeline._Item(f"/f/{name}.pdf", client)
+        item.record = {'Tipo': 'COMPRA', 'Número de Factura': name}
+        batch.append(item)
+    calls = []
+    insert_invoices_bulk = database.insert_invoices_bulk
+    def failing(records):
+        calls.append([path for _, path, _ in records])
+        if any(path == '/f/malo.pdf' for _, path, _ in records):
+            raise TypeError("valor no admitido")
+        return insert_invoices_bulk(records)
+    monkeypatch.setattr(database, 'insert_invoices_bulk', failing)
+
+    pipeline._write(batch)
+    assert calls == [['/f/a.pdf', '/f/malo.pdf', '/f/c.pdf'], ['/f/a.pdf'], ['/f/malo.pdf'], ['/f/c.pdf']]
+    assert client.statuses() == {'/f/a.pdf': ingest_pipeline.STATUS_SAVED, '/f/malo.pdf': ingest_pipeline.STATUS_ERROR,
+                                 '/f/c.pdf': ingest_pipeline.STATUS_SAVED}
+    assert _saved_paths() == ['/f/a.pdf', '/f/c.pdf']
+    assert pipeline.stats()['transactions'] == 3
+
+
+def test_split_parts_are_processed_before_the_queue(invoices, pipeline, tmp_path):
+    parent = _write_pdf(tmp_path / "multi.pdf", ["Varias facturas"])
+    parts = invoices[:2]
+    client = Client(1 + len(parts), parts={parent: parts})
+    pipeline.submit(client, [parent])
+    statuses = client.statuses()
+    assert statuses == {parent: ingest_pipeline.STATUS_SPLIT,
+                        parts[0]: ingest_pipeline.STATUS_SAVED, parts[1]: ingest_pipeline.STATUS_SAVED}
+    queued = [path for kind, path, _ in client.events if kind == 'queued']
+    assert queued == [parent] + parts
+    assert parent not in _saved_paths()
+
+
+def test_shutdown_waits_for_pending_files_and_closes(invoices):
+    pipeline = IngestPipeline(workers=1)
+    client = Client(len(invoices))
+    pipeline.submit(client, invoices)
+    pipeline.shutdown(wait=True)
+    assert client.all_done.is_set() # Sin esperar: shutdown ya terminó lo pendiente
+    assert set(client.statuses().values()) == {ingest_pipeline.STATUS_SAVED}
+    with pytest.raises(RuntimeError):
+        pipeline.submit(Client(1), invoices[:1])
+    assert all(depth == 0 for depth in pipeline.depths().values())
@@ -0,0 +1,70 @@
+# test_keyword_matcher.py
+
+import random
+
+import pytest
+
+from keyword_matcher import KeywordMatcher
+
+
+def _matcher(patterns):
+    matcher = KeywordMatcher()
+    for rank, pattern in enumerate(patterns):
+        matcher.add(pattern, rank, pattern.upper())
+    return matcher.build()
+
+
+def _linear_scan(patterns, text):
+    # Como la búsqueda de antes: la primera palabra clave (en orden) contenida en el texto
+    return next((pattern.upper() for pattern in patterns if pattern and pattern in text), None)
+
+
+def test_best_match_prefers_lowest_rank_not_first_position():
+    matcher = _matcher(['merlin', 'leroy', 'roy'])
+    assert matcher.best_match('factura_leroy_merlin.pdf') == 'MERLIN'
+    assert matcher.best_match('factura_leroy.pdf') == 'LEROY' # 'roy' también aparece
+    assert matcher.best_match('troya.pdf') == 'ROY'
+    assert matcher.best_match('otra.pdf') is None
+    assert matcher.best_match('') is None
+
+
+def test_overlapping_keywords():
+    matcher = _matcher(['hers', 'she', 'he', 'his'])
+    # 'she' y 'he' terminan en la misma posición: solo se da el de menor rank
+    assert [(position, payload) for position, _, payload in matcher.iter_matches('ushers')] == [
+        (3, 'SHE'), (5, 'HERS')]
+    assert matcher.best_match('ushers') == 'HERS'
+    assert matcher.best_match('ushe') == 'SHE'
+    assert matcher.best_match('ahis') == 'HIS'
+
+
+def test_rank_ties_keep_the_first_added_pattern():
+    matcher = KeywordMatcher()
+    matcher.add('abc', 0, 'primero')
+    matcher.add('abc', 0, 'segundo') # Misma palabra y mismo rank
+    matcher.add('xyz', 0, 'otro')
+    assert matcher.best_match('--abc--') == 'primero'
+    # Mismo rank en posiciones distintas: gana el que aparece antes en el texto
+    assert matcher.best_match('xyz abc') == 'otro'
+    assert matcher.best_match('abc xyz') == 'primero'
+
+
+def test_build_is_implicit_and_final():
+    matcher = KeywordMatcher()
+    matcher.add('', 0, 'vacío') # Se ignora
+    matcher.add('ab', 1, 'AB')
+    assert matcher.best_match('xaby') == 'AB' # Se compila al buscar
+    with pytest.raises(RuntimeError):
+        matcher.add('cd', 2, 'CD')
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    alphabet = 'abc_.'
+    patterns = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 25))]
+    patterns = list(dict.fromkeys(patterns))
+    matcher = _matcher(patterns)
+    for _ in range(40):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert matcher.best_match(text) == _linear_scan(patterns, text)
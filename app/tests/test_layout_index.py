@@ -0,0 +1,162 @@
+# test_layout_index.py
+
+import sqlite3
+
+import pytest
+
+import database
+import layout_index
+
+TEMPLATE_A = ["TALLERES GARCÍA S.L.", "Factura nº {n}", "Fecha: {d}/05/2025", "Concepto Importe",
+              "Cambio de aceite 45,00", "Base imponible {n},00", "IVA 21% 9,45", "Total factura 54,45"]
+TEMPLATE_B = ["Recambios del Norte", "Albarán de entrega {n}", "Referencia Cantidad Precio",
+              "Pastillas de freno 2 30,00", "Disco ventilado 1 80,00", "Portes {d},00", "Importe total 140,00 EUR"]
+
+
+def _doc(template, n, d=12):
+    # Las cifras se normalizan a '#' pero no su cantidad: n con 3 cifras y d con 2
+    return [line.format(n=n, d=d) for line in template]
+
+def _fp(lines, grid=0):
+    return {'signature': layout_index.minhash_signature(lines), 'grid': grid}
+
+
+# --- Huella ---
+
+def test_signature_ignores_numbers_but_not_labels():
+    assert layout_index.minhash_signature(_doc(TEMPLATE_A, 118)) == layout_index.minhash_signature(_doc(TEMPLATE_A, 907, 23))
+    assert layout_index.minhash_signature(_doc(TEMPLATE_A, 118)) != layout_index.minhash_signature(_doc(TEMPLATE_B, 118))
+    assert len(layout_index.minhash_signature([])) == layout_index.NUM_PERM
+
+
+def test_similarity():
+    a, a2, b = _fp(_doc(TEMPLATE_A, 101)), _fp(_doc(TEMPLATE_A, 202, 17)), _fp(_doc(TEMPLATE_B, 101))
+    assert layout_index.similarity(a, a2) == 1.0
+    assert layout_index.similarity(a, b) < 0.3
+    # La rejilla pesa GRID_WEIGHT: misma plantilla con celdas distintas
+    left, right = dict(a, grid=0b0011), dict(a2, grid=0b1100)
+    assert layout_index.similarity(left, right) == pytest.approx(1 - layout_index.GRID_WEIGHT)
+    assert layout_index.similarity(left, dict(a2, grid=0b0011)) == 1.0
+
+
+def test_fingerprint_round_trip(tmp_path):
+    fingerprint = _fp(_doc(TEMPLATE_A, 101), grid=1 << 255) # La rejilla no cabe en 64 bits
+    signature, grid, mtime = layout_index.encode_fingerprint(fingerprint, str(tmp_path / 'no_existe.pdf'))
+    assert mtime is None
+    assert layout_index.decode_fingerprint(signature, grid) == fingerprint
+
+
+# --- Índice LSH ---
+
+def test_query_returns_most_similar_label():
+    index = layout_index.LayoutIndex()
+    index.add('a1.pdf', 'extractors.garcia.Garcia', _fp(_doc(TEMPLATE_A, 101)))
+    index.add('b1.pdf', 'extractors.norte.Norte', _fp(_doc(TEMPLATE_B, 101)))
+    assert index.query(_fp(_doc(TEMPLATE_B, 555, 19))) == ('extractors.norte.Norte', 1.0)
+    assert index.query(_fp(_doc(TEMPLATE_A, 555))) == ('extractors.garcia.Garcia', 1.0)
+    # Sin candidatos en ningún cubo
+    assert index.query(_fp(["Documento sin relación con nada indexado"])) is None
+
+
+def test_query_exclude_and_remove():
+    index = layout_index.LayoutIndex()
+    index.add('a1.pdf', 'extractors.garcia.Garcia', _fp(_doc(TEMPLATE_A, 101)))
+    assert index.query(_fp(_doc(TEMPLATE_A, 101)), exclude='a1.pdf') is None
+    index.add('a1.pdf', 'extractors.otro.Otro', _fp(_doc(TEMPLATE_A, 101))) # Reemplaza la entrada
+    assert len(index) == 1
+    assert index.query(_fp(_doc(TEMPLATE_A, 101)))[0] == 'extractors.otro.Otro'
+    index.remove('a1.pdf')
+    assert 'a1.pdf' not in index
+    assert index.query(_fp(_doc(TEMPLATE_A, 101))) is None
+
+
+# --- Índice del proceso (BBDD) ---
+
+@pytest.fixture
+def validated(temp_db):
+    """Dos facturas validadas (una por plantilla), guardadas como las guarda el pipeline."""
+    layout_index.invalidate_index()
+    records = []
+    for path, template, label in [('/f/a1.pdf', TEMPLATE_A, 'extractors.garcia.Garcia'),
+                                  ('/f/b1.pdf', TEMPLATE_B, 'extractors.norte.Norte')]:
+        fingerprint = layout_index.encode_fingerprint(_fp(_doc(template, 101)), path)
+        records.append(({'Tipo': 'COMPRA', 'Extractor': label, 'Huella': fingerprint}, path, 1))
+    records.append(({'Tipo': 'COMPRA', 'Extractor': None}, '/f/generico.pdf', 1)) # Sin huella ni extractor
+    database.insert_invoices_bulk(records)
+    yield
+    layout_index.invalidate_index()
+
+
+def test_training_rows_come_from_columns_not_the_log(validated):
+    rows = database.fetch_layout_training_rows()
+    assert sorted((row['path'], row['extractor']) for row in rows) == [
+        ('/f/a1.pdf', 'extractors.garcia.Garcia'), ('/f/b1.pdf', 'extractors.norte.Norte')]
+    assert all(set(row) == {'path', 'extractor', 'signature', 'grid'} for row in rows)
+
+
+def test_classify_only_queries_memory(validated, monkeypatch):
+    assert layout_index.classify('/f/nueva.pdf', _doc(TEMPLATE_B, 777)) == ('extractors.norte.Norte', 1.0)
+
+    # Con el índice cargado: ni BBDD, ni lectura del PDF, ni cálculo de la huella dada
+    def forbidden(*args, **kwargs):
+        raise AssertionError("classify no debe leer la BBDD ni el PDF")
+    monkeypatch.setattr(database, 'fetch_layout_training_rows', forbidden)
+    monkeypatch.setattr(layout_index, 'layout_grid', forbidden)
+    assert layout_index.classify('/f/nueva.pdf', [], _fp(_doc(TEMPLATE_A, 505))) == ('extractors.garcia.Garcia', 1.0)
+    assert layout_index.classify('/f/nueva.pdf', [], _fp(["Nada parecido"])) is None
+
+
+def test_stale_index_reloads_in_background(validated, monkeypatch):
+    layout_index.get_index()
+    monkeypatch.setattr(layout_index, 'LAYOUT_INDEX_REFRESH_SECONDS', 0)
+    calls, threads = [], []
+    monkeypatch.setattr(database, 'fetch_layout_training_rows', lambda: calls.append(1) or [])
+    monkeypatch.setattr(layout_index.threading, 'Thread', lambda target, **kw: threads.append(target) or _Started())
+    index = layout_index.get_index()
+    assert len(index) == 2 and calls == [] and len(threads) == 1 # Se usa el anterior mientras
+    threads[0]()
+    monkeypatch.setattr(layout_index, 'LAYOUT_INDEX_REFRESH_SECONDS', 60)
+    assert calls == [1] and len(layout_index.get_index()) == 0 and len(threads) == 1
+
+
+class _Started:
+    def start(self):
+        pass
+
+
+def test_backfill_computes_missing_fingerprints_once(temp_db, monkeypatch):
+    layout_index.invalidate_index()
+    database.insert_invoices_bulk([({'Extractor': 'extractors.garcia.Garcia'}, '/f/antigua.pdf', 1)])
+    monkeypatch.setattr(layout_index.os.path, 'exists', lambda path: True)
+    read = []
+    def read_lines(path):
+        read.append(path)
+        return _doc(TEMPLATE_A, 303)
+    assert layout_index.backfill_fingerprints(read_lines) == 1
+    assert layout_index.backfill_fingerprints(read_lines) == 0
+    assert read == ['/f/antigua.pdf']
+    assert layout_index.classify('/f/nueva.pdf', _doc(TEMPLATE_A, 909))[0] == 'extractors.garcia.Garcia'
+    layout_index.invalidate_index()
+
+
+def test_reinsert_without_fingerprint_drops_the_old_one(validated):
+    database.insert_invoices_bulk([({'Extractor': 'extractors.garcia.Garcia'}, '/f/a1.pdf', 1)])
+    assert [row['path'] for row in database.fetch_layout_training_rows()] == ['/f/b1.pdf']
+    assert database.fetch_paths_without_fingerprint() == ['/f/a1.pdf']
+
+
+def test_extractor_column_is_filled_from_old_logs(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'antigua.db')
+    with sqlite3.connect(db_path) as conn: # processed_invoices de antes de la columna extractor
+        conn.execute("CREATE TABLE processed_invoices (path TEXT PRIMARY KEY, fecha TEXT, cif_emisor TEXT, numero_factura TEXT, "
+                     "matricula TEXT, is_validated INTEGER, exportado TEXT, log_data TEXT)")
+        conn.executemany("INSERT INTO processed_invoices (path, is_validated, log_data) VALUES (?, 1, ?)", [
+            ('/f/a.pdf', "🔎 ...\n✅ Usado extractor: extractors.garcia_extractor.GarciaExtractor\n"),
+            ('/f/b.pdf', "ℹ️ Usado extractor genérico (BaseInvoiceExtractor).\n"),
+        ])
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'DB_NAME', db_path)
+    database.setup_database()
+    with database.get_db_connection() as conn:
+        rows = dict(conn.execute("SELECT path, extractor FROM processed_invoices").fetchall())
+    assert rows == {'/f/a.pdf': 'extractors.garcia_extractor.GarciaExtractor', '/f/b.pdf': None}
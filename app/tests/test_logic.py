@@ -0,0 +1,186 @@
+# test_logic.py
+
+import fitz
+import pytest
+
+import database
+import rule_store
+from extractors import rule_extractor
+
+RULES = {
+    'TIPO': {'type': 'FIXED_VALUE', 'value': 'COMPRA'},
+    'CIF_EMISOR': {'type': 'FIXED_VALUE', 'value': 'B-70677158'},
+    'NUM_FACTURA': {'type': 'VARIABLE', 'ref_text': 'Factura', 'offset': 1, 'segment': '1'},
+    'FECHA': {'type': 'VARIABLE', 'ref_text': 'Fecha:', 'offset': 0, 'segment': '2'},
+    'BASE': {'type': 'VARIABLE', 'ref_text': 'Base imponible', 'offset': 0, 'segment': '3'},
+    'IVA': {'type': 'VARIABLE', 'ref_text': 'IVA 21%', 'offset': 0, 'segment': '3'},
+    'IMPORTE': {'type': 'VARIABLE', 'ref_text': 'Total', 'offset': 1, 'segment': '1'},
+    'MATRICULA': {'type': 'VARIABLE', 'ref_text': 'Matrícula', 'offset': 0, 'segment': '2'},
+}
+
+INVOICES = [
+    ["Factura", "A-2025/118", "Fecha: 12/05/2025", "Base imponible 1.234,56", "IVA 21% 259,26", "Total", "1.493,82"],
+    ["Factura", "B-7", "Fecha: 01/06/2025", "Matrícula 1234-BCD", "Total", "99,50 €"],
+    ["Albarán sin referencias", "Importe pendiente"],
+    ["Factura", "C-1", "Fecha: sin indicar", "Base imponible 10,00"],
+]
+
+
+def _write_pdf(path, lines):
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((72, 72 + 18 * i), line)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.fixture
+def invoices(temp_db, tmp_path, monkeypatch):
+    rule_store.invalidate()
+    rule_extractor._configs.clear()
+    for field, rule in RULES.items():
+        assert database.save_extractor_configuration('prueba', field, rule)
+    paths = []
+    for i, lines in enumerate(INVOICES):
+        path = tmp_path / f"factura_{i}.pdf"
+        _write_pdf(path, lines)
+        paths.append(str(path))
+    paths.append(str(tmp_path / "no_existe.pdf"))
+
+    import logic # Después de preparar la BBDD temporal: carga el mapeo al importarse
+    monkeypatch.setattr(logic, 'EXTRACTION_MAPPING', database.get_extraction_mapping())
+    yield logic, paths
+    rule_store.invalidate()
+    rule_extractor._configs.clear()
+
+
+@pytest.mark.parametrize('extractor', ['prueba', 'GENERICO'])
+def test_extract_batch_matches_single_file_extraction(invoices, extractor):
+    logic, paths = invoices
+    batch = logic.extract_batch(paths, extractor)
+    single = [logic.extraer_datos(path, extractor_manual=extractor) for path in paths]
+    assert len(batch) == len(paths)
+    # Los 13 campos (el log puede diferir en el texto de la lectura)
+    assert [result[:13] for result in batch] == [result[:13] for result in single]
+    if extractor == 'prueba':
+        assert batch[0][:13] == ('COMPRA', '12/05/2025', 'A-2025/118', None, 'B-70677158', None, None, None,
+                                 None, 1493.82, 1234.56, 259.26, None)
+
+
+def test_reload_database_config_after_changing_db(invoices, tmp_path, monkeypatch):
+    logic, _ = invoices
+    monkeypatch.setattr(logic, 'EXTRACTION_MAPPING', dict(logic.EXTRACTION_MAPPING))
+    logic.reload_database_config()
+    assert 'prueba' in logic.EXTRACTION_MAPPING
+    # Otra BBDD con la misma versión de reglas (como batch_cli --db sobre una BBDD nueva)
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'otra.db'))
+    database.setup_database()
+    logic.reload_database_config()
+    assert 'prueba' not in logic.EXTRACTION_MAPPING
+    assert rule_store.get_rules('prueba') == {}
+
+
+# --- Índice de detección de extractor (nombre de fichero + CIF) ---
+
+def _valid_cif(letter, digits):
+    from utils import is_valid_tax_id
+    return next(letter + digits + control for control in '0123456789ABCDEFGHIJ' if is_valid_tax_id(letter + digits + control))
+
+
+def _invalid_cif(cif):
+    from utils import is_valid_tax_id
+    return next(cif[:-1] + control for control in '0123456789' if not is_valid_tax_id(cif[:-1] + control))
+
+
+@pytest.fixture
+def routing(temp_db, monkeypatch):
+    """Extractores con CIF fijo, con CIF leído del documento y con palabra clave compartida."""
+    rule_store.invalidate()
+    cifs = {name: _valid_cif('B', digits) for name, digits in
+            [('talleres', '1234567'), ('recambios', '7654321'), ('leroymerlin', '1111111'), ('leroy', '2222222')]}
+    database.save_extractor_configuration('talleres', 'CIF_EMISOR', {'type': 'FIXED_VALUE', 'value': cifs['talleres']})
+    database.save_extractor_configuration('recambios', 'CIF_EMISOR', {'type': 'VARIABLE', 'ref_text': 'CIF:', 'offset': 0, 'segment': '2'})
+    database.save_extractor_configuration('leroymerlin', 'CIF_EMISOR', {'type': 'FIXED_VALUE', 'value': cifs['leroymerlin']})
+    database.save_extractor_configuration('leroy', 'CIF_EMISOR', {'type': 'FIXED_VALUE', 'value': cifs['leroy'][0] + '-' + cifs['leroy'][1:]})
+    import logic
+    logic.invalidate_detection_index()
+    yield logic, cifs
+    logic.invalidate_detection_index()
+    rule_store.invalidate()
+
+
+def _linear_scan(logic, file_path, lines):
+    # La detección de antes: cada extractor en orden, reglas leídas de la BBDD una a una
+    nombre_archivo = logic.os.path.basename(file_path).lower()
+    mapping = database.get_extraction_mapping()
+    for keyword, class_path in mapping.items():
+        if keyword.lower() in nombre_archivo:
+            return class_path
+    if not lines:
+        return None
+    cifs_documento = set(logic.PATRON_CIF.findall("\n".join(lines).upper()))
+    for keyword, class_path in mapping.items():
+        config = database.get_extractor_configuration(keyword)
+        for rule in (config or {}).get('CIF_EMISOR', []):
+            val = logic.rule_engine.resolve_rule(lines, rule)[0]
+            if val:
+                cif = val.replace('-', '').replace('.', '').strip().upper()
+                if cif in cifs_documento and cif != logic.CIF_CLIENTE_FIJO:
+                    return class_path
+    return None
+
+
+def test_routing_matches_linear_scan(routing):
+    logic, cifs = routing
+    cases = [
+        ('factura_talleres_03.pdf', []),
+        ('FACTURA_LEROYMERLIN.PDF', []),          # Contiene también 'leroy': gana el primero del mapeo
+        ('scan_0001.pdf', ["Talleres", f"NIF {cifs['talleres']}"]),
+        ('scan_0002.pdf', ["Recambios del Norte", f"CIF: {cifs['recambios']}", "Total 10,00"]),
+        ('scan_0003.pdf', [f"Emisor {cifs['leroy']}", f"Proveedor {cifs['talleres']}"]),
+        ('scan_0004.pdf', [f"Cliente {logic.CIF_CLIENTE_FIJO}"]),
+        ('scan_0005.pdf', ["Sin ningún CIF conocido", "B00000000"]),
+        ('scan_0006.pdf', []),
+    ]
+    results = [logic.find_extractor_for_file(path, lines) for path, lines in cases]
+    assert results == [_linear_scan(logic, path, lines) for path, lines in cases]
+    assert results[:5] == ['extractors.rule_extractor.talleres', 'extractors.rule_extractor.leroymerlin',
+                           'extractors.rule_extractor.talleres', 'extractors.rule_extractor.recambios',
+                           'extractors.rule_extractor.talleres']
+    assert results[5:] == [None, None, None]
+
+
+def test_dynamic_cif_must_have_a_valid_control_digit(routing):
+    logic, cifs = routing
+    junk = _invalid_cif(cifs['recambios'])
+    lines = ["Recambios del Norte", f"CIF: {junk}"]
+    assert logic.find_extractor_for_file('scan.pdf', lines) is None
+    assert _linear_scan(logic, 'scan.pdf', lines) == 'extractors.rule_extractor.recambios' # Antes sí valía
+
+
+def test_detection_index_is_rebuilt_when_config_or_rules_change(routing, monkeypatch):
+    logic, cifs = routing
+    index = logic.get_detection_index()
+    assert logic.get_detection_index() is index
+    assert cifs['leroy'] in index['fixed'] # CIF normalizado (sin guion)
+
+    # Otra regla: cambia la versión de reglas (y la de configuración)
+    nuevo = _valid_cif('A', '5555555')
+    database.save_extractor_configuration('nuevo', 'CIF_EMISOR', {'type': 'FIXED_VALUE', 'value': nuevo})
+    rebuilt = logic.get_detection_index()
+    assert rebuilt is not index and nuevo in rebuilt['fixed']
+    assert logic.find_extractor_for_file('scan.pdf', [nuevo]) == 'extractors.rule_extractor.nuevo'
+
+    # Solo cambia la versión de configuración (p.ej. se desactiva un extractor)
+    with database.get_db_connection() as conn:
+        conn.execute("UPDATE extractors SET is_enabled = 0 WHERE name = 'nuevo'")
+        conn.commit()
+    database.bump_config_version()
+    assert logic.get_detection_index() is not rebuilt
+    assert logic.find_extractor_for_file('factura_nuevo.pdf', [nuevo]) is None
+
+    # Solo cambia rule_store.version() (regla guardada desde otro proceso)
+    current = logic.get_detection_index()
+    monkeypatch.setattr(rule_store, 'version', lambda: -1)
+    assert logic.get_detection_index() is not current
@@ -0,0 +1,148 @@
+# test_ocr_cache.py
+
+import hashlib
+import itertools
+
+import fitz
+import pytest
+
+import db_connections
+import ocr_cache
+import ocr_engine
+
+SETTINGS = {'lang': 'spa', 'dpi': 300, 'adaptive': True}
+
+
+@pytest.fixture
+def cache(temp_db, monkeypatch):
+    """Caché vacía junto a la BBDD temporal, con un reloj que avanza en cada llamada."""
+    clock = itertools.count(1000)
+    monkeypatch.setattr(ocr_cache.time, 'time', lambda: float(next(clock)))
+    ocr_cache.clear_cache()
+    yield ocr_cache
+    ocr_cache.clear_cache()
+    db_connections.close_all(ocr_cache._cache_path())
+
+
+def _write_pdf(path, pages):
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 72 + 18 * i), line)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+# --- Claves ---
+
+def test_make_key_depends_on_content_and_settings(tmp_path):
+    a, b = tmp_path / 'a.pdf', tmp_path / 'b.pdf'
+    a.write_bytes(b'%PDF factura 1')
+    b.write_bytes(b'%PDF factura 2')
+    moved = tmp_path / 'otra' / 'renombrada.pdf'
+    moved.parent.mkdir()
+    moved.write_bytes(a.read_bytes())
+
+    assert ocr_cache.file_sha256(str(a)) == hashlib.sha256(b'%PDF factura 1').hexdigest()
+    key = ocr_cache.make_key(ocr_cache.file_sha256(str(a)), SETTINGS)
+    assert ocr_cache.make_key(ocr_cache.file_sha256(str(moved)), dict(reversed(list(SETTINGS.items())))) == key
+    assert ocr_cache.make_key(ocr_cache.file_sha256(str(b)), SETTINGS) != key
+    assert ocr_cache.make_key(ocr_cache.file_sha256(str(a)), dict(SETTINGS, dpi=200)) != key
+
+
+# --- Lectura / escritura ---
+
+def test_put_and_get(cache):
+    assert cache.get_entry('k1') is None
+    cache.put_lines('k1', ['Factura', 'Total 10,00 €'], meta={'complete': False, 'page_lines': [1, 1]})
+    assert cache.get_entry('k1') == {'lines': ['Factura', 'Total 10,00 €'], 'meta': {'complete': False, 'page_lines': [1, 1]}}
+    cache.put_lines('k2', ['Sin metadatos'])
+    assert cache.get_lines('k2') == ['Sin metadatos']
+    assert cache.get_entry('k2')['meta'] == {}
+
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (3, 1, 2)
+    assert stats['hit_rate'] == pytest.approx(0.75)
+    assert stats['size_bytes'] > 0
+
+
+def test_lru_eviction_respects_max_bytes(cache, monkeypatch):
+    entry = ['x' * 96] # 100 bytes en JSON
+    monkeypatch.setattr(ocr_cache, 'OCR_CACHE_MAX_BYTES', 300)
+    for key in ('a', 'b', 'c'):
+        cache.put_lines(key, entry)
+    cache.get_entry('a') # 'b' pasa a ser la menos usada
+    cache.put_lines('d', entry)
+    assert [cache.get_lines(key) is not None for key in 'abcd'] == [True, False, True, True]
+    stats = cache.get_stats()
+    assert (stats['evictions'], stats['entries'], stats['size_bytes']) == (1, 3, 300)
+
+    cache.put_lines('enorme', ['x' * 400]) # No cabe ni sola: no se guarda ni expulsa nada
+    assert cache.get_lines('enorme') is None and cache.get_stats()['entries'] == 3
+
+
+def test_clear_cache_resets_entries_and_counters(cache):
+    cache.put_lines('k', ['línea'])
+    cache.get_entry('k'), cache.get_entry('otra')
+    cache.clear_cache()
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (0, 0, 0, 0)
+
+
+# --- Uso desde logic (lectura de documentos) ---
+
+@pytest.fixture
+def logic(cache, monkeypatch):
+    import logic
+    monkeypatch.setattr(logic, 'OCR_CACHE_ENABLED', True)
+    return logic
+
+
+def test_cache_hit_skips_reading(logic, tmp_path, monkeypatch):
+    pdf = _write_pdf(tmp_path / 'f.pdf', [['Factura A-1', 'Total 10,00']])
+    reads = []
+    read_text_pages = ocr_engine.read_text_pages # Abre el PDF en las dos lecturas
+    def recorded(*args, **kwargs):
+        reads.append(args[0])
+        return read_text_pages(*args, **kwargs)
+    monkeypatch.setattr(ocr_engine, 'read_text_pages', recorded)
+
+    lines, _ = logic._get_pdf_lines_with_info(pdf)
+    assert lines == ['Factura A-1', 'Total 10,00'] and reads == [pdf]
+    assert logic._get_pdf_lines_with_info(pdf)[0] == lines
+    key = logic.document_cache_key(pdf)
+    assert logic.document_lines(logic.read_document(pdf, key))[0] == lines
+    assert reads == [pdf] # Los aciertos no leen el PDF
+
+    # Con otros ajustes de OCR la clave cambia: no hay acierto
+    monkeypatch.setattr(logic, 'OCR_DPI', 200)
+    assert logic.document_cache_key(pdf) != key
+    assert logic._get_pdf_lines_with_info(pdf)[0] == lines
+    assert reads == [pdf, pdf]
+
+
+def test_partial_read_is_stored_incomplete_and_continued(logic, tmp_path, monkeypatch):
+    pdf = _write_pdf(tmp_path / 'f.pdf', [['Página uno'], ['Página dos'], ['Página tres']])
+    pages = logic._iter_pdf_lines(pdf, [])
+    assert next(pages) == ['Página uno']
+    pages.close() # Parada temprana tras la primera página
+
+    entry = ocr_cache.get_entry(logic.document_cache_key(pdf))
+    assert entry['lines'] == ['Página uno']
+    assert (entry['meta']['complete'], entry['meta']['page_lines']) == (False, [1])
+
+    starts = []
+    iter_pdf_pages = ocr_engine.iter_pdf_pages
+    def recorded(path, **kwargs):
+        starts.append(kwargs['start'])
+        return iter_pdf_pages(path, **kwargs)
+    monkeypatch.setattr(ocr_engine, 'iter_pdf_pages', recorded)
+    assert list(logic._iter_pdf_lines(pdf, [])) == [['Página uno'], ['Página dos'], ['Página tres']]
+    assert starts == [1] # Continúa desde la primera página que faltaba
+
+    entry = ocr_cache.get_entry(logic.document_cache_key(pdf))
+    assert (entry['meta']['complete'], entry['meta']['page_lines']) == (True, [1, 1, 1])
+    # La lectura por etapas tampoco usa una entrada incompleta
+    assert logic.read_document(pdf, logic.document_cache_key(pdf))['cache_key'] is None
@@ -0,0 +1,220 @@
+# test_ocr_engine.py
+
+import asyncio
+import ctypes
+import os
+import threading
+
+import fitz
+import pytest
+
+import ocr_engine
+
+
+def _page(text='', image_fraction=0.0):
+    """Página A4 con texto digital y, opcionalmente, una imagen que cubre esa fracción del ancho."""
+    doc = fitz.open()
+    page = doc.new_page()
+    if text:
+        page.insert_text((72, 72), text)
+    if image_fraction:
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), False)
+        pix.clear_with(200)
+        rect = page.rect
+        page.insert_image(fitz.Rect(0, 0, rect.width * image_fraction, rect.height), pixmap=pix)
+    return doc, page
+
+
+@pytest.mark.parametrize('text, image_fraction, expected', [
+    ('', 0.0, True),                                 # Sin capa de texto
+    ('', 1.0, True),                                 # Escaneo
+    ('Página 2 de 2', 0.0, False),                   # Digital casi vacía, sin imágenes
+    ('Página 2 de 2', 0.2, False),                   # Con un logotipo pequeño
+    ('Sello', 1.0, True),                            # Escaneo con sello digital
+    ('Factura A-2025/118 Total 1.493,82 EUR', 0.0, False),
+])
+def test_page_needs_ocr(text, image_fraction, expected):
+    doc, page = _page(text, image_fraction)
+    try:
+        assert ocr_engine.page_needs_ocr(page) is expected
+    finally:
+        doc.close()
+
+
+# --- Ejecutable tesseract por stdin/stdout ---
+
+class _Completed:
+    def __init__(self, stdout=b'', returncode=0, stderr=b''):
+        self.stdout, self.returncode, self.stderr = stdout, returncode, stderr
+
+
+@pytest.fixture
+def fake_tesseract(monkeypatch, tmp_path):
+    """Sustituye el ejecutable: guarda cada llamada y devuelve la salida preparada."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ocr_engine, 'tesserocr', None)
+    calls = []
+    outputs = {'txt': b'Factura 118\n', 'tsv': b'', 'pdf': b'%PDF-1.5'}
+    def run(args, input=None, **kwargs):
+        calls.append((args, input))
+        output = args[-1] if args[-1] in ('tsv', 'pdf') else 'txt'
+        return _Completed(outputs[output])
+    monkeypatch.setattr(ocr_engine.subprocess, 'run', run)
+    return calls, outputs
+
+
+def test_cli_passes_the_image_through_stdin(fake_tesseract, tmp_path):
+    calls, _ = fake_tesseract
+    image = ocr_engine.Image.new('L', (20, 10), 255)
+    assert ocr_engine.run_tesseract(image, lang='spa', config='--psm 6') == ('Factura 118\n', None)
+    args, data = calls[0]
+    assert args == [ocr_engine.TESSERACT_CMD, 'stdin', 'stdout', '-l', 'spa', '--psm', '6']
+    assert data.startswith(b'P5') and len(data) > 20 * 10 # PGM en memoria
+    assert list(tmp_path.iterdir()) == [] # Ningún fichero temporal
+
+    rgba = ocr_engine.Image.new('RGBA', (4, 4))
+    assert ocr_engine._pdf_image_job(rgba, 'spa') == b'%PDF-1.5'
+    args, data = calls[1]
+    assert args[-1] == 'pdf' and data.startswith(b'P6')
+
+
+def test_cli_confidence_from_tsv(fake_tesseract):
+    calls, outputs = fake_tesseract
+    header = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+    rows = ["1\t1\t0\t0\t0\t0\t0\t0\t100\t100\t-1\t",
+            "5\t1\t1\t1\t1\t1\t0\t0\t10\t10\t90\tFactura",
+            "5\t1\t1\t1\t1\t2\t0\t0\t10\t10\t80\t118",
+            "5\t1\t1\t1\t2\t1\t0\t0\t10\t10\t70\tTotal"]
+    outputs['tsv'] = "\n".join([header] + rows).encode()
+    text, confidence = ocr_engine.run_tesseract(ocr_engine.Image.new('L', (8, 8)), with_confidence=True)
+    assert text == "Factura 118\nTotal"
+    assert confidence == pytest.approx(80.0)
+    assert calls[0][0][-1] == 'tsv'
+
+
+def test_cli_errors(monkeypatch):
+    monkeypatch.setattr(ocr_engine.subprocess, 'run', lambda *a, **k: _Completed(returncode=1, stderr=b'Failed loading language'))
+    with pytest.raises(RuntimeError, match='Failed loading language'):
+        ocr_engine.run_tesseract_cli(ocr_engine.Image.new('L', (8, 8)))
+    def missing(*args, **kwargs):
+        raise FileNotFoundError(args[0][0])
+    monkeypatch.setattr(ocr_engine.subprocess, 'run', missing)
+    with pytest.raises(RuntimeError, match='No se encuentra'):
+        ocr_engine.run_tesseract_cli(ocr_engine.Image.new('L', (8, 8)))
+
+
+# --- Servicio de OCR (submit / ocr / ocr_async) ---
+
+class _FakeEngine:
+    """Motor persistente de prueba: dice en qué proceso y con qué instancia se reconoció."""
+
+    def __init__(self, lang):
+        self.lang = lang
+
+    def recognize(self, image, psm, with_confidence):
+        return f"{os.getpid()}:{id(self)}:{self.lang}:{psm}:{image.size[0]}", None
+
+
+@pytest.fixture
+def engine_service(monkeypatch):
+    """Servicio con motor persistente de prueba y un pool nuevo de 2 procesos."""
+    ocr_engine.shutdown_pool()
+    monkeypatch.setattr(ocr_engine, 'PERSISTENT_ENGINE', True)
+    monkeypatch.setattr(ocr_engine, 'OCR_AVAILABLE', True)
+    monkeypatch.setattr(ocr_engine, 'OCR_WORKERS', 2)
+    monkeypatch.setattr(ocr_engine, '_new_engine', _FakeEngine)
+    yield
+    ocr_engine.shutdown_pool()
+
+
+def _results(texts):
+    return [text.split(':') for text in texts]
+
+
+def test_submit_runs_in_pool_workers_that_keep_their_engine(engine_service):
+    pids = {future.result(timeout=30) for future in ocr_engine.warm_up('spa')}
+    assert pids and os.getpid() not in pids
+
+    futures = [ocr_engine.submit(ocr_engine.Image.new('L', (10 + i, 10)), lang='spa', config='--psm 6') for i in range(8)]
+    results = _results(future.result(timeout=30) for future in futures)
+    assert [int(width) for *_, width in results] == [10 + i for i in range(8)]
+    assert all(lang == 'spa' and psm == '6' for _, _, lang, psm, _ in results)
+    # Un solo motor por proceso del pool, reutilizado en todas las llamadas
+    engines = {}
+    for pid, engine, *_ in results:
+        engines.setdefault(pid, set()).add(engine)
+    assert str(os.getpid()) not in engines and all(len(ids) == 1 for ids in engines.values())
+
+
+def test_ocr_and_ocr_async(engine_service):
+    image = ocr_engine.Image.new('L', (42, 10))
+    before = ocr_engine.ocr_seconds()
+    pid, _, lang, psm, width = ocr_engine.ocr(image, lang='eng', timeout=30).split(':')
+    assert (int(pid) != os.getpid(), lang, psm, width) == (True, 'eng', 'None', '42')
+    assert ocr_engine.ocr_seconds() > before
+    assert asyncio.run(ocr_engine.ocr_async(image)).endswith(':42')
+
+
+def test_without_persistent_engine_submit_uses_threads(monkeypatch):
+    ocr_engine.shutdown_pool()
+    monkeypatch.setattr(ocr_engine, 'PERSISTENT_ENGINE', False)
+    monkeypatch.setattr(ocr_engine, 'OCR_AVAILABLE', True)
+    monkeypatch.setattr(ocr_engine, 'run_tesseract_cli',
+                        lambda image, lang, config='', output='txt': f"{threading.current_thread().name} {lang} {config}".encode())
+    try:
+        assert ocr_engine.warm_up() == []
+        name, lang, *config = ocr_engine.submit(ocr_engine.Image.new('L', (8, 8)), config='--psm 6').result(timeout=30).split()
+        assert name.startswith('ocr') and lang == ocr_engine.OCR_LANG and config == ['--psm', '6']
+        assert asyncio.run(ocr_engine.ocr_async(ocr_engine.Image.new('L', (8, 8)), lang='eng')).split()[1] == 'eng'
+    finally:
+        ocr_engine.shutdown_pool()
+
+
+# --- libtesseract (API en C) ---
+
+class _FakeLib:
+    """Las funciones de la API en C que usa _LibtesseractEngine, con memoria de ctypes."""
+
+    def __init__(self, init_result=0):
+        self.calls = []
+        self.init_result = init_result
+        self.text = ctypes.create_string_buffer('Total 1.493,82 €\n'.encode())
+        self.confidences = (ctypes.c_int * 4)(90, 70, 80, -1)
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name, args))
+            return {'TessBaseAPICreate': 1234, 'TessBaseAPIInit3': self.init_result,
+                    'TessBaseAPIGetUTF8Text': ctypes.addressof(self.text),
+                    'TessBaseAPIAllWordConfidences': self.confidences}.get(name)
+        return call
+
+
+def test_libtesseract_engine(monkeypatch):
+    lib = _FakeLib()
+    monkeypatch.setattr(ocr_engine, '_libtesseract', lib)
+    monkeypatch.setattr(ocr_engine, 'TESSDATA_PATH', None)
+    engine = ocr_engine._LibtesseractEngine('spa')
+    assert lib.calls == [('TessBaseAPICreate', ()), ('TessBaseAPIInit3', (1234, None, b'spa'))]
+
+    lib.calls.clear()
+    text, confidence = engine.recognize(ocr_engine.Image.new('RGBA', (5, 2)), 6, with_confidence=True)
+    assert (text, confidence) == ('Total 1.493,82 €\n', 80.0)
+    names = [name for name, _ in lib.calls]
+    assert names == ['TessBaseAPISetPageSegMode', 'TessBaseAPISetImage', 'TessBaseAPIGetUTF8Text', 'TessDeleteText',
+                     'TessBaseAPIAllWordConfidences', 'TessDeleteIntArray', 'TessBaseAPIClear']
+    assert lib.calls[0][1] == (1234, 6)
+    _, data, width, height, bytes_per_pixel, bytes_per_line = lib.calls[1][1]
+    assert (len(data), width, height, bytes_per_pixel, bytes_per_line) == (30, 5, 2, 3, 15) # RGBA -> RGB
+
+    lib.calls.clear()
+    assert engine.recognize(ocr_engine.Image.new('1', (4, 4)), None, with_confidence=False)[1] is None
+    assert lib.calls[0][1] == (1234, ocr_engine._PSM_AUTO) and lib.calls[1][1][4] == 1 # Blanco y negro -> gris
+
+
+def test_libtesseract_engine_without_language(monkeypatch):
+    lib = _FakeLib(init_result=-1)
+    monkeypatch.setattr(ocr_engine, '_libtesseract', lib)
+    with pytest.raises(RuntimeError, match="'xyz'"):
+        ocr_engine._LibtesseractEngine('xyz')
+    assert lib.calls[-1] == ('TessBaseAPIDelete', (1234,))
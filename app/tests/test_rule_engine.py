@@ -0,0 +1,112 @@
+# test_rule_engine.py
+
+import random
+
+import pytest
+
+import rule_engine
+
+
+def _first_line_loop(lines, ref_text):
+    """Búsqueda de referencia anterior a DocumentLines: primera línea que la contiene."""
+    ref_lower = (ref_text or '').lower()
+    for i, line in enumerate(lines):
+        if ref_lower in line.lower():
+            return i
+    return None
+
+
+LINES = [
+    "FACTURA Nº 2025/118",
+    "Fecha: 12/05/2025",
+    "",
+    "Base imponible 1.234,56",
+    "IVA 21% 259,26",
+    "Total factura 1.493,82 €",
+    "TOTAL",
+    "Matrícula 1234-BCD  İSTANBUL",
+    "Factura rectificativa",
+]
+
+REFERENCES = ["factura", "FACTURA Nº", "fecha:", "total", "Total factura", "iva 21", "21%", "matrícula",
+              "istanbul", "bcd  i", "1.493,82 €\ntotal", "", " ", "no aparece", "rectificativa", "2025"]
+
+
+@pytest.mark.parametrize('ref_text', REFERENCES)
+def test_find_reference_line_matches_line_loop(ref_text):
+    assert rule_engine.find_reference_line(LINES, ref_text) == _first_line_loop(LINES, ref_text)
+
+
+def test_find_reference_line_on_empty_document():
+    assert rule_engine.find_reference_line([], "total") is None
+    assert rule_engine.find_reference_line([], "") is None
+
+
+def test_document_cache_sees_in_place_edits():
+    lines = list(LINES)
+    assert rule_engine.find_reference_line(lines, "total") == 5
+    lines[0] = "final x" # Misma lista y misma longitud
+    assert rule_engine.find_reference_line(lines, "final x") == 0
+    lines[5] = "sin importe"
+    assert rule_engine.find_reference_line(lines, "total") == _first_line_loop(lines, "total") == 6
+
+
+def test_document_cache_sees_appended_pages():
+    lines = list(LINES[:3])
+    assert rule_engine.find_reference_line(lines, "total") is None
+    lines.extend(LINES[3:])
+    assert rule_engine.find_reference_line(lines, "total") == 5
+
+
+def test_document_lines_reused_while_unchanged():
+    lines = list(LINES)
+    assert rule_engine.document_lines(lines) is rule_engine.document_lines(lines)
+
+
+# --- Plan compilado frente a reglas interpretadas (resolve_field) ---
+
+WORDS = ['Factura', 'FECHA:', 'Total', 'base', 'IVA', 'Cliente', 'Matrícula', 'importe', 'Nº', '1.234,56', '21%']
+SEGMENTS = ['1', '2', '3', '1-2', '2-4', '3-1', '0', '-1', 'abc', '', None, 2, 0, '2.5']
+
+
+def _random_document(rng, size):
+    return [' '.join(rng.choice(WORDS) + rng.choice(['', str(rng.randint(0, 30))]) for _ in range(rng.randint(0, 6)))
+            for _ in range(size)]
+
+
+def _random_rule(rng, lines):
+    kind = rng.choice(['FIXED_VALUE', 'FIXED', 'VARIABLE', 'VARIABLE', 'VARIABLE', 'OTRO'])
+    if kind == 'FIXED_VALUE':
+        return {'type': kind, 'value': rng.choice(['COMPRA', 'B-70677158', None, 21])}
+    rule = {'type': kind, 'segment': rng.choice(SEGMENTS)}
+    if kind == 'FIXED':
+        rule['line'] = rng.choice([None, 0, -2, 1, 2, 5, len(lines), len(lines) + 3])
+    elif kind == 'VARIABLE':
+        # Referencias que están (enteras o en parte de una palabra) y que no están
+        ref = rng.choice(WORDS + ['tota', 'no aparece', ''])
+        rule['ref_text'] = rng.choice([ref, ref.upper(), ref.lower()])
+        rule['offset'] = rng.choice([None, 0, 1, 2, -1, -3, 10])
+    return rule
+
+
+def _random_mapping(rng, lines):
+    return {f'CAMPO_{i}': [_random_rule(rng, lines) for _ in range(rng.randint(1, 3))] for i in range(rng.randint(1, 13))}
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_compiled_plan_matches_interpreted_rules(seed):
+    rng = random.Random(seed)
+    lines = _random_document(rng, rng.choice([0, 1, 5, 30, 120]))
+    mapping = _random_mapping(rng, lines)
+    plan = rule_engine.compile_rules(mapping)
+    doc = rule_engine.document_lines(lines)
+
+    interpreted = {field: rule_engine.resolve_field(lines, rules) for field, rules in mapping.items()}
+    assert plan.evaluate(doc) == {field: value for field, (value, _) in interpreted.items()}
+    assert plan.resolve(doc) == interpreted
+
+    # Lectura por páginas: mismo (valor, definitivo) con el documento incompleto
+    partial = lines[:len(lines) // 2]
+    assert plan.resolve(rule_engine.document_lines(partial), complete=False) == {
+        field: rule_engine.resolve_field(partial, rules, complete=False) for field, rules in mapping.items()
+    }
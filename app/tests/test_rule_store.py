@@ -0,0 +1,57 @@
+# test_rule_store.py
+
+import pytest
+
+import database
+import rule_store
+
+RULE = {'type': 'FIXED_VALUE', 'value': 'COMPRA'}
+
+
+@pytest.fixture
+def store(temp_db, monkeypatch):
+    rule_store.invalidate()
+    calls = []
+    get_rules_version = database.get_rules_version
+    def counted():
+        calls.append(1)
+        return get_rules_version()
+    monkeypatch.setattr(database, 'get_rules_version', counted)
+    yield calls
+    rule_store.invalidate()
+
+
+def test_version_is_read_from_db_once_per_interval(store, monkeypatch):
+    monkeypatch.setattr(rule_store, 'RULES_CHECK_SECONDS', 60.0)
+    for _ in range(100):
+        rule_store.version()
+        rule_store.get_rules('adevinta')
+    assert len(store) == 1
+
+
+def test_changes_in_this_process_are_seen_at_once(store, monkeypatch):
+    monkeypatch.setattr(rule_store, 'RULES_CHECK_SECONDS', 60.0)
+    assert rule_store.get_rules('adevinta') == {}
+    assert database.save_extractor_configuration('adevinta', 'TIPO', RULE)
+    assert rule_store.get_rules('adevinta')['TIPO'][0]['value'] == 'COMPRA'
+
+
+def test_changes_from_another_process_are_seen_after_the_interval(store, monkeypatch):
+    monkeypatch.setattr(rule_store, 'RULES_CHECK_SECONDS', 60.0)
+    version = rule_store.version()
+    with database.get_db_connection() as conn: # Como lo haría el editor en otro proceso
+        database._bump_rules_version(conn.cursor())
+        conn.commit()
+    assert rule_store.version() == version
+    monkeypatch.setattr(rule_store, 'RULES_CHECK_SECONDS', 0.0)
+    assert rule_store.version() == version + 1
+
+
+def test_key_version_changes_only_with_its_own_rules(store):
+    leroy, malaga = rule_store.key_version('leroy'), rule_store.key_version('malaga')
+    assert database.save_extractor_configuration('malaga', 'TIPO', RULE)
+    assert rule_store.key_version('leroy') == leroy
+    assert rule_store.key_version('malaga') != malaga
+    changed = rule_store.key_version('malaga')
+    assert database.save_extractor_configuration('malaga', 'TIPO', RULE) # Mismas reglas otra vez
+    assert rule_store.key_version('malaga') == changed
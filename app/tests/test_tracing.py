@@ -0,0 +1,78 @@
+# test_tracing.py
+
+import threading
+
+import tracing
+
+
+class Costly:
+    """Argumento que cuenta cuántas veces se formatea."""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'caro'
+
+
+def test_debug_is_a_no_op_without_capture():
+    arg = Costly()
+    tracing.debug('base', 'valor %s', arg)
+    tracing.warning('base', 'valor %s', arg)
+    assert arg.formatted == 0
+    assert not tracing.enabled() and not tracing.enabled(tracing.WARNING)
+
+    with tracing.capture(enabled=False) as events:
+        tracing.debug('base', 'valor %s', arg)
+        assert not tracing.enabled()
+    assert events == [] and arg.formatted == 0
+
+
+def test_capture_filters_by_level_and_restores_previous():
+    with tracing.capture() as outer:
+        tracing.debug('base', 'línea %d', 3)
+        with tracing.capture(tracing.INFO) as inner:
+            assert not tracing.enabled(tracing.DEBUG) and tracing.enabled(tracing.INFO)
+            tracing.debug('base', 'descartada')
+            tracing.info('regla', 'campo %s', 'TOTAL')
+            tracing.warning('regla', 'sin valor')
+        tracing.debug('base', 'otra vez fuera')
+    assert inner == [(tracing.INFO, 'regla', 'campo TOTAL'), (tracing.WARNING, 'regla', 'sin valor')]
+    assert outer == [(tracing.DEBUG, 'base', 'línea 3'), (tracing.DEBUG, 'base', 'otra vez fuera')]
+    assert tracing._active_captures == 0
+
+
+def test_bad_format_arguments_do_not_raise():
+    with tracing.capture() as events:
+        tracing.debug('base', 'dos %s %s', 'uno')
+        tracing.debug('base', '100% literal')
+    assert events == [(tracing.DEBUG, 'base', "dos %s %s ('uno',)"), (tracing.DEBUG, 'base', '100% literal')]
+
+
+def test_captures_are_per_thread():
+    ready, done = threading.Event(), threading.Event()
+    arg = Costly()
+    def other_thread():
+        ready.wait()
+        tracing.debug('hilo', 'ajena %s', arg) # Hay captura abierta, pero en otro hilo
+        done.set()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    with tracing.capture() as events:
+        ready.set()
+        done.wait(5)
+        tracing.debug('principal', 'propia')
+    thread.join()
+    assert events == [(tracing.DEBUG, 'principal', 'propia')]
+    assert arg.formatted == 0
+
+
+def test_format_events():
+    events = [(tracing.DEBUG, 'base', 'Referencia en línea 2.'), (tracing.WARNING, 'regla', 'sin valor'), (5, 'x', 'nivel raro')]
+    assert tracing.format_events(events) == (
+        "🔍 [DEBUG] base: Referencia en línea 2.\n"
+        "🔍 [WARNING] regla: sin valor\n"
+        "🔍 [5] x: nivel raro\n")
+    assert tracing.format_events([]) == ''
@@ -0,0 +1,83 @@
+# tracing.py
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+# --- Trazas estructuradas de la extracción ---
+# Sustituyen a los print("DEBUG ...") de los extractores. Cada traza es un evento
+# (nivel, origen, mensaje) que solo se guarda si el hilo tiene una captura abierta
+# (capture(), que abre logic.extraer_datos con debug_mode) y solo se formatea entonces:
+#     tracing.debug("base", "Referencia '%s' en línea %d.", ref_text, i)
+# Sin capturas abiertas, debug()/info()/warning() vuelven tras comprobar un contador.
+
+DEBUG, INFO, WARNING = 10, 20, 30
+_LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING'}
+
+Event = Tuple[int, str, str] # (nivel, origen, mensaje ya formateado)
+
+_local = threading.local()
+_active_captures = 0 # Capturas abiertas en todos los hilos
+_active_lock = threading.Lock()
+
+
+def enabled(level: int = DEBUG) -> bool:
+    """True si una traza de este nivel se guardaría (para evitar preparar argumentos caros)."""
+    if not _active_captures:
+        return False
+    capture = getattr(_local, 'capture', None)
+    return capture is not None and level >= capture[0]
+
+
+def emit(level: int, source: str, message: str, *args):
+    if not _active_captures:
+        return
+    capture = getattr(_local, 'capture', None)
+    if capture is None or level < capture[0]:
+        return
+    try:
+        text = message % args if args else message
+    except (TypeError, ValueError):
+        text = f"{message} {args}"
+    capture[1].append((level, source, text))
+
+
+def debug(source: str, message: str, *args):
+    if _active_captures:
+        emit(DEBUG, source, message, *args)
+
+def info(source: str, message: str, *args):
+    if _active_captures:
+        emit(INFO, source, message, *args)
+
+def warning(source: str, message: str, *args):
+    if _active_captures:
+        emit(WARNING, source, message, *args)
+
+
+@contextmanager
+def capture(level: int = DEBUG, enabled: bool = True) -> Iterator[List[Event]]:
+    """
+    Recoge en una lista las trazas del hilo actual con nivel >= level mientras dura el
+    bloque. Con enabled=False no abre captura (la lista queda vacía).
+    """
+    global _active_captures
+    events: List[Event] = []
+    if not enabled:
+        yield events
+        return
+    previous = getattr(_local, 'capture', None)
+    _local.capture = (level, events)
+    with _active_lock:
+        _active_captures += 1
+    try:
+        yield events
+    finally:
+        _local.capture = previous
+        with _active_lock:
+            _active_captures -= 1
+
+
+def format_events(events: List[Event]) -> str:
+    """Texto para el log de la factura (log_data): una línea por evento."""
+    return ''.join(f"🔍 [{_LEVEL_NAMES.get(level, level)}] {source}: {text}\n" for level, source, text in events)
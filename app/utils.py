@@ -1,6 +1,8 @@
 import re
+import datetime
 # Importa la constante desde el nuevo fichero de configuración
 from config import DEFAULT_VAT_RATE 
+from rule_engine import find_reference_line
 
 # Para que el extractor pueda importarla si está en otro fichero
 VAT_RATE = DEFAULT_VAT_RATE 
@@ -38,6 +40,43 @@ def extract_and_format_date(lineas):
     
     return date_found
 
+# --- Fecha normalizada (columna fecha_iso de processed_invoices) ---
+_NUMERIC_DATE = re.compile(r'(?<!\d)(\d{1,2})\s*[/\-.]\s*(\d{1,2})(?:\s*[/\-.]\s*|\s+)(\d{4}|\d{2})(?!\d)')
+_ISO_DATE = re.compile(r'(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)')
+_TEXT_DATE = re.compile(r'(?<!\d)(\d{1,2})\s+(?:de\s+)?([a-záéíóú]+)\.?(?:\s*,\s*|\s+)(?:de\s+|del\s+)?(\d{4})(?!\d)', re.IGNORECASE)
+
+def normalize_date_iso(value):
+    """
+    Convierte la fecha extraída (texto libre) a 'AAAA-MM-DD', o None si no es una fecha válida.
+    Admite DD-MM-AAAA, DD/MM/AAAA, DD.MM.AAAA (también con año de 2 cifras), AAAA-MM-DD y
+    'DD [de] mes[,] [de] AAAA' con el mes en español (completo o abreviado: '3 jun 2025').
+    """
+    if not value:
+        return None
+    text = str(value).strip()
+    match = _ISO_DATE.search(text)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = _NUMERIC_DATE.search(text)
+        if match:
+            day, month, year = match.groups()
+        else:
+            match = _TEXT_DATE.search(text)
+            if not match:
+                return None
+            day, month_name, year = match.groups()
+            month_name = month_name.lower()
+            month = MONTH_MAP.get(month_name) or next(
+                (num for name, num in MONTH_MAP.items() if len(month_name) >= 3 and name.startswith(month_name)), None)
+            if month is None:
+                return None
+    year = int(year) + 2000 if len(year) == 2 else int(year)
+    try:
+        return datetime.date(year, int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
 # AÑADIDO: Función para extraer el importe numérico
 def _extract_amount(amount_str):
     """
@@ -71,6 +110,51 @@ def _extract_nif_cif(line):
     return None
 # ----------------------------------------------
 
+# --- Validación de NIF / NIE / CIF (dígito de control) ---
+NIF_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+CIF_CONTROL_LETTERS = "JABCDEFGHI"
+
+def normalize_tax_id(value):
+    """Quita espacios, guiones y puntos y pasa a mayúsculas (ej. 'b-85.629.020' -> 'B85629020')."""
+    if not value:
+        return ""
+    return re.sub(r'[\s.\-]', '', str(value)).upper()
+
+def is_valid_tax_id(value):
+    """
+    Comprueba el dígito/letra de control de un NIF (DNI), NIE o CIF español.
+    Sirve para descartar candidatos basura que solo tienen la forma de un CIF.
+    """
+    tax_id = normalize_tax_id(value)
+    if len(tax_id) != 9:
+        return False
+
+    # DNI: 8 dígitos + letra
+    if tax_id[:8].isdigit():
+        return tax_id[8] == NIF_LETTERS[int(tax_id[:8]) % 23]
+
+    # NIE: X/Y/Z + 7 dígitos + letra
+    if tax_id[0] in "XYZ" and tax_id[1:8].isdigit():
+        number = str("XYZ".index(tax_id[0])) + tax_id[1:8]
+        return tax_id[8] == NIF_LETTERS[int(number) % 23]
+
+    # CIF (y NIF K/L/M): letra + 7 dígitos + control (dígito o letra)
+    if tax_id[0] in "ABCDEFGHJKLMNPQRSUVW" and tax_id[1:8].isdigit():
+        digits = tax_id[1:8]
+        total = sum(int(d) for d in digits[1::2])
+        for d in digits[0::2]:
+            doubled = int(d) * 2
+            total += doubled // 10 + doubled % 10
+        control_digit = (10 - total % 10) % 10
+        control_letter = CIF_CONTROL_LETTERS[control_digit]
+        if tax_id[0] in "KLMNPQRSW":
+            return tax_id[8] == control_letter
+        if tax_id[0] in "ABEH":
+            return tax_id[8] == str(control_digit)
+        return tax_id[8] in (str(control_digit), control_letter)
+
+    return False
+
 
 def _extract_from_line(line, regex_pattern, group=1):
     """Helper to extract data using a regex from a single line."""
@@ -84,14 +168,13 @@ def _extract_from_lines_with_keyword(lines, keyword_patterns, regex_pattern, gro
     if not isinstance(keyword_patterns, list):
         keyword_patterns = [keyword_patterns]
 
-    for i, line in enumerate(lines):
-        line_lower = line.lower()
-        for pattern in keyword_patterns:
-            if pattern.lower() in line_lower:
-                target_index = i + look_ahead
-                if 0 <= target_index < len(lines):
-                    target_line = lines[target_index]
-                    return _extract_from_line(target_line, regex_pattern, group)
+    # Primera línea que contiene alguna de las palabras clave (índice del documento)
+    found = [i for i in (find_reference_line(lines, pattern) for pattern in keyword_patterns) if i is not None]
+    if found:
+        target_index = min(found) + look_ahead
+        if 0 <= target_index < len(lines):
+            target_line = lines[target_index]
+            return _extract_from_line(target_line, regex_pattern, group)
     return None
 
 def calculate_total_and_vat(base_amount_str: str, vat_rate: float = DEFAULT_VAT_RATE):
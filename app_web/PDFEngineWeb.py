@@ -1,16 +1,8 @@
 import fitz  # PyMuPDF
 import base64
-import io
-from PIL import Image
-import pytesseract
 
-# Intenta importar la configuración, si falla usa valores por defecto
-try:
-    from config import TESSERACT_CMD_PATH
-    if TESSERACT_CMD_PATH:
-        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
-except ImportError:
-    pass
+# El OCR pasa por el pool persistente de ocr_engine (motores Tesseract ya cargados)
+import ocr_engine
 
 class PDFEngineWeb:
     def __init__(self):
@@ -92,11 +84,9 @@ class PDFEngineWeb:
             if not texto:
                 # Extraer imagen de esa zona con alta resolución para OCR
                 pix = page.get_pixmap(clip=rect_pdf, matrix=fitz.Matrix(2, 2))
-                img_data = pix.tobytes("png")
-                pil_image = Image.open(io.BytesIO(img_data))
                 
-                # Ejecutar Tesseract
-                texto = pytesseract.image_to_string(pil_image, lang='spa', config='--psm 6')
+                # Ejecutar Tesseract (en el pool de OCR)
+                texto = ocr_engine.submit_pixmap(pix, config='--psm 6').result()
             
             return texto.strip()
 
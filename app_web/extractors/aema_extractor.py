@@ -6,11 +6,13 @@ import re
 # 🚨 EXTRACTION_MAPPING: Define la lógica de extracción.
 # 'VARIABLE_ALL': (NUEVO TIPO) Busca todas las coincidencias y concatena.
 # Se usan LISTAS para manejar múltiples formatos (intentos).
-import database
+import rule_store
+import rule_engine
+import tracing
 EXTRACTOR_KEY = "aema"
 
-EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = database.get_extractor_configuration(EXTRACTOR_KEY)
-print("EXTRACTION_MAPPING",EXTRACTION_MAPPING)
+EXTRACTION_MAPPING: Dict[str, Dict[str, Any]] = rule_store.get_rules(EXTRACTOR_KEY)
+tracing.debug(EXTRACTOR_KEY, "EXTRACTION_MAPPING %s", EXTRACTION_MAPPING)
 
 EXTRACTION_MAPPING_PROCESSED = {}
 for key, value in EXTRACTION_MAPPING.items():
@@ -95,22 +97,19 @@ class AemaExtractor:
         
         # Función auxiliar para buscar línea de referencia (primera coincidencia)
         def find_reference_line(ref_text: str) -> Optional[int]:
-            ref_text_lower = ref_text.lower()
-            for i, line in enumerate(lines):
-                if ref_text_lower in line.lower():
-                    return i
-            return None
+            # Índice de líneas del documento (compartido con el resto de extractores)
+            return rule_engine.find_reference_line(lines, ref_text)
             
         # Función auxiliar para buscar *todos* los índices de línea de referencia (CON TRAZAS)
         def find_all_reference_lines(ref_text: str) -> List[int]:
             ref_text_lower = ref_text.lower()
-            print(f'TRAZA: Buscando texto de referencia: "{ref_text_lower}"')
+            tracing.debug(EXTRACTOR_KEY, 'Buscando texto de referencia: "%s"', ref_text_lower)
             
             # Usamos una expresión regular para buscar el texto de referencia con límites de palabra (\b)
             pattern = re.compile(r'\b' + re.escape(ref_text_lower) + r'\b', re.IGNORECASE)
             indices = [i for i, line in enumerate(lines) if pattern.search(line)]
             
-            print(f'TRAZA: Índices de línea encontrados para "{ref_text_lower}": {indices}')
+            tracing.debug(EXTRACTOR_KEY, 'Índices de línea encontrados para "%s": %s', ref_text_lower, indices)
             return indices
 
 
@@ -165,7 +164,7 @@ class AemaExtractor:
 
         # Función auxiliar para obtener *múltiples* valores y concatenarlos (VARIABLE_ALL) (CON TRAZAS)
         def get_all_values(mapping: Dict[str, Any]) -> Optional[str]:
-            print(f'TRAZA: Intentando mapeo VARIABLE_ALL: {mapping}')
+            tracing.debug(EXTRACTOR_KEY, 'Intentando mapeo VARIABLE_ALL: %s', mapping)
             ref_text = mapping.get('ref_text', '')
             offset = mapping.get('offset', 0)
             segment_input = mapping['segment']
@@ -173,7 +172,7 @@ class AemaExtractor:
             ref_indices = find_all_reference_lines(ref_text)
             
             if not ref_indices:
-                print('TRAZA: Extracción fallida. No se encontraron índices de referencia.')
+                tracing.debug(EXTRACTOR_KEY, 'Extracción fallida. No se encontraron índices de referencia.')
                 return None
             
             all_values = []
@@ -209,10 +208,10 @@ class AemaExtractor:
                         
             if all_values:
                 result = ', '.join(all_values)
-                print(f'TRAZA: Resultado de extracción exitoso: {result}')
+                tracing.debug(EXTRACTOR_KEY, 'Resultado de extracción exitoso: %s', result)
                 return result
             
-            print('TRAZA: Extracción fallida. No se obtuvieron valores.')
+            tracing.debug(EXTRACTOR_KEY, 'Extracción fallida. No se obtuvieron valores.')
             return None
 
         # Función auxiliar para manejar múltiples intentos de VARIABLE_ALL
@@ -0,0 +1,82 @@
+# keyword_matcher.py
+
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# --- Autómata Aho-Corasick para buscar muchas palabras clave de una pasada ---
+# Cada patrón lleva un 'rank' (menor = más prioritario) y un 'payload' (p.ej. la ruta
+# del extractor). best_match() recorre el texto una sola vez, sea cual sea el número
+# de patrones, y devuelve el payload del patrón de menor rank que aparece en el texto.
+
+
+class KeywordMatcher:
+    """Autómata Aho-Corasick sobre cadenas (búsqueda de subcadenas exacta)."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Patrones que terminan en cada estado (incluidos los heredados por los enlaces de fallo)
+        self._out: List[List[Tuple[Any, Any]]] = [[]]
+        self._built = False
+
+    def __len__(self) -> int:
+        return sum(len(out) for out in self._out)
+
+    def add(self, pattern: str, rank: Any, payload: Any):
+        """Añade un patrón. No se puede añadir tras build()."""
+        if self._built:
+            raise RuntimeError("KeywordMatcher ya compilado")
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((rank, payload))
+
+    def build(self) -> "KeywordMatcher":
+        """Calcula los enlaces de fallo (recorrido en anchura)."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._out[next_state].extend(self._out[self._fail[next_state]])
+        # Cada estado se queda solo con su patrón más prioritario
+        for index, out in enumerate(self._out):
+            if len(out) > 1:
+                self._out[index] = [min(out, key=lambda item: item[0])]
+        self._built = True
+        return self
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, Any, Any]]:
+        """Genera (posición final, rank, payload) del patrón más prioritario que termina en cada posición."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for rank, payload in out[state]:
+                yield position, rank, payload
+
+    def best_match(self, text: str) -> Optional[Any]:
+        """Payload del patrón de menor rank presente en el texto (o None)."""
+        best = None
+        for _, rank, payload in self.iter_matches(text):
+            if best is None or rank < best[0]:
+                best = (rank, payload)
+        return best[1] if best else None
@@ -1,119 +1,415 @@
 import os
-import sys
-import importlib
-import importlib.util
-import tempfile
 import traceback
-from typing import Tuple, List, Optional, Any, Dict
-import re
-
-# Importaciones para extracción de PDF y OCR
-import fitz # PyMuPDF
-try:
-    from PIL import Image
-    import pytesseract
-except ImportError:
-    Image = None
-    pytesseract = None
+import threading
+from typing import Tuple, List, Optional, Any, Dict, Iterator
 
 # Dependencias del proyecto
-from config import ERROR_DATA, TESSERACT_CMD_PATH, DEFAULT_VAT_RATE_STR
+from config import (
+    OCR_CACHE_ENABLED, OCR_LANG, OCR_DPI, OCR_MULTIPAGE, OCR_MAX_PAGES,
+    OCR_MIN_PAGE_CHARS, OCR_MIN_TEXT_COVERAGE, OCR_MIN_IMAGE_AREA,
+    OCR_ADAPTIVE, OCR_ADAPTIVE_DPI_STEPS, OCR_MIN_CONFIDENCE, EXTRACTION_EARLY_STOP,
+    LAYOUT_MATCH_ENABLED
+)
 import database
+import ocr_cache
+import ocr_engine
+import layout_index
+import rule_store
+import tracing
+from keyword_matcher import KeywordMatcher
+from extractor_registry import ExtractorRegistry
+from extractors import base_invoice_extractor, rule_extractor
 from extractors.base_invoice_extractor import BaseInvoiceExtractor
 
-# --- Configuración de OCR (Tesseract) ---
-if sys.platform == "win32" and pytesseract and TESSERACT_CMD_PATH:
-    try:
-        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
-    except Exception as e:
-        print(f"Error al configurar Tesseract: {e}")
-
 # --- Funciones de Utilidad ---
 
+def _ocr_settings() -> Dict[str, Any]:
+    """Ajustes de OCR que afectan al resultado (forman parte de la clave de caché)."""
+    return {
+        'lang': OCR_LANG, 'dpi': OCR_DPI, 'max_pages': OCR_MAX_PAGES if OCR_MULTIPAGE else 1,
+        'mode': 'hibrido', 'min_chars': OCR_MIN_PAGE_CHARS,
+        'min_text_coverage': OCR_MIN_TEXT_COVERAGE, 'min_image_area': OCR_MIN_IMAGE_AREA,
+        'adaptive': OCR_ADAPTIVE, 'dpi_steps': list(OCR_ADAPTIVE_DPI_STEPS), 'min_confidence': OCR_MIN_CONFIDENCE,
+    }
+
 def _get_pdf_lines(pdf_path: str) -> List[str]:
-    """Extrae el texto de un PDF o Imagen. Punto único de OCR."""
-    lines: List[str] = []
-    file_extension = os.path.splitext(pdf_path)[1].lower()
-    
-    if file_extension == ".pdf":
+    """Extrae el texto de un PDF o Imagen usando la caché persistente de texto/OCR."""
+    return _get_pdf_lines_with_info(pdf_path)[0]
+
+def _get_pdf_lines_with_info(pdf_path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Igual que _get_pdf_lines pero devuelve también la información por página
+    (origen texto/OCR, DPI usado y confianza) para dejarla en el log de extracción.
+    """
+    pages_info: List[Dict[str, Any]] = []
+    lines = [line for page_lines in _iter_pdf_lines(pdf_path, pages_info, lazy=False) for line in page_lines]
+    return lines, pages_info
+
+def _iter_pdf_lines(pdf_path: str, pages_info: List[Dict[str, Any]], lazy: bool = True, start: int = 0) -> Iterator[List[str]]:
+    """
+    Genera las líneas de un PDF o Imagen página a página (desde la página start).
+    Punto único de OCR: en los PDF se decide página a página, capa de texto si la tiene
+    y OCR si es un escaneo.
+    Con lazy=True cada página se lee (y se pasa por OCR) solo cuando se pide: si el
+    consumidor deja de iterar, las siguientes no se procesan. Con lazy=False lo que
+    queda se lee de una vez (OCR en paralelo). pages_info recibe la info de cada página.
+    Lo leído se guarda en la caché de texto/OCR; una lectura cortada queda marcada como
+    incompleta y la siguiente continúa desde la última página guardada.
+    """
+    cache_key = None
+    read_pages: List[List[str]] = []
+    read_info: List[Dict[str, Any]] = []
+    cached_pages = 0
+    complete = False
+    failed = False
+
+    if OCR_CACHE_ENABLED:
         try:
-            doc = fitz.open(pdf_path)
-            texto = "".join([page.get_text() or '' for page in doc])
-            doc.close()
-            lines = [l for l in texto.splitlines() if l.strip()]
-            if lines: return lines
-        except Exception:
-            pass
-
-    if Image and pytesseract:
+            cache_key = ocr_cache.make_key(ocr_cache.file_sha256(pdf_path), _ocr_settings())
+            cached = ocr_cache.get_entry(cache_key)
+        except Exception as e:
+            print(f"Aviso: caché de OCR no disponible: {e}")
+            cache_key, cached = None, None
+
+        if cached is not None:
+            meta = cached['meta']
+            read_info = list(meta.get('pages', []))
+            if meta.get('complete', True) and not meta.get('page_lines'):
+                # Entrada completa sin reparto por páginas: se entrega de una vez
+                if start == 0:
+                    pages_info.extend(read_info)
+                    yield cached['lines']
+                return
+            position = 0
+            for count in meta['page_lines']:
+                read_pages.append(cached['lines'][position:position + count])
+                position += count
+            if meta.get('complete', True):
+                for info, page_lines in zip(read_info[start:], read_pages[start:]):
+                    pages_info.append(info)
+                    yield page_lines
+                return
+            cached_pages = len(read_pages)
+
+    if cached_pages < start:
+        # La caché no tiene las páginas anteriores: no se puede guardar una lectura parcial
+        cache_key = None
+
+    try:
+        for info, page_lines in zip(read_info[start:cached_pages], read_pages[start:cached_pages]):
+            pages_info.append(info)
+            yield page_lines
+
+        first_page = max(start, cached_pages)
+        file_extension = os.path.splitext(pdf_path)[1].lower()
         try:
-            if file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif']:
-                ocr_text = pytesseract.image_to_string(Image.open(pdf_path), lang='spa')
-            elif file_extension == ".pdf":
-                doc = fitz.open(pdf_path)
-                if len(doc) > 0:
-                    page = doc.load_page(0)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-                    temp_path = os.path.join(tempfile.gettempdir(), f"ocr_tmp_{os.getpid()}.png")
-                    pix.save(temp_path)
-                    ocr_text = pytesseract.image_to_string(Image.open(temp_path), lang='spa')
-                    if os.path.exists(temp_path): os.remove(temp_path)
-                doc.close()
-            lines = [l for l in ocr_text.splitlines() if l.strip()]
+            # 1. PDF: lectura híbrida por página (capa de texto + OCR solo donde haga falta)
+            if file_extension == ".pdf":
+                max_ocr_pages = OCR_MAX_PAGES if OCR_MULTIPAGE else 1
+                ocr_done = sum(1 for info in read_info if info.get('source') == 'ocr')
+                reader = ocr_engine.iter_pdf_pages if lazy else ocr_engine.extract_pdf_pages
+                pages = reader(pdf_path, max_ocr_pages=max_ocr_pages, dpi=OCR_DPI, lang=OCR_LANG,
+                               start=first_page, ocr_pages_done=ocr_done)
+                page_texts = ((p['text'], {k: v for k, v in p.items() if k != 'text'}) for p in pages)
+
+            # 2. Imágenes sueltas: OCR directo
+            elif file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif'] and ocr_engine.OCR_AVAILABLE and first_page == 0:
+                page_texts = iter([(ocr_engine.ocr_image(pdf_path, lang=OCR_LANG),
+                                    {'page': 0, 'source': 'ocr', 'dpi': None, 'confidence': None})])
+            else:
+                page_texts = iter([])
+
+            for texto, info in page_texts:
+                page_lines = [l for l in texto.splitlines() if l.strip()]
+                read_pages.append(page_lines)
+                read_info.append(info)
+                pages_info.append(info)
+                yield page_lines
+            complete = True
         except Exception as e:
-            print(f"Error crítico en OCR: {e}")
-    return lines
+            failed = True
+            print(f"Error crítico en lectura/OCR: {e}")
+    finally:
+        # También se guarda una lectura cortada por parada temprana (marcada como incompleta)
+        if cache_key and not failed and any(read_pages) and (len(read_pages) > cached_pages or complete):
+            try:
+                ocr_cache.put_lines(cache_key, [l for page_lines in read_pages for l in page_lines], meta={
+                    'pages': read_info, 'page_lines': [len(p) for p in read_pages], 'complete': complete
+                })
+            except Exception as e:
+                print(f"Aviso: no se pudo guardar en la caché de OCR: {e}")
+
+def _format_pages_log(pages_info: List[Dict[str, Any]]) -> str:
+    """Resumen para el log de extracción de las páginas que han pasado por OCR."""
+    output = ""
+    for info in pages_info:
+        if info.get('source') != 'ocr':
+            continue
+        dpi = f"{info['dpi']} DPI" if info.get('dpi') else "resolución original"
+        conf = f", confianza {info['confidence']:.0f}%" if info.get('confidence') is not None else ""
+        output += f"🔎 OCR página {info['page'] + 1}: {dpi}{conf}\n"
+    return output
+
+# Registro de clases de extractor: cada módulo se ejecuta una vez y se recarga solo si
+# cambia su fichero o la versión de SUS reglas (rule_store.key_version de su EXTRACTOR_KEY).
+_extractor_registry = ExtractorRegistry(
+    inject={'BaseInvoiceExtractor': BaseInvoiceExtractor}, version_fn=rule_store.key_version
+)
+
+def get_extractor_registry_stats() -> Dict[str, Any]:
+    """Contadores del registro de extractores (hits, loads, reloads, failures)."""
+    return _extractor_registry.stats()
 
 def _load_extractor_class_dynamic(extractor_path_str: str):
-    """Carga una clase de extractor dinámicamente."""
-    try:
-        parts = extractor_path_str.split('.')
-        module_name, class_name = ".".join(parts[:-1]), parts[-1]
-        module_spec = importlib.util.find_spec(module_name)
-        if not module_spec: raise ImportError(f"Módulo {module_name} no encontrado")
-        module = importlib.util.module_from_spec(module_spec)
-        module.__dict__['BaseInvoiceExtractor'] = BaseInvoiceExtractor
-        sys.modules[module_name] = module
-        module_spec.loader.exec_module(module)
-        return getattr(module, class_name)
+    """Carga una clase de extractor dinámicamente (con caché, ver ExtractorRegistry)."""
+    try:
+        return _extractor_registry.get(extractor_path_str)
     except Exception as e:
         raise RuntimeError(f"Error cargando {extractor_path_str}: {e}")
 
+# --- Lectura por etapas (ingest_pipeline) ---
+# Lo mismo que _iter_pdf_lines con lazy=False, partido en dos pasos para que el pipeline
+# de ingesta los ejecute en pools distintos: read_document (caché o capa de texto) y
+# ocr_document (solo si quedan páginas por OCR). La lectura es un dict que viaja entre
+# procesos: {'cache_key', 'pages': [{'page', 'text', 'source', 'dpi', 'confidence'}], 'ocr_pages'}.
+
+def document_cache_key(pdf_path: str) -> Optional[str]:
+    """Clave de la caché de texto/OCR del fichero (None si la caché está desactivada o falla)."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    try:
+        return ocr_cache.make_key(ocr_cache.file_sha256(pdf_path), _ocr_settings())
+    except Exception as e:
+        print(f"Aviso: caché de OCR no disponible: {e}")
+        return None
+
+def read_document(pdf_path: str, cache_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Primera etapa de lectura: la entrada completa de la caché si la hay y, si no, la capa
+    de texto de cada página. 'ocr_pages' lista las páginas que aún necesitan OCR.
+    """
+    if cache_key:
+        try:
+            cached = ocr_cache.get_entry(cache_key)
+        except Exception as e:
+            print(f"Aviso: caché de OCR no disponible: {e}")
+            cached = None
+        if cached is not None and cached['meta'].get('complete', True):
+            meta = cached['meta']
+            counts = meta.get('page_lines') or [len(cached['lines'])]
+            infos = meta.get('pages') or [{'page': 0, 'source': 'texto', 'dpi': None, 'confidence': None}]
+            pages, position = [], 0
+            for info, count in zip(infos, counts):
+                pages.append(dict(info, text="\n".join(cached['lines'][position:position + count])))
+                position += count
+            # Ya está en caché: ocr_document/_store_document no la vuelven a guardar
+            return {'cache_key': None, 'pages': pages, 'ocr_pages': []}
+
+    read: Dict[str, Any] = {'cache_key': cache_key, 'pages': [], 'ocr_pages': []}
+    file_extension = os.path.splitext(pdf_path)[1].lower()
+    try:
+        if file_extension == ".pdf":
+            read['pages'], read['ocr_pages'] = ocr_engine.read_text_pages(
+                pdf_path, max_ocr_pages=OCR_MAX_PAGES if OCR_MULTIPAGE else 1
+            )
+        elif file_extension in ['.jpg', '.jpeg', '.png', '.tiff', '.tif'] and ocr_engine.OCR_AVAILABLE:
+            read['pages'] = [{'page': 0, 'text': '', 'source': 'texto', 'dpi': None, 'confidence': None}]
+            read['ocr_pages'] = [0]
+    except Exception as e:
+        print(f"Error crítico en lectura/OCR: {e}")
+        read['cache_key'] = None
+    if not read['ocr_pages']:
+        _store_document(read)
+    return read
+
+def ocr_document(pdf_path: str, read: Dict[str, Any]) -> Dict[str, Any]:
+    """Segunda etapa de lectura: OCR de read['ocr_pages'] y guardado en la caché."""
+    if read['ocr_pages']:
+        if os.path.splitext(pdf_path)[1].lower() == ".pdf":
+            ocr_engine.ocr_into_pages(pdf_path, read['pages'], read['ocr_pages'], dpi=OCR_DPI, lang=OCR_LANG)
+        else:
+            try:
+                read['pages'][0].update(text=ocr_engine.ocr_image(pdf_path, lang=OCR_LANG), source='ocr')
+            except Exception as e:
+                print(f"Error crítico en lectura/OCR: {e}")
+                read['cache_key'] = None
+        read['ocr_pages'] = []
+    _store_document(read)
+    return read
+
+def document_lines(read: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Líneas no vacías de una lectura y la información por página (sin el texto)."""
+    page_lines = [[l for l in page['text'].splitlines() if l.strip()] for page in read['pages']]
+    pages_info = [{k: v for k, v in page.items() if k != 'text'} for page in read['pages']]
+    return [l for lines in page_lines for l in lines], pages_info
+
+def _store_document(read: Dict[str, Any]):
+    """Guarda una lectura completa en la caché de texto/OCR (mismo formato que _iter_pdf_lines)."""
+    if not read['cache_key']:
+        return
+    page_lines = [[l for l in page['text'].splitlines() if l.strip()] for page in read['pages']]
+    if not any(page_lines):
+        return
+    try:
+        ocr_cache.put_lines(read['cache_key'], [l for lines in page_lines for l in lines], meta={
+            'pages': document_lines(read)[1], 'page_lines': [len(p) for p in page_lines], 'complete': True
+        })
+    except Exception as e:
+        print(f"Aviso: no se pudo guardar en la caché de OCR: {e}")
+
+# --- Autómata de detección por cliente (CIF + palabras clave) ---
+# Se compila una vez con todos los clientes y se reconstruye cuando cambia la
+# configuración (save_client, extractores): database.get_config_version().
+# Prioridad: mayor clientes.prioridad primero y, a igualdad, orden alfabético del cliente.
+_client_matcher: Optional[Tuple[int, KeywordMatcher]] = None
+_client_matcher_lock = threading.Lock()
+
+def _build_client_matcher() -> KeywordMatcher:
+    matcher = KeywordMatcher()
+    for order, cliente in enumerate(database.fetch_all_clients()):
+        extractor_pref = cliente.get('extractor_default')
+        if not extractor_pref or extractor_pref == 'GENERICO':
+            continue
+        rank = (-(cliente.get('prioridad') or 0), order)
+
+        # 1. CIF
+        cif = (cliente.get('cif') or '').strip().upper()
+        if len(cif) > 5:
+            matcher.add(cif, rank, extractor_pref)
+
+        # 2. Palabras Clave
+        for kw in (cliente.get('palabras_clave') or '').split(','):
+            if kw.strip():
+                matcher.add(kw.strip().upper(), rank, extractor_pref)
+    return matcher.build()
+
+def get_client_matcher() -> KeywordMatcher:
+    """Autómata de clientes (reconstruido si la configuración ha cambiado)."""
+    global _client_matcher
+    with _client_matcher_lock:
+        version = database.get_config_version()
+        if _client_matcher is None or _client_matcher[0] != version:
+            _client_matcher = (version, _build_client_matcher())
+        return _client_matcher[1]
+
+def invalidate_client_matcher():
+    """Fuerza la reconstrucción (p.ej. tras editar clientes desde otro proceso)."""
+    global _client_matcher
+    with _client_matcher_lock:
+        _client_matcher = None
+
+def reload_database_config():
+    """
+    Vuelve a leer de la BBDD las reglas y los clientes. Necesario si database.DB_PATH cambia
+    después de importar logic (procesos hijos del pipeline): las cachés se validan por
+    versión y la de otra BBDD puede coincidir.
+    """
+    rule_store.invalidate()
+    rule_extractor.invalidate()
+    base_invoice_extractor.reload_extraction_config()
+    _extractor_registry.invalidate()
+    invalidate_client_matcher()
+    layout_index.invalidate_index()
+
 def _detectar_extractor_automatico(lines: List[str]) -> Optional[str]:
     """
     Busca en el contenido del texto si coincide con algún cliente.
     """
     try:
-        # Se conecta a la BD solo cuando se llama a la función, no al importar el archivo
-        clientes = database.fetch_all_clients()
         texto_completo = " ".join(lines).upper()
-
-        for cliente in clientes:
-            extractor_pref = cliente.get('extractor_default')
-            if not extractor_pref or extractor_pref == 'GENERICO':
-                continue
-
-            # 1. Comprobar CIF 
-            cif = cliente.get('cif', '').strip().upper()
-            if cif and len(cif) > 5 and cif in texto_completo:
-                return extractor_pref
-
-            # 2. Comprobar Palabras Clave
-            palabras = cliente.get('palabras_clave', '')
-            if palabras:
-                lista_kws = [k.strip().upper() for k in palabras.split(',') if k.strip()]
-                for kw in lista_kws:
-                    if kw in texto_completo:
-                        return extractor_pref
+        return get_client_matcher().best_match(texto_completo)
     except Exception as e:
         print(f"Error en detección automática: {e}")
     
     return None
 
+def _supports_early_stop(ExtractorClass) -> bool:
+    """El extractor sabe decir cuándo tiene resueltos sus campos obligatorios."""
+    supports = getattr(ExtractorClass, 'supports_early_stop', None)
+    try:
+        return bool(supports and supports())
+    except Exception:
+        return False
+
+def _read_lines_streaming(pdf_path: str, pages_info: List[Dict[str, Any]], select_class_path) -> Tuple[List[str], Optional[str]]:
+    """
+    Lectura por páginas con parada temprana. Con la primera página se elige el extractor
+    (select_class_path(lines) -> ruta de clase o None) y, mientras este admita parada
+    temprana, se lee página a página hasta que declara resueltos los campos obligatorios.
+    Si no hay extractor o no la admite, el resto del documento se lee de una vez (OCR en
+    paralelo). Devuelve (lines, ruta del extractor si se paró antes del final).
+    """
+    lines: List[str] = []
+    reader = _iter_pdf_lines(pdf_path, pages_info)
+    try:
+        page_lines = next(reader, None)
+        if page_lines is None:
+            return lines, None
+        lines.extend(page_lines)
+
+        class_path = select_class_path(lines)
+        ExtractorClass = None
+        if class_path:
+            try:
+                ExtractorClass = _load_extractor_class_dynamic(class_path)
+            except Exception:
+                ExtractorClass = None
+
+        if ExtractorClass is not None and _supports_early_stop(ExtractorClass):
+            while True:
+                if ExtractorClass(lines, pdf_path).required_fields_resolved(lines):
+                    return lines, class_path
+                page_lines = next(reader, None)
+                if page_lines is None:
+                    return lines, None
+                lines.extend(page_lines)
+    finally:
+        reader.close()
+
+    for page_lines in _iter_pdf_lines(pdf_path, pages_info, lazy=False, start=len(pages_info)):
+        lines.extend(page_lines)
+    return lines, None
+
 # --- Función de Extracción Principal ---
 
-def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str = None) -> Tuple[Any, ...]:
-    """Extrae datos de la factura y devuelve una tupla de 13 campos + logs."""
+def _clasificar_por_maquetacion(pdf_path: str, lines: List[str], fingerprint: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, float]]:
+    """Extractor de la factura validada con la maquetación más parecida (o None)."""
+    try:
+        return layout_index.classify(pdf_path, lines, fingerprint)
+    except Exception as e:
+        print(f"Aviso: clasificador por maquetación no disponible: {e}")
+        return None
+
+def start_layout_backfill() -> Optional[threading.Thread]:
+    """Completa en segundo plano las huellas de las facturas validadas que no la tienen (layout_index)."""
+    if not LAYOUT_MATCH_ENABLED:
+        return None
+    thread = threading.Thread(target=layout_index.backfill_fingerprints, args=(_get_pdf_lines,),
+                              name="huellas-maquetacion", daemon=True)
+    thread.start()
+    return thread
+
+def _layout_fingerprint(pdf_path: str, lines: List[str]) -> Optional[Dict[str, Any]]:
+    if not LAYOUT_MATCH_ENABLED:
+        return None
+    try:
+        return layout_index.compute_fingerprint(pdf_path, lines)
+    except Exception as e:
+        print(f"Aviso: no se pudo calcular la huella de {pdf_path}: {e}")
+        return None
+
+def _record_extras(pdf_path: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnas extra para la BBDD (insert_invoices_bulk): extractor usado y huella de maquetación."""
+    layout = info.get('layout')
+    return {'Extractor': info.get('extractor'),
+            'Huella': layout_index.encode_fingerprint(layout, pdf_path) if layout else None}
+
+def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str = None,
+                  info: Optional[Dict[str, Any]] = None) -> Tuple[Any, ...]:
+    """
+    Extrae datos de la factura y devuelve una tupla de 13 campos + logs.
+    info (opcional): sale con el extractor usado y la huella de maquetación (ver _record_extras).
+    """
     debug_output = ""
     
     # [CORRECCIÓN] Cargamos el mapeo AQUÍ dentro, no fuera.
@@ -123,32 +419,76 @@ def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str
     except Exception:
         extraction_mapping = {}
 
+    def _nombre_extractor(lines_leidas: List[str]) -> Optional[str]:
+        if extractor_manual and extractor_manual in extraction_mapping:
+            return extractor_manual
+        detected = _detectar_extractor_automatico(lines_leidas)
+        return detected if detected in extraction_mapping else None
+
     try:
-        lines = _get_pdf_lines(pdf_path)
+        # Lectura por páginas: se para en cuanto el extractor tiene los campos obligatorios
+        stopped_early = False
+        if EXTRACTION_EARLY_STOP:
+            pages_info: List[Dict[str, Any]] = []
+            lines, early_class_path = _read_lines_streaming(
+                pdf_path, pages_info, lambda lines_leidas: extraction_mapping.get(_nombre_extractor(lines_leidas))
+            )
+            stopped_early = early_class_path is not None
+        else:
+            lines, pages_info = _get_pdf_lines_with_info(pdf_path)
         if not lines:
             return (*[None]*13, "Error: No se detectó texto.")
+        debug_output += _format_pages_log(pages_info)
+        if stopped_early:
+            debug_output += f"⏩ Lectura detenida tras {len(pages_info)} página(s): campos obligatorios resueltos.\n"
+        elif info is not None:
+            # Solo con el documento completo: la huella de unas páginas no se compara con las demás
+            info['layout'] = _layout_fingerprint(pdf_path, lines)
 
-        extractor_name_to_use = None
+        return _extract_from_lines(pdf_path, lines, debug_output, extraction_mapping, extractor_manual, debug_mode, info)
 
-        # 1. Estrategia: ¿Tenemos extractor manual?
-        if extractor_manual and extractor_manual in extraction_mapping:
-            extractor_name_to_use = extractor_manual
-            debug_output += f"🔧 Modo Manual seleccionado: {extractor_name_to_use}\n"
+    except Exception as e:
+        tb = traceback.format_exc()
+        return (*[None]*13, f"❌ ERROR FATAL en logic.py: {e}\n{tb}")
+
+def _extract_from_lines(pdf_path: str, lines: List[str], debug_output: str, extraction_mapping: Dict[str, str],
+                        extractor_manual: Optional[str] = None, debug_mode: bool = False,
+                        info: Optional[Dict[str, Any]] = None) -> Tuple[Any, ...]:
+    """
+    Detección, carga del extractor y extracción sobre las líneas ya leídas (ver extraer_datos).
+    info (opcional): entra con la huella de maquetación ('layout') si ya se calculó y sale
+    con la ruta del extractor usado ('extractor', None si fue el genérico).
+    """
+    info = {} if info is None else info
+    extractor_name_to_use = None
+    full_class_path = None
+
+    # 1. Estrategia: ¿Tenemos extractor manual?
+    if extractor_manual and extractor_manual in extraction_mapping:
+        extractor_name_to_use = extractor_manual
+        debug_output += f"🔧 Modo Manual seleccionado: {extractor_name_to_use}\n"
+    else:
+        # 2. Estrategia: Detección Automática por contenido (con las páginas leídas)
+        detected_name = _detectar_extractor_automatico(lines)
+        if detected_name and detected_name in extraction_mapping:
+            extractor_name_to_use = detected_name
+            debug_output += f"🤖 Auto-detección: Encontrado patrón para extractor '{extractor_name_to_use}'\n"
         else:
-            # 2. Estrategia: Detección Automática por contenido
-            detected_name = _detectar_extractor_automatico(lines)
-            if detected_name and detected_name in extraction_mapping:
-                extractor_name_to_use = detected_name
-                debug_output += f"🤖 Auto-detección: Encontrado patrón para extractor '{extractor_name_to_use}'\n"
+            # 2b. Plantilla de la factura validada con la maquetación más parecida
+            layout_match = _clasificar_por_maquetacion(pdf_path, lines, info.get('layout')) if LAYOUT_MATCH_ENABLED else None
+            if layout_match:
+                full_class_path, score = layout_match
+                debug_output += f"🧭 Plantilla por maquetación: {full_class_path} (similitud {score:.2f})\n"
             else:
                 debug_output += "ℹ️ No se detectó cliente específico. Usando Genérico.\n"
 
-        # 3. Cargar la clase correspondiente
-        full_class_path = None
-        if extractor_name_to_use:
-            full_class_path = extraction_mapping.get(extractor_name_to_use)
-        
-        ExtractorClass = None
+    # 3. Cargar la clase correspondiente
+    if extractor_name_to_use:
+        full_class_path = extraction_mapping.get(extractor_name_to_use)
+    
+    ExtractorClass = None
+    # Trazas de los extractores: solo se recogen (y formatean) en modo depuración
+    with tracing.capture(enabled=debug_mode) as trace_events:
         if full_class_path:
             try:
                 ExtractorClass = _load_extractor_class_dynamic(full_class_path)
@@ -169,43 +509,92 @@ def extraer_datos(pdf_path: str, debug_mode: bool = False, extractor_manual: str
         else:
             generic = BaseInvoiceExtractor(lines, pdf_path)
             res_raw = generic.extract_all()
+    debug_output += tracing.format_events(trace_events)
+    info['extractor'] = full_class_path if ExtractorClass else None
+    if ExtractorClass:
+        debug_output += f"✅ Usado extractor: {full_class_path}\n"
 
-        res_list = list(res_raw[:13])
-        return (*res_list, debug_output)
+    res_list = list(res_raw[:13])
+    return (*res_list, debug_output)
 
+def extract_document(pdf_path: str, read: Dict[str, Any], debug_mode: bool = False) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """
+    Etapa de extracción del pipeline de ingesta: como extraer_datos, pero sobre una lectura
+    ya hecha (read_document / ocr_document). Devuelve (tupla de 13 campos + logs, columnas
+    extra para la BBDD: {'Extractor', 'Huella'}, ver _record_extras).
+    """
+    try:
+        extraction_mapping = database.get_extraction_mapping()
+    except Exception:
+        extraction_mapping = {}
+    info: Dict[str, Any] = {}
+    try:
+        lines, pages_info = document_lines(read)
+        if not lines:
+            return (*[None]*13, "Error: No se detectó texto."), _record_extras(pdf_path, info)
+        info['layout'] = _layout_fingerprint(pdf_path, lines)
+        result = _extract_from_lines(pdf_path, lines, _format_pages_log(pages_info), extraction_mapping,
+                                     debug_mode=debug_mode, info=info)
+        return result, _record_extras(pdf_path, info)
     except Exception as e:
         tb = traceback.format_exc()
-        return (*[None]*13, f"❌ ERROR FATAL en logic.py: {e}\n{tb}")
+        return (*[None]*13, f"❌ ERROR FATAL en logic.py: {e}\n{tb}"), _record_extras(pdf_path, {})
 
 def process_single_pdf(pdf_path: str) -> Tuple[bool, str]:
     """Coordina verificación de duplicados, extracción y guardado en base de datos."""
-    debug_output = f"--- Procesando archivo: {os.path.basename(pdf_path)} ---\n"
-    try:
-        # 1. Verificar duplicados
-        if database.is_invoice_processed(pdf_path):
-            return False, debug_output + f"🚫 Factura ya procesada anteriormente.\n"
-
-        # 2. Extraer
-        res_raw = extraer_datos(pdf_path)
-        res_list = list(res_raw[:13])
-        debug_log = res_raw[13]
-        debug_output += debug_log
-        
-        # 3. Guardar si hay datos
-        if any(res_list): 
-            data_dict = {
-                'Tipo': res_list[0], 'Fecha': res_list[1], 'Número de Factura': res_list[2],
-                'Emisor': res_list[3], 'CIF Emisor': res_list[4], 'Cliente': res_list[5],
-                'CIF': res_list[6], 'Modelo': res_list[7], 'Matricula': res_list[8],
-                'Importe': res_list[9], 'Base': res_list[10], 'IVA': res_list[11],
-                'Tasas': res_list[12], 'Concepto': 'Importación Manual'
-            }
-            
-            database.insert_invoice_data(data_dict, pdf_path, is_validated=0)
-            debug_output += f"\n✅ Datos guardados en BD con éxito."
-            return True, debug_output
-        else:
-            return False, debug_output + "\n❌ No se extrajeron datos válidos."
+    return process_pdf_batch([pdf_path])[0]
+
+def process_pdf_batch(pdf_paths: List[str]) -> List[Tuple[bool, str]]:
+    """
+    process_single_pdf para varios ficheros: los duplicados se comprueban con una sola
+    consulta (database.filter_unprocessed) y lo extraído se guarda en una sola transacción
+    (database.insert_invoices_bulk). Devuelve (éxito, log) por fichero, en el mismo orden.
+    """
+    results: List[Tuple[bool, str]] = []
+    to_save: List[Tuple[int, Dict[str, Any], str]] = [] # (posición, datos, ruta)
+    try:
+        unprocessed = set(database.filter_unprocessed(pdf_paths))
+    except Exception as e:
+        return [(False, f"--- Procesando archivo: {os.path.basename(p)} ---\n\n❌ Error: {str(e)}") for p in pdf_paths]
 
+    for pdf_path in pdf_paths:
+        debug_output = f"--- Procesando archivo: {os.path.basename(pdf_path)} ---\n"
+        try:
+            # 1. Verificar duplicados
+            if pdf_path not in unprocessed:
+                results.append((False, debug_output + f"🚫 Factura ya procesada anteriormente.\n"))
+                continue
+
+            # 2. Extraer
+            info: Dict[str, Any] = {}
+            res_raw = extraer_datos(pdf_path, info=info)
+            res_list = list(res_raw[:13])
+            debug_log = res_raw[13]
+            debug_output += debug_log
+
+            # 3. Guardar (al final, todo junto) si hay datos
+            if any(res_list):
+                data_dict = {
+                    'Tipo': res_list[0], 'Fecha': res_list[1], 'Número de Factura': res_list[2],
+                    'Emisor': res_list[3], 'CIF Emisor': res_list[4], 'Cliente': res_list[5],
+                    'CIF': res_list[6], 'Modelo': res_list[7], 'Matricula': res_list[8],
+                    'Importe': res_list[9], 'Base': res_list[10], 'IVA': res_list[11],
+                    'Tasas': res_list[12], 'Concepto': 'Importación Manual',
+                    'DebugLines': debug_log, **_record_extras(pdf_path, info)
+                }
+                to_save.append((len(results), data_dict, pdf_path))
+                results.append((True, debug_output))
+            else:
+                results.append((False, debug_output + "\n❌ No se extrajeron datos válidos."))
+
+        except Exception as e:
+            results.append((False, debug_output + f"\n❌ Error: {str(e)}"))
+
+    try:
+        database.insert_invoices_bulk([(data_dict, pdf_path, 0) for _, data_dict, pdf_path in to_save])
+        for position, _, _ in to_save:
+            results[position] = (True, results[position][1] + f"\n✅ Datos guardados en BD con éxito.")
     except Exception as e:
-        return False, debug_output + f"\n❌ Error: {str(e)}"
\ No newline at end of file
+        for position, _, _ in to_save:
+            results[position] = (False, results[position][1] + f"\n❌ Error: {str(e)}")
+    return results
@@ -1,8 +1,12 @@
 from nicegui import app, ui
 import os
+import asyncio
 import database
+import db_connections
+import ocr_engine
+import ingest_pipeline
 # Importamos la nueva función desde logic.py
-from logic import process_single_pdf
+from logic import process_single_pdf, start_layout_backfill
 # Importamos los módulos de las vistas
 from modules import dashboard, validador, historico, clientes, stock,historico_exportaciones
 
@@ -14,6 +18,10 @@ if not os.path.exists(RUTA_FACTURAS):
     os.makedirs(RUTA_FACTURAS)
 
 app.add_static_files('/documentos', RUTA_FACTURAS)
+# Procesos de OCR con Tesseract ya cargado desde el arranque del servidor
+app.on_startup(ocr_engine.warm_up)
+# Huellas de maquetación de las facturas validadas antiguas (layout_index)
+app.on_startup(start_layout_backfill)
 
 # --- FUNCIONES DE LÓGICA DE INTERFAZ ---
 async def procesar_subida_factura(e, dialog):
@@ -40,12 +48,14 @@ async def procesar_subida_factura(e, dialog):
         with open(ruta_destino, 'wb') as f:
             f.write(contenido)
         
-        # 4. Procesar con logic.py
+        # 4. Procesar en el pipeline de ingesta (sin bloquear el bucle de eventos)
         ui.notify(f'Archivo guardado. Extrayendo datos...', color='blue')
         
-        import logic
-        # Como process_single_pdf no es asíncrona, la llamamos normal
-        success, logs = logic.process_single_pdf(ruta_destino)
+        resultado = await asyncio.wrap_future(ingest_pipeline.ingest_file(
+            ruta_destino, save_empty=False, record_defaults={'Concepto': 'Importación Manual'}
+        ))
+        success = resultado['status'] == ingest_pipeline.STATUS_SAVED
+        logs = ((resultado['data'] or {}).get('DebugLines') or '') + resultado['log']
         
         print("\n" + "="*60)
         print(logs)
@@ -80,7 +90,19 @@ def main_page():
     # Estilo de la barra superior
     with ui.header().classes('items-center justify-between bg-blue-900'):
         ui.label('ERP Compra-Venta de Vehículos').classes('text-h6 text-white')
-        ui.button('IMPORTAR PDF', on_click=uploader_dialog.open).props('icon=upload color=white flat')
+        with ui.row().classes('items-center'):
+            colas_label = ui.label('').classes('text-white text-caption')
+            ui.button('IMPORTAR PDF', on_click=uploader_dialog.open).props('icon=upload color=white flat')
+
+    def actualizar_colas():
+        # Ficheros en cola o en curso por etapa del pipeline (solo si hay trabajo)
+        depths = ingest_pipeline.get_pipeline().depths()
+        colas_label.set_text(
+            f"Colas: entrada {depths['discovery']} · texto {depths['text']} · OCR {depths['ocr']} · "
+            f"extracción {depths['extraction']} · BBDD {depths['persistence']} · {db_connections.describe()}"
+            if any(depths.values()) else ''
+        )
+    ui.timer(2.0, actualizar_colas)
 
     # Menú lateral
     with ui.left_drawer(value=True).classes('bg-slate-100') as drawer:
@@ -254,7 +254,9 @@ class ClientesView:
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (ext_id, row.get('field_id'), row.get('type'), row.get('ref_text'), 
                       row.get('offset'), row.get('segment'), row.get('value'), row.get('line')))
+            database.bump_rules_version(cursor)
             conn.commit()
+        database.bump_config_version()
 
 # --- Instancia global ---
 view = ClientesView()
@@ -142,16 +142,34 @@ import os
 import pandas as pd
 from datetime import datetime
 from PDFEngineWeb import PDFEngineWeb
+from config import TABLE_PAGE_SIZE
 
 def vista_historico():
     pdf_engine = PDFEngineWeb()
     
+    # Cursor de la página siguiente (database.fetch_invoice_page); None si ya están todas
+    pagina = {'cursor': None}
+
     # --- FUNCIONES DE LÓGICA ---
     def cargar_datos():
         print("DEBUG: Cargando datos desde BD...")
-        rows = database.fetch_all_invoices()
-        table.rows = [dict(r) for r in rows]
+        rows, pagina['cursor'] = database.fetch_invoice_page(descending=True, limit=TABLE_PAGE_SIZE)
+        table.rows = rows
+        table.update()
+        boton_mas.visible = pagina['cursor'] is not None
+
+    def cargar_mas():
+        # Página siguiente por clave (procesado_en, path): no vuelve a leer las ya cargadas
+        if pagina['cursor'] is None:
+            return
+        rows, pagina['cursor'] = database.fetch_invoice_page(descending=True, limit=TABLE_PAGE_SIZE, after=pagina['cursor'])
+        table.rows.extend(rows)
         table.update()
+        boton_mas.visible = pagina['cursor'] is not None
+
+    def pendientes_de_exportar():
+        # Desde la BBDD, no desde table.rows: la tabla solo tiene las páginas ya cargadas
+        return list(database.iter_invoices(filters={'is_validated': 1, 'exportado': ('EMPTY', None)}))
 
     def generar_excel(lista_rows, nombre_base):
         if not lista_rows:
@@ -222,7 +240,7 @@ def vista_historico():
     with ui.row().classes('w-full mb-4 gap-2 items-center'):
         # 1. Exportar nuevos (validados y no exportados)
         ui.button('Exportar Pendientes', icon='auto_awesome', 
-                  on_click=lambda: generar_excel([r for r in table.rows if r['is_validated']==1 and not r.get('exportado')], 'Nuevos_Validados')).props('color=green')
+                  on_click=lambda: generar_excel(pendientes_de_exportar(), 'Nuevos_Validados')).props('color=green')
         
         # 2. Exportar selección (lo que esté marcado con el tick)
         ui.button('Exportar Selección', icon='checklist', 
@@ -297,4 +315,6 @@ def vista_historico():
             pdf_display = ui.interactive_image().classes('w-full bg-white')
             pdf_display.visible = False
 
+    boton_mas = ui.button('Cargar más', icon='expand_more', on_click=cargar_mas).props('flat')
+
     cargar_datos()
\ No newline at end of file
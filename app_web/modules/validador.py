@@ -3,6 +3,7 @@ import database
 import os
 import fitz  # PyMuPDF
 import base64
+from document_model import load_document_model
 
 # ----------------------------
 # Estado global
@@ -48,42 +49,35 @@ def obtener_imagen_procesada(ruta):
 # ----------------------------
 # Funciones para encontrar palabra/linea
 # ----------------------------
-def obtener_palabra_en_punto(page, x, y, margen=3):
-    for w in page.get_text("words"):
-        x0, y0, x1, y1, texto, *_ = w
-        if x0-margen <= x <= x1+margen and y0-margen <= y <= y1+margen:
-            return [x0, y0, x1, y1]
-    return None
+# Las consultas usan el DocumentModel cacheado (índice espacial) en lugar de
+# reabrir el PDF y recorrer get_text() en cada evento de ratón.
+def obtener_palabra_en_punto(model, x, y, margen=3, page=0):
+    index = model.word_at(page, x, y, margen)
+    if index is None:
+        return None
+    rect, texto = model.word(index)
+    return list(rect), texto
 
-def obtener_linea_en_punto(page, x, y, margen=3):
-    for b in page.get_text("blocks"):
-        if "lines" not in b: continue
-        for line in b["lines"]:
-            for span in line["spans"]:
-                x0, y0, x1, y1 = span["bbox"]
-                if y0-margen <= y <= y1+margen:
-                    return [x0, y0, x1, y1]
-    return None
+def obtener_linea_en_punto(model, x, y, margen=3, page=0):
+    index = model.line_at(page, x, y, margen)
+    if index is None:
+        return None
+    return list(model.line_box(index)), model.strings[model.line_text[index]]
 
 # ----------------------------
 # Funciones de asignar y aprender
 # ----------------------------
-def encontrar_ancla_cercana(page, target_rect):
-    words = page.get_text("words")
-    if not words: return None
+def encontrar_ancla_cercana(model, target_rect, page=0):
     center_x = (target_rect[0] + target_rect[2]) / 2
     center_y = (target_rect[1] + target_rect[3]) / 2
-    best_anchor = None
-    min_dist = float('inf')
-    for w in words:
-        if len(w[4]) < 3 or w[4].replace('.', '').isdigit(): continue
-        anchor_x = (w[0] + w[2]) / 2
-        anchor_y = (w[1] + w[3]) / 2
-        dist = ((center_x - anchor_x)**2 + (center_y - anchor_y)**2)**0.5
-        if dist < min_dist:
-            min_dist = dist
-            best_anchor = {'texto': w[4], 'x': w[0], 'y': w[1]}
-    return best_anchor
+    index = model.nearest_word(
+        page, center_x, center_y,
+        predicate=lambda texto: len(texto) >= 3 and not texto.replace('.', '').isdigit()
+    )
+    if index is None:
+        return None
+    (x0, y0, _, _), texto = model.word(index)
+    return {'texto': texto, 'x': x0, 'y': y0}
 
 def asignar_y_aprender(campo_destino):
     if not state.facturas or not state.ultimo_rect_pdf: 
@@ -97,10 +91,7 @@ def asignar_y_aprender(campo_destino):
 
     # Aprender posición relativa
     try:
-        doc = fitz.open(f['path'])
-        page = doc.load_page(0)
-        ancla = encontrar_ancla_cercana(page, state.ultimo_rect_pdf)
-        doc.close()
+        ancla = encontrar_ancla_cercana(load_document_model(f['path']), state.ultimo_rect_pdf)
         if ancla and hasattr(database, 'save_learning_rule'):
             rel_x = state.ultimo_rect_pdf[0] - ancla['x']
             rel_y = state.ultimo_rect_pdf[1] - ancla['y']
@@ -136,8 +127,7 @@ def manejar_raton(e: events.MouseEventArguments):
         return
 
     try:
-        doc = fitz.open(f['path'])
-        page = doc.load_page(0)
+        model = load_document_model(f['path'])
         mat = fitz.Matrix(state.zoom, state.zoom).prerotate(state.rotation)
         pdf_pt = fitz.Point(e.image_x, e.image_y) * ~mat
         x, y = pdf_pt.x, pdf_pt.y
@@ -157,7 +147,7 @@ def manejar_raton(e: events.MouseEventArguments):
                 state.start_point = None
                 state.dragging = False
                 state.ultimo_rect_pdf = rect_pdf
-                texto = page.get_text("text", clip=rect_pdf).strip()
+                texto = model.text_in_rect(0, rect_pdf).strip()
                 if texto:
                     state.ultimo_texto = texto
                     input_texto.value = texto
@@ -165,9 +155,10 @@ def manejar_raton(e: events.MouseEventArguments):
                 return
         # Click simple
         if e.type == 'click' and not state.dragging:
-            rect_seleccionado = obtener_linea_en_punto(page, x, y) if e.ctrl else obtener_palabra_en_punto(page, x, y)
-            if rect_seleccionado:
-                texto = page.get_text("text", clip=rect_seleccionado).strip()
+            seleccion = obtener_linea_en_punto(model, x, y) if e.ctrl else obtener_palabra_en_punto(model, x, y)
+            if seleccion:
+                rect_seleccionado, texto = seleccion
+                texto = texto.strip()
                 if texto:
                     state.ultimo_texto = texto
                     state.ultimo_rect_pdf = rect_seleccionado
@@ -175,8 +166,6 @@ def manejar_raton(e: events.MouseEventArguments):
                     visor_interactivo.content = f'<rect x="{img_rect.x0}" y="{img_rect.y0}" width="{img_rect.width}" height="{img_rect.height}" fill="rgba(255,0,0,0.15)" stroke="red" stroke-width="2"/>'
                     input_texto.value = texto
                     dialogo_asignacion.open()
-
-        doc.close()
     except Exception as ex:
         print(f"Error ratón: {ex}")
 def detectar_extractor_del_log(log_text):
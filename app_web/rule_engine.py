@@ -0,0 +1,365 @@
+# rule_engine.py
+
+import re
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Set, Callable
+
+# --- Motor de reglas de extracción (FIXED / VARIABLE / FIXED_VALUE) ---
+# Mismas reglas que aplican BaseInvoiceExtractor y los extractores generados, pero
+# sabiendo si el resultado ya es DEFINITIVO con las líneas leídas hasta ahora.
+# Con lectura por páginas las líneas solo crecen por el final, así que:
+#   - una referencia encontrada ya no cambia (primera coincidencia),
+#   - una línea ya leída no cambia,
+# y un campo queda resuelto cuando su primera regla aplicable ya no depende de
+# páginas que faltan por leer.
+
+
+def find_reference_line(lines: List[str], ref_text: str) -> Optional[int]:
+    """Índice de la primera línea que contiene ref_text (sin distinguir mayúsculas)."""
+    return document_lines(lines).find_line((ref_text or '').lower())
+
+
+def cut_segment(line: str, segment_input: Any) -> Optional[str]:
+    """Devuelve el segmento (1-based, o rango "3-5") de la línea, o None."""
+    if segment_input is None:
+        return None
+    try:
+        line_segments = [seg for seg in re.split(r'\s+', line.strip()) if seg]
+        if isinstance(segment_input, str) and re.match(r'^\d+-\d+$', segment_input):
+            start_s, end_s = segment_input.split('-')
+            start_idx, end_idx = int(start_s) - 1, int(end_s)
+            if 0 <= start_idx < end_idx and end_idx <= len(line_segments):
+                return ' '.join(line_segments[start_idx:end_idx]).strip() or None
+            return None
+        segment_index = int(segment_input) - 1
+        if 0 <= segment_index < len(line_segments):
+            return line_segments[segment_index].strip() or None
+    except Exception:
+        pass
+    return None
+
+
+def resolve_rule(lines: List[str], mapping: Dict[str, Any], complete: bool = True) -> Tuple[Optional[str], bool]:
+    """
+    Aplica una regla y devuelve (valor, definitivo). 'definitivo' es False cuando el
+    resultado aún puede cambiar al añadir más páginas (solo si complete=False).
+    """
+    rule_type = mapping.get('type')
+    if rule_type == 'FIXED_VALUE':
+        value = mapping.get('value')
+        return (str(value) if value is not None else None), True
+
+    line_index = None
+    if rule_type == 'FIXED':
+        abs_line_1based = mapping.get('line')
+        if abs_line_1based is None or abs_line_1based <= 0:
+            return None, True
+        line_index = abs_line_1based - 1
+    elif rule_type == 'VARIABLE':
+        ref_index = find_reference_line(lines, mapping.get('ref_text', ''))
+        if ref_index is None:
+            return None, complete
+        line_index = ref_index + (mapping.get('offset') or 0)
+    else:
+        return None, True
+
+    if line_index < 0:
+        return None, True
+    if line_index >= len(lines):
+        return None, complete
+    return cut_segment(lines[line_index], mapping.get('segment')), True
+
+
+def as_rule_list(rules: Any) -> List[Dict[str, Any]]:
+    """Normaliza la configuración de un campo (dict o lista de dicts) a lista de reglas."""
+    if isinstance(rules, dict):
+        return [rules]
+    if isinstance(rules, list):
+        return [r for r in rules if isinstance(r, dict)]
+    return []
+
+
+def resolve_field(lines: List[str], rules: Any, complete: bool = True) -> Tuple[Optional[str], bool]:
+    """
+    Prueba las reglas del campo en orden (la primera con valor gana). Si una regla
+    anterior aún no es definitiva, las siguientes no pueden decidir.
+    """
+    for mapping in as_rule_list(rules):
+        value, final = resolve_rule(lines, mapping, complete)
+        if not final:
+            return None, False
+        if value is not None:
+            return value, True
+    return None, True
+
+
+def required_fields_resolved(lines: List[str], mapping: Dict[str, Any], required: Optional[Iterable[str]] = None) -> bool:
+    """
+    True si todos los campos obligatorios del mapeo ya tienen un resultado definitivo
+    con las líneas leídas. required=None: se consideran obligatorios todos los campos.
+    """
+    required_set: Optional[Set[str]] = {f.upper() for f in required} if required is not None else None
+    for field_name, rules in mapping.items():
+        if required_set is not None and field_name.upper() not in required_set:
+            continue
+        if not resolve_field(lines, rules, complete=False)[1]:
+            return False
+    return True
+
+
+def load_required_fields() -> Optional[Set[str]]:
+    """Campos marcados como obligatorios (extraction_fields.is_required) o None si no hay tabla."""
+    try:
+        import database
+        return set(database.get_required_fields())
+    except Exception:
+        return None
+
+
+# --- Planes de ejecución compilados ---
+# compile_rules() traduce UNA vez la configuración de un extractor ({campo: reglas}) a
+# tuplas listas para evaluar: referencias ya en minúsculas, segmentos ya parseados y las
+# referencias de todas las reglas agrupadas para buscarlas en una sola pasada.
+# DocumentLines prepara el documento una vez (minúsculas, segmentos por línea e índice
+# de referencias) y document_lines() lo reutiliza con todos los extractores y planes
+# que se prueben sobre la misma lista de líneas.
+# Misma semántica que resolve_rule/cut_segment.
+
+_SPLIT_RE = re.compile(r'\s+')
+_SEGMENT_RANGE_RE = re.compile(r'^\d+-\d+$')
+
+_INVALID, _FIXED_VALUE, _FIXED, _VARIABLE = range(4)
+
+CompiledRule = Tuple[int, Any, Optional[str], int, Optional[Tuple[int, int]]] # (tipo, valor/línea, ref, offset, segmento)
+Validator = Callable[[str], Optional[str]] # Valor limpio, o None para descartarlo y probar la siguiente regla
+
+
+class DocumentLines:
+    """Líneas de un documento con sus versiones en minúsculas y sus segmentos (calculados una vez)."""
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+        self.snapshot = list(lines) # Para detectar cambios en sitio (ver document_lines)
+        self.lower = [line.lower() for line in lines]
+        self._tokens: List[Optional[List[str]]] = [None] * len(lines)
+        self._references: Dict[str, Optional[int]] = {} # referencia -> primera línea que la contiene
+
+        # Índice de referencias: todo el texto en minúsculas (líneas separadas por '\n') y
+        # la posición donde empieza cada línea. Una búsqueda es un str.find sobre el texto
+        # completo y una bisección para pasar de posición a línea.
+        self.text = '\n'.join(self.lower)
+        self._starts: List[int] = []
+        position = 0
+        for line in self.lower:
+            self._starts.append(position)
+            position += len(line) + 1
+
+    def __len__(self) -> int:
+        return len(self.lower)
+
+    def tokens(self, index: int) -> List[str]:
+        """Segmentos de la línea (separados por espacios), como en cut_segment."""
+        tokens = self._tokens[index]
+        if tokens is None:
+            tokens = [seg for seg in _SPLIT_RE.split(self.lines[index].strip()) if seg]
+            self._tokens[index] = tokens
+        return tokens
+
+    def find_line(self, ref_lower: str) -> Optional[int]:
+        """Primera línea que contiene ref_lower (ya en minúsculas), o None."""
+        try:
+            return self._references[ref_lower]
+        except KeyError:
+            pass
+        if not self.lower:
+            line_index = None
+        elif '\n' in ref_lower:
+            # No puede cruzar líneas: búsqueda línea a línea como antes
+            line_index = next((i for i, line in enumerate(self.lower) if ref_lower in line), None)
+        else:
+            position = self.text.find(ref_lower)
+            line_index = bisect_right(self._starts, position) - 1 if position >= 0 else None
+        self._references[ref_lower] = line_index
+        return line_index
+
+    def find_references(self, references: List[str]) -> Dict[str, Optional[int]]:
+        """Primera línea de cada referencia (ya en minúsculas)."""
+        return {ref: self.find_line(ref) for ref in references}
+
+
+# Documentos preparados recientemente, por lista de líneas (la misma lista se pasa a la
+# detección, a cada extractor probado y a la parada temprana). Antes de reutilizar uno se
+# compara la lista con la copia que guardó: si nadie la ha tocado, cada elemento es el
+# mismo objeto y la comparación es solo de punteros (mucho más barata que prepararlo).
+_DOCUMENT_CACHE_SIZE = 8
+_document_cache: "OrderedDict[int, DocumentLines]" = OrderedDict()
+_document_cache_lock = threading.Lock()
+
+
+def document_lines(lines: List[str]) -> DocumentLines:
+    """
+    DocumentLines de la lista, reutilizado mientras sea la misma lista con el mismo contenido
+    (si crece al leer más páginas o se cambia alguna línea, se vuelve a preparar).
+    """
+    key = id(lines)
+    with _document_cache_lock:
+        doc = _document_cache.get(key)
+        if doc is not None and doc.lines is lines and doc.snapshot == lines:
+            _document_cache.move_to_end(key)
+            return doc
+    doc = DocumentLines(lines)
+    with _document_cache_lock:
+        _document_cache[key] = doc
+        _document_cache.move_to_end(key)
+        while len(_document_cache) > _DOCUMENT_CACHE_SIZE:
+            _document_cache.popitem(last=False)
+    return doc
+
+
+def parse_segment(segment_input: Any) -> Optional[Tuple[int, int]]:
+    """Segmento 1-based ("3" o "3-5") como (inicio, fin) 0-based para cortar, o None si no es válido."""
+    if segment_input is None:
+        return None
+    try:
+        if isinstance(segment_input, str) and _SEGMENT_RANGE_RE.match(segment_input):
+            start_s, end_s = segment_input.split('-')
+            start_idx, end_idx = int(start_s) - 1, int(end_s)
+            return (start_idx, end_idx) if 0 <= start_idx < end_idx else None
+        segment_index = int(segment_input) - 1
+        return (segment_index, segment_index + 1) if segment_index >= 0 else None
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_rule(mapping: Dict[str, Any]) -> CompiledRule:
+    rule_type = mapping.get('type')
+    if rule_type == 'FIXED_VALUE':
+        value = mapping.get('value')
+        return (_FIXED_VALUE, str(value) if value is not None else None, None, 0, None)
+    segment = parse_segment(mapping.get('segment'))
+    if rule_type == 'FIXED':
+        abs_line_1based = mapping.get('line')
+        if abs_line_1based is None or abs_line_1based <= 0:
+            return (_INVALID, None, None, 0, None)
+        return (_FIXED, abs_line_1based - 1, None, 0, segment)
+    if rule_type == 'VARIABLE':
+        return (_VARIABLE, None, (mapping.get('ref_text') or '').lower(), mapping.get('offset') or 0, segment)
+    return (_INVALID, None, None, 0, None)
+
+
+def resolve_compiled(doc: DocumentLines, rule: CompiledRule, references: Dict[str, Optional[int]],
+                     complete: bool = True) -> Tuple[Optional[str], bool]:
+    """Como resolve_rule, para una regla compilada y las referencias ya localizadas."""
+    kind, value, ref, offset, segment = rule
+    if kind == _FIXED_VALUE:
+        return value, True
+    if kind == _FIXED:
+        line_index = value
+    elif kind == _VARIABLE:
+        ref_index = references.get(ref)
+        if ref_index is None:
+            return None, complete
+        line_index = ref_index + offset
+    else:
+        return None, True
+
+    if line_index < 0:
+        return None, True
+    if line_index >= len(doc):
+        return None, complete
+    if segment is None:
+        return None, True
+    tokens = doc.tokens(line_index)
+    start_idx, end_idx = segment
+    if end_idx > len(tokens):
+        return None, True
+    return ' '.join(tokens[start_idx:end_idx]), True
+
+
+def apply_compiled(doc: DocumentLines, rule: CompiledRule) -> Optional[str]:
+    """Valor de una regla compilada suelta sobre el documento completo."""
+    references = doc.find_references([rule[2]]) if rule[0] == _VARIABLE else {}
+    return resolve_compiled(doc, rule, references)[0]
+
+
+class RulePlan:
+    """
+    Reglas de un extractor compiladas: [(campo, [reglas])] y sus referencias agrupadas.
+    validators: {campo: función} que limpia cada valor encontrado o lo descarta (None),
+    en cuyo caso se prueba la siguiente regla del campo.
+    """
+
+    def __init__(self, mapping: Dict[str, Any], validators: Optional[Dict[str, Validator]] = None):
+        self.fields: List[Tuple[str, List[CompiledRule]]] = [
+            (field_name, [compile_rule(rule) for rule in as_rule_list(rules)])
+            for field_name, rules in mapping.items()
+        ]
+        self.validators: Dict[str, Validator] = dict(validators or {})
+        self.references = sorted({rule[2] for _, rules in self.fields for rule in rules if rule[0] == _VARIABLE})
+
+    def resolve(self, doc: DocumentLines, complete: bool = True,
+                fields: Optional[Set[str]] = None) -> Dict[str, Tuple[Optional[str], bool]]:
+        """{campo: (valor, definitivo)} como resolve_field; fields limita los campos (en mayúsculas)."""
+        references = doc.find_references(self.references)
+        result = {}
+        for field_name, rules in self.fields:
+            if fields is not None and field_name.upper() not in fields:
+                continue
+            outcome = (None, True)
+            validator = self.validators.get(field_name)
+            for rule in rules:
+                value, final = resolve_compiled(doc, rule, references, complete)
+                if not final:
+                    outcome = (None, False)
+                    break
+                if value is not None and validator is not None:
+                    value = validator(value)
+                if value is not None:
+                    outcome = (value, True)
+                    break
+            result[field_name] = outcome
+        return result
+
+    def evaluate(self, doc: DocumentLines) -> Dict[str, Optional[str]]:
+        """{campo: valor} con el documento completo (la primera regla con valor gana)."""
+        return {field_name: value for field_name, (value, _) in self.resolve(doc).items()}
+
+
+def compile_rules(mapping: Dict[str, Any], validators: Optional[Dict[str, Validator]] = None) -> RulePlan:
+    return RulePlan(mapping, validators)
+
+
+# --- Medición rápida: python rule_engine.py ---
+
+def _benchmark(repeat: int = 200):
+    import random
+    import timeit
+    rng = random.Random(0)
+    words = ['factura', 'fecha', 'total', 'base', 'iva', 'cliente', 'matricula', 'importe', 'ref', 'nº']
+    lines = [' '.join(rng.choice(words).upper() + str(rng.randint(0, 999)) for _ in range(rng.randint(2, 8))) for _ in range(400)]
+    mapping = {
+        f'CAMPO_{i}': [
+            {'type': 'VARIABLE', 'ref_text': f'{rng.choice(words)}{rng.randint(0, 999)}', 'offset': 1, 'segment': '2'},
+            {'type': 'VARIABLE', 'ref_text': rng.choice(words), 'offset': 0, 'segment': '1-2'},
+            {'type': 'FIXED', 'line': rng.randint(1, 400), 'segment': 3},
+        ]
+        for i in range(13)
+    }
+    # Cada iteración con una lista nueva: se cuenta también la preparación del documento
+    interpreted = timeit.timeit(lambda: (lambda doc: {f: resolve_field(doc, r) for f, r in mapping.items()})(list(lines)), number=repeat)
+    plan = compile_rules(mapping)
+    compiled = timeit.timeit(lambda: plan.evaluate(document_lines(list(lines))), number=repeat)
+    # Mismo documento ya preparado (varios extractores o la parada temprana sobre la misma lista)
+    warm_interpreted = timeit.timeit(lambda: {f: resolve_field(lines, r) for f, r in mapping.items()}, number=repeat)
+    warm_compiled = timeit.timeit(lambda: plan.evaluate(document_lines(lines)), number=repeat)
+    assert plan.evaluate(DocumentLines(lines)) == {f: resolve_field(lines, r)[0] for f, r in mapping.items()}
+    print(f"Interpretado: {interpreted / repeat * 1000:.3f} ms/documento "
+          f"({warm_interpreted / repeat * 1000:.3f} ms con el documento ya preparado)")
+    print(f"Compilado:    {compiled / repeat * 1000:.3f} ms/documento (x{interpreted / compiled:.1f}) "
+          f"({warm_compiled / repeat * 1000:.3f} ms, x{warm_interpreted / warm_compiled:.1f})")
+
+
+if __name__ == '__main__':
+    _benchmark()